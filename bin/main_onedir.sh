@@ -0,0 +1,3 @@
+#!/bin/sh
+# entrypoint of the one-directory build, see `make module-onedir.tar.gz`
+exec "$(dirname "$0")/torchreid-embedder/main" "$@"
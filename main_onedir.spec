@@ -0,0 +1,82 @@
+# -*- mode: python ; coding: utf-8 -*-
+# One-directory build: the module starts straight from the unpacked directory
+# instead of extracting a one-file bundle to a temp directory on every start.
+import glob
+import sys
+sys.setrecursionlimit(5000)
+
+# never imported by the module
+EXCLUDES = [
+    'IPython',
+    'matplotlib',
+    'pandas',
+    'scipy',
+    'tensorboard',
+    'tkinter',
+    'numpy.f2py',
+    'torch.contrib',
+    'torch.distributed.checkpoint',
+    'torch.distributed.elastic',
+    'torch.distributed.pipelining',
+    'torch.utils.tensorboard',
+    'torchvision.prototype',
+]
+
+# build-time only files collected with torch
+EXCLUDED_DATA = (
+    'torch/include/',
+    'torch/share/cmake/',
+    'torch/bin/protoc',
+)
+
+# ship the memory-mappable weights from `make weights` when they exist
+mappable_weights = glob.glob('./src/models/osnet/*.pt')
+if mappable_weights:
+    datas = [(path, 'src/models/osnet') for path in mappable_weights]
+else:
+    datas = [('./src/models/', 'src/models')]
+
+a = Analysis(
+    ['src/main.py'],
+    pathex=[],
+    binaries=[],
+    datas=datas,
+    hiddenimports=['googleapiclient'],
+    hookspath=[],
+    hooksconfig={},
+    runtime_hooks=[],
+    excludes=EXCLUDES,
+    noarchive=False,
+    optimize=0,
+)
+a.datas = [d for d in a.datas if not d[0].replace('\\', '/').startswith(EXCLUDED_DATA)]
+a.binaries = [b for b in a.binaries if not b[0].endswith('.a')]
+pyz = PYZ(a.pure)
+
+exe = EXE(
+    pyz,
+    a.scripts,
+    [],
+    exclude_binaries=True,
+    name='main',
+    debug=False,
+    bootloader_ignore_signals=False,
+    strip=False,
+    # compressed shared libraries would have to be decompressed on every start
+    upx=False,
+    console=True,
+    disable_windowed_traceback=False,
+    argv_emulation=False,
+    target_arch=None,
+    codesign_identity=None,
+    entitlements_file=None,
+)
+coll = COLLECT(
+    exe,
+    a.binaries,
+    a.datas,
+    strip=False,
+    upx=False,
+    upx_exclude=[],
+    name='torchreid-embedder',
+)
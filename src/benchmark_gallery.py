@@ -0,0 +1,222 @@
+"""
+Benchmark gallery prototype consolidation against the raw gallery.
+
+Every identity's gallery embeddings are added to a PrototypeGallery for
+each --max-prototypes value and consolidated. The queries are then searched
+in the raw gallery (every embedding), and in the prototypes exactly and
+through the inverted lists with every --nprobe. Reports the gallery size, the consolidation
+time, the query latency and the rank-1 recall of each.
+
+By default the embeddings are synthetic: every identity has a few
+appearances (e.g. viewpoints), and its frames are near-duplicates of one of
+them, as along a tracked person. With --embeddings, the output directory of
+embed_offline is used instead, the identity of a crop being the first
+directory of its id; every --query-every-th crop of an identity is a query.
+
+    python -m src.benchmark_gallery --identities 2000 --frames 100 \\
+        --max-prototypes 1 4 8 --nprobe 4 16
+    python -m src.benchmark_gallery --embeddings embeddings/
+"""
+
+import argparse
+import json
+import os
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from src.person_embedder.gallery import PrototypeGallery, top_identities
+from src.person_embedder.utils import l2_normalize
+
+
+def synthetic_embeddings(
+    identities: int,
+    frames: int,
+    appearances: int = 3,
+    noise: float = 0.3,
+    dim: int = 512,
+    seed: int = 0,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Frames of every identity, in track order.
+
+    An embedding sums a direction shared by everyone, one per identity, one
+    per appearance of the identity and per-frame noise of norm `noise`.
+    Frames come in runs of one appearance, so consecutive frames are
+    near-duplicates, while different people stay moderately similar as
+    with real re-id embeddings.
+    """
+    rng = np.random.default_rng(seed)
+
+    def directions(*shape):
+        return l2_normalize(rng.normal(size=shape + (dim,)))
+
+    shared = directions()
+    people = directions(identities, 1)
+    looks = directions(identities, appearances)
+    embeddings = np.empty((identities * frames, dim), dtype=np.float32)
+    labels = np.repeat(np.arange(identities), frames)
+    for identity in range(identities):
+        runs = np.sort(rng.integers(0, appearances, size=frames))
+        rows = slice(identity * frames, (identity + 1) * frames)
+        embeddings[rows] = l2_normalize(
+            0.8 * shared
+            + 0.5 * people[identity]
+            + 0.5 * looks[identity, runs]
+            + noise * directions(frames)
+        )
+    return embeddings, labels
+
+
+def load_embeddings(directory: str) -> Tuple[np.ndarray, np.ndarray]:
+    """embed_offline output, labeled by the first directory of every id."""
+    embeddings = np.load(os.path.join(directory, "embeddings.npy"), mmap_mode="r")
+    with open(os.path.join(directory, "ids.txt"), encoding="utf-8") as f:
+        ids = [line.rstrip("\n") for line in f]
+    names = [item_id.split("/", 1)[0] for item_id in ids]
+    _, labels = np.unique(names, return_inverse=True)
+    return l2_normalize(np.asarray(embeddings, dtype=np.float32)), labels
+
+
+def split_queries(
+    labels: np.ndarray, query_every: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Indices of the gallery and of the queries: every `query_every`-th per identity."""
+    gallery, queries = [], []
+    for label in np.unique(labels):
+        rows = np.flatnonzero(labels == label)
+        is_query = np.arange(len(rows)) % query_every == query_every - 1
+        gallery.extend(rows[~is_query])
+        queries.extend(rows[is_query])
+    return np.array(gallery), np.array(queries)
+
+
+def timed_search(
+    search, queries: np.ndarray, batch_size: int
+) -> Tuple[np.ndarray, float]:
+    """Matched identity of every query and the median latency per batch in ms."""
+    matches, latencies = [], []
+    for start in range(0, len(queries), batch_size):
+        started = time.perf_counter()
+        matches.append(search(queries[start : start + batch_size]))
+        latencies.append((time.perf_counter() - started) * 1000)
+    return np.concatenate(matches), float(np.median(latencies))
+
+
+def benchmark(
+    embeddings: np.ndarray,
+    labels: np.ndarray,
+    max_prototypes: List[int],
+    merge_threshold: float,
+    query_every: int,
+    batch_size: int,
+    nprobes: List[int],
+) -> List[Dict]:
+    gallery_rows, query_rows = split_queries(labels, query_every)
+    queries, truth = embeddings[query_rows], labels[query_rows]
+    raw, raw_labels = embeddings[gallery_rows], labels[gallery_rows]
+
+    def search_raw(batch):
+        similarity = batch @ raw.T
+        return np.array(
+            [top_identities(row, raw_labels, 1)[0][0] for row in similarity]
+        )
+
+    matches, latency = timed_search(search_raw, queries, batch_size)
+    results = [
+        {
+            "gallery": "raw",
+            "search": "exact",
+            "vectors": len(raw),
+            "gallery_mb": raw.nbytes / 2**20,
+            "consolidate_s": 0.0,
+            "batch_ms": latency,
+            "recall_at_1": float(np.mean(matches == truth)),
+        }
+    ]
+    for k in max_prototypes:
+        gallery = PrototypeGallery(
+            max_prototypes=k,
+            merge_threshold=merge_threshold,
+            max_identities=len(np.unique(labels)),
+        )
+        gallery.add(raw_labels, raw)
+        started = time.perf_counter()
+        gallery.consolidate()
+        consolidate_s = time.perf_counter() - started
+        stats = gallery.stats()
+        for nprobe in [0] + nprobes:
+            gallery.nprobe = nprobe
+            matches, latency = timed_search(
+                lambda batch: gallery.search(batch, 1, gallery.nprobe > 0)[0][:, 0],
+                queries,
+                batch_size,
+            )
+            results.append(
+                {
+                    "gallery": f"prototypes k={k}",
+                    "search": f"ivf {nprobe}" if nprobe else "exact",
+                    "vectors": stats["gallery_prototypes"],
+                    "gallery_mb": gallery.memory_bytes() / 2**20,
+                    "consolidate_s": consolidate_s,
+                    "batch_ms": latency,
+                    "recall_at_1": float(np.mean(matches == truth)),
+                }
+            )
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n\n", maxsplit=1)[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--embeddings", help="embed_offline output directory")
+    parser.add_argument("--identities", type=int, default=500)
+    parser.add_argument("--frames", type=int, default=100, help="frames per identity")
+    parser.add_argument("--appearances", type=int, default=3)
+    parser.add_argument("--noise", type=float, default=0.3)
+    parser.add_argument("--max-prototypes", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--merge-threshold", type=float, default=0.9)
+    parser.add_argument(
+        "--nprobe", type=int, nargs="+", default=[4, 16], help="inverted lists scanned"
+    )
+    parser.add_argument("--query-every", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=32, help="queries per search")
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    if args.embeddings:
+        embeddings, labels = load_embeddings(args.embeddings)
+    else:
+        embeddings, labels = synthetic_embeddings(
+            args.identities, args.frames, args.appearances, args.noise
+        )
+    results = benchmark(
+        embeddings,
+        labels,
+        args.max_prototypes,
+        args.merge_threshold,
+        args.query_every,
+        args.batch_size,
+        args.nprobe,
+    )
+
+    print(
+        f"{'gallery':<18}{'search':>8}{'vectors':>9}{'MB':>8}"
+        f"{'consolidate s':>15}{'batch ms':>10}{'recall@1':>10}"
+    )
+    for res in results:
+        print(
+            f"{res['gallery']:<18}{res['search']:>8}{res['vectors']:>9}"
+            f"{res['gallery_mb']:>8.1f}{res['consolidate_s']:>15.2f}"
+            f"{res['batch_ms']:>10.2f}{res['recall_at_1']:>10.3f}"
+        )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Benchmark binary-code Hamming search against exhaustive cosine search.
+
+A projection to binary codes is fitted for every --bits and --method on
+the database vectors, which are then searched for the held-out queries by
+Hamming distance alone, and by Hamming distance for every --candidates
+count followed by exact cosine re-ranking of the candidates. Reports the
+recall@1 and recall@10 against the exhaustive float32 search (the fraction
+of its nearest neighbors that are found), the median latency per query
+batch and the bytes stored per vector.
+
+By default the vectors are synthetic (see benchmark_gallery); with
+--embeddings, the output directory of embed_offline is used instead. numpy
+has no BLAS float16 product, so there is no float16 row: on numpy it is
+slower than float32.
+
+    python -m src.benchmark_hamming --identities 2000 --frames 50 \\
+        --bits 128 256 --candidates 16 64 256
+    python -m src.benchmark_hamming --embeddings gallery/ --method itq
+"""
+
+import argparse
+import json
+from typing import Dict, List
+
+import numpy as np
+
+from src.benchmark_gallery import load_embeddings, synthetic_embeddings, timed_search
+from src.person_embedder.hashing import (
+    BinaryHasher,
+    HammingIndex,
+    as_words,
+    fit_projection,
+    hamming_distances,
+)
+
+RECALL_AT = (1, 10)
+
+
+def exhaustive(vectors: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """(N, k) rows of the most similar vectors, most similar first."""
+    similarity = queries @ vectors.T
+    top = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(similarity, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+def recall(found: np.ndarray, truth: np.ndarray) -> Dict[str, float]:
+    return {
+        f"recall_at_{k}": float(
+            np.mean([len(set(f[:k]) & set(t[:k])) / k for f, t in zip(found, truth)])
+        )
+        for k in RECALL_AT
+    }
+
+
+def benchmark(
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    bits: List[int],
+    methods: List[str],
+    candidates: List[int],
+    batch_size: int,
+) -> List[Dict]:
+    k = max(RECALL_AT)
+    truth = exhaustive(vectors, queries, k)
+    _, latency = timed_search(
+        lambda batch: exhaustive(vectors, batch, k), queries, batch_size
+    )
+    results = [
+        {
+            "search": "exhaustive fp32",
+            "candidates": len(vectors),
+            "bytes_per_vector": vectors.shape[1] * 4,
+            "batch_ms": latency,
+            **recall(truth, truth),
+        }
+    ]
+    for method in methods:
+        for size in bits:
+            index = HammingIndex(
+                BinaryHasher(*fit_projection(vectors, size, method)), vectors
+            )
+
+            def hamming_only(batch):
+                found = index.candidates(batch, k)
+                codes = as_words(index.hasher.encode(batch))
+                distances = np.stack(
+                    [
+                        hamming_distances(code[None], index.codes[rows])[0]
+                        for code, rows in zip(codes, found)
+                    ]
+                )
+                return np.take_along_axis(
+                    found, np.argsort(distances, axis=1, kind="stable"), axis=1
+                )
+
+            found, latency = timed_search(hamming_only, queries, batch_size)
+            results.append(
+                {
+                    "search": f"{method} {size} bits",
+                    "candidates": 0,
+                    "bytes_per_vector": size // 8,
+                    "batch_ms": latency,
+                    **recall(found, truth),
+                }
+            )
+            for count in candidates:
+                found, latency = timed_search(
+                    lambda batch, count=count: index.search(batch, k, count)[0],
+                    queries,
+                    batch_size,
+                )
+                results.append(
+                    {
+                        "search": f"{method} {size} bits + rerank",
+                        "candidates": count,
+                        # the full vectors are still needed for re-ranking
+                        "bytes_per_vector": size // 8 + vectors.shape[1] * 4,
+                        "batch_ms": latency,
+                        **recall(found, truth),
+                    }
+                )
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n\n", maxsplit=1)[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--embeddings", help="embed_offline output directory")
+    parser.add_argument("--identities", type=int, default=1000)
+    parser.add_argument("--frames", type=int, default=50, help="frames per identity")
+    parser.add_argument("--queries", type=int, default=256)
+    parser.add_argument("--bits", type=int, nargs="+", default=[128, 256])
+    parser.add_argument(
+        "--method", nargs="+", choices=["itq", "random"], default=["itq", "random"]
+    )
+    parser.add_argument("--candidates", type=int, nargs="+", default=[16, 64, 256])
+    parser.add_argument("--batch-size", type=int, default=32, help="queries per search")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    if args.embeddings:
+        embeddings, _ = load_embeddings(args.embeddings)
+    else:
+        embeddings, _ = synthetic_embeddings(args.identities, args.frames)
+    rows = np.random.default_rng(args.seed).permutation(len(embeddings))
+    queries = embeddings[rows[: args.queries]]
+    vectors = np.ascontiguousarray(embeddings[rows[args.queries :]])
+    results = benchmark(
+        vectors, queries, args.bits, args.method, args.candidates, args.batch_size
+    )
+
+    print(
+        f"{'search':<26}{'candidates':>11}{'bytes':>7}{'batch ms':>10}"
+        f"{'recall@1':>10}{'recall@10':>11}"
+    )
+    for res in results:
+        print(
+            f"{res['search']:<26}{res['candidates']:>11}{res['bytes_per_vector']:>7}"
+            f"{res['batch_ms']:>10.2f}{res['recall_at_1']:>10.3f}"
+            f"{res['recall_at_10']:>11.3f}"
+        )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Benchmark every OSBlock against its fused rewrite.
+
+Each block of the model runs on the activations it sees for a 256x128
+input, once as loaded and once rewritten by fuse_os_blocks, at every batch
+size. Reports the median latency of both and the speedup, per block and for
+the whole model, after checking that the outputs match.
+
+    python -m src.benchmark_osblock --batch-sizes 1 4 16 --threads 4
+"""
+
+import argparse
+import copy
+import json
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+import torch
+
+from src.person_embedder.fused_osnet import FusedOSBlock, fuse_os_blocks
+from src.person_embedder.os_net_encoder import OSNetFeatureEmbedder
+from src.person_embedder.osnet import OSBlock, OSBlockINin
+
+
+def median_ms(function: Callable, inputs: torch.Tensor, iterations: int) -> float:
+    with torch.no_grad():
+        function(inputs)  # warm-up
+        latencies = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            out = function(inputs)
+            if out.is_cuda:
+                torch.cuda.synchronize()
+            latencies.append((time.perf_counter() - started) * 1000)
+    return float(np.median(latencies))
+
+
+def block_inputs(
+    model: torch.nn.Module, inputs: torch.Tensor
+) -> Dict[str, torch.Tensor]:
+    """Input of every OSBlock of `model` for `inputs`, by module name."""
+    captured = {}
+    hooks = [
+        module.register_forward_pre_hook(
+            lambda _, args, name=name: captured.__setitem__(name, args[0])
+        )
+        for name, module in model.named_modules()
+        if isinstance(module, (OSBlock, OSBlockINin))
+    ]
+    with torch.no_grad():
+        model(inputs)
+    for hook in hooks:
+        hook.remove()
+    return captured
+
+
+def benchmark(
+    model: torch.nn.Module, batch_sizes: List[int], iterations: int
+) -> List[Dict]:
+    fused_model = copy.deepcopy(model)
+    fuse_os_blocks(fused_model)
+    device = next(model.parameters()).device
+    results = []
+    for batch_size in batch_sizes:
+        inputs = torch.randn(batch_size, 3, 256, 128, device=device)
+        for name, block_input in block_inputs(model, inputs).items():
+            block = model.get_submodule(name)
+            fused = FusedOSBlock(block).to(device)
+            with torch.no_grad():
+                error = (block(block_input) - fused(block_input)).abs().max().item()
+            results.append(
+                {
+                    "block": name,
+                    "batch_size": batch_size,
+                    "input_shape": list(block_input.shape[1:]),
+                    "original_ms": median_ms(block, block_input, iterations),
+                    "fused_ms": median_ms(fused, block_input, iterations),
+                    "max_abs_error": error,
+                }
+            )
+        with torch.no_grad():
+            error = (model(inputs) - fused_model(inputs)).abs().max().item()
+        results.append(
+            {
+                "block": "model",
+                "batch_size": batch_size,
+                "input_shape": [3, 256, 128],
+                "original_ms": median_ms(model, inputs, iterations),
+                "fused_ms": median_ms(fused_model, inputs, iterations),
+                "max_abs_error": error,
+            }
+        )
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n\n", maxsplit=1)[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--threads", type=int, help="intra-op threads")
+    parser.add_argument("--model-path", help="checkpoint, the bundled one by default")
+    parser.add_argument(
+        "--random-weights", action="store_true", help="skip loading weights"
+    )
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    embedder = OSNetFeatureEmbedder(args.model_path, random_weights=args.random_weights)
+    results = benchmark(embedder.model, args.batch_sizes, args.iterations)
+
+    print(
+        f"{'block':<10}{'batch':>6}{'input':>16}{'original ms':>13}"
+        f"{'fused ms':>10}{'speedup':>9}{'max err':>10}"
+    )
+    for res in results:
+        shape = "x".join(str(v) for v in res["input_shape"])
+        print(
+            f"{res['block']:<10}{res['batch_size']:>6}{shape:>16}"
+            f"{res['original_ms']:>13.2f}{res['fused_ms']:>10.2f}"
+            f"{res['original_ms'] / res['fused_ms']:>8.2f}x"
+            f"{res['max_abs_error']:>10.1e}"
+        )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
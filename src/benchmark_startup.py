@@ -0,0 +1,168 @@
+"""
+Benchmark module start time of different builds.
+
+Every run starts the build on a fresh unix socket and times how long it takes
+until the socket is served, until the embedder resource is added (the model
+is loaded) and until the first infer returns. The first run of each build is
+reported as cold and the median of the others as warm; with --drop-caches
+the page cache is dropped before the cold run (needs root), otherwise the
+cold run only reflects a cold process. The module runs with its own TMPDIR,
+whose size after start shows how much a build extracts to disk per start.
+
+    python -m src.benchmark_startup \\
+        --build onefile=build/pyinstaller_dist/main \\
+        --build onedir=build/pyinstaller_dist/torchreid-embedder/main \\
+        --build source --runs 5
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from src.module_process import ModuleProcess
+
+PHASES = ("socket_s", "ready_s", "first_infer_s")
+
+
+def directory_size(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+        if not os.path.islink(os.path.join(root, name))
+    )
+
+
+def drop_page_cache() -> bool:
+    try:
+        os.sync()
+        with open("/proc/sys/vm/drop_caches", "w", encoding="utf-8") as f:
+            f.write("3\n")
+        return True
+    except OSError:
+        return False
+
+
+async def start_once(command: Optional[List[str]], attributes: Dict) -> Dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        module_tmp = os.path.join(tmp, "tmp")
+        os.makedirs(module_tmp)
+        started = time.monotonic()
+        module = ModuleProcess(
+            os.path.join(tmp, "module.sock"),
+            command=command,
+            env={"TMPDIR": module_tmp},
+        )
+        try:
+            await module.connect(timeout=300)
+            socket_s = time.monotonic() - started
+            client = await module.add_embedder("embedder", attributes)
+            ready_s = time.monotonic() - started
+            crop = np.random.rand(3, 256, 128).astype(np.float32) * 255
+            await client.infer({"input": crop})
+            first_infer_s = time.monotonic() - started
+            extracted = directory_size(module_tmp)
+        finally:
+            module.stop()
+    return {
+        "socket_s": socket_s,
+        "ready_s": ready_s,
+        "first_infer_s": first_infer_s,
+        "extracted_mb": extracted / 1024 / 1024,
+    }
+
+
+async def benchmark_build(
+    command: Optional[List[str]], runs: int, drop_caches: bool, attributes: Dict
+) -> Dict:
+    res = {"runs": []}
+    if drop_caches:
+        res["page_cache_dropped"] = drop_page_cache()
+    for _ in range(runs):
+        res["runs"].append(await start_once(command, attributes))
+    res["cold"] = res["runs"][0]
+    warm = res["runs"][1:]
+    if warm:
+        res["warm"] = {
+            key: float(np.median([run[key] for run in warm])) for key in warm[0]
+        }
+    return res
+
+
+def parse_build(value: str):
+    """`name=path` runs the executable at path, `source` runs python -m src.main."""
+    if value == "source":
+        return value, None
+    name, _, path = value.partition("=")
+    if not path:
+        raise argparse.ArgumentTypeError("builds are given as name=path or source")
+    return name, path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n\n", maxsplit=1)[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "--build",
+        type=parse_build,
+        action="append",
+        required=True,
+        help="name=path of a module executable, or source",
+    )
+    parser.add_argument("--runs", type=int, default=5, help="starts per build")
+    parser.add_argument(
+        "--drop-caches",
+        action="store_true",
+        help="drop the page cache before the first run of each build (root only)",
+    )
+    parser.add_argument("--config", default="{}", help="embedder attributes as JSON")
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, path in args.build:
+        command = None if path is None else [os.path.abspath(path)]
+        if path is not None:
+            # a one-file build is its executable, a one-dir build its directory
+            is_onedir = os.path.exists(os.path.join(os.path.dirname(path), "_internal"))
+            size = directory_size(os.path.dirname(path) if is_onedir else path)
+        else:
+            size = None
+        print(f"benchmarking {name} ...", file=sys.stderr)
+        results[name] = asyncio.run(
+            benchmark_build(
+                command, args.runs, args.drop_caches, json.loads(args.config)
+            )
+        )
+        results[name]["size_mb"] = None if size is None else size / 1024 / 1024
+
+    header = f"{'build':<12}{'size MB':>9}{'tmp MB':>8}"
+    for temperature in ("cold", "warm"):
+        header += "".join(f"{temperature + ' ' + phase:>20}" for phase in PHASES)
+    print(header)
+    for name, res in results.items():
+        size = "-" if res["size_mb"] is None else f"{res['size_mb']:.0f}"
+        line = f"{name:<12}{size:>9}{res['cold']['extracted_mb']:>8.0f}"
+        for temperature in ("cold", "warm"):
+            for phase in PHASES:
+                value = res.get(temperature, {}).get(phase)
+                line += f"{'-' if value is None else f'{value:.2f}':>20}"
+        print(line)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Convert a torchreid checkpoint into a memory-mappable state dict.
+
+Checkpoints such as osnet_ain_ms_d_c.pth.tar are pickled training snapshots
+that have to be read and copied in full on every start. This keeps only the
+model weights and saves them in torch's zip format, which `load_checkpoint`
+memory-maps, so the weights are paged in from disk on first use and shared
+between processes.
+
+    python -m src.convert_weights src/models/osnet/osnet_ain_ms_d_c.pth.tar
+"""
+
+import argparse
+import os
+from collections import OrderedDict
+
+import torch
+
+from src.person_embedder.os_net_encoder import load_checkpoint
+
+
+def convert(source: str, destination: str):
+    checkpoint = load_checkpoint(source)
+    state_dict = checkpoint.get("state_dict", checkpoint)
+    weights = OrderedDict()
+    for key, value in state_dict.items():
+        if key.startswith("module."):
+            key = key[7:]
+        weights[key] = value.detach().cpu().contiguous()
+    tmp_path = destination + ".tmp"
+    torch.save(weights, tmp_path)
+    os.replace(tmp_path, destination)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("source", help="torchreid .pth.tar checkpoint")
+    parser.add_argument(
+        "-o", "--output", help="destination, the source with a .pt suffix by default"
+    )
+    args = parser.parse_args(argv)
+    destination = args.output
+    if destination is None:
+        destination = args.source.removesuffix(".tar").removesuffix(".pth") + ".pt"
+    convert(args.source, destination)
+    print(f"wrote {destination}")
+
+
+if __name__ == "__main__":
+    main()
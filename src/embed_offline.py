@@ -0,0 +1,383 @@
+"""
+Embed a directory of images or a video file offline.
+
+Images (or video frames) are decoded on a pool of worker threads, cut by
+the boxes of an optional box file, and embedded in large batches through
+the staged execution engine, so decoding, preprocessing and the model
+overlap. Results go to OUTPUT/embeddings.npy, a memory-mapped (N, D)
+float32 matrix whose row i belongs to line i of OUTPUT/ids.txt. Progress is
+committed after every batch, so an interrupted run picks up where it
+stopped when started again with the same arguments.
+
+The box file is a CSV of `key,x1,y1,x2,y2` rows, where key is an image path
+relative to the input directory or a video frame index. Without a box file
+every image or frame is embedded whole. Crop ids are the key, followed by
+`#i` for the i-th box of an image or frame.
+
+    python -m src.embed_offline crops/ gallery/ --batch-size 128
+    python -m src.embed_offline street.mp4 street/ --boxes detections.csv
+
+Video decoding needs PyAV (`pip install av`).
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+
+from src.person_embedder.decode import (
+    decode_image,
+    encoded_image_size,
+    letterbox_scale,
+)
+from src.person_embedder.engine import StagedExecutionEngine
+from src.person_embedder.os_net_encoder import OSNetFeatureEmbedder
+from src.person_embedder.utils import crop_boxes
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+VIDEO_EXTENSIONS = (".mp4", ".mkv", ".avi", ".mov", ".webm")
+
+# a group is the crops of one image or frame: (key, boxes or None)
+Group = Tuple[str, Optional[np.ndarray]]
+
+
+def read_boxes(path: str) -> Dict[str, np.ndarray]:
+    """Read a `key,x1,y1,x2,y2` box file into {key: (N, 4) boxes}."""
+    boxes: Dict[str, List[List[float]]] = {}
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.reader(f):
+            if not row or row[0].startswith("#"):
+                continue
+            try:
+                box = [float(v) for v in row[1:5]]
+            except ValueError:
+                continue  # header
+            if len(box) != 4:
+                raise ValueError(f"box file rows must be key,x1,y1,x2,y2, got {row}")
+            boxes.setdefault(row[0].strip(), []).append(box)
+    return {key: np.array(value, dtype=np.float32) for key, value in boxes.items()}
+
+
+def list_images(root: str) -> List[str]:
+    """Image paths under `root`, relative to it, in a stable order."""
+    paths = []
+    for directory, _, names in os.walk(root):
+        for name in names:
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.relpath(os.path.join(directory, name), root))
+    return sorted(paths)
+
+
+def plan_groups(
+    keys: Sequence[str], boxes: Optional[Dict[str, np.ndarray]]
+) -> Tuple[List[Group], List[str]]:
+    """
+    :return: (groups, ids): the groups to decode and the id of every crop,
+        in output row order.
+    """
+    groups, ids = [], []
+    for key in keys:
+        if boxes is None:
+            groups.append((key, None))
+            ids.append(key)
+        elif key in boxes:
+            groups.append((key, boxes[key]))
+            ids.extend(f"{key}#{i}" for i in range(len(boxes[key])))
+    return groups, ids
+
+
+def count_video_frames(path: str) -> int:
+    import av  # pylint: disable=import-outside-toplevel
+
+    with av.open(path) as container:
+        stream = container.streams.video[0]
+        return sum(1 for packet in container.demux(stream) if packet.size > 0)
+
+
+def video_frames(path: str) -> Iterator[Tuple[str, np.ndarray]]:
+    """(frame index, (H, W, 3) uint8 RGB frame) of every frame of a video."""
+    import av  # pylint: disable=import-outside-toplevel
+
+    with av.open(path) as container:
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"  # decode on FFmpeg's own threads
+        for index, frame in enumerate(container.decode(stream)):
+            yield str(index), frame.to_ndarray(format="rgb24")
+
+
+def crops_from_image(
+    root: str, group: Group, target_size: Sequence[int]
+) -> List[torch.Tensor]:
+    """Decode one image file no larger than its crops need, and cut its boxes."""
+    key, boxes = group
+    with open(os.path.join(root, key), "rb") as f:
+        data = f.read()
+    height, width = encoded_image_size(data)
+    if boxes is None:
+        image, _ = decode_image(data, letterbox_scale(height, width, target_size))
+        return [torch.from_numpy(image)]
+    widths = np.maximum(boxes[:, 2] - boxes[:, 0], 1)
+    heights = np.maximum(boxes[:, 3] - boxes[:, 1], 1)
+    scale = float(np.max(np.minimum(target_size[0] / heights, target_size[1] / widths)))
+    image, applied_scale = decode_image(data, scale)
+    return crop_boxes(torch.from_numpy(image), boxes * applied_scale)
+
+
+def crops_from_frame(frame: np.ndarray, boxes: Optional[np.ndarray]):
+    tensor = torch.from_numpy(frame).permute(2, 0, 1).float()
+    if boxes is None:
+        return [tensor]
+    return crop_boxes(tensor, boxes)
+
+
+class EmbeddingStore:
+    """
+    Memory-mapped embedding matrix plus id index, resumable across runs.
+
+    `progress.json` records how many leading rows are complete; it is only
+    advanced after the rows are flushed, so a crash never marks unwritten
+    rows as done.
+    """
+
+    def __init__(self, directory: str, ids: List[str], dim: int, overwrite=False):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.ids_path = os.path.join(directory, "ids.txt")
+        self.matrix_path = os.path.join(directory, "embeddings.npy")
+        self.progress_path = os.path.join(directory, "progress.json")
+        digest = hashlib.sha256("\n".join(ids).encode()).hexdigest()
+
+        progress = self._read_progress()
+        if (
+            not overwrite
+            and progress is not None
+            and progress["ids_sha256"] == digest
+            and os.path.exists(self.matrix_path)
+        ):
+            self.matrix = np.load(self.matrix_path, mmap_mode="r+")
+            self.done = progress["done"]
+        else:
+            if progress is not None and not overwrite:
+                raise ValueError(
+                    f"{directory} holds the output of different inputs, "
+                    "pass --overwrite to replace it"
+                )
+            with open(self.ids_path, "w", encoding="utf-8") as f:
+                f.writelines(f"{item_id}\n" for item_id in ids)
+            self.matrix = np.lib.format.open_memmap(
+                self.matrix_path, mode="w+", dtype=np.float32, shape=(len(ids), dim)
+            )
+            self.done = 0
+        self.digest = digest
+        self._write_progress()
+
+    def write(self, start: int, embeddings: np.ndarray):
+        self.matrix[start : start + len(embeddings)] = embeddings
+        if start == self.done:
+            self.matrix.flush()
+            self.done = start + len(embeddings)
+            self._write_progress()
+
+    def _read_progress(self) -> Optional[Dict]:
+        try:
+            with open(self.progress_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_progress(self):
+        tmp_path = self.progress_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"ids_sha256": self.digest, "done": self.done}, f)
+        os.replace(tmp_path, self.progress_path)
+
+
+class ThroughputReporter:
+    def __init__(self, total: int, interval: float = 5.0):
+        self.total = total
+        self.interval = interval
+        self.started = time.monotonic()
+        self.last_report = self.started
+        self.images = 0
+        self.crops = 0
+
+    def update(self, images: int, crops: int, done: int):
+        self.images += images
+        self.crops += crops
+        now = time.monotonic()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            self.report(done)
+
+    def report(self, done: int, final: bool = False):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        prefix = "done:" if final else f"{done}/{self.total} crops,"
+        print(
+            f"{prefix} {self.images / elapsed:.1f} images/s, "
+            f"{self.crops / elapsed:.1f} crops/s",
+            file=sys.stderr,
+            flush=True,
+        )
+
+
+def run(args: argparse.Namespace):
+    boxes = read_boxes(args.boxes) if args.boxes else None
+    is_video = os.path.isfile(args.input) and args.input.lower().endswith(
+        VIDEO_EXTENSIONS
+    )
+    if is_video:
+        keys = [str(i) for i in range(count_video_frames(args.input))]
+        keys = keys[:: args.frame_step]
+    else:
+        keys = list_images(args.input)
+    groups, ids = plan_groups(keys, boxes)
+    if not ids:
+        raise ValueError(f"nothing to embed in {args.input}")
+
+    embedder = OSNetFeatureEmbedder(args.model_path)
+    if args.max_batch_size:
+        embedder.max_batch_size = args.max_batch_size
+    engine = StagedExecutionEngine(
+        embedder,
+        preprocess_workers=args.preprocess_workers,
+        micro_batch_size=args.batch_size,
+        normalize=args.normalize,
+    )
+    store = EmbeddingStore(
+        args.output, ids, embedder.model.feature_dim, overwrite=args.overwrite
+    )
+    if store.done == len(ids):
+        print(f"{args.output} is already complete", file=sys.stderr)
+        engine.shutdown()
+        return
+    if store.done:
+        print(f"resuming after {store.done}/{len(ids)} crops", file=sys.stderr)
+
+    # skip the groups whose crops are all stored already
+    first_row = 0
+    start_group = 0
+    for _, group_boxes in groups:
+        size = 1 if group_boxes is None else len(group_boxes)
+        if first_row + size > store.done:
+            break
+        first_row += size
+        start_group += 1
+    pending_groups = groups[start_group:]
+
+    reporter = ThroughputReporter(len(ids))
+    if is_video:
+        wanted = {key: group_boxes for key, group_boxes in pending_groups}
+        crop_lists = (
+            crops_from_frame(frame, wanted[key])
+            for key, frame in video_frames(args.input)
+            if key in wanted
+        )
+    else:
+        decoder = ThreadPoolExecutor(
+            max_workers=args.decode_workers, thread_name_prefix="decode"
+        )
+        crop_lists = prefetch(
+            decoder,
+            (
+                (crops_from_image, args.input, group, embedder.input_shape)
+                for group in pending_groups
+            ),
+            args.decode_workers * 4,
+        )
+
+    in_flight: deque = deque()
+    batch: List[torch.Tensor] = []
+    batch_images = 0
+    row = first_row
+    try:
+        for crops in crop_lists:
+            batch.extend(crops)
+            batch_images += 1
+            if len(batch) >= args.batch_size:
+                in_flight.append((row, batch_images, engine.submit(batch)))
+                row += len(batch)
+                batch, batch_images = [], 0
+            # keep two batches in the engine so its stages stay busy
+            while len(in_flight) > 2:
+                collect(in_flight.popleft(), store, reporter)
+        if batch:
+            in_flight.append((row, batch_images, engine.submit(batch)))
+        while in_flight:
+            collect(in_flight.popleft(), store, reporter)
+    finally:
+        engine.shutdown()
+        if not is_video:
+            decoder.shutdown(cancel_futures=True)
+    reporter.report(store.done, final=True)
+    print(f"wrote {store.done} embeddings to {store.matrix_path}", file=sys.stderr)
+
+
+def prefetch(executor: ThreadPoolExecutor, calls, depth: int) -> Iterator:
+    """Run `calls` on `executor` in order, with at most `depth` of them in flight."""
+    futures: deque = deque()
+    for fn, *fn_args in calls:
+        futures.append(executor.submit(fn, *fn_args))
+        if len(futures) >= depth:
+            yield futures.popleft().result()
+    while futures:
+        yield futures.popleft().result()
+
+
+def collect(item: Tuple[int, int, Future], store: EmbeddingStore, reporter):
+    start, images, future = item
+    embeddings = future.result()
+    store.write(start, embeddings)
+    reporter.update(images, len(embeddings), store.done)
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n\n", maxsplit=1)[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("input", help="directory of images or a video file")
+    parser.add_argument("output", help="directory for embeddings.npy and ids.txt")
+    parser.add_argument("--boxes", help="CSV of key,x1,y1,x2,y2 boxes")
+    parser.add_argument("--model-path", help="checkpoint, the bundled one by default")
+    parser.add_argument("--batch-size", type=int, default=64, help="crops per batch")
+    parser.add_argument(
+        "--max-batch-size",
+        type=int,
+        help="crops per forward pass, e.g. from autotune, the batch size by default",
+    )
+    parser.add_argument(
+        "--decode-workers",
+        type=int,
+        default=min(8, os.cpu_count() or 1),
+        help="image decoding threads",
+    )
+    parser.add_argument(
+        "--preprocess-workers", type=int, default=2, help="letterboxing threads"
+    )
+    parser.add_argument(
+        "--frame-step", type=int, default=1, help="embed every n-th video frame"
+    )
+    parser.add_argument("--normalize", action="store_true", help="L2-normalize")
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="replace an output directory holding other inputs",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    run(parse_args(argv))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,473 @@
+import asyncio
+import os
+import sys
+import tempfile
+from typing import ClassVar, Dict, List, Mapping, Optional, Sequence
+
+from grpclib import GRPCError, Status
+from numpy.typing import NDArray
+from typing_extensions import Self
+from viam.logging import getLogger
+from viam.module.types import Reconfigurable
+from viam.proto.app.robot import ServiceConfig
+from viam.proto.common import ResourceName
+from viam.proto.service.mlmodel import Metadata
+from viam.resource.base import ResourceBase
+from viam.resource.types import Model, ModelFamily
+from viam.services.mlmodel import MLModel
+from viam.utils import ValueTypes, struct_to_dict
+
+from src.module_process import ModuleProcess
+from src.person_embedder.metrics import ServiceMetrics
+from src.person_embedder.router import (
+    PER_CROP_OUTPUTS,
+    HashRing,
+    Instance,
+    aggregate_metrics,
+    crop_routing_keys,
+    is_instance_failure,
+    merge_outputs,
+    split_request,
+)
+
+LOGGER = getLogger(__name__)
+
+# attribute: (keyword argument, type), numbers must be non-negative
+ROUTER_ATTRIBUTES = {
+    "local_processes": ("local_processes", int),
+    "virtual_nodes": ("virtual_nodes", int),
+    "health_check_interval_s": ("health_check_interval_s", float),
+    "health_check_timeout_s": ("health_check_timeout_s", float),
+    "unhealthy_after": ("unhealthy_after", int),
+    "local_start_timeout_s": ("local_start_timeout_s", float),
+}
+
+
+class EmbedderRouter(MLModel, Reconfigurable):
+    """
+    EmbedderRouter fronts several embedder instances as one MLModel service.
+
+    Instances are other embedder services (`instances`, resolved as
+    dependencies) and module processes the router starts itself
+    (`local_processes`). infer requests are routed by consistent hashing on
+    their camera or track ids, so each camera or track keeps hitting the
+    same instance and its track state and caches stay warm. Instances that
+    fail a request or their health checks are skipped until they recover,
+    and their keys fall back to the next instance of the ring.
+    """
+
+    MODEL: ClassVar[Model] = Model(
+        ModelFamily("viam", "mlmodel"), "torchreid-embedder-router"
+    )
+
+    def __init__(self, name: str):
+        super().__init__(name=name)
+        self.ring = HashRing()
+        self.instances: Dict[str, Instance] = {}
+        self.processes: Dict[str, ModuleProcess] = {}
+        self.local_names: List[str] = []
+        self.local_attributes: Dict = {}
+        self.per_crop_outputs: Sequence[str] = PER_CROP_OUTPUTS
+        self.local_start_timeout_s = 60.0
+        self.health_check_interval_s = 2.0
+        self.health_check_timeout_s = 1.0
+        self.metrics = ServiceMetrics()
+        self._health_task: Optional[asyncio.Task] = None
+        self._start_lock: Optional[asyncio.Lock] = None
+        self._socket_dir: Optional[tempfile.TemporaryDirectory] = None
+
+    @classmethod
+    def new_service(
+        cls, config: ServiceConfig, dependencies: Mapping[ResourceName, ResourceBase]
+    ) -> Self:
+        """returns new ml model router"""
+        service = cls(config.name)
+        service.reconfigure(config, dependencies)
+        return service
+
+    @classmethod
+    def validate_config(cls, config: ServiceConfig) -> Sequence[str]:
+        """Validate config and returns the embedder instances it depends on."""
+        attributes = struct_to_dict(config.attributes)
+        kwargs = get_router_kwargs(attributes)
+        instances = get_router_instances(attributes)
+        get_router_heads(attributes)
+        if not instances and not kwargs.get("local_processes", 0):
+            raise ValueError("the router needs instances or local_processes")
+        return instances
+
+    def reconfigure(
+        self, config: ServiceConfig, dependencies: Mapping[ResourceName, ResourceBase]
+    ):
+        attributes = struct_to_dict(config.attributes)
+        kwargs = get_router_kwargs(attributes)
+        self.health_check_interval_s = kwargs.get("health_check_interval_s", 2.0)
+        self.health_check_timeout_s = kwargs.get("health_check_timeout_s", 1.0)
+        self.local_start_timeout_s = kwargs.get("local_start_timeout_s", 60.0)
+        unhealthy_after = max(kwargs.get("unhealthy_after", 2), 1)
+        virtual_nodes = max(kwargs.get("virtual_nodes", 64), 1)
+        local_attributes = attributes.get("local_attributes", {})
+        if local_attributes != self.local_attributes:
+            # the running processes embed with the old attributes
+            self._stop_processes(list(self.processes))
+        self.local_attributes = local_attributes
+        self.per_crop_outputs = PER_CROP_OUTPUTS + tuple(get_router_heads(attributes))
+
+        instances = {
+            name: Instance(
+                name, dependencies[MLModel.get_resource_name(name)], unhealthy_after
+            )
+            for name in get_router_instances(attributes)
+        }
+        self.local_names = []
+        for index in range(kwargs.get("local_processes", 0)):
+            name = f"local-{index}"
+            if name in instances:
+                raise ValueError(f"{name} is the name of a local process")
+            # started on the first request, since starting one is asynchronous
+            instance = Instance(name, None, unhealthy_after)
+            if name in self.processes:
+                instance.client = self.instances[name].client
+            instances[name] = instance
+            self.local_names.append(name)
+        self._stop_processes([name for name in self.processes if name not in instances])
+
+        if virtual_nodes != self.ring.virtual_nodes:
+            self.ring = HashRing(virtual_nodes=virtual_nodes)
+        for name in self.ring.names:
+            if name not in instances:
+                self.ring.remove(name)
+                self.metrics.increment("router_instances_removed")
+        for name in instances:
+            if name not in self.ring.names:
+                self.ring.add(name)
+                self.metrics.increment("router_instances_added")
+        self.instances = instances
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+
+    async def infer(
+        self,
+        input_tensors: Dict[str, NDArray],
+        *,
+        extra: Optional[Mapping[str, ValueTypes]] = None,
+        timeout: Optional[float] = None,
+    ) -> Dict[str, NDArray]:
+        """Embed the request on the instances that own its cameras or tracks.
+
+        Args:
+            input_tensors: as for the embedder service. With `track_ids`,
+                every crop goes to its track's instance: the request is split
+                per instance and the outputs are put back in crop order.
+                Requests with `clip_pooling` or `track_embeddings` are never
+                split, and go to the instance of their first track.
+            extra: forwarded to the instances. "camera_id" sends the whole
+                request to the camera's instance, before track ids are
+                looked at; "caller_id" routes requests without track ids.
+                Requests without any of them go to the least busy instance.
+            timeout: forwarded to the instances.
+
+        Returns:
+            Dict[str, NDArray]: the outputs of the instances.
+
+        Raises:
+            GRPCError: UNAVAILABLE when no instance could serve the request.
+        """
+        await self._ensure_started()
+        extra = dict(extra or {})
+        keys = crop_routing_keys(input_tensors, extra)
+        self.metrics.increment("router_requests")
+        if not keys:
+            return await self._forward(None, input_tensors, extra, timeout)
+        healthy = {name: i.healthy for name, i in self.instances.items()}
+        groups: Dict[str, List[int]] = {}
+        for row, key in enumerate(keys):
+            groups.setdefault(self.ring.owner(key, healthy), []).append(row)
+        if (
+            len(groups) == 1
+            or "clip_pooling" in extra
+            or "track_embeddings" in input_tensors
+        ):
+            return await self._forward(keys[0], input_tensors, extra, timeout)
+        self.metrics.increment("router_split_requests")
+        parts = await asyncio.gather(
+            *(
+                self._forward(
+                    keys[rows[0]], split_request(input_tensors, rows), extra, timeout
+                )
+                for rows in groups.values()
+            )
+        )
+        return merge_outputs(
+            len(keys), list(zip(groups.values(), parts)), self.per_crop_outputs
+        )
+
+    async def _forward(
+        self,
+        key: Optional[str],
+        input_tensors: Dict[str, NDArray],
+        extra: Mapping[str, ValueTypes],
+        timeout: Optional[float],
+    ) -> Dict[str, NDArray]:
+        """Serve a request on the first instance of `key` that answers."""
+        if key is None:
+            order = sorted(self.instances, key=lambda n: self.instances[n].in_flight)
+        else:
+            order = list(self.ring.owners(key))
+        # unhealthy instances are only tried once every healthy one failed
+        order.sort(key=lambda n: not self.instances[n].healthy)
+        error: Optional[BaseException] = None
+        for attempt, name in enumerate(order):
+            instance = self.instances[name]
+            if instance.client is None:
+                continue
+            instance.in_flight += 1
+            try:
+                res = await instance.client.infer(
+                    input_tensors, extra=extra, timeout=timeout
+                )
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                if not is_instance_failure(e):
+                    raise
+                LOGGER.warning(f"embedder instance {name} failed, failing over: {e}")
+                instance.failed(e, immediately=True)
+                self.metrics.increment("router_failovers")
+                error = e
+                continue
+            finally:
+                instance.in_flight -= 1
+            instance.succeeded()
+            self.metrics.increment(f"router_requests_{name}")
+            if attempt > 0:
+                self.metrics.increment("router_rerouted")
+            return res
+        raise GRPCError(
+            Status.UNAVAILABLE, "no embedder instance could serve the request"
+        ) from error
+
+    async def _ensure_started(self):
+        """Start the local processes and the health checks that are not running."""
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            missing = [
+                name for name in self.local_names if self.instances[name].client is None
+            ]
+            if missing:
+                await asyncio.gather(*(self._start_process(name) for name in missing))
+            if self.health_check_interval_s > 0 and (
+                self._health_task is None or self._health_task.done()
+            ):
+                self._health_task = asyncio.ensure_future(self._check_health())
+
+    async def _start_process(self, name: str):
+        """Start the module process of a local instance and add its embedder."""
+        instance = self.instances[name]
+        self._stop_processes([name])
+        if self._socket_dir is None:
+            self._socket_dir = tempfile.TemporaryDirectory(prefix="embedder-router-")
+        # a PyInstaller build runs the module binary itself
+        command = [sys.executable] if getattr(sys, "frozen", False) else None
+        process = ModuleProcess(
+            os.path.join(self._socket_dir.name, f"{name}.sock"), command=command
+        )
+        self.processes[name] = process
+        try:
+            await process.connect(self.local_start_timeout_s)
+            instance.client = await process.add_embedder(
+                "embedder", self.local_attributes
+            )
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            LOGGER.warning(f"failed to start embedder instance {name}: {e}")
+            instance.failed(e, immediately=True)
+            self._stop_processes([name])
+            return
+        instance.succeeded()
+        self.metrics.increment("router_processes_started")
+
+    def _stop_processes(self, names: Sequence[str]):
+        for name in names:
+            process = self.processes.pop(name, None)
+            if process is not None:
+                process.stop()
+            if name in self.instances:
+                self.instances[name].client = None
+
+    async def _check_health(self):
+        while True:
+            await asyncio.gather(
+                *(self._check(instance) for instance in list(self.instances.values()))
+            )
+            await asyncio.sleep(self.health_check_interval_s)
+
+    async def _check(self, instance: Instance):
+        """Health check an instance, restarting its local process if it died."""
+        if instance.name in self.local_names:
+            process = self.processes.get(instance.name, None)
+            if process is not None and process.process.poll() is not None:
+                instance.failed(
+                    RuntimeError(f"exited with code {process.process.returncode}"),
+                    immediately=True,
+                )
+            if process is None or process.process.poll() is not None:
+                async with self._start_lock:
+                    await self._start_process(instance.name)
+        if instance.client is None:
+            return
+        was_healthy = instance.healthy
+        try:
+            res = await asyncio.wait_for(
+                instance.client.do_command({"get_metrics": {}}),
+                self.health_check_timeout_s,
+            )
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            instance.failed(e)
+            if was_healthy and not instance.healthy:
+                LOGGER.warning(f"embedder instance {instance.name} is unhealthy: {e}")
+                self.metrics.increment("router_instances_down")
+            return
+        instance.succeeded(res.get("metrics", {}))
+        if not was_healthy:
+            LOGGER.info(f"embedder instance {instance.name} recovered")
+
+    async def do_command(
+        self,
+        command: Mapping[str, ValueTypes],
+        *,
+        timeout: Optional[float] = None,
+        **kwargs,
+    ) -> Mapping[str, ValueTypes]:
+        """
+        Handle router commands; others are sent to every instance.
+
+        Commands:
+            {"get_metrics": {}}: returns the instances' metrics combined
+                under "metrics" (counters summed, observations averaged,
+                p95 of the worst instance) with the router's own, and every
+                instance's health and metrics under "instances"
+            {"router_status": {}}: returns every instance's health under
+                "instances"
+            {"reset_metrics": {}}: clears the router and instance metrics
+
+        Any other command is sent to every instance that has started, and
+        the answers are returned by instance name under "instances".
+        """
+        await self._ensure_started()
+        if "router_status" in command:
+            return {
+                "instances": {
+                    name: instance.stats() for name, instance in self.instances.items()
+                }
+            }
+        if "reset_metrics" in command:
+            self.metrics.reset()
+        answers = await self._broadcast(command, timeout)
+        if "get_metrics" in command:
+            instance_metrics = {
+                name: answer.get("metrics", {})
+                for name, answer in answers.items()
+                if isinstance(answer, Mapping)
+            }
+            metrics = aggregate_metrics(list(instance_metrics.values()))
+            metrics.update(self.metrics.snapshot())
+            metrics["router_instances"] = len(self.instances)
+            metrics["router_healthy_instances"] = sum(
+                instance.healthy for instance in self.instances.values()
+            )
+            return {
+                "metrics": metrics,
+                "instances": {
+                    name: {
+                        **instance.stats(),
+                        "metrics": instance_metrics.get(name, {}),
+                    }
+                    for name, instance in self.instances.items()
+                },
+            }
+        return {"instances": answers}
+
+    async def _broadcast(
+        self, command: Mapping[str, ValueTypes], timeout: Optional[float]
+    ) -> Dict[str, ValueTypes]:
+        """Send `command` to every started instance; failures answer {"error"}."""
+        names = [name for name, i in self.instances.items() if i.client is not None]
+        answers = await asyncio.gather(
+            *(
+                self.instances[name].client.do_command(command, timeout=timeout)
+                for name in names
+            ),
+            return_exceptions=True,
+        )
+        res = {}
+        for name, answer in zip(names, answers):
+            if isinstance(answer, Exception):
+                if is_instance_failure(answer):
+                    self.instances[name].failed(answer, immediately=True)
+                answer = {"error": f"{type(answer).__name__}: {answer}"}
+            res[name] = answer
+        return res
+
+    async def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        self._stop_processes(list(self.processes))
+        if self._socket_dir is not None:
+            self._socket_dir.cleanup()
+            self._socket_dir = None
+
+    async def metadata(
+        self,
+        *,
+        extra: Optional[Mapping[str, ValueTypes]] = None,
+        timeout: Optional[float] = None,
+    ) -> Metadata:
+        """The metadata of the first healthy instance."""
+        await self._ensure_started()
+        for instance in sorted(self.instances.values(), key=lambda i: not i.healthy):
+            if instance.client is not None:
+                return await instance.client.metadata(extra=extra, timeout=timeout)
+        raise GRPCError(Status.UNAVAILABLE, "no embedder instance is available")
+
+
+def get_router_instances(attributes: Mapping) -> List[str]:
+    """Read the `instances` attribute: names of embedder services."""
+    instances = attributes.get("instances", [])
+    if not isinstance(instances, list) or not all(
+        isinstance(name, str) for name in instances
+    ):
+        raise ValueError("instances must be a list of service names")
+    if len(set(instances)) != len(instances):
+        raise ValueError("instances must not repeat")
+    return instances
+
+
+def get_router_heads(attributes: Mapping) -> List[str]:
+    """
+    Read the `heads` attribute: head output names of the instances, which
+    split requests put back in crop order. Heads of `local_attributes` are
+    added.
+    """
+    heads = attributes.get("heads", [])
+    if not isinstance(heads, list) or not all(isinstance(name, str) for name in heads):
+        raise ValueError("heads must be a list of head output names")
+    local_heads = attributes.get("local_attributes", {}).get("heads", {})
+    if isinstance(local_heads, dict):
+        heads = heads + [name for name in local_heads if name not in heads]
+    return heads
+
+
+def get_router_kwargs(attributes: Mapping) -> Dict[str, ValueTypes]:
+    """Read the router attributes that were set, see ROUTER_ATTRIBUTES."""
+    kwargs = {}
+    for attribute, (kwarg, kind) in ROUTER_ATTRIBUTES.items():
+        if attribute not in attributes:
+            continue
+        value = attributes[attribute]
+        if not isinstance(value, (int, float)) or isinstance(value, bool) or value < 0:
+            raise ValueError(f"{attribute} must be a non-negative number")
+        kwargs[kwarg] = kind(value)
+    if not isinstance(attributes.get("local_attributes", {}), dict):
+        raise ValueError("local_attributes must be a JSON object")
+    return kwargs
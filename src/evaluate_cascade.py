@@ -0,0 +1,180 @@
+"""
+Measure the accuracy cost of the embedding cascade on a labeled folder.
+
+The folder holds one sub-directory of crops per identity. The first
+--gallery-size crops of every identity, in name order, form the gallery and
+the others are the queries. Every crop is embedded once by both models, then
+the cascade is replayed for every margin threshold. The tool reports rank-1
+accuracy, the fraction of queries escalated to the large model, and the
+embedding time per query relative to the large model alone. The small-only
+and large-only baselines are reported alongside.
+
+    python -m src.evaluate_cascade crops/ --small-model-path osnet_ain_x0_25.pth \\
+        --margins 0.02 0.05 0.1 0.2
+"""
+
+import argparse
+import json
+import os
+import time
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from src.embed_offline import crops_from_image, list_images
+from src.person_embedder.cascade import match_margins, select_escalations
+from src.person_embedder.os_net_encoder import OSNetFeatureEmbedder
+
+
+def load_labeled_folder(root: str) -> Tuple[List[str], np.ndarray]:
+    """Image paths relative to `root` and the identity (sub-directory) of each."""
+    paths = [path for path in list_images(root) if os.sep in path]
+    labels = np.array([path.split(os.sep, 1)[0] for path in paths])
+    return paths, labels
+
+
+def split_gallery(
+    labels: np.ndarray, gallery_size: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Indices of the gallery (first `gallery_size` per identity) and the queries."""
+    gallery, queries = [], []
+    seen: Dict[str, int] = {}
+    for i, label in enumerate(labels):
+        if seen.get(label, 0) < gallery_size:
+            gallery.append(i)
+        else:
+            queries.append(i)
+        seen[label] = seen.get(label, 0) + 1
+    return np.array(gallery, dtype=int), np.array(queries, dtype=int)
+
+
+def embed(
+    embedder: OSNetFeatureEmbedder, crops, batch_size: int
+) -> Tuple[np.ndarray, float]:
+    """Embeddings of `crops` and the mean embedding time per crop in ms."""
+    res = []
+    started = time.perf_counter()
+    for start in range(0, len(crops), batch_size):
+        res.append(
+            embedder.compute_features(crops[start : start + batch_size]).cpu().numpy()
+        )
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    return np.concatenate(res), elapsed_ms / max(len(crops), 1)
+
+
+def evaluate(
+    small: np.ndarray,
+    large: np.ndarray,
+    labels: np.ndarray,
+    gallery: np.ndarray,
+    queries: np.ndarray,
+    margins: Sequence[float],
+    max_escalation: float,
+    small_ms: float,
+    large_ms: float,
+) -> List[Dict]:
+    """Rank-1 accuracy, escalation and relative cost of every configuration."""
+    correct_label = labels[queries]
+    gallery_labels = labels[gallery]
+    small_best, _, small_margin = match_margins(small[queries], small[gallery])
+    large_best, _, _ = match_margins(large[queries], large[gallery])
+
+    def row(name, best, escalated):
+        fraction = escalated / max(len(queries), 1)
+        return {
+            "config": name,
+            "rank1": float(np.mean(gallery_labels[best] == correct_label)),
+            "escalated": fraction,
+            "relative_cost": (small_ms + fraction * large_ms) / large_ms,
+        }
+
+    rows = [
+        row("small", small_best, 0),
+        {**row("large", large_best, len(queries)), "relative_cost": 1.0},
+    ]
+    for margin in margins:
+        escalate = select_escalations(small_margin, margin, max_escalation)
+        best = small_best.copy()
+        best[escalate] = large_best[escalate]
+        rows.append(row(f"margin {margin:g}", best, len(escalate)))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n\n", maxsplit=1)[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("folder", help="one sub-directory of crops per identity")
+    parser.add_argument("--small-model-path", help="checkpoint of the small model")
+    parser.add_argument("--small-architecture", default="osnet_ain_x0_25")
+    parser.add_argument(
+        "--model-path", help="large checkpoint, the bundled one by default"
+    )
+    parser.add_argument(
+        "--margins", type=float, nargs="+", default=[0.02, 0.05, 0.1, 0.2]
+    )
+    parser.add_argument("--max-escalation", type=float, default=1.0)
+    parser.add_argument(
+        "--gallery-size", type=int, default=1, help="gallery crops per identity"
+    )
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument(
+        "--random-weights", action="store_true", help="skip loading weights"
+    )
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    paths, labels = load_labeled_folder(args.folder)
+    gallery, queries = split_gallery(labels, args.gallery_size)
+    if len(queries) == 0:
+        raise SystemExit(
+            "no queries: every identity needs more than --gallery-size crops"
+        )
+    small_embedder = OSNetFeatureEmbedder(
+        args.small_model_path,
+        random_weights=args.random_weights,
+        architecture=args.small_architecture,
+    )
+    large_embedder = OSNetFeatureEmbedder(
+        args.model_path, random_weights=args.random_weights
+    )
+    crops = [
+        crops_from_image(args.folder, (path, None), large_embedder.input_shape)[0]
+        for path in paths
+    ]
+    small, small_ms = embed(small_embedder, crops, args.batch_size)
+    large, large_ms = embed(large_embedder, crops, args.batch_size)
+    rows = evaluate(
+        small,
+        large,
+        labels,
+        gallery,
+        queries,
+        args.margins,
+        args.max_escalation,
+        small_ms,
+        large_ms,
+    )
+
+    print(
+        f"{len(set(labels))} identities, {len(gallery)} gallery crops, "
+        f"{len(queries)} queries; {small_ms:.1f} ms/crop small, {large_ms:.1f} ms/crop large"
+    )
+    print(f"{'config':<14}{'rank-1':>8}{'escalated':>11}{'cost':>7}")
+    for res in rows:
+        print(
+            f"{res['config']:<14}{res['rank1']:>8.3f}{res['escalated']:>11.2f}"
+            f"{res['relative_cost']:>7.2f}"
+        )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(
+                {"small_ms": small_ms, "large_ms": large_ms, "results": rows},
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
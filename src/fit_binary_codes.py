@@ -0,0 +1,60 @@
+"""
+Fit the projection of embeddings to binary codes.
+
+Reads the output directory of embed_offline, fits a projection to `--bits`
+bit codes on (a sample of) its embeddings and saves it as a .npz file for
+the `binary_codes_path` attribute. "itq" learns the rotation that loses the
+fewest neighbors to binarization; "random" only needs a handful of
+embeddings to estimate their mean.
+
+    python -m src.fit_binary_codes gallery/ codes.npz --bits 256
+    python -m src.fit_binary_codes gallery/ codes.npz --bits 128 --method random
+"""
+
+import argparse
+import os
+
+import numpy as np
+
+from src.person_embedder.hashing import HASH_METHODS, BinaryHasher, fit_projection
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n\n", maxsplit=1)[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("embeddings", help="embed_offline output directory")
+    parser.add_argument("output", help=".npz file to write")
+    parser.add_argument("--bits", type=int, default=256)
+    parser.add_argument("--method", choices=HASH_METHODS, default="itq")
+    parser.add_argument(
+        "--sample", type=int, default=50000, help="embeddings fitted on, at most"
+    )
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    if not args.output.lower().endswith(".npz"):
+        parser.error("the output must be a .npz file")
+
+    embeddings = np.load(os.path.join(args.embeddings, "embeddings.npy"), mmap_mode="r")
+    rows = np.arange(len(embeddings))
+    if len(rows) > args.sample:
+        rows = np.sort(
+            np.random.default_rng(args.seed).choice(rows, args.sample, replace=False)
+        )
+    sample = np.asarray(embeddings[rows], dtype=np.float32)
+    # rows embed_offline has not reached yet are zero
+    sample = sample[sample.any(axis=1)]
+    projection, mean = fit_projection(
+        sample, args.bits, args.method, args.iterations, args.seed
+    )
+    BinaryHasher(projection, mean).save(args.output)
+    print(
+        f"fitted {args.bits}-bit {args.method} codes on {len(sample)} embeddings "
+        f"to {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
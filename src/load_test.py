@@ -0,0 +1,359 @@
+"""
+End-to-end load test of the module.
+
+Starts the module with `src/main.py` on a local unix socket, adds an embedder
+resource through the module interface, the way viam-server does, and drives
+`infer` from simulated cameras. Each camera replays the frames of a
+`FakeCamera` with the detections of a `FakeDetectorVisionService`, sent as
+encoded JPEG frames plus boxes, like the pipeline mode does.
+
+In closed-loop mode every camera sends its next request as soon as the
+previous one returns, so concurrency is fixed at the number of cameras. In
+open-loop mode every camera sends requests at a fixed rate whether or not
+earlier ones returned, and latency is measured from the scheduled send time,
+so a saturated module shows up as growing latency instead of a lower send
+rate. Latency percentiles, throughput and the module's CPU and RSS are
+reported every interval and for the whole run.
+
+    python -m src.load_test --cameras 8 --mode open --rate 5 --duration 60
+
+With --fake-profile, the cameras drive an in-process FakeEmbedderMLModel
+that replays a latency profile from src/record_latency_profile.py instead of
+the module, for capacity planning on machines without the model weights:
+
+    python -m src.load_test --cameras 16 --mode open --rate 5 \
+        --fake-profile profile.json --fake-concurrency 2
+
+CPU and RSS are read from /proc and are only reported on Linux.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+from viam.services.mlmodel import MLModel
+
+from src.module_process import ModuleProcess
+from src.person_embedder.latency_profile import LatencyProfile
+from src.test.fake_camera import FakeCamera
+from src.test.fake_detector_vision_service import FakeDetectorVisionService
+from src.test.fake_embedder_ml_model_service import FakeEmbedderMLModel
+
+PERCENTILES = (50, 95, 99)
+
+
+class SimulatedCamera:
+    """Cycles through the frames of a FakeCamera with their fake detections."""
+
+    def __init__(self, name: str, images_path: str, labels: Optional[List[str]]):
+        self.name = name
+        self.camera = FakeCamera(name, images_path, use_ring_buffer=True)
+        self.detector = FakeDetectorVisionService(f"{name}-detector")
+        self.labels = set(labels) if labels else None
+        self.requests: List[Dict[str, NDArray]] = []
+        self._next = 0
+
+    async def load(self):
+        """Encode every frame once, so the load generator only sends requests."""
+        for _ in range(self.camera.get_number_of_images()):
+            image = await self.camera.get_image()
+            detections = [
+                d
+                for d in await self.detector.get_detections(image)
+                if self.labels is None or d.class_name in self.labels
+            ]
+            boxes = np.array(
+                [[d.x_min, d.y_min, d.x_max, d.y_max] for d in detections],
+                dtype=np.float32,
+            ).reshape(-1, 4)
+            self.requests.append(
+                {"input": np.frombuffer(image.data, dtype=np.uint8), "boxes": boxes}
+            )
+
+    def next_request(self) -> Dict[str, NDArray]:
+        request = self.requests[self._next % len(self.requests)]
+        self._next += 1
+        return request
+
+
+class ProcessSampler:
+    """CPU utilization and resident memory of a process, read from /proc."""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.clock_ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+        self._last: Optional[Tuple[float, float]] = None
+
+    def available(self) -> bool:
+        return os.path.exists(f"/proc/{self.pid}/stat")
+
+    def sample(self) -> Tuple[Optional[float], Optional[float]]:
+        """
+        :return: (cpu_percent since the previous sample, rss_mb), None when unknown.
+        """
+        if not self.available():
+            return None, None
+        with open(f"/proc/{self.pid}/stat", encoding="utf-8") as f:
+            # the command name may contain spaces, fields start after it
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu_seconds = (int(fields[11]) + int(fields[12])) / self.clock_ticks
+        rss_mb = None
+        with open(f"/proc/{self.pid}/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss_mb = int(line.split()[1]) / 1024
+        now = time.monotonic()
+        cpu_percent = None
+        if self._last is not None:
+            last_now, last_cpu = self._last
+            cpu_percent = 100 * (cpu_seconds - last_cpu) / max(now - last_now, 1e-9)
+        self._last = (now, cpu_seconds)
+        return cpu_percent, rss_mb
+
+
+class LoadTest:
+    def __init__(
+        self,
+        client: MLModel,
+        cameras: List[SimulatedCamera],
+        sampler: ProcessSampler,
+        mode: str = "closed",
+        rate: float = 5.0,
+        duration: float = 30.0,
+        report_interval: float = 5.0,
+    ):
+        """
+        :param mode: "closed" or "open" loop.
+        :param rate: requests per second per camera in open-loop mode.
+        """
+        self.client = client
+        self.cameras = cameras
+        self.sampler = sampler
+        self.mode = mode
+        self.rate = rate
+        self.duration = duration
+        self.report_interval = report_interval
+        # (completed_at, latency_s, ok) of every request
+        self.results: List[Tuple[float, float, bool]] = []
+        self.timeline: List[Dict] = []
+        self._in_flight = 0
+
+    async def run(self) -> Dict:
+        self.started_at = time.monotonic()
+        self._window_start = self.started_at
+        self.sampler.sample()
+        runner = self._open_loop if self.mode == "open" else self._closed_loop
+        tasks = [asyncio.ensure_future(runner(camera)) for camera in self.cameras]
+        reporter = asyncio.ensure_future(self._report())
+        await asyncio.gather(*tasks)
+        reporter.cancel()
+        self._report_window(self._window_start, time.monotonic())
+        return self.summary()
+
+    async def _send(self, camera: SimulatedCamera, scheduled_at: float):
+        self._in_flight += 1
+        ok = True
+        try:
+            await self.client.infer(camera.next_request())
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            ok = False
+            print(f"{camera.name}: infer failed: {e}", file=sys.stderr)
+        finally:
+            self._in_flight -= 1
+        now = time.monotonic()
+        self.results.append((now, now - scheduled_at, ok))
+
+    async def _closed_loop(self, camera: SimulatedCamera):
+        while time.monotonic() - self.started_at < self.duration:
+            await self._send(camera, time.monotonic())
+
+    async def _open_loop(self, camera: SimulatedCamera):
+        interval = 1 / self.rate
+        # spread the cameras over the first interval instead of sending in bursts
+        scheduled_at = self.started_at + interval * np.random.rand()
+        pending = set()
+        while scheduled_at - self.started_at < self.duration:
+            await asyncio.sleep(max(0, scheduled_at - time.monotonic()))
+            task = asyncio.ensure_future(self._send(camera, scheduled_at))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            scheduled_at += interval
+        if pending:
+            await asyncio.gather(*pending)
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            now = time.monotonic()
+            self._report_window(self._window_start, now)
+            self._window_start = now
+
+    def _report_window(self, start: float, end: float):
+        window = [r for r in self.results if start <= r[0] < end]
+        cpu_percent, rss_mb = self.sampler.sample()
+        entry = {
+            "t": round(end - self.started_at, 2),
+            "throughput": len(window) / max(end - start, 1e-9),
+            "errors": sum(1 for r in window if not r[2]),
+            "in_flight": self._in_flight,
+            "cpu_percent": cpu_percent,
+            "rss_mb": rss_mb,
+        }
+        entry.update(latency_percentiles([r[1] for r in window if r[2]]))
+        self.timeline.append(entry)
+        print(format_entry(entry), flush=True)
+
+    def summary(self) -> Dict:
+        elapsed = max((r[0] for r in self.results), default=self.started_at)
+        elapsed -= self.started_at
+        latencies = [r[1] for r in self.results if r[2]]
+        cpu = [e["cpu_percent"] for e in self.timeline if e["cpu_percent"] is not None]
+        rss = [e["rss_mb"] for e in self.timeline if e["rss_mb"] is not None]
+        res = {
+            "mode": self.mode,
+            "cameras": len(self.cameras),
+            "rate_per_camera": self.rate if self.mode == "open" else None,
+            "requests": len(self.results),
+            "errors": sum(1 for r in self.results if not r[2]),
+            "throughput": len(latencies) / max(elapsed, 1e-9),
+            "cpu_percent_mean": float(np.mean(cpu)) if cpu else None,
+            "rss_mb_max": max(rss) if rss else None,
+        }
+        res.update(latency_percentiles(latencies))
+        return res
+
+
+def latency_percentiles(latencies: List[float]) -> Dict[str, Optional[float]]:
+    if not latencies:
+        return {f"p{p}_ms": None for p in PERCENTILES}
+    values = np.percentile(np.asarray(latencies) * 1000, PERCENTILES)
+    return {f"p{p}_ms": float(v) for p, v in zip(PERCENTILES, values)}
+
+
+def format_entry(entry: Dict) -> str:
+    def fmt(value, spec):
+        return "-" if value is None else format(value, spec)
+
+    return (
+        f"t={entry['t']:>7.1f}s  {entry['throughput']:7.1f} req/s  "
+        + "  ".join(f"p{p}={fmt(entry[f'p{p}_ms'], '.1f')}ms" for p in PERCENTILES)
+        + f"  errors={entry['errors']}  in_flight={entry['in_flight']}"
+        + f"  cpu={fmt(entry['cpu_percent'], '.0f')}%  rss={fmt(entry['rss_mb'], '.0f')}MB"
+    )
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--cameras", type=int, default=4, help="simulated cameras")
+    parser.add_argument("--mode", choices=("closed", "open"), default="closed")
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=5.0,
+        help="requests per second per camera in open-loop mode",
+    )
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds")
+    parser.add_argument("--report-interval", type=float, default=5.0, help="seconds")
+    parser.add_argument(
+        "--images", default="./src/test/alex", help="folder of .jpg frames"
+    )
+    parser.add_argument(
+        "--labels",
+        nargs="*",
+        default=None,
+        help="detection class names to embed, all by default",
+    )
+    parser.add_argument(
+        "--config",
+        default="{}",
+        help="embedder attributes as JSON, or a path to a JSON file",
+    )
+    parser.add_argument(
+        "--random-weights",
+        action="store_true",
+        help="run without the weights file (sets the random_weights attribute)",
+    )
+    parser.add_argument(
+        "--fake-profile",
+        help="latency profile JSON to load test a fake embedder instead of the module",
+    )
+    parser.add_argument(
+        "--fake-concurrency",
+        type=int,
+        default=1,
+        help="requests the fake embedder serves at once",
+    )
+    parser.add_argument("--output", help="write the timeline and summary as JSON")
+    return parser.parse_args(argv)
+
+
+def load_attributes(config: str) -> Dict:
+    if os.path.exists(config):
+        with open(config, encoding="utf-8") as f:
+            return json.load(f)
+    return json.loads(config)
+
+
+async def main(argv=None):
+    args = parse_args(argv)
+    attributes = load_attributes(args.config)
+    if args.random_weights:
+        attributes["random_weights"] = True
+
+    cameras = [
+        SimulatedCamera(f"camera-{i}", args.images, args.labels)
+        for i in range(args.cameras)
+    ]
+    for camera in cameras:
+        await camera.load()
+
+    def make_load_test(client: MLModel, pid: int) -> LoadTest:
+        return LoadTest(
+            client,
+            cameras,
+            ProcessSampler(pid),
+            mode=args.mode,
+            rate=args.rate,
+            duration=args.duration,
+            report_interval=args.report_interval,
+        )
+
+    if args.fake_profile:
+        fake = FakeEmbedderMLModel(
+            "embedder",
+            LatencyProfile.load(args.fake_profile),
+            max_concurrency=args.fake_concurrency,
+        )
+        load_test = make_load_test(fake, os.getpid())
+        summary = await load_test.run()
+        summary["fake_metrics"] = (await fake.do_command({"get_metrics": {}}))[
+            "metrics"
+        ]
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            module = ModuleProcess(os.path.join(tmp, "module.sock"))
+            try:
+                await module.connect()
+                client = await module.add_embedder("embedder", attributes)
+                # the first call pays for lazy initialization, keep it out of the stats
+                await client.infer(cameras[0].next_request())
+                load_test = make_load_test(client, module.pid)
+                summary = await load_test.run()
+            finally:
+                module.stop()
+
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "timeline": load_test.timeline}, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
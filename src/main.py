@@ -6,6 +6,7 @@ from viam.resource.registry import Registry, ResourceCreatorRegistration
 from viam.services.mlmodel import MLModel
 from viam.services.vision import Vision
 
+from src.embedder_router import EmbedderRouter
 from src.person_embedder_service import PersonEmbedderService
 
 
@@ -23,9 +24,18 @@ async def main():
             PersonEmbedderService.validate_config,
         ),
     )
+    Registry.register_resource_creator(
+        MLModel.API,
+        EmbedderRouter.MODEL,
+        ResourceCreatorRegistration(
+            EmbedderRouter.new_service,
+            EmbedderRouter.validate_config,
+        ),
+    )
     module = Module.from_args()
 
     module.add_model_from_registry(MLModel.API, PersonEmbedderService.MODEL)
+    module.add_model_from_registry(MLModel.API, EmbedderRouter.MODEL)
     await module.start()
 
 
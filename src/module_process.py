@@ -0,0 +1,81 @@
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+from google.protobuf.struct_pb2 import Struct
+from grpclib.client import Channel
+from viam.proto.app.robot import ComponentConfig, LogConfiguration
+from viam.proto.module import AddResourceRequest, ModuleServiceStub
+from viam.services.mlmodel import MLModel, MLModelClient
+
+from src.person_embedder_service import PersonEmbedderService
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ModuleProcess:
+    """The module started with src/main.py, serving on a unix socket."""
+
+    def __init__(
+        self,
+        socket_path: str,
+        log_level: str = "info",
+        command: Optional[List[str]] = None,
+        env: Optional[Dict[str, str]] = None,
+    ):
+        """
+        :param command: module executable, e.g. a PyInstaller build, to run
+            instead of `python -m src.main`.
+        :param env: extra environment variables of the module process.
+        """
+        self.socket_path = socket_path
+        args = list(command or [sys.executable, "-m", "src.main"]) + [socket_path]
+        if log_level == "debug":
+            args.append("--log-level=debug")
+        self.process = subprocess.Popen(
+            args, cwd=REPO_ROOT, env={**os.environ, **(env or {})}
+        )
+        self.channel: Optional[Channel] = None
+
+    @property
+    def pid(self) -> int:
+        return self.process.pid
+
+    async def connect(self, timeout: float = 60.0) -> Channel:
+        deadline = time.monotonic() + timeout
+        while not os.path.exists(self.socket_path):
+            if self.process.poll() is not None:
+                raise RuntimeError(f"module exited with code {self.process.returncode}")
+            if time.monotonic() > deadline:
+                raise TimeoutError("module did not create its socket in time")
+            await asyncio.sleep(0.1)
+        self.channel = Channel(path=self.socket_path)
+        return self.channel
+
+    async def add_embedder(self, name: str, attributes: Dict) -> MLModelClient:
+        """Create the embedder resource like viam-server does and return a client to it."""
+        struct = Struct()
+        struct.update(attributes)
+        config = ComponentConfig(
+            name=name,
+            api=str(MLModel.API),
+            model=str(PersonEmbedderService.MODEL),
+            attributes=struct,
+            log_configuration=LogConfiguration(level="info"),
+        )
+        await ModuleServiceStub(self.channel).AddResource(
+            AddResourceRequest(config=config)
+        )
+        return MLModelClient(name, self.channel)
+
+    def stop(self):
+        if self.channel is not None:
+            self.channel.close()
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
@@ -0,0 +1,270 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from grpclib import GRPCError, Status
+from numpy.typing import NDArray
+
+from src.person_embedder.metrics import ServiceMetrics
+
+
+class OverloadError(GRPCError):
+    """A request shed by admission control, seen by clients as RESOURCE_EXHAUSTED."""
+
+    def __init__(self, message: str):
+        super().__init__(Status.RESOURCE_EXHAUSTED, message)
+
+
+def count_crops(input_tensors: Dict[str, NDArray]) -> int:
+    """Number of crops an infer request embeds."""
+    if "boxes" in input_tensors:
+        return len(input_tensors["boxes"].reshape(-1, 4))
+    if "input_lengths" in input_tensors:
+        return input_tensors["input_lengths"].size
+    if input_tensors["input"].ndim == 4:
+        return input_tensors["input"].shape[0]
+    return 1
+
+
+def is_batched(input_tensors: Dict[str, NDArray]) -> bool:
+    """
+    Whether an infer request is a batch, answered with (N, ...) outputs,
+    rather than a single crop answered with unbatched ones.
+
+    A frame with boxes, crops with `input_lengths` (even one) and 4-D input
+    are batches.
+    """
+    return (
+        "boxes" in input_tensors
+        or "input_lengths" in input_tensors
+        or input_tensors["input"].ndim == 4
+    )
+
+
+class _Waiter:
+    """A queued request, released by setting its future."""
+
+    def __init__(self, cost: int, future: asyncio.Future):
+        self.cost = cost
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class AdmissionController:
+    """
+    Deadline-aware admission in front of infer.
+
+    At most `max_concurrency` requests run at once, the others wait in an
+    earliest-deadline-first queue. A request's deadline is the `timeout` its
+    caller set (the gRPC deadline), or `default_deadline_ms` when it has none.
+    The time a request needs is estimated from an EWMA of the recent per-crop
+    service time, so requests are shed as soon as they can no longer finish
+    in time instead of being computed for a caller that has given up:
+
+    - on arrival, when the running work plus the queued requests with earlier
+      deadlines plus the request itself would end past its deadline;
+    - when a slot frees up, queued requests that can no longer make it are
+      dropped instead of started;
+    - when the queue holds `max_queue` requests, the one with the latest
+      deadline (possibly the new request) is shed;
+    - when a caller (`caller_id` in extra) already has
+      `max_in_flight_per_caller` requests queued or running.
+
+    Shed requests fail with OverloadError and are counted in the
+    `admission_shed_*` metrics. All methods run on the event loop.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 1,
+        max_queue: int = 64,
+        max_in_flight_per_caller: int = 0,
+        default_deadline_ms: float = 0.0,
+        initial_crop_ms: float = 20.0,
+        ewma_alpha: float = 0.2,
+        metrics: Optional[ServiceMetrics] = None,
+    ):
+        """
+        :param max_in_flight_per_caller: 0 disables the per-caller cap.
+        :param default_deadline_ms: deadline of requests without a timeout,
+            0 lets them wait as long as it takes.
+        :param initial_crop_ms: per-crop service time assumed until requests
+            have been measured.
+        """
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_in_flight_per_caller = max_in_flight_per_caller
+        self.default_deadline_ms = default_deadline_ms
+        self.crop_s = initial_crop_ms / 1000
+        self.ewma_alpha = ewma_alpha
+        self.metrics = metrics
+        self._queue: List[Tuple[float, int, _Waiter]] = []
+        self._sequence = itertools.count()
+        # request token -> (started at, estimated seconds)
+        self._running: Dict[int, Tuple[float, float]] = {}
+        self._in_flight: Dict[str, int] = {}
+
+    def estimate(self, cost: int) -> float:
+        """Estimated seconds to serve a request of `cost` crops."""
+        return max(cost, 1) * self.crop_s
+
+    def deadline(self, timeout: Optional[float], now: float) -> float:
+        if timeout is not None:
+            return now + timeout
+        if self.default_deadline_ms > 0:
+            return now + self.default_deadline_ms / 1000
+        return math.inf
+
+    def queue_depth(self) -> int:
+        return sum(1 for _, _, w in self._queue if not w.future.done())
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "admission_queue_depth": self.queue_depth(),
+            "admission_running": len(self._running),
+            "admission_crop_ms": self.crop_s * 1000,
+        }
+
+    @asynccontextmanager
+    async def admit(
+        self, cost: int, timeout: Optional[float] = None, caller: Optional[str] = None
+    ) -> AsyncIterator[None]:
+        """
+        Wait for a slot to serve a request of `cost` crops.
+
+        :raises OverloadError: when the request is shed.
+        """
+        now = time.monotonic()
+        deadline = self.deadline(timeout, now)
+        if (
+            caller is not None
+            and self.max_in_flight_per_caller > 0
+            and self._in_flight.get(caller, 0) >= self.max_in_flight_per_caller
+        ):
+            self._shed(
+                "caller_limit",
+                f"caller {caller} already has {self.max_in_flight_per_caller} requests in flight",
+            )
+        if now + self._backlog(now, deadline) + self.estimate(cost) > deadline:
+            self._shed(
+                "deadline",
+                f"request of {cost} crops cannot finish within its "
+                f"{(deadline - now) * 1000:.0f} ms deadline",
+            )
+
+        self._add_caller(caller, 1)
+        try:
+            if len(self._running) < self.max_concurrency and self.queue_depth() == 0:
+                token = self._start(cost, now)
+            else:
+                token = await self._wait(deadline, cost)
+        except BaseException:
+            self._add_caller(caller, -1)
+            raise
+
+        started = time.monotonic()
+        succeeded = False
+        try:
+            yield
+            succeeded = True
+        finally:
+            self._running.pop(token, None)
+            self._add_caller(caller, -1)
+            if succeeded:
+                elapsed = time.monotonic() - started
+                self.crop_s += self.ewma_alpha * (elapsed / max(cost, 1) - self.crop_s)
+            self._dispatch()
+
+    async def _wait(self, deadline: float, cost: int) -> int:
+        if self.queue_depth() >= self.max_queue:
+            latest = max(
+                (entry for entry in self._queue if not entry[2].future.done()),
+                key=lambda entry: entry[0],
+                default=None,
+            )
+            if latest is None or latest[0] <= deadline:
+                self._shed("queue_full", f"admission queue of {self.max_queue} is full")
+            latest[2].future.set_exception(
+                self._overload(
+                    "queue_full", "evicted by a request with an earlier deadline"
+                )
+            )
+
+        waiter = _Waiter(cost, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queue, (deadline, next(self._sequence), waiter))
+        try:
+            token = await waiter.future
+        except asyncio.CancelledError:
+            # the caller went away; a slot it was just given goes to the next request
+            if waiter.future.done() and not waiter.future.cancelled():
+                if waiter.future.exception() is None:
+                    self._running.pop(waiter.future.result(), None)
+                    self._dispatch()
+            else:
+                waiter.future.cancel()
+            raise
+        if self.metrics is not None:
+            self.metrics.observe(
+                "admission_wait_ms", (time.monotonic() - waiter.enqueued_at) * 1000
+            )
+        return token
+
+    def _dispatch(self):
+        """Start queued requests, earliest deadline first, while slots are free."""
+        while self._queue and len(self._running) < self.max_concurrency:
+            deadline, _, waiter = heapq.heappop(self._queue)
+            if waiter.future.done():
+                continue
+            now = time.monotonic()
+            if now + self.estimate(waiter.cost) > deadline:
+                waiter.future.set_exception(
+                    self._overload(
+                        "expired", "request can no longer finish within its deadline"
+                    )
+                )
+                continue
+            waiter.future.set_result(self._start(waiter.cost, now))
+
+    def _start(self, cost: int, now: float) -> int:
+        token = next(self._sequence)
+        self._running[token] = (now, self.estimate(cost))
+        if self.metrics is not None:
+            self.metrics.increment("admission_admitted")
+        return token
+
+    def _backlog(self, now: float, deadline: float) -> float:
+        """Estimated seconds until a request with `deadline` would start."""
+        if len(self._running) < self.max_concurrency and self.queue_depth() == 0:
+            return 0.0
+        running = sum(
+            max(estimate - (now - started), 0.0)
+            for started, estimate in self._running.values()
+        )
+        ahead = sum(
+            self.estimate(waiter.cost)
+            for entry_deadline, _, waiter in self._queue
+            if entry_deadline <= deadline and not waiter.future.done()
+        )
+        return (running + ahead) / self.max_concurrency
+
+    def _add_caller(self, caller: Optional[str], delta: int):
+        if caller is None:
+            return
+        count = self._in_flight.get(caller, 0) + delta
+        if count > 0:
+            self._in_flight[caller] = count
+        else:
+            self._in_flight.pop(caller, None)
+
+    def _overload(self, reason: str, message: str) -> OverloadError:
+        if self.metrics is not None:
+            self.metrics.increment("admission_shed")
+            self.metrics.increment(f"admission_shed_{reason}")
+        return OverloadError(f"overloaded: {message}")
+
+    def _shed(self, reason: str, message: str):
+        raise self._overload(reason, message)
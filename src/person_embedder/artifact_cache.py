@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+import platform
+import tempfile
+import time
+from typing import Dict, Mapping, Optional
+
+import torch
+from viam.logging import getLogger
+
+from src.person_embedder.metrics import ServiceMetrics
+
+LOGGER = getLogger(__name__)
+
+# bump when the way artifacts are built or stored changes to invalidate them
+ARTIFACT_VERSION = 1
+ARTIFACT_SUFFIX = ".pt"
+
+
+def file_hash(path: str) -> str:
+    """Hash of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cpu_flags() -> str:
+    """
+    Hash of the instruction set extensions of the host CPU.
+
+    Kernels picked while building an artifact can depend on them, so an
+    artifact cache shared between hosts never mixes CPUs.
+    """
+    flags = platform.machine()
+    try:
+        with open("/proc/cpuinfo", encoding="utf-8") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                # x86 reports "flags", ARM "Features"
+                if key.strip() in ("flags", "Features"):
+                    flags += " " + " ".join(sorted(value.split()))
+                    break
+    except OSError:
+        pass
+    return hashlib.sha256(flags.encode()).hexdigest()[:16]
+
+
+class ArtifactCache:
+    """
+    Directory of ready-to-run model state dicts, keyed by everything they
+    were built from.
+
+    An artifact is the state dict of a model once its checkpoint is loaded
+    and its load-time optimizations are applied. The key hashes the
+    checkpoint content, the build options, the torch version, the device
+    and the CPU flags, so any change builds a new artifact. Artifacts are
+    written to a temporary file and renamed, so concurrent starts never read
+    a partial one, and loaded memory-mapped. Once the directory exceeds
+    `max_mb`, the least recently used artifacts are deleted.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_mb: float = 512,
+        metrics: Optional[ServiceMetrics] = None,
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_mb * 2**20)
+        self.metrics = metrics
+
+    def key(self, checkpoint_path: str, options: Mapping) -> str:
+        """Cache key of the artifact built from `checkpoint_path` with `options`."""
+        key = {
+            "version": ARTIFACT_VERSION,
+            "checkpoint": file_hash(checkpoint_path),
+            "options": dict(options),
+            "torch": torch.__version__,
+            "device": "cuda" if torch.cuda.is_available() else "cpu",
+            "cpu_flags": cpu_flags(),
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + ARTIFACT_SUFFIX)
+
+    def load(self, key: str) -> Optional[Dict[str, torch.Tensor]]:
+        """The cached state dict of `key`, None on a miss."""
+        path = self.path(key)
+        if not os.path.exists(path):
+            LOGGER.info(f"artifact cache miss for {key[:16]}")
+            self._increment("artifact_cache_misses")
+            return None
+        started = time.perf_counter()
+        map_location = None if torch.cuda.is_available() else "cpu"
+        try:
+            state_dict = torch.load(
+                path, map_location=map_location, mmap=True, weights_only=True
+            )
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            LOGGER.warning(f"dropping unreadable artifact {path}: {e}")
+            self._remove(path)
+            self._increment("artifact_cache_misses")
+            return None
+        try:
+            # the modification time orders artifacts for eviction
+            os.utime(path)
+        except OSError:
+            pass
+        load_ms = (time.perf_counter() - started) * 1000
+        LOGGER.info(f"artifact cache hit for {key[:16]}, loaded in {load_ms:.1f} ms")
+        self._increment("artifact_cache_hits")
+        if self.metrics is not None:
+            self.metrics.observe("artifact_load_ms", load_ms)
+        return state_dict
+
+    def save(self, key: str, state_dict: Mapping[str, torch.Tensor]):
+        """Store an artifact, then evict the least recently used ones over the limit."""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # write then rename so concurrent starts never read a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    torch.save(dict(state_dict), f)
+                os.replace(tmp_path, self.path(key))
+            except BaseException:
+                self._remove(tmp_path)
+                raise
+        except OSError as e:
+            LOGGER.warning(f"failed to cache artifact: {e}")
+            return
+        LOGGER.info(f"cached artifact {key[:16]}")
+        self.evict(keep=key)
+
+    def evict(self, keep: Optional[str] = None) -> int:
+        """
+        Delete the least recently used artifacts until the directory fits.
+
+        :param keep: key that is never evicted, e.g. the one just written.
+        :return: number of artifacts deleted.
+        """
+        artifacts = []
+        try:
+            with os.scandir(self.cache_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith(ARTIFACT_SUFFIX):
+                        stat = entry.stat()
+                        artifacts.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError:
+            return 0
+        total = sum(size for _, size, _ in artifacts)
+        evicted = 0
+        for _, size, path in sorted(artifacts):
+            if total <= self.max_bytes:
+                break
+            if keep is not None and path == self.path(keep):
+                continue
+            self._remove(path)
+            total -= size
+            evicted += 1
+        if evicted:
+            LOGGER.info(f"evicted {evicted} artifacts from {self.cache_dir}")
+            self._increment("artifact_cache_evictions", evicted)
+        return evicted
+
+    def _increment(self, name: str, value: int = 1):
+        if self.metrics is not None:
+            self.metrics.increment(name, value)
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
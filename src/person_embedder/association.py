@@ -0,0 +1,166 @@
+from typing import Optional
+
+import numpy as np
+from numpy.typing import NDArray
+
+from src.person_embedder.utils import l2_normalize
+
+ASSIGNMENT_METHODS = ("hungarian", "greedy")
+
+# cost of gated pairs: far above any cosine distance, yet small enough to sum
+# without overflow
+GATED_COST = 1e5
+
+
+def pairwise_iou(boxes_a: NDArray, boxes_b: NDArray) -> NDArray:
+    """(N, M) IoU between (N, 4) and (M, 4) arrays of x1, y1, x2, y2 boxes."""
+    a = boxes_a[:, None, :]
+    b = boxes_b[None, :, :]
+    width = np.clip(
+        np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None
+    )
+    height = np.clip(
+        np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None
+    )
+    intersection = width * height
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    union = area_a + area_b - intersection
+    return np.where(union > 0, intersection / np.maximum(union, 1e-9), 0.0)
+
+
+def association_cost(
+    embeddings: NDArray,
+    track_embeddings: NDArray,
+    boxes: Optional[NDArray] = None,
+    track_boxes: Optional[NDArray] = None,
+    iou_weight: float = 0.0,
+    min_iou: float = 0.0,
+) -> NDArray:
+    """
+    Fused (N, M) cost between N detections and M tracks.
+
+    The appearance cost is the cosine distance, computed for every pair in one
+    matmul. With boxes, it is blended with 1 - IoU by `iou_weight`, and pairs
+    whose IoU is under `min_iou` are gated to infinity; passing the tracks'
+    motion-predicted boxes as `track_boxes` makes this a motion gate.
+    """
+    similarity = (
+        l2_normalize(embeddings.astype(np.float32))
+        @ l2_normalize(track_embeddings.astype(np.float32)).T
+    )
+    cost = 1.0 - similarity.astype(np.float64)
+    if boxes is None or track_boxes is None:
+        return cost
+    iou = pairwise_iou(boxes.astype(np.float64), track_boxes.astype(np.float64))
+    if iou_weight > 0:
+        cost = (1 - iou_weight) * cost + iou_weight * (1 - iou)
+    if min_iou > 0:
+        cost[iou < min_iou] = np.inf
+    return cost
+
+
+def linear_assignment(cost: NDArray) -> NDArray:
+    """
+    Minimum cost assignment of a rectangular cost matrix (Hungarian method).
+
+    Shortest augmenting path with row and column potentials, O(N^2 M), with
+    the inner scan over columns vectorized. Costs must be finite.
+
+    :return: (N,) column assigned to each row, -1 for rows left unassigned
+        when there are more rows than columns.
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+    # 1-based potentials and matches, index 0 is the virtual start column
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    row_of = np.zeros(m + 1, dtype=np.int64)
+    way = np.zeros(m + 1, dtype=np.int64)
+    for row in range(1, n + 1):
+        row_of[0] = row
+        column = 0
+        min_reduced = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[column] = True
+            current_row = row_of[column]
+            free = ~used
+            free[0] = False
+            reduced = cost[current_row - 1] - u[current_row] - v[1:]
+            better = free[1:] & (reduced < min_reduced[1:])
+            min_reduced[1:][better] = reduced[better]
+            way[1:][better] = column
+            candidates = np.where(free, min_reduced, np.inf)
+            next_column = int(np.argmin(candidates))
+            delta = candidates[next_column]
+            u[row_of[used]] += delta
+            v[used] -= delta
+            min_reduced[free] -= delta
+            column = next_column
+            if row_of[column] == 0:
+                break
+        # augment along the path back to the start column
+        while column:
+            previous = way[column]
+            row_of[column] = row_of[previous]
+            column = previous
+
+    res = np.full(n, -1, dtype=np.int64)
+    matched = np.flatnonzero(row_of[1:])
+    res[row_of[1:][matched] - 1] = matched
+    if not transposed:
+        return res
+    columns = np.full(m, -1, dtype=np.int64)
+    columns[res] = np.arange(n)
+    return columns
+
+
+def greedy_assignment(cost: NDArray) -> NDArray:
+    """Assign the cheapest remaining pair first. (N,) column per row or -1."""
+    n, m = cost.shape
+    res = np.full(n, -1, dtype=np.int64)
+    column_used = np.zeros(m, dtype=bool)
+    for index in np.argsort(cost, axis=None, kind="stable"):
+        row, column = divmod(int(index), m)
+        if not np.isfinite(cost[row, column]):
+            break
+        if res[row] < 0 and not column_used[column]:
+            res[row] = column
+            column_used[column] = True
+    return res
+
+
+def associate(
+    cost: NDArray, method: str = "hungarian", max_cost: Optional[float] = None
+) -> NDArray:
+    """
+    Assign detections (rows) to tracks (columns).
+
+    Pairs gated to infinity or costing more than `max_cost` are never
+    assigned; for the Hungarian method they are capped just above
+    `max_cost`, so they cannot pull other pairs into worse matches.
+
+    :return: (N,) int32 track index of each detection, -1 when unassigned.
+    """
+    if method not in ASSIGNMENT_METHODS:
+        raise ValueError(
+            f"unsupported association {method}, use one of {ASSIGNMENT_METHODS}"
+        )
+    n, m = cost.shape
+    if n == 0 or m == 0:
+        return np.full(n, -1, dtype=np.int32)
+    allowed = np.isfinite(cost)
+    if max_cost is not None:
+        allowed &= cost <= max_cost
+    if method == "greedy":
+        res = greedy_assignment(np.where(allowed, cost, np.inf))
+    else:
+        ceiling = GATED_COST if max_cost is None else max_cost + 1e-5
+        res = linear_assignment(np.where(allowed, cost, ceiling))
+    rows = np.flatnonzero(res >= 0)
+    res[rows[~allowed[rows, res[rows]]]] = -1
+    return res.astype(np.int32)
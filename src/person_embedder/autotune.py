@@ -0,0 +1,271 @@
+import hashlib
+import json
+import os
+import platform
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+import torch
+from viam.logging import getLogger
+
+from src.person_embedder.os_net_encoder import OSNetFeatureEmbedder
+
+LOGGER = getLogger(__name__)
+
+# bump when the sweep or the result format changes to invalidate cached results
+AUTOTUNE_VERSION = 1
+CACHE_FILE_NAME = "autotune.json"
+
+
+def cpu_model() -> str:
+    """Name of the host CPU, falling back to the machine type."""
+    try:
+        with open("/proc/cpuinfo", encoding="utf-8") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                # x86 reports "model name", ARM boards "Hardware" or "Model"
+                if key.strip() in ("model name", "Hardware", "Model"):
+                    return value.strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def available_cpus() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def model_hash(model: torch.nn.Module) -> str:
+    """Hash of the model weights, so a new checkpoint invalidates cached results."""
+    digest = hashlib.sha256()
+    for name, tensor in model.state_dict().items():
+        digest.update(name.encode())
+        digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+
+def default_cache_dir() -> str:
+    """The module data directory viam-server provides, or ~/.cache."""
+    if os.environ.get("VIAM_MODULE_DATA"):
+        return os.environ["VIAM_MODULE_DATA"]
+    return os.path.join(os.path.expanduser("~"), ".cache", "torchreid-embedder-service")
+
+
+def powers_of_two(limit: int) -> List[int]:
+    """1, 2, 4, ... up to and including `limit`."""
+    values = [1]
+    while values[-1] * 2 < limit:
+        values.append(values[-1] * 2)
+    if values[-1] != limit:
+        values.append(limit)
+    return values
+
+
+class PauseGate:
+    """
+    Lets requests run concurrently until `paused()` closes the gate: new
+    requests then wait, and `paused()` waits for the running ones to finish
+    before handing the embedder over.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._running = 0
+        self._paused = False
+
+    @property
+    def is_paused(self) -> bool:
+        return self._paused
+
+    @contextmanager
+    def enter(self) -> Iterator[None]:
+        with self._condition:
+            self._condition.wait_for(lambda: not self._paused)
+            self._running += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._running -= 1
+                self._condition.notify_all()
+
+    @contextmanager
+    def paused(self) -> Iterator[None]:
+        with self._condition:
+            self._condition.wait_for(lambda: not self._paused)
+            self._paused = True
+            self._condition.wait_for(lambda: self._running == 0)
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._paused = False
+                self._condition.notify_all()
+
+
+class Autotuner:
+    """
+    Picks the thread count, batch size and execution backend for the host.
+
+    The sweep runs synthetic crops through the model for every combination of
+    intra-op thread count, execution backend and batch size, and keeps the
+    one with the highest throughput whose batch latency stays within
+    `latency_slo_ms`. Larger batches of a thread count and backend are skipped
+    once one exceeds the SLO. Results are cached in `cache_dir`, keyed by the
+    CPU model, device, torch version, model weights and sweep settings, so
+    later starts on the same host skip the sweep.
+
+    Inter-op threads are left alone: torch only allows setting them once per
+    process, before any parallel work, so they cannot be swept.
+    """
+
+    def __init__(
+        self,
+        embedder: OSNetFeatureEmbedder,
+        latency_slo_ms: float = 100.0,
+        max_batch_size: int = 32,
+        reduced_precision: bool = False,
+        iterations: int = 5,
+        cache_dir: Optional[str] = None,
+        thread_counts: Optional[Sequence[int]] = None,
+    ):
+        """
+        :param reduced_precision: also try the bf16 (CPU) or fp16 (CUDA) backend.
+        :param iterations: timed forward passes per configuration.
+        :param thread_counts: intra-op thread counts to try, powers of two up
+            to the number of available CPUs by default.
+        """
+        self.embedder = embedder
+        self.latency_slo_ms = latency_slo_ms
+        self.max_batch_size = max_batch_size
+        self.reduced_precision = reduced_precision
+        self.iterations = iterations
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.thread_counts = list(thread_counts or powers_of_two(available_cpus()))
+        self.batch_sizes = powers_of_two(max_batch_size)
+        self.backends = embedder.available_backends(reduced_precision)
+
+    def cache_key(self) -> str:
+        key = {
+            "version": AUTOTUNE_VERSION,
+            "cpu": cpu_model(),
+            "cpus": available_cpus(),
+            "device": str(self.embedder.device),
+            "torch": torch.__version__,
+            "model": model_hash(self.embedder.model),
+            "input_shape": list(self.embedder.input_shape),
+            "latency_slo_ms": self.latency_slo_ms,
+            "thread_counts": self.thread_counts,
+            "batch_sizes": self.batch_sizes,
+            "backends": self.backends,
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+    def run(self, force: bool = False) -> Dict:
+        """
+        Apply the cached result for this host, or sweep and cache a new one.
+
+        :param force: sweep even when a cached result exists.
+        """
+        key = self.cache_key()
+        cache = self._load_cache()
+        result = None if force else cache.get(key)
+        if result is None:
+            result = self.sweep()
+            cache[key] = result
+            self._save_cache(cache)
+        else:
+            LOGGER.info("using cached autotune result")
+        apply_autotune(self.embedder, result)
+        LOGGER.info(
+            f"autotune: {result['threads']} threads, batch size {result['batch_size']}, "
+            f"{result['backend']} backend, {result['throughput']:.1f} crops/s"
+        )
+        return result
+
+    def sweep(self) -> Dict:
+        started = time.monotonic()
+        trials = []
+        for threads in self.thread_counts:
+            torch.set_num_threads(threads)
+            for backend in self.backends:
+                self.embedder.set_backend(backend)
+                for batch_size in self.batch_sizes:
+                    latency_ms = self._measure(batch_size)
+                    trials.append(
+                        {
+                            "threads": threads,
+                            "backend": backend,
+                            "batch_size": batch_size,
+                            "latency_ms": latency_ms,
+                            "throughput": batch_size / latency_ms * 1000,
+                        }
+                    )
+                    if latency_ms > self.latency_slo_ms:
+                        break
+
+        within_slo = [t for t in trials if t["latency_ms"] <= self.latency_slo_ms]
+        if within_slo:
+            best = max(within_slo, key=lambda t: t["throughput"])
+        else:
+            LOGGER.warning(
+                f"no configuration meets the {self.latency_slo_ms} ms latency SLO, "
+                "using the lowest latency one"
+            )
+            best = min(trials, key=lambda t: t["latency_ms"])
+        return {
+            **best,
+            "meets_slo": bool(within_slo),
+            "latency_slo_ms": self.latency_slo_ms,
+            "sweep_seconds": time.monotonic() - started,
+            "trials": trials,
+        }
+
+    def _measure(self, batch_size: int) -> float:
+        """Median latency in ms of a forward pass over `batch_size` synthetic crops."""
+        batch = torch.randn(
+            batch_size, 3, *self.embedder.input_shape, device=self.embedder.device
+        )
+        self.embedder.forward(batch)  # warm-up
+        latencies = []
+        for _ in range(self.iterations):
+            started = time.perf_counter()
+            features = self.embedder.forward(batch)
+            if features.is_cuda:
+                torch.cuda.synchronize()
+            latencies.append((time.perf_counter() - started) * 1000)
+        return float(np.median(latencies))
+
+    def _cache_path(self) -> str:
+        return os.path.join(self.cache_dir, CACHE_FILE_NAME)
+
+    def _load_cache(self) -> Dict:
+        try:
+            with open(self._cache_path(), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_cache(self, cache: Dict):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # write then rename so concurrent starts never read a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(cache, f)
+            os.replace(tmp_path, self._cache_path())
+        except OSError as e:
+            LOGGER.warning(f"failed to cache autotune result: {e}")
+
+
+def apply_autotune(embedder: OSNetFeatureEmbedder, result: Dict):
+    """Apply the thread count, batch size and backend of an autotune result."""
+    torch.set_num_threads(result["threads"])
+    embedder.set_backend(result["backend"])
+    embedder.max_batch_size = result["batch_size"]
@@ -0,0 +1,148 @@
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import torch
+from numpy.typing import NDArray
+
+from src.person_embedder.metrics import ServiceMetrics
+from src.person_embedder.os_net_encoder import OSNetFeatureEmbedder
+from src.person_embedder.pixel_formats import RawFrameCrops
+from src.person_embedder.utils import l2_normalize
+
+
+def match_margins(
+    embeddings: NDArray, gallery: NDArray
+) -> Tuple[NDArray, NDArray, NDArray]:
+    """
+    Best gallery match of every embedding and how clearly it wins.
+
+    :return: (best, similarity, margin): the (N,) index of the most similar
+        gallery entry, its cosine similarity, and the gap to the second most
+        similar entry (the similarity itself when the gallery has one entry).
+    """
+    if len(gallery) == 0:
+        zeros = np.zeros(len(embeddings), dtype=np.float32)
+        return np.full(len(embeddings), -1, dtype=np.int32), zeros, zeros
+    similarity = (
+        l2_normalize(embeddings.astype(np.float32))
+        @ l2_normalize(gallery.astype(np.float32)).T
+    )
+    best = np.argmax(similarity, axis=1)
+    top = similarity[np.arange(len(similarity)), best]
+    if similarity.shape[1] == 1:
+        return best.astype(np.int32), top, top
+    second = np.partition(similarity, -2, axis=1)[:, -2]
+    return best.astype(np.int32), top, top - second
+
+
+def select_escalations(
+    margins: NDArray, margin_threshold: float, max_fraction: float = 1.0
+) -> NDArray:
+    """
+    Crops whose small-model match is ambiguous, most ambiguous first.
+
+    :param margin_threshold: crops whose margin is under this are escalated.
+    :param max_fraction: at most this fraction of the crops is escalated.
+    :return: indices of the crops to escalate.
+    """
+    ambiguous = np.flatnonzero(margins < margin_threshold)
+    limit = int(np.floor(max_fraction * len(margins)))
+    if len(ambiguous) > limit:
+        ambiguous = ambiguous[np.argsort(margins[ambiguous], kind="stable")[:limit]]
+    return np.sort(ambiguous)
+
+
+class EmbeddingCascade:
+    """
+    Coarse-to-fine matching against a gallery with two models.
+
+    Every crop is embedded by the small model and matched against the
+    gallery's small-model embeddings. Only crops whose best match does not
+    beat the runner-up by `margin` cosine similarity, at most `max_escalation`
+    of them, are embedded again by the large model and matched against the
+    gallery's large-model embeddings. Easy crops thus cost a small-model pass
+    only.
+
+    The two models embed into different spaces, so the gallery is kept in
+    both; `embedding` rows of crops that were not escalated are zero.
+    """
+
+    def __init__(
+        self,
+        small: OSNetFeatureEmbedder,
+        large: OSNetFeatureEmbedder,
+        margin: float = 0.1,
+        max_escalation: float = 1.0,
+        normalize: bool = False,
+        metrics: Optional[ServiceMetrics] = None,
+    ):
+        self.small = small
+        self.large = large
+        self.margin = margin
+        self.max_escalation = max_escalation
+        self.normalize = normalize
+        self.metrics = metrics
+
+    def run(
+        self,
+        crops: Union[List[torch.Tensor], RawFrameCrops],
+        gallery: NDArray,
+        gallery_small: NDArray,
+    ) -> Dict[str, NDArray]:
+        """
+        :param gallery: (G, D) large-model embeddings of the gallery.
+        :param gallery_small: (G, D_small) small-model embeddings of the same entries.
+        :return: "match" ((N,) int32 gallery index), "similarity", "margin"
+            (small-model margin), "escalated" ((N,) uint8), "embedding_small"
+            ((N, D_small)) and "embedding" ((N, D), zero unless escalated).
+        """
+        if len(gallery) != len(gallery_small):
+            raise ValueError(
+                f"got {len(gallery)} gallery_embeddings and "
+                f"{len(gallery_small)} gallery_embeddings_small"
+            )
+        embeddings_small = self._embed(self.small, crops)
+        match, similarity, margin = match_margins(embeddings_small, gallery_small)
+        escalate = select_escalations(margin, self.margin, self.max_escalation)
+
+        embeddings = np.zeros(
+            (len(embeddings_small), self.large.model.feature_dim), dtype=np.float32
+        )
+        if len(escalate):
+            if isinstance(crops, RawFrameCrops):
+                escalated_crops = crops.subset(escalate)
+            else:
+                escalated_crops = [crops[i] for i in escalate]
+            embeddings[escalate] = self._embed(self.large, escalated_crops)
+            match[escalate], similarity[escalate], _ = match_margins(
+                embeddings[escalate], gallery
+            )
+        escalated = np.zeros(len(embeddings_small), dtype=np.uint8)
+        escalated[escalate] = 1
+
+        if self.metrics is not None and len(embeddings_small):
+            self.metrics.increment("cascade_crops", len(embeddings_small))
+            self.metrics.increment("cascade_escalated", len(escalate))
+            self.metrics.observe(
+                "cascade_escalation_fraction", len(escalate) / len(embeddings_small)
+            )
+        return {
+            "embedding": embeddings,
+            "embedding_small": embeddings_small,
+            "match": match,
+            "similarity": similarity.astype(np.float32),
+            "margin": margin.astype(np.float32),
+            "escalated": escalated,
+        }
+
+    def _embed(
+        self,
+        embedder: OSNetFeatureEmbedder,
+        crops: Union[List[torch.Tensor], RawFrameCrops],
+    ) -> NDArray:
+        if len(crops) == 0:
+            return np.zeros((0, embedder.model.feature_dim), dtype=np.float32)
+        embeddings = embedder.compute_features(crops).cpu().numpy()
+        if self.normalize:
+            embeddings = l2_normalize(embeddings)
+        return embeddings
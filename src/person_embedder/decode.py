@@ -0,0 +1,129 @@
+import io
+import math
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+from numpy.typing import NDArray
+from PIL import Image
+
+from src.person_embedder.utils import crop_boxes
+
+
+def is_encoded_image(array: NDArray) -> bool:
+    """Encoded JPEG/PNG inputs are sent as flat uint8 byte tensors."""
+    return array.dtype == np.uint8 and array.ndim == 1
+
+
+def letterbox_scale(height, width, target_size) -> float:
+    target_height, target_width = target_size
+    return min(target_height / height, target_width / width)
+
+
+def decode_image(data: bytes, scale: Optional[float] = None) -> Tuple[NDArray, float]:
+    """
+    Decode a JPEG/PNG image to a (C, H, W) float32 RGB array.
+
+    When `scale` is below 1, JPEGs are decoded with DCT-domain downscaling
+    (1/2, 1/4 or 1/8) to the smallest size that is still at least `scale`
+    times the original, so the full resolution image is never materialized.
+    Other formats are decoded at full resolution.
+
+    :param data: encoded image bytes.
+    :param scale: smallest acceptable output / original size ratio.
+    :return: (image, applied_scale) where applied_scale is decoded / original width.
+    """
+    image = Image.open(io.BytesIO(data))
+    original_width = image.size[0]
+    if scale is not None and scale < 1:
+        image.draft(
+            "RGB",
+            (
+                math.ceil(image.size[0] * scale),
+                math.ceil(image.size[1] * scale),
+            ),
+        )
+    image = image.convert("RGB")
+    array = np.asarray(image, dtype=np.float32).transpose(2, 0, 1)
+    return array, image.size[0] / original_width
+
+
+def encoded_image_size(data: bytes) -> Tuple[int, int]:
+    """(height, width) of an encoded image, read from its header only."""
+    width, height = Image.open(io.BytesIO(data)).size
+    return height, width
+
+
+class ImageDecoder:
+    """
+    Decodes encoded crops and frames for the embedder, in parallel on a thread pool.
+
+    PIL releases the GIL while decoding, so the threads run concurrently.
+    """
+
+    def __init__(self, target_size: Sequence[int], max_workers: int = 4):
+        self.target_size = tuple(target_size)
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="decode"
+        )
+
+    def decode_crops(self, buffer: NDArray, lengths: NDArray) -> List[torch.Tensor]:
+        """
+        Decode concatenated encoded crops.
+
+        :param buffer: (sum(lengths),) uint8 concatenation of the encoded crops.
+        :param lengths: (N,) byte length of each crop.
+        :return: list of (C, H, W) float32 tensors, decoded no larger than needed
+            to fill `target_size`.
+        """
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        if offsets[-1] != len(buffer):
+            raise ValueError(
+                f"input_lengths add up to {offsets[-1]} bytes but input has {len(buffer)}"
+            )
+        chunks = [
+            buffer[offsets[i] : offsets[i + 1]].tobytes() for i in range(len(lengths))
+        ]
+        arrays = self.executor.map(self._decode_crop, chunks)
+        return [torch.from_numpy(array) for array in arrays]
+
+    def _decode_crop(self, data: bytes) -> NDArray:
+        height, width = encoded_image_size(data)
+        array, _ = decode_image(data, letterbox_scale(height, width, self.target_size))
+        return array
+
+    def decode_frame(
+        self, buffer: NDArray, boxes: Optional[NDArray]
+    ) -> Tuple[torch.Tensor, Optional[List[torch.Tensor]], Tuple[int, int]]:
+        """
+        Decode an encoded frame, and crop it when boxes are given.
+
+        The frame is only decoded at the resolution the largest upscaled crop
+        needs; boxes are rescaled to the decoded frame before cropping.
+
+        :param buffer: (L,) uint8 encoded frame.
+        :param boxes: optional (N, 4) x1, y1, x2, y2 boxes in original frame pixels.
+        :return: (frame, crops, original (height, width)).
+        """
+        data = buffer.tobytes()
+        frame_size = encoded_image_size(data)
+        scale = None
+        if boxes is not None and len(boxes) > 0:
+            widths = np.maximum(boxes[:, 2] - boxes[:, 0], 1)
+            heights = np.maximum(boxes[:, 3] - boxes[:, 1], 1)
+            scale = float(
+                np.max(
+                    np.minimum(
+                        self.target_size[0] / heights, self.target_size[1] / widths
+                    )
+                )
+            )
+        array, applied_scale = decode_image(data, scale)
+        frame = torch.from_numpy(array)
+        if boxes is None:
+            return frame, None, frame_size
+        return frame, crop_boxes(frame, boxes * applied_scale), frame_size
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
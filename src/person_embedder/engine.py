@@ -0,0 +1,212 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+import torch
+from numpy.typing import NDArray
+
+from src.person_embedder.os_net_encoder import OSNetFeatureEmbedder
+from src.person_embedder.pixel_formats import RawFrameCrops
+from src.person_embedder.utils import l2_normalize
+
+STAGES = ("preprocess", "model", "postprocess")
+
+
+class _Job:
+    """One submit() call, completed once all of its micro-batches are postprocessed."""
+
+    def __init__(self, size: int, with_heads: bool = False):
+        self.future: Future = Future()
+        self.result: Optional[Dict[str, NDArray]] = None
+        self.size = size
+        self.with_heads = with_heads
+        self.pending = size
+        self.lock = threading.Lock()
+
+    def fail(self, error: BaseException):
+        if not self.future.done():
+            self.future.set_exception(error)
+
+
+class StagedExecutionEngine:
+    """
+    Runs preprocessing, the model forward and postprocessing as three
+    overlapped stages.
+
+    Each submit() is split into micro-batches. A thread pool letterboxes and
+    normalizes micro-batches into model input buffers, a single model thread
+    consumes them, and a postprocess thread converts the features to numpy
+    (and L2-normalizes them when asked). The queues between stages hold at
+    most `queue_size` buffers, so with the default of 2 the preprocess pool
+    fills the next buffer while the model consumes the current one, and a
+    slow stage backpressures the ones before it instead of growing memory.
+
+    Per-stage busy time is tracked to report each stage's utilization.
+    """
+
+    def __init__(
+        self,
+        embedder: OSNetFeatureEmbedder,
+        preprocess_workers: int = 2,
+        micro_batch_size: int = 16,
+        queue_size: int = 2,
+        normalize: bool = False,
+    ):
+        self.embedder = embedder
+        self.preprocess_workers = preprocess_workers
+        self.micro_batch_size = micro_batch_size
+        self.normalize = normalize
+        self.preprocess_pool = ThreadPoolExecutor(
+            max_workers=preprocess_workers, thread_name_prefix="preprocess"
+        )
+        self.model_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.postprocess_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._busy = {stage: 0.0 for stage in STAGES}
+        self._busy_lock = threading.Lock()
+        self._started_at = time.monotonic()
+        self._closed = False
+        self._threads = [
+            threading.Thread(target=self._model_loop, name="model", daemon=True),
+            threading.Thread(
+                target=self._postprocess_loop, name="postprocess", daemon=True
+            ),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(
+        self,
+        crops: Union[List[torch.Tensor], RawFrameCrops],
+        with_heads: bool = False,
+    ) -> Future:
+        """
+        Queue crops for embedding.
+
+        :param with_heads: also run the embedder's heads.
+        :return: future resolving to the (N, feature_dim) numpy embeddings,
+            or with heads to a dict of them under "embedding" and the (N, ...)
+            head outputs.
+        """
+        if self._closed:
+            raise RuntimeError("engine is shut down")
+        starts = list(range(0, len(crops), self.micro_batch_size))
+        job = _Job(len(crops), with_heads)
+        if not starts:
+            embeddings = np.zeros(
+                (0, self.embedder.model.feature_dim), dtype=np.float32
+            )
+            job.future.set_result(
+                {"embedding": embeddings} if with_heads else embeddings
+            )
+            return job.future
+        for start in starts:
+            indices = list(range(start, min(start + self.micro_batch_size, len(crops))))
+            if isinstance(crops, RawFrameCrops):
+                chunk = crops.subset(indices)
+            else:
+                chunk = crops[indices[0] : indices[-1] + 1]
+            self.preprocess_pool.submit(self._preprocess, job, indices, chunk)
+        return job.future
+
+    def _preprocess(self, job: _Job, indices: List[int], chunk):
+        try:
+            started = time.monotonic()
+            batches = self.embedder.prepare_batches(chunk)
+            self._add_busy("preprocess", time.monotonic() - started)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            job.fail(e)
+            return
+        for batch_indices, batch in batches:
+            # blocks while the model is still busy with the previous buffers
+            self.model_queue.put((job, [indices[i] for i in batch_indices], batch))
+
+    def _model_loop(self):
+        while True:
+            item = self.model_queue.get()
+            if item is None:
+                self.postprocess_queue.put(None)
+                return
+            job, indices, batch = item
+            try:
+                started = time.monotonic()
+                features = self.embedder.forward(batch, with_heads=job.with_heads)
+                self._add_busy("model", time.monotonic() - started)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                job.fail(e)
+                continue
+            self.postprocess_queue.put((job, indices, features))
+
+    def _postprocess_loop(self):
+        while True:
+            item = self.postprocess_queue.get()
+            if item is None:
+                return
+            job, indices, features = item
+            if job.future.done():
+                continue
+            try:
+                started = time.monotonic()
+                if not job.with_heads:
+                    features = {"embedding": features}
+                outputs = {
+                    name: value.cpu().numpy() for name, value in features.items()
+                }
+                if self.normalize:
+                    outputs["embedding"] = l2_normalize(outputs["embedding"])
+                with job.lock:
+                    if job.result is None:
+                        job.result = {
+                            name: np.empty((job.size,) + value.shape[1:], value.dtype)
+                            for name, value in outputs.items()
+                        }
+                    for name, value in outputs.items():
+                        job.result[name][indices] = value
+                    job.pending -= len(indices)
+                    done = job.pending == 0
+                self._add_busy("postprocess", time.monotonic() - started)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                job.fail(e)
+                continue
+            if done and not job.future.done():
+                job.future.set_result(
+                    job.result if job.with_heads else job.result["embedding"]
+                )
+
+    def _add_busy(self, stage: str, seconds: float):
+        with self._busy_lock:
+            self._busy[stage] += seconds
+
+    def utilization(self) -> Dict[str, float]:
+        """
+        Fraction of wall time each stage spent working since the last reset.
+
+        The preprocess figure is averaged over its workers, so 1.0 always means
+        the stage is saturated and is the bottleneck.
+        """
+        with self._busy_lock:
+            elapsed = max(time.monotonic() - self._started_at, 1e-9)
+            res = {
+                f"engine_{stage}_utilization": busy / elapsed
+                for stage, busy in self._busy.items()
+            }
+        res["engine_preprocess_utilization"] /= self.preprocess_workers
+        res["engine_model_queue_depth"] = self.model_queue.qsize()
+        res["engine_postprocess_queue_depth"] = self.postprocess_queue.qsize()
+        return res
+
+    def reset_utilization(self):
+        with self._busy_lock:
+            self._busy = {stage: 0.0 for stage in STAGES}
+            self._started_at = time.monotonic()
+
+    def shutdown(self):
+        if self._closed:
+            return
+        self._closed = True
+        self.preprocess_pool.shutdown(wait=True)
+        self.model_queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout=5)
@@ -0,0 +1,132 @@
+from typing import List, Tuple
+
+import torch
+from torch import nn
+from torch.nn import functional as F
+
+from src.person_embedder.osnet import OSBlock, OSBlockINin
+
+
+def fold_batchnorm(
+    conv: nn.Conv2d, bn: nn.BatchNorm2d
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Weight and bias of `conv` followed by `bn` in eval mode as one convolution."""
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+    weight = conv.weight * scale.reshape(-1, 1, 1, 1)
+    bias = bn.bias - bn.running_mean * scale
+    if conv.bias is not None:
+        bias = bias + conv.bias * scale
+    return weight, bias
+
+
+class FusedLightConvStreams(nn.Module):
+    """
+    The T LightConvStreams of an OSBlock (depths 1 to T) run level by level.
+
+    Level k holds layer k of every stream deeper than k. At level 0 all
+    streams read the same input, so their 1x1 convolutions become one 1x1
+    convolution; at deeper levels each stream reads its own channels, so
+    they become one batched matmul with a weight matrix per stream (a grouped
+    1x1 convolution, which PyTorch's CPU kernels run several times slower
+    than the equivalent matmul). The depthwise 3x3 convolutions of a level,
+    with their batch norms folded in, become one depthwise convolution over
+    the channels of all its streams. A block then launches 2T kernels
+    instead of T(T+1). Streams are ordered by depth, so the shallowest
+    remaining stream is the first `channels` channels of a level and
+    finishes there.
+    """
+
+    def __init__(self, streams: nn.ModuleList):
+        super().__init__()
+        depths = [len(stream.layers) for stream in streams]
+        if depths != list(range(1, len(streams) + 1)):
+            raise ValueError(f"expected streams of depth 1 to T, got {depths}")
+        first = streams[0].layers[0]
+        self.channels = first.conv1.out_channels
+        width = len(streams) * self.channels
+        self.pointwise = nn.Conv2d(first.conv1.in_channels, width, 1, bias=False)
+        # level k >= 1: (streams, out channels, in channels)
+        self.pointwise_weights = nn.ParameterList()
+        self.depthwise = nn.ModuleList()
+        with torch.no_grad():
+            for level in range(len(streams)):
+                layers = [stream.layers[level] for stream in streams[level:]]
+                weights = torch.cat([l.conv1.weight for l in layers])
+                if level == 0:
+                    self.pointwise.weight.copy_(weights)
+                else:
+                    self.pointwise_weights.append(
+                        nn.Parameter(
+                            weights.reshape(len(layers), self.channels, self.channels)
+                        )
+                    )
+                width = len(layers) * self.channels
+                depthwise = nn.Conv2d(width, width, 3, padding=1, groups=width)
+                folded = [fold_batchnorm(l.conv2, l.bn) for l in layers]
+                depthwise.weight.copy_(torch.cat([w for w, _ in folded]))
+                depthwise.bias.copy_(torch.cat([b for _, b in folded]))
+                self.depthwise.append(depthwise)
+
+    def forward(self, x: torch.Tensor) -> List[torch.Tensor]:
+        """:return: the output of every stream, shallowest first."""
+        x = F.relu(self.depthwise[0](self.pointwise(x)))
+        outputs = [x[:, : self.channels]]
+        batch, _, height, width = x.shape
+        for weight, depthwise in zip(self.pointwise_weights, self.depthwise[1:]):
+            # the streams still running, as (B, streams, C, H * W) without a copy
+            remaining = x.reshape(batch, -1, self.channels, height * width)[:, 1:]
+            x = torch.matmul(weight, remaining).view(batch, -1, height, width)
+            x = F.relu(depthwise(x))
+            outputs.append(x[:, : self.channels])
+        return outputs
+
+
+class FusedOSBlock(nn.Module):
+    """
+    Inference-time rewrite of an OSBlock or OSBlockINin.
+
+    The streams run as FusedLightConvStreams, and their outputs are stacked
+    along the batch dimension so the shared ChannelGate, which gates every
+    stream with the same weights, runs once instead of once per stream.
+    Batch norms are folded with their running statistics, so the block only
+    matches the original in eval mode.
+    """
+
+    def __init__(self, block: nn.Module):
+        super().__init__()
+        self.conv1 = block.conv1
+        self.streams = FusedLightConvStreams(block.conv2)
+        self.gate = block.gate
+        self.conv3 = block.conv3
+        self.downsample = block.downsample
+        self.IN = getattr(block, "IN", None)
+
+    def forward(self, x):
+        identity = x
+        x1 = self.conv1(x)
+        streams = torch.stack(self.streams(x1))
+        x2 = self.gate(streams.flatten(0, 1)).view(streams.shape).sum(0)
+        x3 = self.conv3(x2)
+        if self.IN is not None:
+            x3 = self.IN(x3)
+        if self.downsample is not None:
+            identity = self.downsample(identity)
+        return F.relu(x3 + identity)
+
+
+def fuse_os_blocks(model: nn.Module) -> int:
+    """
+    Replace every OSBlock and OSBlockINin of an eval-mode model in place.
+
+    :return: number of blocks replaced.
+    """
+    if model.training:
+        raise ValueError("fuse_os_blocks folds batch norms, put the model in eval mode")
+    count = 0
+    for name, child in model.named_children():
+        if isinstance(child, (OSBlock, OSBlockINin)):
+            setattr(model, name, FusedOSBlock(child).to(child.conv1.conv.weight.device))
+            count += 1
+        else:
+            count += fuse_os_blocks(child)
+    return count
@@ -0,0 +1,554 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+from viam.logging import getLogger
+
+from src.person_embedder.hashing import BinaryHasher, as_words, nearest_codes
+from src.person_embedder.metrics import ServiceMetrics
+from src.person_embedder.utils import l2_normalize
+
+LOGGER = getLogger(__name__)
+
+# memory an identity keeps besides its prototypes: weights, lists, dict entry
+IDENTITY_OVERHEAD_BYTES = 1024
+# embeddings compared to the prototypes at once while folding
+FOLD_CHUNK = 16
+
+
+def kmeans(
+    vectors: NDArray, clusters: int, iterations: int = 10, seed: int = 0
+) -> Tuple[NDArray, NDArray]:
+    """
+    Spherical k-means of unit vectors.
+
+    :return: (centroids, assignment): (clusters, D) unit centroids and the
+        (N,) cluster of every vector.
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), clusters, replace=False)]
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        empty = ~sums.any(axis=1)
+        # an empty cluster keeps its centroid
+        sums[empty] = centroids[empty]
+        centroids = l2_normalize(sums)
+    return centroids, np.argmax(vectors @ centroids.T, axis=1)
+
+
+class _Identity:
+    """Prototypes of one identity and the embeddings not yet folded into them."""
+
+    def __init__(self, dim: int):
+        self.prototypes = np.zeros((0, dim), dtype=np.float32)
+        self.weights = np.zeros(0, dtype=np.float64)
+        self.pending: List[Tuple[NDArray, NDArray]] = []
+        self.added = 0
+
+
+class _Index:
+    """
+    Immutable search snapshot of the consolidated prototypes.
+
+    With `nlist` inverted lists, the prototypes are clustered after removing
+    their mean, which re-id embeddings share, so the lists are balanced, and
+    stored list after list so a list is a contiguous slice of `vectors`.
+    With a `hasher`, `codes` holds the binary code of every prototype.
+    """
+
+    def __init__(
+        self,
+        vectors: NDArray,
+        labels: NDArray,
+        nlist: int,
+        hasher: Optional[BinaryHasher] = None,
+    ):
+        self.vectors = vectors
+        self.labels = labels
+        self.codes: Optional[NDArray] = None
+        self.mean: Optional[NDArray] = None
+        self.centroids: Optional[NDArray] = None
+        self.offsets: Optional[NDArray] = None
+        if nlist > 1 and len(vectors) >= 2 * nlist:
+            self.mean = vectors.mean(axis=0)
+            self.centroids, assignment = kmeans(
+                l2_normalize(vectors - self.mean), nlist
+            )
+            order = np.argsort(assignment, kind="stable")
+            self.vectors, self.labels = vectors[order], labels[order]
+            self.offsets = np.searchsorted(assignment[order], np.arange(nlist + 1))
+        if hasher is not None and len(self.vectors):
+            self.codes = as_words(hasher.encode(self.vectors))
+
+    def probe(self, queries: NDArray, nprobe: int) -> NDArray:
+        """(N, nprobe) lists closest to every query."""
+        nprobe = min(nprobe, len(self.centroids))
+        scores = l2_normalize(queries - self.mean) @ self.centroids.T
+        return np.argpartition(-scores, nprobe - 1, axis=1)[:, :nprobe]
+
+
+class _Folding:
+    """
+    Prototypes of one identity while embeddings are folded into them.
+
+    Keeps the unit-norm prototypes and their pairwise similarities up to
+    date, so folding an embedding costs one pass over the prototypes.
+    """
+
+    def __init__(self, prototypes: NDArray, weights: NDArray, max_prototypes: int):
+        self.max_prototypes = max_prototypes
+        capacity = max(max_prototypes, len(prototypes))
+        self.count = len(prototypes)
+        self.means = np.zeros((capacity, prototypes.shape[1]), dtype=np.float32)
+        self.means[: self.count] = prototypes
+        self.totals = np.zeros(capacity, dtype=np.float64)
+        self.totals[: self.count] = weights
+        self.normalized = l2_normalize(self.means)
+        self.pairs = np.full((capacity, capacity), -np.inf, dtype=np.float32)
+        self._update_pairs()
+
+    def fold(self, embedding: NDArray, weight: float, merge_threshold: float):
+        count = self.count
+        similarity = self.normalized[:count] @ embedding
+        nearest = int(np.argmax(similarity)) if count else -1
+        if count and similarity[nearest] >= merge_threshold:
+            self._merge(nearest, embedding, weight)
+        elif count < self.max_prototypes:
+            self._set(count, embedding, weight)
+            self.count += 1
+        else:
+            # the two most similar of the prototypes and the embedding merge
+            a, b = np.unravel_index(
+                np.argmax(self.pairs[:count, :count]), (count, count)
+            )
+            if similarity[nearest] >= self.pairs[a, b]:
+                self._merge(nearest, embedding, weight)
+            else:
+                self._merge(a, self.means[b], self.totals[b])
+                self._set(b, embedding, weight)
+
+    def merge_many(self, rows: NDArray, embeddings: NDArray, weights: NDArray):
+        """Merge every embedding into the prototype of its row."""
+        count = self.count
+        sums = self.means[:count] * self.totals[:count, None]
+        np.add.at(sums, rows, embeddings * weights[:, None])
+        np.add.at(self.totals, rows, weights)
+        self.means[:count] = sums / self.totals[:count, None]
+        self.normalized[:count] = l2_normalize(self.means[:count])
+        self._update_pairs()
+
+    def prototypes(self) -> Tuple[NDArray, NDArray]:
+        return self.means[: self.count].copy(), self.totals[: self.count].copy()
+
+    def _merge(self, row: int, vector: NDArray, weight: float):
+        """Fold `vector` with `weight` into the weighted mean of `row`."""
+        total = self.totals[row] + weight
+        self.means[row] = (self.totals[row] * self.means[row] + weight * vector) / total
+        self.totals[row] = total
+        self.normalized[row] = l2_normalize(self.means[row])
+        self._update_row(row)
+
+    def _set(self, row: int, vector: NDArray, weight: float):
+        self.means[row] = vector
+        self.totals[row] = weight
+        self.normalized[row] = vector
+        self._update_row(row)
+
+    def _update_row(self, row: int):
+        count = max(self.count, row + 1)
+        similarity = self.normalized[:count] @ self.normalized[row]
+        self.pairs[row, :count] = similarity
+        self.pairs[:count, row] = similarity
+        self.pairs[row, row] = -np.inf
+
+    def _update_pairs(self):
+        count = self.count
+        self.pairs[:count, :count] = self.normalized[:count] @ self.normalized[:count].T
+        np.fill_diagonal(self.pairs, -np.inf)
+
+
+class PrototypeGallery:
+    """
+    Embeddings of known identities, consolidated into a few prototypes each.
+
+    Embeddings added for an identity are first kept as they are. Consolidation
+    folds them, in order, into at most `max_prototypes` quality-weighted
+    prototypes: an embedding whose cosine similarity to the nearest prototype
+    reaches `merge_threshold` is merged into it as a weighted mean, otherwise
+    it starts a new prototype, and when there are `max_prototypes` already,
+    the two most similar of the prototypes and the embedding are merged.
+    Near-duplicate frames of a long track thus cost one vector instead of
+    hundreds, while distinct appearances (e.g. viewpoints) keep their own
+    prototype.
+
+    Searches see the consolidated prototypes and the pending embeddings. They
+    are exact, or approximate over an inverted file of the prototypes: the
+    prototypes are clustered into `nlist` lists and a query only scans the
+    `nprobe` lists with the closest centroids. With a `hasher`, they can
+    instead pre-filter the `hamming_candidates` prototypes with the closest
+    binary codes and re-rank those exactly. At most `max_identities` are
+    kept, the least recently updated are evicted first.
+    """
+
+    def __init__(
+        self,
+        max_prototypes: int = 8,
+        merge_threshold: float = 0.9,
+        max_identities: int = 10000,
+        nlist: int = 0,
+        nprobe: int = 4,
+        hasher: Optional[BinaryHasher] = None,
+        hamming_candidates: int = 64,
+        metrics: Optional[ServiceMetrics] = None,
+    ):
+        """
+        :param nlist: inverted lists of the approximate search, by default
+            the square root of the number of prototypes.
+        """
+        self.max_prototypes = max_prototypes
+        self.merge_threshold = merge_threshold
+        self.max_identities = max_identities
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.hasher = hasher
+        self.hamming_candidates = hamming_candidates
+        self.metrics = metrics
+        self._identities: "OrderedDict[int, _Identity]" = OrderedDict()
+        self._index = _Index(np.zeros((0, 0), np.float32), np.zeros(0, np.int64), 0)
+        self._dirty = False
+        self._lock = threading.Lock()
+        # one consolidation at a time, so batches are never folded twice
+        self._consolidating = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(
+        self,
+        identities: Sequence[int],
+        embeddings: NDArray,
+        weights: Optional[NDArray] = None,
+    ):
+        """
+        Add embeddings to their identities.
+
+        :param weights: (N,) weight of every embedding, e.g. its quality
+            score. Embeddings with a zero weight are skipped.
+        """
+        embeddings = l2_normalize(np.asarray(embeddings, dtype=np.float32))
+        weights = (
+            np.ones(len(embeddings))
+            if weights is None
+            else np.asarray(weights, dtype=np.float64).reshape(-1)
+        )
+        identities = np.asarray(identities, dtype=np.int64).reshape(-1)
+        if not len(identities) == len(embeddings) == len(weights):
+            raise ValueError(
+                f"got {len(identities)} identities for {len(embeddings)} embeddings"
+            )
+        keep = weights > 0
+        with self._lock:
+            for identity in np.unique(identities[keep]):
+                rows = keep & (identities == identity)
+                state = self._identities.get(int(identity), None)
+                if state is None:
+                    state = _Identity(embeddings.shape[1])
+                    self._identities[int(identity)] = state
+                state.pending.append((embeddings[rows], weights[rows]))
+                state.added += int(np.count_nonzero(rows))
+                self._identities.move_to_end(int(identity))
+            evicted = 0
+            while len(self._identities) > self.max_identities:
+                self._identities.popitem(last=False)
+                evicted += 1
+            self._dirty = self._dirty or evicted > 0
+        if self.metrics is not None:
+            self.metrics.increment("gallery_added", int(np.count_nonzero(keep)))
+            if evicted:
+                self.metrics.increment("gallery_identities_evicted", evicted)
+
+    def consolidate(self) -> int:
+        """
+        Fold the pending embeddings into prototypes and rebuild the index.
+
+        :return: number of embeddings folded.
+        """
+        with self._consolidating:
+            return self._consolidate()
+
+    def _consolidate(self) -> int:
+        started = time.monotonic()
+        with self._lock:
+            snapshot = [
+                (identity, state, len(state.pending), list(state.pending))
+                for identity, state in self._identities.items()
+            ]
+            dirty = self._dirty
+        if not dirty and not any(count for _, _, count, _ in snapshot):
+            return 0
+        # folding and indexing run outside of the lock so adds and searches
+        # go on; pending embeddings stay searchable until the new prototypes
+        # and index are swapped in together
+        folded = 0
+        results = []
+        for identity, state, count, batches in snapshot:
+            prototypes, weights = state.prototypes, state.weights
+            for embeddings, embedding_weights in batches:
+                prototypes, weights = self._fold(
+                    prototypes, weights, embeddings, embedding_weights
+                )
+                folded += len(embeddings)
+            results.append((identity, state, count, prototypes, weights))
+        index = self._build_index([(i, p) for i, _, _, p, _ in results])
+        with self._lock:
+            for _, state, count, prototypes, weights in results:
+                state.prototypes, state.weights = prototypes, weights
+                del state.pending[:count]
+            self._index = index
+            # identities removed meanwhile are still in the index
+            self._dirty = not np.isin(
+                index.labels, np.fromiter(self._identities, np.int64)
+            ).all()
+        if self.metrics is not None:
+            self.metrics.observe(
+                "gallery_consolidate_ms", (time.monotonic() - started) * 1000
+            )
+        return folded
+
+    def search(
+        self,
+        queries: NDArray,
+        k: int = 1,
+        approximate: bool = False,
+        hamming: bool = False,
+    ) -> Tuple[NDArray, NDArray]:
+        """
+        Most similar identities of every query.
+
+        :param k: identities returned per query.
+        :param approximate: scan only the `nprobe` inverted lists closest to
+            a query rather than every prototype.
+        :param hamming: re-rank only the `hamming_candidates` prototypes with
+            the binary codes closest to a query's. Pending embeddings are
+            always scanned.
+        :return: ((N, k) int64 identities, (N, k) float32 cosine similarity
+            to their closest vector), padded with -1 and 0.
+        """
+        if approximate and hamming:
+            raise ValueError("search is either approximate or hamming, not both")
+        if hamming and self.hasher is None:
+            raise ValueError("hamming search needs binary codes")
+        queries = l2_normalize(np.asarray(queries, dtype=np.float32))
+        with self._lock:
+            index = self._index
+            pending = [
+                (identity, embeddings)
+                for identity, state in self._identities.items()
+                for embeddings, _ in state.pending
+            ]
+            known = np.fromiter(self._identities, np.int64, len(self._identities))
+            dirty = self._dirty
+        dim = queries.shape[1]
+        vectors, labels = index.vectors.reshape(-1, dim), index.labels
+        if dirty:
+            # prototypes of identities removed since the index was built
+            live = np.isin(labels, known)
+        pending_labels = np.concatenate(
+            [np.zeros(0, np.int64)] + [np.full(len(e), i, np.int64) for i, e in pending]
+        )
+        pending_similarity = (
+            queries
+            @ np.concatenate(
+                [np.zeros((0, dim), np.float32)] + [e for _, e in pending]
+            ).T
+        )
+
+        hamming = hamming and index.codes is not None
+        if hamming:
+            candidates = nearest_codes(
+                as_words(self.hasher.encode(queries)),
+                index.codes,
+                self.hamming_candidates,
+            )
+        if approximate and index.centroids is not None:
+            probes = index.probe(queries, self.nprobe)
+        elif not hamming:
+            approximate = False
+            similarity = queries @ vectors.T
+            if dirty:
+                similarity, labels = similarity[:, live], labels[live]
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        sims = np.zeros((len(queries), k), dtype=np.float32)
+        for i, query in enumerate(queries):
+            if hamming:
+                rows = candidates[i]
+                if dirty:
+                    rows = rows[live[rows]]
+                row_similarity, row_labels = vectors[rows] @ query, labels[rows]
+            elif approximate:
+                rows = [slice(*index.offsets[p : p + 2]) for p in probes[i]]
+                row_similarity = np.concatenate([vectors[r] @ query for r in rows])
+                row_labels = np.concatenate([labels[r] for r in rows])
+                if dirty:
+                    keep = np.concatenate([live[r] for r in rows])
+                    row_similarity, row_labels = (
+                        row_similarity[keep],
+                        row_labels[keep],
+                    )
+            else:
+                row_similarity, row_labels = similarity[i], labels
+            ids[i], sims[i] = top_identities(
+                np.concatenate([row_similarity, pending_similarity[i]]),
+                np.concatenate([row_labels, pending_labels]),
+                k,
+            )
+        if self.metrics is not None:
+            self.metrics.increment("gallery_queries", len(queries))
+        return ids, sims
+
+    def remove(self, identities: Sequence[int]) -> int:
+        """Forget identities; returns how many were known."""
+        with self._lock:
+            removed = sum(
+                self._identities.pop(int(identity), None) is not None
+                for identity in identities
+            )
+            self._dirty = self._dirty or removed > 0
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._identities.clear()
+            self._dirty = True
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            states = list(self._identities.values())
+        return {
+            "gallery_identities": len(states),
+            "gallery_prototypes": sum(len(s.prototypes) for s in states),
+            "gallery_pending": sum(len(e) for s in states for e, _ in s.pending),
+            "gallery_embeddings_added": sum(s.added for s in states),
+        }
+
+    def memory_bytes(self) -> int:
+        """Approximate memory held by the identities and the index."""
+        with self._lock:
+            states = list(self._identities.values())
+            index = self._index
+            index_bytes = index.vectors.nbytes + index.labels.nbytes
+            if index.codes is not None:
+                index_bytes += index.codes.nbytes
+        return index_bytes + sum(
+            s.prototypes.nbytes
+            + s.weights.nbytes
+            + sum(e.nbytes + w.nbytes for e, w in s.pending)
+            + IDENTITY_OVERHEAD_BYTES
+            for s in states
+        )
+
+    def identity_bytes(self, dim: int) -> int:
+        """
+        Memory of one consolidated identity: its prototypes, their copy and
+        binary codes in the index and its bookkeeping.
+        """
+        code_bytes = 0 if self.hasher is None else self.hasher.bits // 8
+        return (
+            self.max_prototypes * (2 * dim * 4 + code_bytes + 8 + 8)
+            + IDENTITY_OVERHEAD_BYTES
+        )
+
+    def start(self, interval_s: float):
+        """Consolidate in a background thread every `interval_s` seconds."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(interval_s,), name="gallery", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self._thread = None
+
+    def _run(self, interval_s: float):
+        while not self._stop.wait(interval_s):
+            try:
+                self.consolidate()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                LOGGER.warning(f"gallery consolidation failed: {e}")
+
+    def _fold(
+        self,
+        prototypes: NDArray,
+        weights: NDArray,
+        embeddings: NDArray,
+        embedding_weights: NDArray,
+    ) -> Tuple[NDArray, NDArray]:
+        folding = _Folding(prototypes, weights, self.max_prototypes)
+        for start in range(0, len(embeddings), FOLD_CHUNK):
+            chunk = embeddings[start : start + FOLD_CHUNK]
+            chunk_weights = embedding_weights[start : start + FOLD_CHUNK]
+            if folding.count:
+                # near-duplicates of a prototype, the bulk of a track's
+                # frames, are merged all at once
+                similarity = chunk @ folding.normalized[: folding.count].T
+                nearest = np.argmax(similarity, axis=1)
+                duplicate = (
+                    similarity[np.arange(len(chunk)), nearest] >= self.merge_threshold
+                )
+                if duplicate.any():
+                    folding.merge_many(
+                        nearest[duplicate],
+                        chunk[duplicate],
+                        chunk_weights[duplicate],
+                    )
+                    chunk = chunk[~duplicate]
+                    chunk_weights = chunk_weights[~duplicate]
+            for embedding, weight in zip(chunk, chunk_weights):
+                folding.fold(embedding, weight, self.merge_threshold)
+        return folding.prototypes()
+
+    def _build_index(self, items: List[Tuple[int, NDArray]]) -> _Index:
+        items = [(identity, p) for identity, p in items if len(p)]
+        if not items:
+            return _Index(np.zeros((0, 0), np.float32), np.zeros(0, np.int64), 0)
+        vectors = l2_normalize(np.concatenate([p for _, p in items]))
+        labels = np.concatenate([np.full(len(p), i, np.int64) for i, p in items])
+        nlist = self.nlist or int(np.sqrt(len(vectors)))
+        return _Index(vectors, labels, nlist, self.hasher)
+
+
+def top_identities(
+    similarity: NDArray, labels: NDArray, k: int
+) -> Tuple[NDArray, NDArray]:
+    """
+    The `k` identities with the most similar vector.
+
+    :param similarity: (P,) similarity of a query to every vector.
+    :param labels: (P,) identity of every vector.
+    :return: ((k,) identities, (k,) similarities), padded with -1 and 0.
+    """
+    ids = np.full(k, -1, dtype=np.int64)
+    sims = np.zeros(k, dtype=np.float32)
+    if len(similarity) == 0:
+        return ids, sims
+    if k == 1:
+        best = int(np.argmax(similarity))
+        ids[0], sims[0] = labels[best], similarity[best]
+        return ids, sims
+    order = np.argsort(-similarity, kind="stable")
+    # the first occurrence of each identity in similarity order is its best vector
+    _, first = np.unique(labels[order], return_index=True)
+    best = order[np.sort(first)][:k]
+    ids[: len(best)] = labels[best]
+    sims[: len(best)] = similarity[best]
+    return ids, sims
@@ -0,0 +1,212 @@
+from typing import Optional, Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+
+from src.person_embedder.utils import l2_normalize
+
+HASH_METHODS = ("itq", "random")
+# database rows compared at once, bounds the (N, rows) distance temporaries
+HAMMING_CHUNK = 1 << 16
+
+_M1 = np.uint64(0x5555555555555555)
+_M2 = np.uint64(0x3333333333333333)
+_M4 = np.uint64(0x0F0F0F0F0F0F0F0F)
+_H01 = np.uint64(0x0101010101010101)
+
+
+def popcount(words: NDArray) -> NDArray:
+    """Set bits of every uint64, as uint64."""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words)
+    # SWAR popcount, for numpy < 2
+    words = words - ((words >> np.uint64(1)) & _M1)
+    words = (words & _M2) + ((words >> np.uint64(2)) & _M2)
+    words = (words + (words >> np.uint64(4))) & _M4
+    return (words * _H01) >> np.uint64(56)
+
+
+def as_words(codes: NDArray) -> NDArray:
+    """View (N, bits / 8) uint8 codes as (N, bits / 64) uint64 words."""
+    return np.ascontiguousarray(codes).view(np.uint64)
+
+
+def hamming_distances(queries: NDArray, codes: NDArray) -> NDArray:
+    """
+    Hamming distance between packed codes.
+
+    :param queries: (N, W) uint64 words.
+    :param codes: (M, W) uint64 words.
+    :return: (N, M) int32 distances.
+    """
+    # int32 rather than a narrower type: numpy partitions it several times faster
+    distances = np.zeros((len(queries), len(codes)), dtype=np.int32)
+    for word in range(queries.shape[1]):
+        distances += popcount(queries[:, word, None] ^ codes[None, :, word]).astype(
+            np.int32
+        )
+    return distances
+
+
+def nearest_codes(queries: NDArray, codes: NDArray, count: int) -> NDArray:
+    """
+    Rows of the `count` codes closest to every query, in no order.
+
+    :param queries: (N, W) uint64 words.
+    :param codes: (M, W) uint64 words, scanned `HAMMING_CHUNK` rows at a time.
+    :return: (N, min(count, M)) int64 rows.
+    """
+    count = min(count, len(codes))
+    best = np.zeros((len(queries), 0), dtype=np.int64)
+    best_distances = np.zeros((len(queries), 0), dtype=np.int32)
+    for start in range(0, len(codes), HAMMING_CHUNK):
+        chunk = codes[start : start + HAMMING_CHUNK]
+        distances = np.concatenate(
+            [best_distances, hamming_distances(queries, chunk)], axis=1
+        )
+        rows = np.concatenate(
+            [
+                best,
+                np.broadcast_to(
+                    np.arange(start, start + len(chunk)), (len(queries), len(chunk))
+                ),
+            ],
+            axis=1,
+        )
+        if distances.shape[1] > count:
+            keep = np.argpartition(distances, count - 1, axis=1)[:, :count]
+            distances = np.take_along_axis(distances, keep, axis=1)
+            rows = np.take_along_axis(rows, keep, axis=1)
+        best, best_distances = rows, distances
+    return best
+
+
+def fit_projection(
+    embeddings: NDArray,
+    bits: int = 256,
+    method: str = "itq",
+    iterations: int = 50,
+    seed: int = 0,
+) -> Tuple[NDArray, NDArray]:
+    """
+    Fit a projection to binary codes on sample embeddings.
+
+    "random" is a random rotation of the centered embeddings. "itq"
+    (iterative quantization, Gong & Lazebnik) projects them on their `bits`
+    principal components, then learns the rotation that loses the least
+    when the result is binarized, which keeps more of the neighbors.
+
+    :return: ((D, bits) projection, (D,) mean).
+    """
+    if method not in HASH_METHODS:
+        raise ValueError(f"unsupported method {method}, use one of {HASH_METHODS}")
+    if bits % 64 or not 0 < bits <= embeddings.shape[1]:
+        raise ValueError(
+            f"bits must be a multiple of 64 up to the embedding size, got {bits}"
+        )
+    rng = np.random.default_rng(seed)
+    embeddings = l2_normalize(np.asarray(embeddings, dtype=np.float64))
+    mean = embeddings.mean(axis=0)
+    centered = embeddings - mean
+    if method == "random":
+        projection, _ = np.linalg.qr(rng.normal(size=(embeddings.shape[1], bits)))
+        return projection.astype(np.float32), mean.astype(np.float32)
+    if len(embeddings) < bits:
+        raise ValueError(f"itq needs at least {bits} sample embeddings")
+    _, _, vt = np.linalg.svd(centered, full_matrices=False)
+    components = vt[:bits].T
+    reduced = centered @ components
+    rotation, _ = np.linalg.qr(rng.normal(size=(bits, bits)))
+    for _ in range(iterations):
+        binary = np.where(reduced @ rotation >= 0, 1.0, -1.0)
+        # orthogonal Procrustes: the rotation closest to mapping reduced onto binary
+        u, _, wt = np.linalg.svd(reduced.T @ binary)
+        rotation = u @ wt
+    return (components @ rotation).astype(np.float32), mean.astype(np.float32)
+
+
+class BinaryHasher:
+    """
+    Maps embeddings to packed binary codes: the signs of a linear projection
+    of the normalized, centered embedding, 8 bits per byte.
+    """
+
+    def __init__(self, projection: NDArray, mean: Optional[NDArray] = None):
+        projection = np.asarray(projection, dtype=np.float32)
+        if projection.ndim != 2 or projection.shape[1] % 64:
+            raise ValueError(
+                "the projection must be (D, bits) with bits a multiple of 64, "
+                f"got {projection.shape}"
+            )
+        self.projection = projection
+        self.mean = (
+            np.zeros(projection.shape[0], dtype=np.float32)
+            if mean is None
+            else np.asarray(mean, dtype=np.float32).reshape(-1)
+        )
+        if len(self.mean) != projection.shape[0]:
+            raise ValueError("the mean must have one value per embedding dimension")
+
+    @property
+    def bits(self) -> int:
+        return self.projection.shape[1]
+
+    @property
+    def dim(self) -> int:
+        return self.projection.shape[0]
+
+    @classmethod
+    def load(cls, path: str) -> "BinaryHasher":
+        """Load a hasher saved with `save`, e.g. by src/fit_binary_codes.py."""
+        if not path.lower().endswith(".npz"):
+            raise ValueError(f"binary code projections are .npz files, got {path}")
+        with np.load(path) as data:
+            return cls(data["projection"], data["mean"] if "mean" in data else None)
+
+    def save(self, path: str):
+        np.savez(path, projection=self.projection, mean=self.mean)
+
+    def encode(self, embeddings: NDArray) -> NDArray:
+        """(N, D) embeddings -> (N, bits / 8) uint8 codes."""
+        embeddings = l2_normalize(np.asarray(embeddings, dtype=np.float32))
+        return np.packbits((embeddings - self.mean) @ self.projection >= 0, axis=-1)
+
+
+class HammingIndex:
+    """
+    Binary codes of stored vectors, searched by Hamming distance.
+
+    The codes pre-filter `candidates` vectors per query, which are then
+    re-ranked by exact cosine similarity on the full vectors.
+    """
+
+    def __init__(self, hasher: BinaryHasher, vectors: NDArray):
+        self.hasher = hasher
+        self.vectors = l2_normalize(np.asarray(vectors, dtype=np.float32))
+        self.codes = as_words(hasher.encode(self.vectors))
+
+    def candidates(self, queries: NDArray, count: int) -> NDArray:
+        """(N, count) rows of the closest codes to every query, in no order."""
+        return nearest_codes(as_words(self.hasher.encode(queries)), self.codes, count)
+
+    def search(
+        self, queries: NDArray, k: int = 1, candidates: int = 64
+    ) -> Tuple[NDArray, NDArray]:
+        """
+        The `k` most similar stored vectors of every query.
+
+        :return: ((N, k) rows, (N, k) cosine similarities), padded with -1
+            and 0.
+        """
+        queries = l2_normalize(np.asarray(queries, dtype=np.float32))
+        rows = np.full((len(queries), k), -1, dtype=np.int64)
+        sims = np.zeros((len(queries), k), dtype=np.float32)
+        if len(self.vectors) == 0:
+            return rows, sims
+        found = self.candidates(queries, max(candidates, k))
+        # (N, C) cosine similarity of every query to its candidates
+        similarity = np.einsum("nd,ncd->nc", queries, self.vectors[found])
+        order = np.argsort(-similarity, axis=1)[:, :k]
+        rows[:, : order.shape[1]] = np.take_along_axis(found, order, axis=1)
+        sims[:, : order.shape[1]] = np.take_along_axis(similarity, order, axis=1)
+        return rows, sims
@@ -0,0 +1,99 @@
+import importlib.util
+from typing import Dict, Mapping
+
+import numpy as np
+import torch
+
+# infer outputs a head cannot be named after
+RESERVED_OUTPUTS = (
+    "embedding",
+    "embedding_small",
+    "embedding_code",
+    "frame_embeddings",
+    "quality",
+    "valid",
+    "recomputed",
+    "assignment",
+    "cost",
+    "match",
+    "similarity",
+    "margin",
+    "escalated",
+    "gallery_identity",
+    "gallery_similarity",
+)
+
+TORCHSCRIPT_EXTENSIONS = (".pt", ".pth", ".torchscript")
+ONNX_EXTENSIONS = (".onnx",)
+
+
+class TorchScriptHead:
+    """A TorchScript module mapping (B, C, H, W) feature maps to (B, ...) outputs."""
+
+    def __init__(self, path: str, device: torch.device):
+        self.path = path
+        self.module = torch.jit.load(path, map_location=device).eval()
+
+    def __call__(self, featuremaps: torch.Tensor) -> torch.Tensor:
+        with torch.no_grad():
+            return self.module(featuremaps)
+
+
+class OnnxHead:
+    """
+    An ONNX model mapping (B, C, H, W) feature maps to (B, ...) outputs.
+
+    Runs with onnxruntime on its default provider. Only the first output of
+    the model is used.
+    """
+
+    def __init__(self, path: str):
+        import onnxruntime  # pylint: disable=import-outside-toplevel
+
+        self.path = path
+        self.session = onnxruntime.InferenceSession(path)
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, featuremaps: torch.Tensor) -> torch.Tensor:
+        inputs = featuremaps.detach().cpu().numpy().astype(np.float32)
+        outputs = self.session.run(None, {self.input_name: inputs})[0]
+        return torch.from_numpy(outputs).to(featuremaps.device)
+
+
+def load_head(path: str, device: torch.device):
+    """Load a TorchScript or ONNX head, by file extension."""
+    check_head_file(path)
+    if path.lower().endswith(ONNX_EXTENSIONS):
+        return OnnxHead(path)
+    return TorchScriptHead(path, device)
+
+
+def onnxruntime_available() -> bool:
+    return importlib.util.find_spec("onnxruntime") is not None
+
+
+def check_head_file(path: str):
+    if not path.lower().endswith(TORCHSCRIPT_EXTENSIONS + ONNX_EXTENSIONS):
+        raise ValueError(
+            f"unsupported head file {path}, use one of "
+            f"{list(TORCHSCRIPT_EXTENSIONS + ONNX_EXTENSIONS)}"
+        )
+    # onnxruntime is not a dependency of the module, nor in its builds
+    if path.lower().endswith(ONNX_EXTENSIONS) and not onnxruntime_available():
+        raise ValueError(
+            f"head file {path} is ONNX, which needs onnxruntime installed; "
+            "export the head to TorchScript instead"
+        )
+
+
+def validate_heads(heads: Mapping) -> Dict[str, str]:
+    """Check a head name -> file path mapping."""
+    if not isinstance(heads, Mapping):
+        raise ValueError("heads must map output names to head files")
+    for name, path in heads.items():
+        if name in RESERVED_OUTPUTS:
+            raise ValueError(f"head name {name} clashes with an infer output")
+        if not isinstance(path, str):
+            raise ValueError(f"the file of head {name} must be a string")
+        check_head_file(path)
+    return dict(heads)
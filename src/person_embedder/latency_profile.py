@@ -0,0 +1,102 @@
+import json
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+
+class LatencyProfile:
+    """
+    Latency of the real embedder per batch size, as recorded by
+    src/record_latency_profile.py.
+
+    Between recorded batch sizes the latency is interpolated, past them it
+    grows by the per-crop cost of the two largest. `per_batch_ms` and
+    `per_crop_ms` summarize the profile as a fitted line. `jitter` is the
+    relative standard deviation of the recorded latencies.
+    """
+
+    def __init__(
+        self,
+        batch_sizes: Sequence[int],
+        batch_ms: Sequence[float],
+        jitter: float = 0.0,
+        max_batch_size: Optional[int] = None,
+    ):
+        """
+        :param batch_sizes: recorded batch sizes, increasing.
+        :param batch_ms: median latency of a batch of each size.
+        :param max_batch_size: crops per forward pass; larger requests run
+            as several batches one after the other, as with
+            `micro_batch_size`.
+        """
+        if len(batch_sizes) == 0 or len(batch_sizes) != len(batch_ms):
+            raise ValueError("the profile needs one latency per batch size")
+        if np.any(np.diff(batch_sizes) <= 0) or min(batch_sizes) < 1:
+            raise ValueError("batch sizes must be positive and increasing")
+        self.batch_sizes = [int(size) for size in batch_sizes]
+        self.batch_ms = [float(ms) for ms in batch_ms]
+        self.jitter = float(jitter)
+        self.max_batch_size = max_batch_size
+        if len(self.batch_sizes) > 1:
+            self.per_crop_ms, self.per_batch_ms = (
+                float(v) for v in np.polyfit(self.batch_sizes, self.batch_ms, 1)
+            )
+        else:
+            self.per_crop_ms = self.batch_ms[0] / self.batch_sizes[0]
+            self.per_batch_ms = 0.0
+
+    @classmethod
+    def constant(
+        cls, per_batch_ms: float = 0.0, per_crop_ms: float = 0.0, jitter: float = 0.0
+    ) -> "LatencyProfile":
+        """A profile of `per_batch_ms + per_crop_ms * crops`."""
+        return cls(
+            [1, 2], [per_batch_ms + per_crop_ms, per_batch_ms + 2 * per_crop_ms], jitter
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "LatencyProfile":
+        with open(path, encoding="utf-8") as f:
+            profile = json.load(f)
+        return cls(
+            profile["batch_sizes"],
+            profile["batch_ms"],
+            profile.get("jitter", 0.0),
+            profile.get("max_batch_size", None),
+        )
+
+    def to_dict(self) -> Dict:
+        return {
+            "batch_sizes": self.batch_sizes,
+            "batch_ms": self.batch_ms,
+            "jitter": self.jitter,
+            "max_batch_size": self.max_batch_size,
+            "per_batch_ms": self.per_batch_ms,
+            "per_crop_ms": self.per_crop_ms,
+        }
+
+    def save(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def batch_latency_ms(self, crops: int) -> float:
+        """Median latency of one batch of `crops` crops."""
+        if crops <= 0:
+            return 0.0
+        if crops > self.batch_sizes[-1]:
+            if len(self.batch_sizes) == 1:
+                return self.batch_ms[-1] * crops / self.batch_sizes[-1]
+            slope = (self.batch_ms[-1] - self.batch_ms[-2]) / (
+                self.batch_sizes[-1] - self.batch_sizes[-2]
+            )
+            return self.batch_ms[-1] + slope * (crops - self.batch_sizes[-1])
+        return float(np.interp(crops, self.batch_sizes, self.batch_ms))
+
+    def latency_ms(self, crops: int) -> float:
+        """Median latency of a request of `crops` crops."""
+        if self.max_batch_size is None or crops <= self.max_batch_size:
+            return self.batch_latency_ms(crops)
+        full, rest = divmod(crops, self.max_batch_size)
+        return full * self.batch_latency_ms(
+            self.max_batch_size
+        ) + self.batch_latency_ms(rest)
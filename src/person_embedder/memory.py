@@ -0,0 +1,197 @@
+import os
+import resource
+import sys
+from typing import Dict, Iterable, Optional
+
+import torch
+from torch.profiler import ProfilerActivity, profile
+
+from src.person_embedder.os_net_encoder import OSNetFeatureEmbedder
+
+MB = 2**20
+
+
+class MemoryBudgetError(ValueError):
+    """The fixed memory of the configuration does not fit in the budget."""
+
+
+def module_bytes(module: torch.nn.Module) -> int:
+    """Bytes of the parameters and buffers of `module`, shared storages counted once."""
+    storages = {}
+    for tensor in list(module.parameters()) + list(module.buffers()):
+        storage = tensor.untyped_storage()
+        storages[storage.data_ptr()] = storage.nbytes()
+    return sum(storages.values())
+
+
+def weights_bytes(embedder: OSNetFeatureEmbedder) -> int:
+    """Bytes of the model weights and of the TorchScript heads of `embedder`."""
+    return module_bytes(embedder.model) + sum(
+        module_bytes(head.module)
+        for head in embedder.heads.values()
+        if hasattr(head, "module")
+    )
+
+
+def input_bytes_per_crop(embedder: OSNetFeatureEmbedder) -> int:
+    """Bytes of one letterboxed float32 crop in a model input batch."""
+    height, width = embedder.input_shape
+    return 3 * height * width * 4
+
+
+def measure_activation_bytes(
+    embedder: OSNetFeatureEmbedder, batch_size: int = 2
+) -> int:
+    """
+    Peak memory allocated by a forward pass, per crop.
+
+    Runs one forward pass of `batch_size` crops at the embedder input shape
+    with its current backend. On CUDA this is the allocator's peak; on CPU the
+    allocations and frees recorded by the profiler are replayed in order.
+    Activations grow linearly with the batch size.
+    """
+    batch = torch.zeros((batch_size, 3, *embedder.input_shape), device=embedder.device)
+    if embedder.device.type == "cuda":
+        torch.cuda.synchronize()
+        baseline = torch.cuda.memory_allocated()
+        torch.cuda.reset_peak_memory_stats()
+        embedder.forward(batch)
+        torch.cuda.synchronize()
+        peak = torch.cuda.max_memory_allocated() - baseline
+    else:
+        with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+            embedder.forward(batch)
+        changes = []
+        for event in prof.events():
+            if event.name == "[memory]":
+                # frees, and allocations outside of any operator
+                changes.append((event.time_range.start, event.cpu_memory_usage))
+            elif event.self_cpu_memory_usage > 0:
+                changes.append((event.time_range.start, event.self_cpu_memory_usage))
+        current, peak = 0, 0
+        for _, change in sorted(changes, key=lambda change: change[0]):
+            current += change
+            peak = max(peak, current)
+    return -(-peak // batch_size)
+
+
+def process_memory() -> Dict[str, float]:
+    """Resident and peak resident memory of the process, and CUDA memory, in MB."""
+    res = {}
+    try:
+        with open("/proc/self/status", encoding="utf-8") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "VmHWM"):
+                    # reported in kB
+                    name = "rss_mb" if key == "VmRSS" else "peak_rss_mb"
+                    res[name] = int(value.split()[0]) / 1024
+    except OSError:
+        pass
+    if "peak_rss_mb" not in res:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kB on Linux, bytes on macOS
+        res["peak_rss_mb"] = peak / (MB if sys.platform == "darwin" else 1024)
+    if torch.cuda.is_available():
+        res["cuda_allocated_mb"] = torch.cuda.memory_allocated() / MB
+        res["cuda_peak_allocated_mb"] = torch.cuda.max_memory_allocated() / MB
+    return res
+
+
+class MemoryBudget:
+    """
+    Fits the batch size and the track cache of a configuration into a budget.
+
+    Only the memory the service allocates for its own data is accounted:
+    model weights, the activations and input tensor of the batches in flight,
+    the preprocessed buffers queued in staged execution, and the track cache.
+    The Python and torch runtime come on top and are visible in the process
+    memory reported next to the budget.
+
+    The weights are fixed. A batch of one crop is reserved next, then the
+    track cache gets at most half of what is left, and batches get the rest.
+    """
+
+    def __init__(self, budget_mb: float):
+        self.budget_bytes = int(budget_mb * MB)
+        self.plan: Dict[str, float] = {}
+
+    def fit(
+        self,
+        embedders: Iterable[OSNetFeatureEmbedder],
+        batch_size: Optional[int] = None,
+        concurrent_batches: int = 1,
+        buffered_batches: int = 0,
+        max_tracks: int = 0,
+        track_bytes: int = 0,
+        max_identities: int = 0,
+        identity_bytes: int = 0,
+    ) -> Dict[str, float]:
+        """
+        Largest batch size, track count and gallery size that fit in the budget.
+
+        :param embedders: models loaded at the same time; they run one after
+            the other, so the largest activations count.
+        :param batch_size: requested crops per forward pass, unlimited when None.
+        :param concurrent_batches: forward passes that can run at once.
+        :param buffered_batches: preprocessed batches queued ahead of the model.
+        :param max_tracks: requested track cache size.
+        :param track_bytes: memory of one cached track.
+        :param max_identities: requested gallery size.
+        :param identity_bytes: memory of one gallery identity.
+        :return: the plan: "batch_size", "max_tracks", "max_identities" and
+            the MB of each part.
+        :raises MemoryBudgetError: the weights and a single crop do not fit.
+        """
+        embedders = list(embedders)
+        weights = sum(weights_bytes(embedder) for embedder in embedders)
+        activations = max(measure_activation_bytes(embedder) for embedder in embedders)
+        inputs = max(input_bytes_per_crop(embedder) for embedder in embedders)
+        crop_bytes = concurrent_batches * (activations + inputs) + (
+            buffered_batches * inputs
+        )
+
+        available = self.budget_bytes - weights - crop_bytes
+        if available < 0:
+            raise MemoryBudgetError(
+                f"memory_budget_mb {self.budget_bytes / MB:.0f} is too small: the "
+                f"model weights need {weights / MB:.1f} MB and a single crop "
+                f"{crop_bytes / MB:.1f} MB"
+            )
+        # the track cache and the gallery share at most half of what is left
+        cache_bytes = max_tracks * track_bytes + max_identities * identity_bytes
+        if cache_bytes > available // 2:
+            scale = available // 2 / cache_bytes
+            max_tracks = int(max_tracks * scale)
+            max_identities = int(max_identities * scale)
+        available -= max_tracks * track_bytes + max_identities * identity_bytes
+        fitting_batch_size = 1 + available // crop_bytes
+        if batch_size is not None:
+            fitting_batch_size = min(fitting_batch_size, batch_size)
+
+        self.plan = {
+            "budget_mb": self.budget_bytes / MB,
+            "batch_size": int(fitting_batch_size),
+            "max_tracks": int(max_tracks),
+            "max_identities": int(max_identities),
+            "weights_mb": weights / MB,
+            "activations_mb_per_crop": activations / MB,
+            "batches_mb": fitting_batch_size * crop_bytes / MB,
+            "tracks_mb": max_tracks * track_bytes / MB,
+            "gallery_mb": max_identities * identity_bytes / MB,
+        }
+        self.plan["planned_mb"] = (
+            self.plan["weights_mb"]
+            + self.plan["batches_mb"]
+            + self.plan["tracks_mb"]
+            + self.plan["gallery_mb"]
+        )
+        return self.plan
+
+
+def available_memory_mb() -> Optional[float]:
+    """Memory available to new allocations on this host, in MB, None when unknown."""
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") / MB
+    except (ValueError, OSError, AttributeError):
+        return None
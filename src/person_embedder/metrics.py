@@ -0,0 +1,52 @@
+import threading
+from collections import deque
+from typing import Deque, Dict
+
+import numpy as np
+
+
+class ServiceMetrics:
+    """
+    Thread-safe counters and rolling windows shared by the service components.
+
+    Counters only ever go up; observations keep the last `window` values so the
+    snapshot reflects recent behaviour rather than the whole process lifetime.
+    """
+
+    def __init__(self, window: int = 256):
+        self.window = window
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        self._observations: Dict[str, Deque[float]] = {}
+
+    def increment(self, name: str, value: float = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            if name not in self._observations:
+                self._observations[name] = deque(maxlen=self.window)
+            self._observations[name].append(float(value))
+
+    def snapshot(self) -> Dict[str, float]:
+        """
+        Flatten counters and observation summaries into a do_command friendly dict.
+
+        Observations are reported as `<name>_last`, `<name>_mean` and `<name>_p95`.
+        """
+        with self._lock:
+            res = dict(self._counters)
+            for name, values in self._observations.items():
+                if not values:
+                    continue
+                array = np.fromiter(values, dtype=np.float64)
+                res[f"{name}_last"] = float(array[-1])
+                res[f"{name}_mean"] = float(array.mean())
+                res[f"{name}_p95"] = float(np.percentile(array, 95))
+        return res
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._observations.clear()
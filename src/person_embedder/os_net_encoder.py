@@ -1,37 +1,103 @@
 import os
 import os.path as osp
 import pickle
+import zipfile
 from collections import OrderedDict
 from functools import partial
-from typing import Dict, List
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple, Union
 
 import numpy as np
 import torch
 import torchvision.transforms as T
 from viam.logging import getLogger
 
-from src.person_embedder.osnet import osnet_ain_x1_0
+from src.person_embedder.artifact_cache import ArtifactCache
+from src.person_embedder.fused_osnet import fuse_os_blocks
+from src.person_embedder.heads import load_head
+from src.person_embedder.metrics import ServiceMetrics
+from src.person_embedder.osnet import (
+    osnet_ain_x0_5,
+    osnet_ain_x0_25,
+    osnet_ain_x0_75,
+    osnet_ain_x1_0,
+)
+from src.person_embedder.pixel_formats import RawFrameCrops
 from src.person_embedder.utils import (
+    letterbox_fill_fraction,
     pad_image_to_target_size,
     resize_for_padding,
     resource_path,
+    select_aspect_ratio_bucket,
 )
 
 LOGGER = getLogger(__name__)
 
 
 OSNET_REPO = "osnet"
+DEFAULT_CHECKPOINT = "osnet_ain_ms_d_c.pth.tar"
+# DEFAULT_CHECKPOINT converted by src/convert_weights.py, used when bundled
+MAPPABLE_CHECKPOINT = "osnet_ain_ms_d_c.pt"
+
+# the bundled checkpoints are for DEFAULT_ARCHITECTURE, the others need a model_path
+DEFAULT_ARCHITECTURE = "osnet_ain_x1_0"
+ARCHITECTURES = {
+    "osnet_ain_x1_0": osnet_ain_x1_0,
+    "osnet_ain_x0_75": osnet_ain_x0_75,
+    "osnet_ain_x0_5": osnet_ain_x0_5,
+    "osnet_ain_x0_25": osnet_ain_x0_25,
+}
+
+# execution backend -> (channels_last, autocast dtype)
+EXECUTION_BACKENDS = {
+    "fp32": (False, None),
+    "fp32_channels_last": (True, None),
+    "bf16": (True, torch.bfloat16),
+    "fp16": (True, torch.float16),
+}
 
 
 class OSNetFeatureEmbedder:
-    def __init__(self, model_path: str = None):
+    def __init__(
+        self,
+        model_path: str = None,
+        aspect_ratio_buckets: Optional[Sequence[Tuple[int, int]]] = None,
+        metrics: Optional[ServiceMetrics] = None,
+        random_weights: bool = False,
+        fuse_blocks: bool = False,
+        architecture: str = DEFAULT_ARCHITECTURE,
+        heads: Optional[Mapping[str, str]] = None,
+        artifact_cache: Optional[ArtifactCache] = None,
+    ):
         """
         Initialize the FeatureEncoder with a feature extractor model.
 
         :param model_name: The name of the model to use for feature extraction.
         :param model_path: The path to the pre-trained model file.
         :param device: The device to run the model on ('cpu' or 'cuda').
+        :param aspect_ratio_buckets: Optional (height, width) input sizes to batch crops into
+            instead of letterboxing everything into `input_shape`.
+        :param metrics: Optional metrics sink shared with the service.
+        :param random_weights: Skip loading a checkpoint and keep the random
+            initialization, for benchmarking without the weights file.
+        :param fuse_blocks: Rewrite the OSBlocks with grouped stream
+            convolutions and a single gate call, see FusedOSBlock.
+        :param architecture: OSNet variant, one of ARCHITECTURES.
+        :param heads: Optional output name -> TorchScript or ONNX file of
+            heads run on the conv5 feature maps, see compute_outputs.
+        :param artifact_cache: Optional cache of the loaded and optimized
+            weights, so a restart with the same checkpoint and options skips
+            loading the checkpoint and rebuilding the optimizations.
         """
+        if architecture not in ARCHITECTURES:
+            raise ValueError(
+                f"unsupported architecture {architecture}, use one of {list(ARCHITECTURES)}"
+            )
+        if (
+            architecture != DEFAULT_ARCHITECTURE
+            and model_path is None
+            and not random_weights
+        ):
+            raise ValueError(f"{architecture} needs a model_path")
         if torch.cuda.is_available():
             use_gpu = True
             self.device = torch.device("cuda")
@@ -40,23 +106,68 @@ class OSNetFeatureEmbedder:
             self.device = torch.device("cpu")
 
         self.input_shape = (256, 128)
-        model = osnet_ain_x1_0(
+        self.aspect_ratio_buckets = (
+            None
+            if aspect_ratio_buckets is None
+            else [tuple(bucket) for bucket in aspect_ratio_buckets]
+        )
+        self.metrics = metrics
+        # crops per forward pass, unlimited when None
+        self.max_batch_size: Optional[int] = None
+        self.backend = "fp32"
+        self.architecture = architecture
+        model = ARCHITECTURES[architecture](
             num_classes=1000, loss="softmax", pretrained=False, use_gpu=use_gpu
         )
         model.eval()
-        if model_path is None:
+        if random_weights:
+            LOGGER.warning("random_weights is set, embeddings are meaningless")
+        elif model_path is None:
             LOGGER.info("No model path provided, using default model")
-            model_path = resource_path(
-                os.path.join(OSNET_REPO, "osnet_ain_ms_d_c.pth.tar")
-            )
+            model_path = resource_path(os.path.join(OSNET_REPO, MAPPABLE_CHECKPOINT))
+            if not os.path.exists(model_path):
+                model_path = resource_path(os.path.join(OSNET_REPO, DEFAULT_CHECKPOINT))
         else:
             LOGGER.info(f"Using model path: {model_path}")
-        load_pretrained_weights(model, model_path)
-        self.model = model.to(self.device)
+        artifact_key, artifact = None, None
+        if artifact_cache is not None and not random_weights:
+            artifact_key = artifact_cache.key(
+                model_path, {"architecture": architecture, "fuse_blocks": fuse_blocks}
+            )
+            artifact = artifact_cache.load(artifact_key)
+        if artifact is not None:
+            if fuse_blocks:
+                # only the structure, the weights come from the artifact
+                fuse_os_blocks(model)
+            model.load_state_dict(artifact, assign=True)
+            self.model = model.to(self.device)
+        else:
+            if not random_weights:
+                load_pretrained_weights(model, model_path)
+            self.model = model.to(self.device)
+            if fuse_blocks:
+                fuse_os_blocks(self.model)
+            if artifact_key is not None:
+                artifact_cache.save(artifact_key, self.model.state_dict())
+        self.heads = {
+            name: load_head(path, self.device) for name, path in (heads or {}).items()
+        }
+        # per-crop output shape of every head, probed once so a broken head
+        # fails here and empty requests still get correctly shaped outputs
+        self.head_shapes: Dict[str, Tuple[int, ...]] = {}
+        if self.heads:
+            probe = torch.zeros((1, 3, *self.input_shape), device=self.device)
+            self.head_shapes = {
+                name: tuple(value.shape[1:])
+                for name, value in self.forward(probe, with_heads=True).items()
+                if name != "embedding"
+            }
 
         ##preprocessing
         pixel_mean = [0.485, 0.456, 0.406]
         pixel_std = [0.229, 0.224, 0.225]
+        self.pixel_mean = torch.tensor(pixel_mean, device=self.device)
+        self.pixel_std = torch.tensor(pixel_std, device=self.device)
 
         def gpu_compatible_transforms(tensor: torch.Tensor):
             normalize = T.Normalize(mean=pixel_mean, std=pixel_std)
@@ -68,63 +179,184 @@ class OSNetFeatureEmbedder:
         """
         Compute a single feature vector for an image.
         """
-        resized_image, _, _, _, _ = resize_for_padding(img, self.input_shape)
-        padded_image = pad_image_to_target_size(resized_image, self.input_shape)
-        preprocessed_image = self.preprocess(padded_image)
+        return self.compute_features([img])[0]
+
+    def compute_features(
+        self, crops: Union[List[torch.Tensor], RawFrameCrops]
+    ) -> torch.Tensor:
+        """
+        Compute feature vectors for a list of cropped images.
+
+        Crops are letterboxed to the model input shape and run as one batched
+        forward pass. When aspect ratio buckets are configured, each crop is
+        letterboxed into the bucket that wastes the least padding instead and
+        one forward pass runs per bucket; this is valid because OSNet ends in
+        global average pooling.
+
+        :param crops: list of (C, H, W) float32 tensors, or the crops of a raw
+            camera frame, which are converted, letterboxed and normalized in one pass.
+        :return: (N, feature_dim) tensor, in the order of `crops`.
+        """
+        features = None
+        for indices, batch in self.prepare_batches(crops):
+            res = self.forward(batch)
+            if features is None:
+                features = res.new_empty((len(crops), res.shape[1]))
+            features[torch.tensor(indices, device=res.device)] = res
+        return features
+
+    def compute_outputs(
+        self, crops: Union[List[torch.Tensor], RawFrameCrops]
+    ) -> Dict[str, torch.Tensor]:
+        """
+        Compute the feature vectors and the outputs of every head.
+
+        The heads run on the feature maps the embedding is pooled from, so
+        they cost no extra backbone pass.
+
+        :return: "embedding" ((N, feature_dim)) and one (N, ...) tensor per
+            head, in the order of `crops`.
+        """
+        outputs: Dict[str, torch.Tensor] = {}
+        for indices, batch in self.prepare_batches(crops):
+            res = self.forward(batch, with_heads=True)
+            for name, value in res.items():
+                if name not in outputs:
+                    outputs[name] = value.new_empty((len(crops),) + value.shape[1:])
+                outputs[name][torch.tensor(indices, device=value.device)] = value
+        return outputs
+
+    def prepare_batches(
+        self, crops: Union[List[torch.Tensor], RawFrameCrops]
+    ) -> List[Tuple[List[int], torch.Tensor]]:
+        """
+        Letterbox and normalize crops into model input batches, one per target size.
+
+        :return: list of (indices into `crops`, (len(indices), C, H, W) batch).
+        """
+        if isinstance(crops, RawFrameCrops):
+            sizes = crops.sizes()
+
+            def make_batch(indices, target_size):
+                return crops.letterbox(
+                    indices, target_size, self.pixel_mean, self.pixel_std
+                )
+
+        else:
+            sizes = [crop.shape[1:] for crop in crops]
+
+            def make_batch(indices, target_size):
+                batch = torch.cat(
+                    [self._letterbox(crops[i], target_size) for i in indices], dim=0
+                )
+                return self.preprocess(batch)
+
+        groups: Dict[Tuple[int, int], List[int]] = {}
+        for i, (height, width) in enumerate(sizes):
+            if self.aspect_ratio_buckets is None:
+                target_size = self.input_shape
+            else:
+                target_size = select_aspect_ratio_bucket(
+                    height, width, self.aspect_ratio_buckets
+                )
+            groups.setdefault(target_size, []).append(i)
+
+        if self.metrics is not None and self.aspect_ratio_buckets is not None:
+            self._record_padding_metrics(sizes, groups)
+        step = self.max_batch_size or len(sizes) or 1
+        return [
+            (indices[i : i + step], make_batch(indices[i : i + step], target_size))
+            for target_size, indices in groups.items()
+            for i in range(0, len(indices), step)
+        ]
+
+    def forward(
+        self, batch: torch.Tensor, with_heads: bool = False
+    ) -> Union[torch.Tensor, Dict[str, torch.Tensor]]:
+        """
+        Run the model on a preprocessed (B, C, H, W) batch.
+
+        :param with_heads: also run the heads on the feature maps and return
+            a dict of "embedding" and the head outputs.
+        """
+        channels_last, autocast_dtype = EXECUTION_BACKENDS[self.backend]
+        if channels_last:
+            batch = batch.contiguous(memory_format=torch.channels_last)
         with torch.no_grad():
-            res = self.model(preprocessed_image)
-        return res[0]
-
-    # TODO: implement compute_features when the tracker is able to ask for batched inference
-    #  def compute_features(
-    #     self, img: ImageObject, detections: List[Detection]
-    # ) -> List[np.ndarray]:
-    #     device = img.float32_tensor.device
-    #     image_height, image_width = img.float32_tensor.shape[
-    #         1:
-    #     ]  # Assuming CxHxW format
-
-    #     # Stack all bounding boxes into a tensor (x1, y1, x2, y2)
-    #     bboxes = torch.tensor(
-    #         [[d.bbox[0], d.bbox[1], d.bbox[2], d.bbox[3]] for d in detections],
-    #         device=device,
-    #     )
-
-    #     # Crop and resize images
-    #     cropped_images = []
-    #     for bbox in bboxes:
-    #         x1, y1, x2, y2 = map(int, bbox)  # Ensure integer coordinates
-    #         x1, y1 = max(0, x1), max(0, y1)  # Clip to image dimensions
-    #         x2, y2 = min(image_width, x2), min(image_height, y2)
-
-    #         cropped_image = img.float32_tensor[
-    #             :, y1:y2, x1:x2
-    #         ]  # Crop image (CxH_cropxW_crop)
-
-    #         # Ensure the cropped region is valid
-    #         if cropped_image.numel() == 0:
-    #             raise ValueError(f"Invalid crop region: {bbox}")
-
-    #         # Resize the cropped image
-
-    #         resized_image, new_height, new_width, _, _ = resize_for_padding(
-    #             cropped_image, self.input_shape
-    #         )
-    #         padded_image = pad_image_to_target_size(resized_image, self.input_shape)
-    #         cropped_images.append(padded_image[0])
-
-    #     # Stack all resized images into a batch
-    #     cropped_batch = torch.stack(
-    #         cropped_images, dim=0
-    #     )  # Resulting shape: (B, C, H, W)
-
-    #     # Normalize the batch
-    #     cropped_batch = self.preprocess(cropped_batch)
-
-    #     # Extract features
-    #     with torch.no_grad():
-    #         res = self.model(cropped_batch)
-    #     return res
+            if not with_heads:
+                if autocast_dtype is None:
+                    return self.model(batch)
+                with torch.autocast(self.device.type, dtype=autocast_dtype):
+                    return self.model(batch).float()
+
+            with torch.autocast(
+                self.device.type,
+                dtype=autocast_dtype,
+                enabled=autocast_dtype is not None,
+            ):
+                featuremaps = self.model(batch, return_featuremaps=True)
+                embedding = self._pool_featuremaps(featuremaps)
+            featuremaps = featuremaps.float()
+            outputs = {"embedding": embedding.float()}
+            for name, head in self.heads.items():
+                outputs[name] = head(featuremaps).float()
+            return outputs
+
+    def _pool_featuremaps(self, featuremaps: torch.Tensor) -> torch.Tensor:
+        """The eval-mode tail of OSNet.forward: global pooling and the fc layer."""
+        features = self.model.global_avgpool(featuremaps).flatten(1)
+        if self.model.fc is not None:
+            features = self.model.fc(features)
+        return features
+
+    def available_backends(self, reduced_precision: bool = False) -> List[str]:
+        """
+        Execution backends supported on the embedder device.
+
+        :param reduced_precision: include the half precision backend of the
+            device (bf16 on CPU, fp16 on CUDA).
+        """
+        backends = ["fp32", "fp32_channels_last"]
+        if reduced_precision:
+            backends.append("fp16" if self.device.type == "cuda" else "bf16")
+        return backends
+
+    def set_backend(self, backend: str):
+        """Switch the execution backend, see EXECUTION_BACKENDS."""
+        if backend not in EXECUTION_BACKENDS:
+            raise ValueError(
+                f"unsupported backend {backend}, use one of {list(EXECUTION_BACKENDS)}"
+            )
+        channels_last, _ = EXECUTION_BACKENDS[backend]
+        memory_format = (
+            torch.channels_last if channels_last else torch.contiguous_format
+        )
+        self.model = self.model.to(memory_format=memory_format)
+        self.backend = backend
+
+    def _letterbox(self, img: torch.Tensor, target_size: Tuple[int, int]):
+        resized_image, _, _, _, _ = resize_for_padding(img, target_size)
+        return pad_image_to_target_size(resized_image, target_size)
+
+    def _record_padding_metrics(self, sizes, groups):
+        target_pixels = self.input_shape[0] * self.input_shape[1]
+        baseline_pixels = len(sizes) * target_pixels
+        baseline_padding, bucketed_padding = 0.0, 0.0
+        for target_size, indices in groups.items():
+            bucket_pixels = target_size[0] * target_size[1]
+            for i in indices:
+                height, width = sizes[i]
+                baseline_padding += target_pixels * (
+                    1 - letterbox_fill_fraction(height, width, self.input_shape)
+                )
+                bucketed_padding += bucket_pixels * (
+                    1 - letterbox_fill_fraction(height, width, target_size)
+                )
+        self.metrics.observe(
+            "padding_fraction_saved",
+            (baseline_padding - bucketed_padding) / baseline_pixels,
+        )
+        self.metrics.observe("padding_fraction", bucketed_padding / baseline_pixels)
 
 
 def load_checkpoint(fpath):
@@ -150,6 +382,15 @@ def load_checkpoint(fpath):
     if not osp.exists(fpath):
         raise FileNotFoundError('File is not found at "{}"'.format(fpath))
     map_location = None if torch.cuda.is_available() else "cpu"
+    if zipfile.is_zipfile(fpath):
+        # files saved by torch >= 1.6 can be memory-mapped: tensors are paged
+        # in from the file on first use instead of read and copied up front
+        try:
+            return torch.load(
+                fpath, map_location=map_location, mmap=True, weights_only=True
+            )
+        except Exception:  # pylint: disable=broad-exception-caught
+            LOGGER.debug(f"cannot memory-map {fpath}, loading it fully")
     try:
         checkpoint = torch.load(fpath, map_location=map_location)
     except UnicodeDecodeError:
@@ -183,20 +424,28 @@ def load_pretrained_weights(model, weight_path):
         state_dict = checkpoint["state_dict"]
     else:
         state_dict = checkpoint
+    # drop the rest of the checkpoint (e.g. optimizer state) right away
+    del checkpoint
 
-    model_dict = model.state_dict()
+    model_shapes = {k: v.size() for k, v in model.state_dict().items()}
     new_state_dict = OrderedDict()
     matched_layers, discarded_layers = [], []
 
-    for k, v in state_dict.items():
+    # pop the tensors as they are matched, so discarded ones (e.g. the
+    # classifier) are released instead of living as long as the checkpoint
+    for k in list(state_dict):
+        v = state_dict.pop(k)
         if k.startswith("module."):
             k = k[7:]  # discard module.
 
-        if k in model_dict and model_dict[k].size() == v.size():
+        if model_shapes.get(k, None) == v.size():
             new_state_dict[k] = v
             matched_layers.append(k)
         else:
             discarded_layers.append(k)
+        del v
 
-    model_dict.update(new_state_dict)
-    model.load_state_dict(model_dict)
+    # use the checkpoint tensors as parameters instead of copying them, so
+    # memory-mapped weights stay backed by the file; layers missing from the
+    # checkpoint keep their initialization
+    model.load_state_dict(new_state_dict, strict=False, assign=True)
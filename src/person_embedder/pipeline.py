@@ -0,0 +1,206 @@
+import asyncio
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+from numpy.typing import NDArray
+from viam.components.camera import Camera
+from viam.logging import getLogger
+from viam.media.utils.pil import viam_to_pil_image
+from viam.media.video import CameraMimeType, ViamImage
+from viam.proto.service.vision import Detection
+from viam.services.vision import Vision
+
+from src.person_embedder.metrics import ServiceMetrics
+
+LOGGER = getLogger(__name__)
+
+
+class PipelineResult:
+    """Detections and embeddings of one processed frame."""
+
+    def __init__(
+        self,
+        frame_id: int,
+        captured_at: float,
+        detections: List[Detection],
+        outputs: Dict[str, NDArray],
+    ):
+        self.frame_id = frame_id
+        self.captured_at = captured_at
+        self.detections = detections
+        self.outputs = outputs
+
+    def to_dict(self) -> Dict[str, Any]:
+        res = {
+            "frame_id": self.frame_id,
+            "captured_at": self.captured_at,
+            "detections": [
+                {
+                    "x_min": d.x_min,
+                    "y_min": d.y_min,
+                    "x_max": d.x_max,
+                    "y_max": d.y_max,
+                    "confidence": d.confidence,
+                    "class_name": d.class_name,
+                }
+                for d in self.detections
+            ],
+        }
+        for name, value in self.outputs.items():
+            res[name] = value.tolist()
+        return res
+
+
+class EmbeddingPipeline:
+    """
+    Runs get-image -> detect -> crop + embed as three overlapped asyncio stages.
+
+    Stages are connected by bounded queues. When a downstream stage falls
+    behind, the oldest queued frame is dropped so the pipeline always works on
+    the freshest frame instead of building up latency. The embed stage runs
+    `embed_fn` on a worker thread so capture and detection keep going during
+    the forward pass. The output of the last processed frame is kept in
+    `latest`.
+    """
+
+    def __init__(
+        self,
+        camera: Camera,
+        detector: Vision,
+        embed_fn: Callable[[Dict[str, NDArray]], Dict[str, NDArray]],
+        queue_size: int = 2,
+        labels: Optional[Sequence[str]] = None,
+        min_confidence: float = 0.0,
+        max_fps: float = 10.0,
+        metrics: Optional[ServiceMetrics] = None,
+    ):
+        """
+        :param embed_fn: called with {"input": (C, H, W) or encoded frame, "boxes": (N, 4)} and
+            returns the infer outputs for the boxes.
+        :param labels: detection class names to embed, all when empty or None.
+        :param max_fps: cap on the capture rate, 0 for no cap.
+        """
+        self.camera = camera
+        self.detector = detector
+        self.embed_fn = embed_fn
+        self.labels = set(labels) if labels else None
+        self.min_confidence = min_confidence
+        self.max_fps = max_fps
+        self.metrics = metrics
+        self.frames: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.detections: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.latest: Optional[PipelineResult] = None
+        self._tasks: List[asyncio.Task] = []
+        self._frame_count = 0
+
+    def start(self):
+        """Start the stages on the running event loop."""
+        if self._tasks:
+            return
+        self._tasks = [
+            asyncio.ensure_future(self._capture()),
+            asyncio.ensure_future(self._detect()),
+            asyncio.ensure_future(self._embed()),
+        ]
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    @property
+    def running(self) -> bool:
+        return any(not task.done() for task in self._tasks)
+
+    async def _capture(self):
+        min_interval = 1 / self.max_fps if self.max_fps > 0 else 0
+        while True:
+            started = time.monotonic()
+            try:
+                image = await self.camera.get_image(mime_type=CameraMimeType.JPEG)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                LOGGER.warning(f"pipeline failed to get image: {e}")
+                self._increment("pipeline_capture_errors")
+                await asyncio.sleep(max(min_interval, 0.1))
+                continue
+            self._frame_count += 1
+            self._put_latest(self.frames, (self._frame_count, time.time(), image))
+            self._increment("pipeline_frames_captured")
+            await asyncio.sleep(max(0, min_interval - (time.monotonic() - started)))
+
+    async def _detect(self):
+        while True:
+            frame_id, captured_at, image = await self.frames.get()
+            try:
+                detections = await self.detector.get_detections(image)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                LOGGER.warning(f"pipeline failed to get detections: {e}")
+                self._increment("pipeline_detection_errors")
+                continue
+            detections = [
+                d
+                for d in detections
+                if (self.labels is None or d.class_name in self.labels)
+                and d.confidence >= self.min_confidence
+            ]
+            self._put_latest(
+                self.detections, (frame_id, captured_at, image, detections)
+            )
+
+    async def _embed(self):
+        while True:
+            frame_id, captured_at, image, detections = await self.detections.get()
+            started = time.monotonic()
+            try:
+                outputs = {}
+                if detections:
+                    outputs = await asyncio.to_thread(
+                        self._embed_frame, image, detections
+                    )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                LOGGER.warning(f"pipeline failed to embed frame {frame_id}: {e}")
+                self._increment("pipeline_embed_errors")
+                continue
+            self.latest = PipelineResult(frame_id, captured_at, detections, outputs)
+            self._increment("pipeline_frames_embedded")
+            if self.metrics is not None:
+                self.metrics.observe(
+                    "pipeline_embed_latency_ms", (time.monotonic() - started) * 1000
+                )
+                self.metrics.observe(
+                    "pipeline_frame_age_ms", (time.time() - captured_at) * 1000
+                )
+
+    def _embed_frame(
+        self, image: ViamImage, detections: List[Detection]
+    ) -> Dict[str, NDArray]:
+        boxes = np.array(
+            [[d.x_min, d.y_min, d.x_max, d.y_max] for d in detections],
+            dtype=np.float32,
+        )
+        if image.mime_type in (CameraMimeType.JPEG, CameraMimeType.PNG):
+            # let the embedder decode only at the resolution the crops need
+            frame = np.frombuffer(image.data, dtype=np.uint8)
+        else:
+            frame = np.asarray(
+                viam_to_pil_image(image).convert("RGB"), dtype=np.float32
+            ).transpose(2, 0, 1)
+        return self.embed_fn({"input": frame, "boxes": boxes})
+
+    def _put_latest(self, queue: asyncio.Queue, item):
+        """Enqueue `item`, dropping the oldest queued item when the queue is full."""
+        if queue.full():
+            queue.get_nowait()
+            self._increment("pipeline_frames_dropped")
+        queue.put_nowait(item)
+
+    def _increment(self, name: str):
+        if self.metrics is not None:
+            self.metrics.increment(name)
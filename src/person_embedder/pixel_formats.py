@@ -0,0 +1,249 @@
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from numpy.typing import NDArray
+from torchvision.ops import roi_align
+
+PIXEL_FORMATS = ("rgb", "bgr", "nv12", "yuv420")
+
+# BT.601 limited range YUV -> RGB, applied as rgb = YUV_TO_RGB @ yuv + YUV_TO_RGB_OFFSET
+YUV_TO_RGB = torch.tensor(
+    [
+        [1.164, 0.0, 1.596],
+        [1.164, -0.392, -0.813],
+        [1.164, 2.017, 0.0],
+    ]
+)
+YUV_TO_RGB_OFFSET = -YUV_TO_RGB @ torch.tensor([16.0, 128.0, 128.0])
+
+
+def raw_frame_size(frame: NDArray, pixel_format: str) -> Tuple[int, int]:
+    """
+    (height, width) of a raw frame.
+
+    bgr frames are (H, W, 3) uint8; nv12 and yuv420 (I420) frames are
+    (H * 3 / 2, W) uint8 with the Y plane on top of the chroma planes.
+    """
+    if pixel_format == "bgr":
+        if frame.ndim != 3 or frame.shape[2] != 3:
+            raise ValueError(f"bgr frames must be (H, W, 3), got {frame.shape}")
+        return frame.shape[0], frame.shape[1]
+    if pixel_format in ("nv12", "yuv420"):
+        if frame.ndim != 2 or frame.shape[0] % 3 != 0 or frame.shape[1] % 2 != 0:
+            raise ValueError(
+                f"{pixel_format} frames must be (H * 3 / 2, W) with even H and W, got {frame.shape}"
+            )
+        return frame.shape[0] * 2 // 3, frame.shape[1]
+    raise ValueError(
+        f"unsupported pixel_format {pixel_format}, use one of {PIXEL_FORMATS}"
+    )
+
+
+def yuv_planes(frame: NDArray, pixel_format: str) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Split a nv12/yuv420 frame into its planes without copying.
+
+    :return: (y, uv): (H, W) and (2, H / 2, W / 2) uint8 tensors.
+    """
+    height, width = raw_frame_size(frame, pixel_format)
+    data = torch.from_numpy(np.ascontiguousarray(frame))
+    y = data[:height]
+    chroma = data[height:]
+    if pixel_format == "nv12":
+        # interleaved U, V pairs
+        uv = chroma.reshape(height // 2, width // 2, 2).permute(2, 0, 1)
+    else:
+        uv = chroma.reshape(2, height // 2, width // 2)
+    return y, uv
+
+
+def yuv_to_rgb(yuv: torch.Tensor) -> torch.Tensor:
+    """Convert (N, 3, H, W) float YUV to clamped 0-255 RGB."""
+    rgb = torch.einsum(
+        "ij,njhw->nihw", YUV_TO_RGB.to(yuv.device), yuv
+    ) + YUV_TO_RGB_OFFSET.to(yuv.device).view(1, 3, 1, 1)
+    return rgb.clamp_(0, 255)
+
+
+class RawFrameCrops:
+    """
+    Crops of a raw bgr/nv12/yuv420 frame, converted to RGB only when needed.
+
+    Indexing converts just the pixels inside one box, which is what crop-level
+    stages such as the quality gate need. `letterbox` is the fast path for the
+    model input: it samples every box straight from the raw planes with a
+    single roi_align, then converts color and normalizes the sampled batch, so
+    color is never converted outside the boxes nor at full crop resolution.
+    """
+
+    def __init__(
+        self,
+        frame: NDArray,
+        pixel_format: str,
+        boxes: Optional[NDArray] = None,
+        device: Optional[torch.device] = None,
+    ):
+        self.frame = frame
+        self.pixel_format = pixel_format
+        self.frame_size = raw_frame_size(frame, pixel_format)
+        self.device = device
+        height, width = self.frame_size
+        if boxes is None:
+            boxes = np.array([[0, 0, width, height]])
+        # same integer clipping as crop_boxes
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4).astype(int)
+        boxes[:, [0, 2]] = np.clip(boxes[:, [0, 2]], 0, width)
+        boxes[:, [1, 3]] = np.clip(boxes[:, [1, 3]], 0, height)
+        for box in boxes:
+            if box[2] <= box[0] or box[3] <= box[1]:
+                raise ValueError(f"Invalid crop region: {list(box)}")
+        self.boxes = boxes
+
+    def __len__(self) -> int:
+        return len(self.boxes)
+
+    def sizes(self) -> List[Tuple[int, int]]:
+        return [(y2 - y1, x2 - x1) for x1, y1, x2, y2 in self.boxes]
+
+    def subset(self, indices: Sequence[int]) -> "RawFrameCrops":
+        res = RawFrameCrops.__new__(RawFrameCrops)
+        res.frame = self.frame
+        res.pixel_format = self.pixel_format
+        res.frame_size = self.frame_size
+        res.device = self.device
+        res.boxes = self.boxes[np.asarray(indices, dtype=int)]
+        return res
+
+    def __getitem__(self, i: int) -> torch.Tensor:
+        """(3, h, w) float32 RGB crop of box i."""
+        x1, y1, x2, y2 = self.boxes[i]
+        if self.pixel_format == "bgr":
+            crop = torch.from_numpy(self.frame[y1:y2, x1:x2, ::-1].copy())
+            return self._to_device(crop.permute(2, 0, 1).float())
+        y, uv = yuv_planes(self.frame, self.pixel_format)
+        # chroma region covering the box plus one sample of margin so the
+        # upsampling does not clamp at the box border
+        chroma_height, chroma_width = uv.shape[1:]
+        cx1, cy1 = max(x1 // 2 - 1, 0), max(y1 // 2 - 1, 0)
+        cx2 = min((x2 + 1) // 2 + 1, chroma_width)
+        cy2 = min((y2 + 1) // 2 + 1, chroma_height)
+        uv_crop = F.interpolate(
+            uv[:, cy1:cy2, cx1:cx2].float().unsqueeze(0),
+            scale_factor=2,
+            mode="bilinear",
+            align_corners=False,
+        )
+        uv_crop = uv_crop[
+            :, :, y1 - 2 * cy1 : y2 - 2 * cy1, x1 - 2 * cx1 : x2 - 2 * cx1
+        ]
+        yuv = torch.cat(
+            [y[y1:y2, x1:x2].float().view(1, 1, y2 - y1, x2 - x1), uv_crop], 1
+        )
+        return self._to_device(yuv_to_rgb(yuv)[0])
+
+    def letterbox(
+        self,
+        indices: Sequence[int],
+        target_size: Tuple[int, int],
+        pixel_mean: torch.Tensor,
+        pixel_std: torch.Tensor,
+    ) -> torch.Tensor:
+        """
+        Crop, resize, convert, pad and normalize the selected boxes in one pass.
+
+        Matches letterboxing `self[i]` with resize_for_padding and
+        pad_image_to_target_size followed by normalization.
+
+        :return: (len(indices), 3, target_height, target_width) model input.
+        """
+        target_height, target_width = target_size
+        boxes = self.boxes[np.asarray(indices, dtype=int)].astype(np.float64)
+        heights = boxes[:, 3] - boxes[:, 1]
+        widths = boxes[:, 2] - boxes[:, 0]
+        scales = np.minimum(target_height / heights, target_width / widths)
+        new_heights = (heights * scales).astype(int)
+        new_widths = (widths * scales).astype(int)
+        pad_tops = (target_height - new_heights) // 2
+        pad_lefts = (target_width - new_widths) // 2
+        # extend every box so one roi_align bin maps to one resized pixel and
+        # the padding lands outside the box
+        bin_heights = heights / new_heights
+        bin_widths = widths / new_widths
+        x1 = boxes[:, 0] - pad_lefts * bin_widths
+        y1 = boxes[:, 1] - pad_tops * bin_heights
+        rois = np.stack(
+            [
+                np.zeros(len(boxes)),
+                x1,
+                y1,
+                x1 + target_width * bin_widths,
+                y1 + target_height * bin_heights,
+            ],
+            axis=1,
+        )
+        # only convert and move the region the boxes sample from: the
+        # samples inside a box read at most one pixel past it, two chroma
+        # pixels with 4:2:0, and the padding samples are masked below. The
+        # region starts on even coordinates so it maps onto the chroma planes.
+        frame_height, frame_width = self.frame_size
+        region_x1 = max((int(boxes[:, 0].min()) // 2 - 1) * 2, 0)
+        region_y1 = max((int(boxes[:, 1].min()) // 2 - 1) * 2, 0)
+        region_x2 = min((int(boxes[:, 2].max() + 1) // 2 + 1) * 2, frame_width)
+        region_y2 = min((int(boxes[:, 3].max() + 1) // 2 + 1) * 2, frame_height)
+        rois[:, [1, 3]] -= region_x1
+        rois[:, [2, 4]] -= region_y1
+        device = self.device if self.device is not None else torch.device("cpu")
+        rois = torch.from_numpy(rois).float().to(device)
+
+        if self.pixel_format == "bgr":
+            planes = self.frame[region_y1:region_y2, region_x1:region_x2]
+            planes = torch.from_numpy(np.ascontiguousarray(planes)).to(device)
+            planes = planes.permute(2, 0, 1).unsqueeze(0).float()
+            rgb = roi_align(
+                planes, rois, (target_height, target_width), 1.0, 1, aligned=True
+            ).flip(1)
+        else:
+            y, uv = yuv_planes(self.frame, self.pixel_format)
+            y = y[region_y1:region_y2, region_x1:region_x2]
+            uv = uv[:, region_y1 // 2 : region_y2 // 2, region_x1 // 2 : region_x2 // 2]
+            y = roi_align(
+                y.to(device).float()[None, None],
+                rois,
+                (target_height, target_width),
+                1.0,
+                1,
+                aligned=True,
+            )
+            uv = roi_align(
+                uv.to(device).float().unsqueeze(0),
+                rois,
+                (target_height, target_width),
+                0.5,
+                1,
+                aligned=True,
+            )
+            rgb = yuv_to_rgb(torch.cat([y, uv], dim=1))
+
+        mean = pixel_mean.to(device).view(1, 3, 1, 1)
+        std = pixel_std.to(device).view(1, 3, 1, 1)
+        normalized = (rgb - mean) / std
+        rows = torch.arange(target_height, device=device).view(1, -1)
+        cols = torch.arange(target_width, device=device).view(1, -1)
+        pad_tops = torch.from_numpy(pad_tops).to(device).view(-1, 1)
+        pad_lefts = torch.from_numpy(pad_lefts).to(device).view(-1, 1)
+        inside_rows = (rows >= pad_tops) & (
+            rows < pad_tops + torch.from_numpy(new_heights).to(device).view(-1, 1)
+        )
+        inside_cols = (cols >= pad_lefts) & (
+            cols < pad_lefts + torch.from_numpy(new_widths).to(device).view(-1, 1)
+        )
+        inside = inside_rows.unsqueeze(2) & inside_cols.unsqueeze(1)
+        # zero padding before normalization, like pad_image_to_target_size
+        return torch.where(inside.unsqueeze(1), normalized, -mean / std)
+
+    def _to_device(self, tensor: torch.Tensor) -> torch.Tensor:
+        if self.device is not None:
+            return tensor.to(self.device)
+        return tensor
@@ -0,0 +1,140 @@
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from src.person_embedder.pixel_formats import RawFrameCrops
+
+# grayscale size crops are resampled to before measuring sharpness, so every
+# crop of a batch goes through a single convolution
+SHARPNESS_INPUT_SHAPE = (128, 64)
+
+LAPLACIAN_KERNEL = torch.tensor(
+    [[0.0, 1.0, 0.0], [1.0, -4.0, 1.0], [0.0, 1.0, 0.0]]
+).view(1, 1, 3, 3)
+
+RGB_TO_GRAY = torch.tensor([0.299, 0.587, 0.114]).view(1, 3, 1, 1)
+
+
+class CropQualityGate:
+    """
+    Scores crops before they reach the model and flags the ones not worth embedding.
+
+    A crop is rejected when it is smaller than `min_height` x `min_width`, when
+    its height / width ratio falls outside [`min_aspect_ratio`,
+    `max_aspect_ratio`], when the variance of its Laplacian (on 0-255
+    grayscale) is under `min_sharpness`, or, with `reject_truncated`, when its
+    box touches the frame border. Crops whose box touches the border are
+    otherwise kept but scored down.
+    """
+
+    def __init__(
+        self,
+        min_height: int = 40,
+        min_width: int = 16,
+        min_aspect_ratio: float = 0.8,
+        max_aspect_ratio: float = 5.0,
+        min_sharpness: float = 10.0,
+        reject_truncated: bool = False,
+        truncation_margin: int = 2,
+    ):
+        self.min_height = min_height
+        self.min_width = min_width
+        self.min_aspect_ratio = min_aspect_ratio
+        self.max_aspect_ratio = max_aspect_ratio
+        self.min_sharpness = min_sharpness
+        self.reject_truncated = reject_truncated
+        self.truncation_margin = truncation_margin
+
+    def score(
+        self,
+        crops: Union[List[torch.Tensor], RawFrameCrops],
+        boxes: Optional[np.ndarray] = None,
+        frame_size: Optional[Sequence[int]] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Score a batch of crops.
+
+        :param crops: list of (C, H, W) float32 tensors with 0-255 values, or
+            the crops of a raw camera frame.
+        :param boxes: optional (N, 4) x1, y1, x2, y2 boxes the crops were cut from.
+        :param frame_size: (height, width) of the frame `boxes` refer to.
+        :return: (quality, valid): (N,) float32 scores in [0, 1] and (N,) bool mask.
+        """
+        if len(crops) == 0:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=bool)
+        if isinstance(crops, RawFrameCrops):
+            sizes = np.array(crops.sizes(), dtype=np.float64)
+        else:
+            sizes = np.array([crop.shape[1:] for crop in crops], dtype=np.float64)
+        heights, widths = sizes[:, 0], sizes[:, 1]
+        aspect_ratios = heights / widths
+        sharpness = self.sharpness(crops)
+        truncated = np.zeros(len(crops), dtype=bool)
+        if boxes is not None and frame_size is not None:
+            truncated = self.truncated(np.asarray(boxes).reshape(-1, 4), frame_size)
+
+        valid = (
+            (heights >= self.min_height)
+            & (widths >= self.min_width)
+            & (aspect_ratios >= self.min_aspect_ratio)
+            & (aspect_ratios <= self.max_aspect_ratio)
+            & (sharpness >= self.min_sharpness)
+        )
+        if self.reject_truncated:
+            valid &= ~truncated
+
+        size_score = np.clip(
+            np.minimum(heights / (2 * self.min_height), widths / (2 * self.min_width)),
+            0,
+            1,
+        )
+        aspect_score = np.clip(
+            np.minimum(
+                aspect_ratios / self.min_aspect_ratio,
+                self.max_aspect_ratio / aspect_ratios,
+            ),
+            0,
+            1,
+        )
+        sharpness_score = sharpness / (sharpness + max(self.min_sharpness, 1e-6))
+        quality = (
+            size_score * aspect_score * sharpness_score * np.where(truncated, 0.5, 1.0)
+        )
+        return quality.astype(np.float32), valid
+
+    @staticmethod
+    def sharpness(crops: Union[List[torch.Tensor], RawFrameCrops]) -> np.ndarray:
+        """
+        Variance of the Laplacian of each crop, measured at SHARPNESS_INPUT_SHAPE.
+        """
+        if len(crops) == 0:
+            return np.zeros(0, dtype=np.float64)
+        resized = torch.cat(
+            [
+                F.interpolate(
+                    crop.unsqueeze(0),
+                    size=SHARPNESS_INPUT_SHAPE,
+                    mode="bilinear",
+                    align_corners=False,
+                )
+                for crop in crops
+            ]
+        )
+        gray = (resized * RGB_TO_GRAY.to(resized.device)).sum(dim=1, keepdim=True)
+        laplacian = F.conv2d(gray, LAPLACIAN_KERNEL.to(resized.device))
+        return laplacian.flatten(1).var(dim=1).cpu().numpy().astype(np.float64)
+
+    def truncated(self, boxes: np.ndarray, frame_size: Sequence[int]) -> np.ndarray:
+        """
+        Flag boxes that touch the frame border, i.e. persons likely cut off.
+        """
+        frame_height, frame_width = frame_size
+        margin = self.truncation_margin
+        return (
+            (boxes[:, 0] <= margin)
+            | (boxes[:, 1] <= margin)
+            | (boxes[:, 2] >= frame_width - margin)
+            | (boxes[:, 3] >= frame_height - margin)
+        )
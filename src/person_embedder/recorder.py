@@ -0,0 +1,197 @@
+import io
+import json
+import queue
+import random
+import struct
+import threading
+import time
+import zlib
+from typing import Dict, Iterator, Mapping, Optional, Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+from PIL import Image
+from viam.logging import getLogger
+
+from src.person_embedder.metrics import ServiceMetrics
+
+LOGGER = getLogger(__name__)
+
+# every record is a little-endian uint32 header length, a JSON header, then
+# the encoded tensors back to back in header order
+HEADER_LENGTH = struct.Struct("<I")
+
+
+def encode_tensor(array: NDArray, jpeg_quality: int = 90) -> Tuple[str, bytes]:
+    """
+    Compress one infer input tensor.
+
+    Float (C, H, W) and (B, C, H, W) RGB images with 0-255 values are stored
+    as one JPEG per image; anything else (encoded bytes, raw frames, boxes,
+    ids) is stored losslessly with zlib.
+
+    :return: (codec, data).
+    """
+    is_image = (
+        array.dtype == np.float32
+        and array.ndim in (3, 4)
+        and array.shape[-3] == 3
+        and array.size > 0
+    )
+    if not is_image:
+        return "zlib", zlib.compress(np.ascontiguousarray(array).tobytes(), 1)
+    images = array.reshape(-1, *array.shape[-3:])
+    chunks = []
+    for image in images:
+        buffer = io.BytesIO()
+        pixels = np.clip(image, 0, 255).round().astype(np.uint8).transpose(1, 2, 0)
+        Image.fromarray(pixels).save(buffer, format="JPEG", quality=jpeg_quality)
+        chunks.append(HEADER_LENGTH.pack(buffer.tell()) + buffer.getvalue())
+    return "jpeg", b"".join(chunks)
+
+
+def decode_tensor(codec: str, data: bytes, dtype: str, shape) -> NDArray:
+    if codec == "zlib":
+        array = np.frombuffer(zlib.decompress(data), dtype=dtype)
+        return array.reshape(shape).copy()
+    if codec != "jpeg":
+        raise ValueError(f"unknown codec {codec}")
+    images = []
+    offset = 0
+    while offset < len(data):
+        (length,) = HEADER_LENGTH.unpack_from(data, offset)
+        offset += HEADER_LENGTH.size
+        image = Image.open(io.BytesIO(data[offset : offset + length])).convert("RGB")
+        images.append(np.asarray(image, dtype=np.float32).transpose(2, 0, 1))
+        offset += length
+    return np.stack(images).reshape(shape)
+
+
+class TrafficRecorder:
+    """
+    Samples infer() requests to an append-only file for later replay.
+
+    Each sampled request is stored with its arrival time, tensor shapes and
+    dtypes and its `extra` options, with the tensors compressed by
+    `encode_tensor`. `record` only copies the inputs into a bounded queue;
+    compression and writes happen on a background thread, and requests are
+    dropped instead of slowing infer down when the writer falls behind.
+    Recording stops once the file reaches `max_mb`.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        sample_rate: float = 1.0,
+        max_mb: float = 100.0,
+        jpeg_quality: int = 90,
+        queue_size: int = 64,
+        metrics: Optional[ServiceMetrics] = None,
+    ):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.jpeg_quality = jpeg_quality
+        self.metrics = metrics
+        self.file = open(path, "ab")  # pylint: disable=consider-using-with
+        self.bytes_written = self.file.tell()
+        self.full = self.bytes_written >= self.max_bytes
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(
+            target=self._write_loop, name="recorder", daemon=True
+        )
+        self._thread.start()
+
+    def record(
+        self,
+        input_tensors: Mapping[str, NDArray],
+        extra: Optional[Mapping] = None,
+    ):
+        if self.full or random.random() >= self.sample_rate:
+            return
+        item = (
+            time.time(),
+            {name: np.array(value) for name, value in input_tensors.items()},
+            dict(extra or {}),
+        )
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self._increment("recorder_dropped")
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            try:
+                self._write(*item)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                LOGGER.warning(f"failed to record request: {e}")
+                self._increment("recorder_errors")
+
+    def _write(self, arrived_at: float, input_tensors: Dict[str, NDArray], extra):
+        if self.full:
+            return
+        header = {"arrived_at": arrived_at, "extra": extra, "tensors": []}
+        payloads = []
+        for name, array in input_tensors.items():
+            codec, data = encode_tensor(array, self.jpeg_quality)
+            header["tensors"].append(
+                {
+                    "name": name,
+                    "dtype": array.dtype.str,
+                    "shape": list(array.shape),
+                    "codec": codec,
+                    "length": len(data),
+                }
+            )
+            payloads.append(data)
+        header_bytes = json.dumps(header).encode()
+        size = HEADER_LENGTH.size + len(header_bytes) + sum(map(len, payloads))
+        if self.bytes_written + size > self.max_bytes:
+            self.full = True
+            LOGGER.info(
+                f"traffic recording reached its size cap, stopping: {self.path}"
+            )
+            return
+        self.file.write(HEADER_LENGTH.pack(len(header_bytes)) + header_bytes)
+        for data in payloads:
+            self.file.write(data)
+        self.file.flush()
+        self.bytes_written += size
+        self._increment("recorder_requests")
+
+    def _increment(self, name: str):
+        if self.metrics is not None:
+            self.metrics.increment(name)
+
+    def close(self):
+        """Write the queued requests and close the file."""
+        self._queue.put(None)
+        self._thread.join()
+        self.file.close()
+
+
+def read_traffic(path: str) -> Iterator[Tuple[float, Dict[str, NDArray], Dict]]:
+    """
+    Read a file written by TrafficRecorder.
+
+    :return: iterator of (arrived_at, input_tensors, extra) in recording order.
+    """
+    with open(path, "rb") as f:
+        while True:
+            prefix = f.read(HEADER_LENGTH.size)
+            if len(prefix) < HEADER_LENGTH.size:
+                return
+            (length,) = HEADER_LENGTH.unpack(prefix)
+            header = json.loads(f.read(length))
+            input_tensors = {}
+            for tensor in header["tensors"]:
+                input_tensors[tensor["name"]] = decode_tensor(
+                    tensor["codec"],
+                    f.read(tensor["length"]),
+                    tensor["dtype"],
+                    tensor["shape"],
+                )
+            yield header["arrived_at"], input_tensors, header["extra"]
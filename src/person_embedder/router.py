@@ -0,0 +1,259 @@
+import asyncio
+import bisect
+import hashlib
+import time
+from typing import Dict, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+from grpclib import GRPCError, Status
+from grpclib.exceptions import StreamTerminatedError
+from numpy.typing import NDArray
+from viam.utils import ValueTypes
+
+from src.person_embedder.admission import count_crops
+
+# inputs with one row per crop, split along with the crops
+PER_CROP_INPUTS = ("boxes", "track_ids", "gallery_ids", "weights")
+# infer outputs with one row per crop, put back in crop order after a split;
+# head outputs are per crop too, but named by the config
+PER_CROP_OUTPUTS = (
+    "embedding",
+    "embedding_small",
+    "embedding_code",
+    "quality",
+    "valid",
+    "recomputed",
+    "match",
+    "similarity",
+    "margin",
+    "escalated",
+    "gallery_identity",
+    "gallery_similarity",
+)
+# statuses of an instance that is down rather than of a bad request
+FAILOVER_STATUSES = (
+    Status.UNAVAILABLE,
+    Status.DEADLINE_EXCEEDED,
+    Status.CANCELLED,
+    Status.INTERNAL,
+)
+
+
+def hash_key(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Consistent hashing of keys to instances.
+
+    Every instance owns `virtual_nodes` points of a 64-bit ring, and a key
+    belongs to the first point after its hash. Adding or removing an
+    instance only moves the keys of its own points, so the other instances
+    keep their keys and whatever they cached about them.
+    """
+
+    def __init__(self, names: Sequence[str] = (), virtual_nodes: int = 64):
+        self.virtual_nodes = virtual_nodes
+        self._points: List[Tuple[int, str]] = []
+        self._names: List[str] = []
+        for name in names:
+            self.add(name)
+
+    @property
+    def names(self) -> List[str]:
+        return list(self._names)
+
+    def add(self, name: str):
+        if name in self._names:
+            return
+        self._names.append(name)
+        for node in range(self.virtual_nodes):
+            bisect.insort(self._points, (hash_key(f"{name}#{node}"), name))
+
+    def remove(self, name: str):
+        if name not in self._names:
+            return
+        self._names.remove(name)
+        self._points = [point for point in self._points if point[1] != name]
+
+    def owners(self, key: str) -> Iterator[str]:
+        """Every instance, in the order `key` falls back through them."""
+        if not self._points:
+            return
+        start = bisect.bisect(self._points, (hash_key(key), ""))
+        seen = set()
+        for index in range(len(self._points)):
+            name = self._points[(start + index) % len(self._points)][1]
+            if name not in seen:
+                seen.add(name)
+                yield name
+                if len(seen) == len(self._names):
+                    return
+
+    def owner(self, key: str, healthy: Optional[Mapping[str, bool]] = None) -> str:
+        """The first instance of `key` that is healthy, or the first one."""
+        fallback = None
+        for name in self.owners(key):
+            if healthy is None or healthy.get(name, False):
+                return name
+            if fallback is None:
+                fallback = name
+        if fallback is None:
+            raise ValueError("the ring has no instances")
+        return fallback
+
+
+class Instance:
+    """An embedder behind the router and its health."""
+
+    def __init__(self, name: str, client, unhealthy_after: int = 2):
+        """
+        :param client: the MLModel (or client to one) that serves requests.
+        :param unhealthy_after: consecutive failed health checks before the
+            instance is taken out of the ring.
+        """
+        self.name = name
+        self.client = client
+        self.unhealthy_after = unhealthy_after
+        self.healthy = True
+        self.in_flight = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.last_check: Optional[float] = None
+        self.metrics: Dict[str, float] = {}
+
+    def succeeded(self, metrics: Optional[Dict[str, float]] = None):
+        self.healthy = True
+        self.failures = 0
+        self.last_check = time.monotonic()
+        if metrics is not None:
+            self.metrics = metrics
+
+    def failed(self, error: BaseException, immediately: bool = False):
+        self.failures += 1
+        self.last_error = f"{type(error).__name__}: {error}"
+        self.last_check = time.monotonic()
+        if immediately or self.failures >= self.unhealthy_after:
+            self.healthy = False
+
+    def stats(self) -> Dict[str, ValueTypes]:
+        return {
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "failures": self.failures,
+            "last_error": self.last_error or "",
+        }
+
+
+def is_instance_failure(error: BaseException) -> bool:
+    """Whether `error` means the instance is down, so the request can fail over."""
+    if isinstance(error, GRPCError):
+        return error.status in FAILOVER_STATUSES
+    return isinstance(
+        error,
+        (ConnectionError, OSError, asyncio.TimeoutError, StreamTerminatedError),
+    )
+
+
+def crop_routing_keys(
+    input_tensors: Mapping[str, NDArray], extra: Mapping
+) -> Optional[List[str]]:
+    """
+    Routing key of every crop of a request, None to route by load.
+
+    Requests with a `camera_id` in extra go whole to the camera's instance.
+    Otherwise each crop with a track id goes to its track's instance, and
+    requests of a `caller_id` to the caller's.
+    """
+    if "camera_id" in extra:
+        return [f"camera {extra['camera_id']}"] * max(count_crops(input_tensors), 1)
+    if "track_ids" in input_tensors:
+        return [
+            f"track {track_id}"
+            for track_id in np.asarray(input_tensors["track_ids"]).reshape(-1).tolist()
+        ]
+    if "caller_id" in extra:
+        return [f"caller {extra['caller_id']}"] * max(count_crops(input_tensors), 1)
+    return None
+
+
+def split_request(
+    input_tensors: Mapping[str, NDArray], rows: Sequence[int]
+) -> Dict[str, NDArray]:
+    """The request for the crops at `rows` only."""
+    rows = np.asarray(rows, dtype=np.int64)
+    res = dict(input_tensors)
+    if "input_lengths" in input_tensors:
+        lengths = np.asarray(input_tensors["input_lengths"]).reshape(-1)
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        data = np.asarray(input_tensors["input"]).reshape(-1)
+        res["input"] = np.concatenate(
+            [data[starts[row] : starts[row] + lengths[row]] for row in rows]
+        )
+        res["input_lengths"] = lengths[rows]
+    elif "boxes" not in input_tensors:
+        res["input"] = np.asarray(input_tensors["input"])[rows]
+    for name in PER_CROP_INPUTS:
+        if name in input_tensors:
+            value = np.asarray(input_tensors[name])
+            res[name] = value.reshape((-1, 4) if name == "boxes" else (-1,))[rows]
+    return res
+
+
+def merge_outputs(
+    crops: int,
+    parts: Sequence[Tuple[Sequence[int], Dict[str, NDArray]]],
+    per_crop: Sequence[str] = PER_CROP_OUTPUTS,
+) -> Dict[str, NDArray]:
+    """
+    Put the outputs of split requests back in crop order.
+
+    The `per_crop` outputs are scattered to their part's rows; the others
+    are taken from the first part.
+    """
+    res: Dict[str, NDArray] = {}
+    for rows, outputs in parts:
+        for name, value in outputs.items():
+            value = np.asarray(value)
+            if name not in per_crop:
+                res.setdefault(name, value)
+                continue
+            if len(value) != len(rows):
+                raise ValueError(
+                    f"output {name} has {len(value)} rows for {len(rows)} crops"
+                )
+            if name not in res:
+                res[name] = np.zeros((crops,) + value.shape[1:], dtype=value.dtype)
+            res[name][np.asarray(rows, dtype=np.int64)] = value
+    return res
+
+
+def aggregate_metrics(metrics: Sequence[Mapping[str, float]]) -> Dict[str, float]:
+    """
+    Combine the metrics of several instances.
+
+    Counters and gauges are summed. Observations (`_last`, `_mean`) and
+    utilizations are averaged over the instances that report them, and
+    `_p95` takes the worst instance.
+    """
+    sums: Dict[str, float] = {}
+    counts: Dict[str, int] = {}
+    for instance_metrics in metrics:
+        for name, value in instance_metrics.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            if name.endswith("_p95"):
+                sums[name] = max(sums.get(name, value), value)
+                counts[name] = 1
+            else:
+                sums[name] = sums.get(name, 0) + value
+                counts[name] = counts.get(name, 0) + 1
+    return {
+        name: (
+            value / counts[name]
+            if name.endswith(("_last", "_mean", "_utilization"))
+            else value
+        )
+        for name, value in sums.items()
+    }
@@ -0,0 +1,193 @@
+import threading
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, Mapping, Optional, Sequence
+
+import numpy as np
+from numpy.typing import NDArray
+
+# tensors are placed on cache line boundaries
+ALIGNMENT = 64
+
+SHM_DTYPES = ("float32", "uint8")
+
+
+def align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """
+    Attach to a region created by another process.
+
+    Before Python 3.13 attaching also registers the region with this process'
+    resource tracker, which would unlink it when the service exits although
+    the caller owns it, so the registration is undone.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(
+            shm._name, "shared_memory"  # pylint: disable=protected-access
+        )
+        return shm
+
+
+def tensor_descriptor(offset: int, array: NDArray) -> Dict:
+    return {"offset": offset, "shape": list(array.shape), "dtype": array.dtype.name}
+
+
+class SharedMemoryRegions:
+    """
+    Service side of the shared-memory transport.
+
+    Attaches to the callers' regions by name, once, and exposes numpy views
+    of them, so inputs reach the embedder and outputs reach the caller
+    without serialization or copies.
+    """
+
+    def __init__(self):
+        self._regions: Dict[str, shared_memory.SharedMemory] = {}
+        self._lock = threading.Lock()
+
+    def region(self, name: str) -> shared_memory.SharedMemory:
+        with self._lock:
+            if name not in self._regions:
+                self._regions[name] = attach_shared_memory(name)
+            return self._regions[name]
+
+    def view(self, name: str, descriptor: Mapping) -> NDArray:
+        """Zero-copy numpy view of the tensor `descriptor` points to."""
+        dtype = descriptor.get("dtype", "float32")
+        if dtype not in SHM_DTYPES:
+            raise ValueError(f"unsupported shm dtype {dtype}, use one of {SHM_DTYPES}")
+        shape = tuple(int(v) for v in descriptor["shape"])
+        offset = int(descriptor["offset"])
+        shm = self.region(name)
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if offset < 0 or offset + nbytes > shm.size:
+            raise ValueError(
+                f"tensor at offset {offset} of {nbytes} bytes is outside {name} ({shm.size} bytes)"
+            )
+        return np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+
+    def write(
+        self, name: str, offset: int, size: int, outputs: Mapping[str, NDArray]
+    ) -> Dict[str, Dict]:
+        """
+        Write `outputs` back to back into the `size` bytes reserved at `offset`.
+
+        :return: descriptor of every output.
+        """
+        shm = self.region(name)
+        if offset < 0 or offset + size > shm.size:
+            raise ValueError(f"output region is outside {name} ({shm.size} bytes)")
+        end = offset + size
+        descriptors = {}
+        for output_name, value in outputs.items():
+            value = np.ascontiguousarray(value)
+            if value.nbytes and offset + value.nbytes > end:
+                raise ValueError(
+                    f"output region of {size} bytes is too small for {output_name}"
+                )
+            np.ndarray(value.shape, value.dtype, buffer=shm.buf, offset=offset)[...] = (
+                value
+            )
+            descriptors[output_name] = tensor_descriptor(offset, value)
+            offset = align(offset + value.nbytes)
+        return descriptors
+
+    def close(self):
+        with self._lock:
+            for shm in self._regions.values():
+                try:
+                    shm.close()
+                except BufferError:
+                    # a view is still referenced, the mapping goes with the process
+                    pass
+            self._regions = {}
+
+
+class SharedMemoryRing:
+    """
+    Caller side of the shared-memory transport: a ring buffer of tensors.
+
+    Tensors are allocated one after the other and the ring wraps to the start
+    when the end is reached, so the region must be large enough for all the
+    requests a caller has in flight at once.
+
+        ring = SharedMemoryRing(size_mb=64)
+        command = ring.shm_infer_command(crops)
+        res = await embedder.do_command(command)
+        embeddings = ring.read(res["shm_infer"]["embedding"])
+    """
+
+    def __init__(self, size_mb: float = 64, name: Optional[str] = None):
+        self.shm = shared_memory.SharedMemory(
+            name=name, create=True, size=int(size_mb * 1024 * 1024)
+        )
+        self.name = self.shm.name
+        self._head = 0
+
+    def allocate(self, nbytes: int) -> int:
+        if nbytes > self.shm.size:
+            raise ValueError(f"{nbytes} bytes do not fit in {self.shm.size} bytes")
+        offset = align(self._head)
+        if offset + nbytes > self.shm.size:
+            offset = 0
+        self._head = offset + nbytes
+        return offset
+
+    def write(self, array: NDArray) -> Dict:
+        """Copy `array` into the ring and return its descriptor."""
+        array = np.ascontiguousarray(array)
+        offset = self.allocate(array.nbytes)
+        np.ndarray(array.shape, array.dtype, buffer=self.shm.buf, offset=offset)[
+            ...
+        ] = array
+        return tensor_descriptor(offset, array)
+
+    def read(self, descriptor: Mapping) -> NDArray:
+        """Copy a tensor out of the ring, before the ring wraps over it."""
+        return np.ndarray(
+            tuple(descriptor["shape"]),
+            dtype=descriptor["dtype"],
+            buffer=self.shm.buf,
+            offset=descriptor["offset"],
+        ).copy()
+
+    def shm_infer_command(
+        self,
+        crops: NDArray,
+        boxes: Optional[Sequence[Sequence[float]]] = None,
+        output_size: Optional[int] = None,
+        feature_dim: int = 512,
+    ) -> Dict:
+        """
+        Write `crops` and build the shm_infer do_command.
+
+        :param crops: (C, H, W) crop or frame, or (B, C, H, W) crops, float32 or uint8.
+        :param boxes: optional (N, 4) boxes cutting crops out of a (C, H, W) frame.
+        :param output_size: bytes reserved for the outputs, room for the
+            embeddings plus the per-crop quality outputs by default.
+        """
+        input_descriptor = self.write(crops)
+        if output_size is None:
+            if boxes is not None:
+                count = len(boxes)
+            else:
+                count = crops.shape[0] if crops.ndim == 4 else 1
+            output_size = 4 * ALIGNMENT + count * (feature_dim * 4 + 8)
+        command = {
+            "name": self.name,
+            "input": input_descriptor,
+            "output": {"offset": self.allocate(output_size), "size": output_size},
+        }
+        if boxes is not None:
+            command["boxes"] = [list(map(float, box)) for box in boxes]
+        return {"shm_infer": command}
+
+    def close(self, unlink: bool = True):
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
@@ -0,0 +1,232 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+from src.person_embedder.metrics import ServiceMetrics
+
+# memory a track keeps besides its embedding: box, TrackState and dict entry
+TRACK_OVERHEAD_BYTES = 512
+
+
+def box_iou(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    """
+    Element-wise IoU between two (N, 4) arrays of x1, y1, x2, y2 boxes.
+    """
+    x1 = np.maximum(boxes_a[:, 0], boxes_b[:, 0])
+    y1 = np.maximum(boxes_a[:, 1], boxes_b[:, 1])
+    x2 = np.minimum(boxes_a[:, 2], boxes_b[:, 2])
+    y2 = np.minimum(boxes_a[:, 3], boxes_b[:, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    union = area_a + area_b - intersection
+    return np.where(union > 0, intersection / np.maximum(union, 1e-9), 0.0)
+
+
+class TrackState:
+    """Running embedding and the geometry it was last computed from."""
+
+    def __init__(self, embedding: np.ndarray, box: np.ndarray, now: float):
+        self.embedding = embedding
+        self.box = box
+        self.frames_since_compute = 0
+        self.computed_at = now
+        self.seen_at = now
+
+
+class TrackEmbeddingScheduler:
+    """
+    Decides per track whether a crop needs a fresh forward pass or whether the
+    track's EMA-smoothed embedding can be returned instead.
+
+    A track is re-embedded when any enabled policy fires: every
+    `refresh_interval_frames` frames, when the box area changed by more than
+    `max_scale_change` (relative), when the IoU with the box the embedding was
+    computed from falls under `min_iou`, or when the embedding is older than
+    `max_age_s`. Setting a policy to 0 disables it. Tracks not seen for `ttl_s`
+    seconds are evicted, and at most `max_tracks` tracks are kept (least
+    recently seen first out).
+
+    Tracks that `schedule` decided to reuse are pinned until `update` (or
+    `release`) runs, so requests in flight never lose the embedding they
+    were promised; pinned tracks may briefly exceed `max_tracks`.
+    """
+
+    def __init__(
+        self,
+        refresh_interval_frames: int = 5,
+        max_scale_change: float = 0.2,
+        min_iou: float = 0.5,
+        max_age_s: float = 1.0,
+        ema_alpha: float = 0.5,
+        ttl_s: float = 10.0,
+        max_tracks: int = 1000,
+        metrics: Optional[ServiceMetrics] = None,
+    ):
+        self.refresh_interval_frames = refresh_interval_frames
+        self.max_scale_change = max_scale_change
+        self.min_iou = min_iou
+        self.max_age_s = max_age_s
+        self.ema_alpha = ema_alpha
+        self.ttl_s = ttl_s
+        self.max_tracks = max_tracks
+        self.metrics = metrics
+        self.tracks: "OrderedDict[int, TrackState]" = OrderedDict()
+        # crops in flight that reuse each track's embedding
+        self._pinned: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def schedule(
+        self, track_ids: Sequence[int], boxes: np.ndarray, now: Optional[float] = None
+    ) -> np.ndarray:
+        """
+        Return a boolean mask of the crops that need a fresh embedding.
+
+        :param track_ids: (N,) track id of each crop.
+        :param boxes: (N, 4) x1, y1, x2, y2 geometry of each crop.
+        """
+        now = time.monotonic() if now is None else now
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        recompute = np.ones(len(track_ids), dtype=bool)
+        with self._lock:
+            self._evict(now)
+            known = [i for i, t in enumerate(track_ids) if int(t) in self.tracks]
+            if not known:
+                return recompute
+            states = [self.tracks[int(track_ids[i])] for i in known]
+            previous_boxes = np.stack([state.box for state in states])
+            current_boxes = boxes[known]
+            stale = np.zeros(len(known), dtype=bool)
+            if self.refresh_interval_frames > 0:
+                frames = np.array([state.frames_since_compute for state in states])
+                stale |= frames + 1 >= self.refresh_interval_frames
+            if self.max_scale_change > 0:
+                previous_area = _area(previous_boxes)
+                current_area = _area(current_boxes)
+                change = np.abs(current_area - previous_area) / np.maximum(
+                    previous_area, 1e-9
+                )
+                stale |= change > self.max_scale_change
+            if self.min_iou > 0:
+                stale |= box_iou(previous_boxes, current_boxes) < self.min_iou
+            if self.max_age_s > 0:
+                ages = now - np.array([state.computed_at for state in states])
+                stale |= ages > self.max_age_s
+            recompute[known] = stale
+            for i in known:
+                if not recompute[i]:
+                    self._pin(int(track_ids[i]))
+        return recompute
+
+    def update(
+        self,
+        track_ids: Sequence[int],
+        boxes: np.ndarray,
+        recompute: np.ndarray,
+        embeddings: np.ndarray,
+        now: Optional[float] = None,
+    ) -> np.ndarray:
+        """
+        Fold freshly computed embeddings into the track state.
+
+        :param recompute: mask returned by `schedule`.
+        :param embeddings: (recompute.sum(), D) embeddings of the recomputed crops, in order.
+        :return: (N, D) running embedding of every crop's track.
+        """
+        now = time.monotonic() if now is None else now
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        res = []
+        computed = iter(embeddings)
+        with self._lock:
+            for i, track_id in enumerate(track_ids):
+                track_id = int(track_id)
+                state = self.tracks.get(track_id, None)
+                if recompute[i]:
+                    # a copy, so the track does not keep the whole batch alive
+                    embedding = np.array(next(computed))
+                    if state is None:
+                        state = TrackState(embedding, boxes[i], now)
+                        self.tracks[track_id] = state
+                    else:
+                        state.embedding = (
+                            self.ema_alpha * embedding
+                            + (1 - self.ema_alpha) * state.embedding
+                        )
+                        state.box = boxes[i]
+                        state.frames_since_compute = 0
+                        state.computed_at = now
+                elif state is None:
+                    raise KeyError(f"track {track_id} has no embedding")
+                else:
+                    self._unpin(track_id)
+                    state.frames_since_compute += 1
+                state.seen_at = now
+                self.tracks.move_to_end(track_id)
+                res.append(state.embedding)
+            self._evict(now)
+            active_tracks = len(self.tracks)
+
+        if self.metrics is not None:
+            computed_count = int(np.count_nonzero(recompute))
+            self.metrics.increment("track_embeddings_computed", computed_count)
+            self.metrics.increment(
+                "track_embeddings_reused", len(track_ids) - computed_count
+            )
+            self.metrics.observe("active_tracks", active_tracks)
+        return np.stack(res)
+
+    def release(self, track_ids: Sequence[int], recompute: np.ndarray):
+        """Unpin the tracks of a `schedule` call that will not reach `update`."""
+        with self._lock:
+            for i, track_id in enumerate(track_ids):
+                if not recompute[i]:
+                    self._unpin(int(track_id))
+
+    def _pin(self, track_id: int):
+        self._pinned[track_id] = self._pinned.get(track_id, 0) + 1
+
+    def _unpin(self, track_id: int):
+        count = self._pinned.pop(track_id, 0) - 1
+        if count > 0:
+            self._pinned[track_id] = count
+
+    def _evict(self, now: float):
+        evicted = []
+        # pinned tracks are kept on top of `max_tracks`
+        excess = len(self.tracks) - self.max_tracks - len(self._pinned)
+        # tracks are kept in least recently seen order
+        for track_id, state in self.tracks.items():
+            if track_id in self._pinned:
+                continue
+            if self.ttl_s > 0 and now - state.seen_at > self.ttl_s:
+                evicted.append(track_id)
+            elif len(evicted) < excess:
+                evicted.append(track_id)
+            else:
+                break
+        for track_id in evicted:
+            del self.tracks[track_id]
+        if evicted and self.metrics is not None:
+            self.metrics.increment("tracks_evicted", len(evicted))
+
+    def clear(self):
+        """Forget every track but the pinned ones, which requests still need."""
+        with self._lock:
+            for track_id in list(self.tracks):
+                if track_id not in self._pinned:
+                    del self.tracks[track_id]
+
+    def memory_bytes(self) -> int:
+        """Approximate memory held by the tracks."""
+        with self._lock:
+            return sum(
+                state.embedding.nbytes + TRACK_OVERHEAD_BYTES
+                for state in self.tracks.values()
+            )
+
+
+def _area(boxes: np.ndarray) -> np.ndarray:
+    return (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
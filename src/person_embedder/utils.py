@@ -1,6 +1,7 @@
 import os
 import sys
 
+import numpy as np
 import torch.nn.functional as F
 
 
@@ -75,3 +76,120 @@ def pad_image_to_target_size(resized_image, target_size):
     )
 
     return padded_image
+
+
+def letterbox_fill_fraction(height, width, target_size):
+    """
+    Fraction of a letterboxed target covered by image pixels (the rest is padding).
+
+    Args:
+        height (int): height of the crop.
+        width (int): width of the crop.
+        target_size (tuple): (target_height, target_width).
+
+    Returns:
+        float: value in (0, 1].
+    """
+    target_height, target_width = target_size
+    scale = min(target_height / height, target_width / width)
+    new_height = int(height * scale)
+    new_width = int(width * scale)
+    return (new_height * new_width) / (target_height * target_width)
+
+
+def select_aspect_ratio_bucket(height, width, buckets):
+    """
+    Pick the bucket that wastes the least letterbox padding for a crop.
+
+    Ties go to the earliest bucket, so the first entry acts as the default.
+
+    Args:
+        height (int): height of the crop.
+        width (int): width of the crop.
+        buckets (Sequence[tuple]): candidate (target_height, target_width) sizes.
+
+    Returns:
+        tuple: the selected (target_height, target_width).
+    """
+    best_bucket, best_fill = None, -1.0
+    for bucket in buckets:
+        fill = letterbox_fill_fraction(height, width, bucket)
+        if fill > best_fill:
+            best_bucket, best_fill = bucket, fill
+    return tuple(best_bucket)
+
+
+def crop_boxes(image, boxes):
+    """
+    Crop detections out of a full frame.
+
+    Args:
+        image (torch.Tensor): (C, H, W) frame.
+        boxes (Sequence): (N, 4) boxes as x1, y1, x2, y2 in pixels.
+
+    Returns:
+        List[torch.Tensor]: one (C, H_crop, W_crop) view per box.
+    """
+    image_height, image_width = image.shape[1:]
+    crops = []
+    for box in boxes:
+        x1, y1, x2, y2 = map(int, box)  # Ensure integer coordinates
+        x1, y1 = max(0, x1), max(0, y1)  # Clip to image dimensions
+        x2, y2 = min(image_width, x2), min(image_height, y2)
+        cropped_image = image[:, y1:y2, x1:x2]
+        if cropped_image.numel() == 0:
+            raise ValueError(f"Invalid crop region: {list(box)}")
+        crops.append(cropped_image)
+    return crops
+
+
+def l2_normalize(embeddings):
+    """
+    Scale embeddings to unit L2 norm along the last axis.
+
+    Args:
+        embeddings (np.ndarray): (..., D) array.
+
+    Returns:
+        np.ndarray: normalized array, all-zero rows stay zero.
+    """
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+CLIP_POOLING_METHODS = ("mean", "weighted", "max")
+
+
+def pool_embeddings(embeddings, method="mean", weights=None):
+    """
+    Pool the per-frame embeddings of a track clip into one embedding.
+
+    Args:
+        embeddings (np.ndarray): (T, D) frame embeddings.
+        method (str): "mean", "weighted" (weighted mean) or "max" (element-wise).
+        weights (np.ndarray): optional (T,) non-negative frame weights. Frames
+            with a zero weight are left out of every method.
+
+    Returns:
+        np.ndarray: (D,) pooled embedding.
+    """
+    if method not in CLIP_POOLING_METHODS:
+        raise ValueError(
+            f"unsupported clip_pooling {method}, use one of {CLIP_POOLING_METHODS}"
+        )
+    if weights is None:
+        weights = np.ones(len(embeddings), dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64).reshape(-1)
+    if len(weights) != len(embeddings):
+        raise ValueError(f"got {len(weights)} weights for {len(embeddings)} frames")
+    if np.any(weights < 0):
+        raise ValueError("clip weights must be non-negative")
+    used = weights > 0
+    if not used.any():
+        return np.zeros(embeddings.shape[1:], dtype=embeddings.dtype)
+    if method == "max":
+        return embeddings[used].max(axis=0)
+    if method == "mean":
+        weights = used.astype(np.float64)
+    pooled = weights @ embeddings / weights.sum()
+    return pooled.astype(embeddings.dtype)
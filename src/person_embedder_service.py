@@ -3,17 +3,24 @@ This module provides a Viam ML Model Service module
 to perform person Re-Id tracking.
 """
 
+import asyncio
+import gc
+import os
 from typing import (
     ClassVar,
     Dict,
+    List,
     Mapping,
     Optional,
     Sequence,
+    Union,
 )
 
+import numpy as np
 import torch
 from numpy.typing import NDArray
 from typing_extensions import Self
+from viam.components.camera import Camera
 from viam.logging import getLogger
 from viam.module.types import Reconfigurable
 from viam.proto.app.robot import ServiceConfig
@@ -25,9 +32,128 @@ from viam.resource.types import (
     ModelFamily,
 )
 from viam.services.mlmodel import MLModel
-from viam.utils import ValueTypes
+from viam.services.vision import Vision
+from viam.utils import ValueTypes, struct_to_dict
 
-from src.person_embedder.os_net_encoder import OSNetFeatureEmbedder
+from src.person_embedder.admission import (
+    AdmissionController,
+    count_crops,
+    is_batched,
+)
+from src.person_embedder.artifact_cache import ArtifactCache
+from src.person_embedder.association import associate, association_cost
+from src.person_embedder.autotune import Autotuner, PauseGate, default_cache_dir
+from src.person_embedder.cascade import EmbeddingCascade
+from src.person_embedder.decode import ImageDecoder, is_encoded_image
+from src.person_embedder.engine import StagedExecutionEngine
+from src.person_embedder.gallery import PrototypeGallery
+from src.person_embedder.hashing import BinaryHasher
+from src.person_embedder.heads import validate_heads
+from src.person_embedder.memory import (
+    MB,
+    MemoryBudget,
+    available_memory_mb,
+    measure_activation_bytes,
+    process_memory,
+    weights_bytes,
+)
+from src.person_embedder.metrics import ServiceMetrics
+from src.person_embedder.os_net_encoder import ARCHITECTURES, OSNetFeatureEmbedder
+from src.person_embedder.pipeline import EmbeddingPipeline
+from src.person_embedder.pixel_formats import PIXEL_FORMATS, RawFrameCrops
+from src.person_embedder.quality import CropQualityGate
+from src.person_embedder.recorder import TrafficRecorder
+from src.person_embedder.shm_transport import SharedMemoryRegions
+from src.person_embedder.track_scheduler import (
+    TRACK_OVERHEAD_BYTES,
+    TrackEmbeddingScheduler,
+)
+from src.person_embedder.utils import (
+    CLIP_POOLING_METHODS,
+    crop_boxes,
+    l2_normalize,
+    pool_embeddings,
+)
+
+DEFAULT_ASPECT_RATIO_BUCKETS = [[256, 128], [192, 128], [256, 96]]
+
+DEFAULT_DECODE_THREADS = min(4, os.cpu_count() or 1)
+
+# config attribute -> (TrackEmbeddingScheduler keyword argument, type)
+TRACK_SCHEDULER_ATTRIBUTES = {
+    "track_refresh_interval_frames": ("refresh_interval_frames", int),
+    "track_max_scale_change": ("max_scale_change", float),
+    "track_min_iou": ("min_iou", float),
+    "track_max_age_s": ("max_age_s", float),
+    "track_ema_alpha": ("ema_alpha", float),
+    "track_ttl_s": ("ttl_s", float),
+    "track_max_tracks": ("max_tracks", int),
+}
+
+# config attribute -> (StagedExecutionEngine keyword argument, type)
+STAGED_EXECUTION_ATTRIBUTES = {
+    "preprocess_workers": ("preprocess_workers", int),
+    "micro_batch_size": ("micro_batch_size", int),
+    "engine_queue_size": ("queue_size", int),
+}
+
+# config attribute -> (CropQualityGate keyword argument, type)
+QUALITY_GATE_ATTRIBUTES = {
+    "quality_min_height": ("min_height", int),
+    "quality_min_width": ("min_width", int),
+    "quality_min_aspect_ratio": ("min_aspect_ratio", float),
+    "quality_max_aspect_ratio": ("max_aspect_ratio", float),
+    "quality_min_sharpness": ("min_sharpness", float),
+    "quality_reject_truncated": ("reject_truncated", bool),
+    "quality_truncation_margin": ("truncation_margin", int),
+}
+
+# config attribute -> (Autotuner keyword argument, type)
+AUTOTUNE_ATTRIBUTES = {
+    "autotune_latency_slo_ms": ("latency_slo_ms", float),
+    "autotune_max_batch_size": ("max_batch_size", int),
+    "autotune_reduced_precision": ("reduced_precision", bool),
+    "autotune_iterations": ("iterations", int),
+}
+
+# config attribute -> (TrafficRecorder keyword argument, type)
+RECORDER_ATTRIBUTES = {
+    "record_sample_rate": ("sample_rate", float),
+    "record_max_mb": ("max_mb", float),
+    "record_jpeg_quality": ("jpeg_quality", int),
+}
+
+# config attribute -> (EmbeddingCascade keyword argument, type)
+CASCADE_ATTRIBUTES = {
+    "cascade_margin": ("margin", float),
+    "cascade_max_escalation": ("max_escalation", float),
+}
+
+# config attribute -> (ArtifactCache keyword argument, type)
+ARTIFACT_CACHE_ATTRIBUTES = {
+    "artifact_cache_max_mb": ("max_mb", float),
+}
+
+# config attribute -> (PrototypeGallery keyword argument, type)
+GALLERY_ATTRIBUTES = {
+    "gallery_max_prototypes": ("max_prototypes", int),
+    "gallery_merge_threshold": ("merge_threshold", float),
+    "gallery_max_identities": ("max_identities", int),
+    "gallery_nlist": ("nlist", int),
+    "gallery_nprobe": ("nprobe", int),
+    "gallery_hamming_candidates": ("hamming_candidates", int),
+    "gallery_consolidate_interval_s": ("consolidate_interval_s", float),
+}
+
+# config attribute -> (AdmissionController keyword argument, type)
+ADMISSION_ATTRIBUTES = {
+    "admission_max_concurrency": ("max_concurrency", int),
+    "admission_max_queue": ("max_queue", int),
+    "admission_max_in_flight_per_caller": ("max_in_flight_per_caller", int),
+    "admission_default_deadline_ms": ("default_deadline_ms", float),
+    "admission_initial_crop_ms": ("initial_crop_ms", float),
+    "admission_ewma_alpha": ("ewma_alpha", float),
+}
 
 LOGGER = getLogger(__name__)
 
@@ -42,6 +168,26 @@ class PersonEmbedderService(MLModel, Reconfigurable):
     def __init__(self, name: str):
         super().__init__(name=name)
         self.embedder: OSNetFeatureEmbedder = None
+        self.track_scheduler: Optional[TrackEmbeddingScheduler] = None
+        self.quality_gate: Optional[CropQualityGate] = None
+        self.pipeline: Optional[EmbeddingPipeline] = None
+        self.decoder: Optional[ImageDecoder] = None
+        self.engine: Optional[StagedExecutionEngine] = None
+        self.recorder: Optional[TrafficRecorder] = None
+        self.autotuner: Optional[Autotuner] = None
+        self.admission: Optional[AdmissionController] = None
+        self.cascade: Optional[EmbeddingCascade] = None
+        self.memory_budget: Optional[MemoryBudget] = None
+        self.artifact_cache: Optional[ArtifactCache] = None
+        self.gallery: Optional[PrototypeGallery] = None
+        self.hasher: Optional[BinaryHasher] = None
+        self._activation_bytes: Optional[int] = None
+        self.autotune_result: Optional[Dict] = None
+        # closed while autotune sweeps the live embedder
+        self.autotune_gate = PauseGate()
+        self.shm_regions = SharedMemoryRegions()
+        self.normalize_embeddings = False
+        self.metrics = ServiceMetrics()
 
     @classmethod
     def new_service(
@@ -56,10 +202,50 @@ class PersonEmbedderService(MLModel, Reconfigurable):
     @classmethod
     def validate_config(cls, config: ServiceConfig) -> Sequence[str]:
         """Validate config and returns a list of dependencies."""
-        return []
+        attributes = struct_to_dict(config.attributes)
+        get_aspect_ratio_buckets(attributes)
+        get_track_scheduler_kwargs(attributes)
+        get_optional_kwargs(attributes, "quality_gate", QUALITY_GATE_ATTRIBUTES)
+        decode_threads = attributes.get("decode_threads", DEFAULT_DECODE_THREADS)
+        if not isinstance(decode_threads, (int, float)) or decode_threads < 1:
+            raise ValueError("decode_threads must be a positive integer")
+        if not isinstance(attributes.get("normalize_embeddings", False), bool):
+            raise ValueError("normalize_embeddings must be a boolean")
+        if not isinstance(attributes.get("random_weights", False), bool):
+            raise ValueError("random_weights must be a boolean")
+        if not isinstance(attributes.get("fuse_os_blocks", False), bool):
+            raise ValueError("fuse_os_blocks must be a boolean")
+        get_recorder_kwargs(attributes)
+        get_autotune_kwargs(attributes)
+        get_admission_kwargs(attributes)
+        get_cascade_kwargs(attributes)
+        get_memory_budget_mb(attributes)
+        get_artifact_cache_kwargs(attributes)
+        get_gallery_kwargs(attributes)
+        get_binary_codes_path(attributes)
+        validate_heads(attributes.get("heads", {}))
+        engine_kwargs = get_optional_kwargs(
+            attributes, "staged_execution", STAGED_EXECUTION_ATTRIBUTES
+        )
+        if engine_kwargs is not None and any(v < 1 for v in engine_kwargs.values()):
+            raise ValueError(
+                "preprocess_workers, micro_batch_size and engine_queue_size must be at least 1"
+            )
+        return get_pipeline_dependencies(attributes)
 
     def reconfigure(
         self, config: ServiceConfig, dependencies: Mapping[ResourceName, ResourceBase]
+    ):
+        self._release_models()
+        try:
+            self._configure(config, dependencies)
+        except Exception:
+            # rather than serve with half of the new configuration
+            self._release_models()
+            raise
+
+    def _configure(
+        self, config: ServiceConfig, dependencies: Mapping[ResourceName, ResourceBase]
     ):
         model_path = config.attributes.fields.get("model_path", None)
         if model_path is not None:
@@ -68,9 +254,212 @@ class PersonEmbedderService(MLModel, Reconfigurable):
             model_path = model_path.string_value
         else:
             model_path = None
-        self.embedder = OSNetFeatureEmbedder(model_path)
+        attributes = struct_to_dict(config.attributes)
+        artifact_cache_kwargs = get_artifact_cache_kwargs(attributes)
+        self.artifact_cache = (
+            None
+            if artifact_cache_kwargs is None
+            else ArtifactCache(**artifact_cache_kwargs, metrics=self.metrics)
+        )
+        self.embedder = OSNetFeatureEmbedder(
+            model_path,
+            aspect_ratio_buckets=get_aspect_ratio_buckets(attributes),
+            metrics=self.metrics,
+            random_weights=attributes.get("random_weights", False),
+            fuse_blocks=attributes.get("fuse_os_blocks", False),
+            heads=attributes.get("heads", None),
+            artifact_cache=self.artifact_cache,
+        )
+        self.autotuner = None
+        self.autotune_result = None
+        autotune_kwargs = get_autotune_kwargs(attributes)
+        if autotune_kwargs is not None:
+            self.autotuner = Autotuner(self.embedder, **autotune_kwargs)
+            self.autotune_result = self.autotuner.run()
+        decode_threads = attributes.get("decode_threads", DEFAULT_DECODE_THREADS)
+        if self.decoder is not None:
+            self.decoder.shutdown()
+        self.decoder = ImageDecoder(self.embedder.input_shape, int(decode_threads))
+
+        self.normalize_embeddings = attributes.get("normalize_embeddings", False)
+        binary_codes_path = get_binary_codes_path(attributes)
+        self.hasher = None
+        if binary_codes_path is not None:
+            self.hasher = BinaryHasher.load(binary_codes_path)
+            if self.hasher.dim != self.embedder.model.feature_dim:
+                raise ValueError(
+                    f"the binary code projection takes {self.hasher.dim}-d "
+                    f"embeddings, the model makes {self.embedder.model.feature_dim}-d"
+                )
+        cascade_kwargs = get_cascade_kwargs(attributes)
+        if cascade_kwargs is None:
+            self.cascade = None
+        else:
+            small = OSNetFeatureEmbedder(
+                cascade_kwargs.pop("model_path"),
+                aspect_ratio_buckets=get_aspect_ratio_buckets(attributes),
+                random_weights=attributes.get("random_weights", False),
+                architecture=cascade_kwargs.pop("architecture"),
+                artifact_cache=self.artifact_cache,
+            )
+            self.cascade = EmbeddingCascade(
+                small,
+                self.embedder,
+                **cascade_kwargs,
+                normalize=self.normalize_embeddings,
+                metrics=self.metrics,
+            )
+        if self.engine is not None:
+            self.engine.shutdown()
+            self.engine = None
+        engine_kwargs = get_optional_kwargs(
+            attributes, "staged_execution", STAGED_EXECUTION_ATTRIBUTES
+        )
+        if engine_kwargs is not None:
+            if self.autotune_result is not None:
+                # an explicit micro_batch_size wins over the tuned batch size
+                engine_kwargs.setdefault(
+                    "micro_batch_size", self.autotune_result["batch_size"]
+                )
+            self.engine = StagedExecutionEngine(
+                self.embedder, **engine_kwargs, normalize=self.normalize_embeddings
+            )
+
+        track_scheduler_kwargs = get_track_scheduler_kwargs(attributes)
+        if track_scheduler_kwargs is None:
+            self.track_scheduler = None
+        else:
+            self.track_scheduler = TrackEmbeddingScheduler(
+                **track_scheduler_kwargs, metrics=self.metrics
+            )
+        quality_gate_kwargs = get_optional_kwargs(
+            attributes, "quality_gate", QUALITY_GATE_ATTRIBUTES
+        )
+        if quality_gate_kwargs is None:
+            self.quality_gate = None
+        else:
+            self.quality_gate = CropQualityGate(**quality_gate_kwargs)
+
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+        recorder_kwargs = get_recorder_kwargs(attributes)
+        if recorder_kwargs is not None:
+            self.recorder = TrafficRecorder(**recorder_kwargs, metrics=self.metrics)
+
+        admission_kwargs = get_admission_kwargs(attributes)
+        if admission_kwargs is None:
+            self.admission = None
+        else:
+            self.admission = AdmissionController(
+                **admission_kwargs, metrics=self.metrics
+            )
+
+        if self.gallery is not None:
+            self.gallery.stop()
+            self.gallery = None
+        gallery_kwargs = get_gallery_kwargs(attributes)
+        if gallery_kwargs is not None:
+            interval_s = gallery_kwargs.pop("consolidate_interval_s", 1.0)
+            self.gallery = PrototypeGallery(
+                **gallery_kwargs, hasher=self.hasher, metrics=self.metrics
+            )
+            if interval_s > 0:
+                self.gallery.start(interval_s)
+
+        if get_pipeline_dependencies(attributes):
+            self.pipeline = EmbeddingPipeline(
+                dependencies[Camera.get_resource_name(attributes["camera_name"])],
+                dependencies[Vision.get_resource_name(attributes["detector_name"])],
+                self._serve,
+                queue_size=int(attributes.get("pipeline_queue_size", 2)),
+                labels=attributes.get("pipeline_labels", ["person"]),
+                min_confidence=attributes.get("pipeline_min_confidence", 0.0),
+                max_fps=attributes.get("pipeline_max_fps", 10.0),
+                metrics=self.metrics,
+            )
+
+        budget_mb = get_memory_budget_mb(attributes)
+        self.memory_budget = None if budget_mb is None else MemoryBudget(budget_mb)
+        if self.memory_budget is not None:
+            self._fit_memory_budget()
+        if self.pipeline is not None:
+            self.pipeline.start()
         return
 
+    def _release_models(self):
+        """Drop the models and what holds on to them before loading new ones.
+
+        Otherwise the previous models stay alive until the new ones replace
+        them, and a reconfigure needs the memory of both. Until a reconfigure
+        loads new ones, requests fail with a "not configured" error.
+        """
+        if self.pipeline is not None:
+            self.pipeline.stop()
+            self.pipeline = None
+        if self.engine is not None:
+            self.engine.shutdown()
+            self.engine = None
+        self.embedder = None
+        self.cascade = None
+        self.autotuner = None
+        self._activation_bytes = None
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def _fit_memory_budget(self):
+        """Cap the batch size, the track cache and the gallery to fit `memory_budget`."""
+        embedders = [self.embedder]
+        if self.cascade is not None:
+            embedders.append(self.cascade.small)
+        batch_size = self.embedder.max_batch_size
+        buffered_batches = 0
+        if self.engine is not None:
+            batch_size = self.engine.micro_batch_size
+            buffered_batches = (
+                self.engine.model_queue.maxsize + self.engine.preprocess_workers
+            )
+        concurrent_batches = 1
+        if self.engine is None:
+            # without the engine's single model thread, every request in
+            # flight runs its own forward pass
+            if self.admission is not None:
+                concurrent_batches = self.admission.max_concurrency
+            if self.pipeline is not None:
+                # the camera pipeline does not go through admission control
+                concurrent_batches += 1
+        plan = self.memory_budget.fit(
+            embedders,
+            batch_size=batch_size,
+            concurrent_batches=concurrent_batches,
+            buffered_batches=buffered_batches,
+            max_tracks=(
+                0 if self.track_scheduler is None else self.track_scheduler.max_tracks
+            ),
+            track_bytes=self.embedder.model.feature_dim * 4 + TRACK_OVERHEAD_BYTES,
+            max_identities=0 if self.gallery is None else self.gallery.max_identities,
+            identity_bytes=(
+                0
+                if self.gallery is None
+                else self.gallery.identity_bytes(self.embedder.model.feature_dim)
+            ),
+        )
+        for embedder in embedders:
+            embedder.max_batch_size = plan["batch_size"]
+        if self.engine is not None:
+            self.engine.micro_batch_size = plan["batch_size"]
+        if self.track_scheduler is not None:
+            self.track_scheduler.max_tracks = plan["max_tracks"]
+        if self.gallery is not None:
+            self.gallery.max_identities = plan["max_identities"]
+        LOGGER.info(
+            f"memory budget of {plan['budget_mb']:.0f} MB: batch size "
+            f"{plan['batch_size']}, {plan['max_tracks']} tracks, "
+            f"{plan['max_identities']} gallery identities, "
+            f"{plan['planned_mb']:.0f} MB planned"
+        )
+
     async def infer(
         self,
         input_tensors: Dict[str, NDArray],
@@ -81,32 +470,674 @@ class PersonEmbedderService(MLModel, Reconfigurable):
         """Perform inference on the input tensors to generate person embeddings.
 
         Args:
-            input_tensors: Dictionary containing input tensors with key "input"
-            extra: Optional extra parameters
-            timeout: Optional timeout for the operation
+            input_tensors: Dictionary containing input tensors with key "input".
+                "input" is either a single (C, H, W) crop, a (B, C, H, W) batch of
+                crops, or a (C, H, W) frame when "boxes" ((N, 4) x1, y1, x2, y2)
+                is also given. "input" may also be encoded JPEG/PNG bytes as a
+                flat uint8 tensor: one frame when "boxes" is given, otherwise
+                one or more concatenated crops whose byte lengths are given in
+                "input_lengths". With the track scheduler enabled, "track_ids"
+                ((N,) ints) tags each crop with its track.
+            extra: Optional extra parameters. "pixel_format" selects the layout
+                of "input": "rgb" (default, float32 CHW as above), "bgr"
+                ((H, W, 3) uint8), "nv12" or "yuv420" ((H * 3 / 2, W) uint8).
+                Raw formats are one frame, cropped by "boxes" when given.
+                "clip_pooling" ("mean", "weighted" or "max") treats the crops
+                as the frames of one track clip and pools their embeddings;
+                "weights" ((T,) floats) in input_tensors weights the frames,
+                defaulting to the quality gate scores. "return_frames" also
+                returns the per-frame embeddings. "caller_id" identifies the
+                caller for the admission control per-caller cap.
+                "track_embeddings" ((M, D)) in input_tensors associates the
+                crops with active tracks: "association" ("hungarian" or
+                "greedy"), "association_max_cost" (cosine distance gate),
+                and, with "boxes" and "track_boxes" ((M, 4), e.g. the
+                tracks' predicted boxes), "association_iou_weight" and
+                "association_min_iou". "return_costs" also returns the cost
+                matrix. With the cascade enabled, "gallery_embeddings" ((G, D))
+                and "gallery_embeddings_small" ((G, D_small)), the same gallery
+                embedded by both models, match the crops coarse-to-fine.
+                With the gallery enabled, "gallery_search" (k) searches the
+                gallery for the k most similar identities of each crop,
+                exactly or, with "gallery_approximate", through its inverted
+                lists, or, with "gallery_hamming", by re-ranking the
+                prototypes with the closest binary codes; "gallery_ids"
+                ((N,) ints) in input_tensors then adds
+                each crop's embedding to its identity, weighted by its
+                quality score when the quality gate is enabled.
+            timeout: Optional timeout for the operation. With admission
+                control, the request's deadline.
 
         Returns:
-            Dictionary containing the embedding with key "embedding"
+            Dictionary containing the embedding with key "embedding", (D,) for a
+            single crop and (N, D) for batched inputs. When "track_ids" are
+            scheduled, "embedding" holds each track's running embedding and
+            "recomputed" ((N,) uint8) flags the crops that ran through the model.
+            With "clip_pooling", "embedding" is the (D,) pooled embedding and
+            "frame_embeddings" the (T, D) per-frame ones when asked for.
+            With "track_embeddings", "assignment" ((N,) int32) holds the
+            track row each crop is assigned to, -1 for none, and "cost" the
+            (N, M) fused cost matrix when asked for. In cascade mode, "match"
+            ((N,) int32) is each crop's best gallery entry, with "similarity",
+            the small-model "margin", "escalated" ((N,) uint8) and
+            "embedding_small"; "embedding" rows are zero unless escalated.
+            Every configured head adds its output under its name, with the
+            same leading dimension as "embedding" (zero rows for crops that
+            were rejected or reused a track embedding); the cascade does not
+            run heads. With "gallery_search", "gallery_identity" ((N, k)
+            int64) holds the matched identities, -1 for none, and
+            "gallery_similarity" ((N, k)) their cosine similarities.
+            With `binary_codes_path`, "embedding_code" ((N, bits / 8) uint8)
+            holds the packed binary code of every embedding, zero for
+            all-zero embeddings.
+
+        Raises:
+            OverloadError: admission control shed the request.
         """
+        if self.recorder is not None:
+            self.recorder.record(input_tensors, extra)
+        if self.admission is not None:
+            caller = (extra or {}).get("caller_id", None)
+            async with self.admission.admit(
+                count_crops(input_tensors), timeout, caller
+            ):
+                # off the event loop, so requests keep arriving and queueing
+                return await asyncio.to_thread(self._serve, input_tensors, extra)
+        if self.engine is not None or self.autotune_gate.is_paused:
+            # concurrent requests overlap in the engine stages, and requests
+            # waiting for autotune must not block the event loop
+            return await asyncio.to_thread(self._serve, input_tensors, extra)
+        return self._serve(input_tensors, extra)
+
+    def _serve(
+        self,
+        input_tensors: Dict[str, NDArray],
+        extra: Optional[Mapping[str, ValueTypes]] = None,
+    ) -> Dict[str, NDArray]:
+        """Run _infer, or wait for it while autotune has the embedder."""
+        self._check_configured()
+        with self.autotune_gate.enter():
+            return self._infer(input_tensors, extra)
+
+    def _infer(
+        self,
+        input_tensors: Dict[str, NDArray],
+        extra: Optional[Mapping[str, ValueTypes]] = None,
+    ) -> Dict[str, NDArray]:
+        pixel_format = (extra or {}).get("pixel_format", "rgb")
+        clip_pooling = (extra or {}).get("clip_pooling", None)
+        if clip_pooling is not None and clip_pooling not in CLIP_POOLING_METHODS:
+            raise ValueError(
+                f"unsupported clip_pooling {clip_pooling}, use one of {CLIP_POOLING_METHODS}"
+            )
+        crops, batched, frame_size = self._get_crops(input_tensors, pixel_format)
+        boxes = input_tensors.get("boxes", None)
+        if boxes is not None:
+            boxes = boxes.reshape(-1, 4)
+        track_ids = input_tensors.get("track_ids", None)
+        if track_ids is not None:
+            track_ids = track_ids.reshape(-1)
+            if len(track_ids) != len(crops):
+                raise ValueError(
+                    f"got {len(track_ids)} track_ids for {len(crops)} crops"
+                )
+            if clip_pooling is not None:
+                raise ValueError("track_ids cannot be combined with clip_pooling")
+        if "track_embeddings" in input_tensors and clip_pooling is not None:
+            raise ValueError("track_embeddings cannot be combined with clip_pooling")
+        cascade = "gallery_embeddings" in input_tensors
+        if cascade:
+            if self.cascade is None:
+                raise ValueError("gallery_embeddings needs the cascade to be enabled")
+            if "gallery_embeddings_small" not in input_tensors:
+                raise ValueError("the cascade needs gallery_embeddings_small")
+            if (
+                track_ids is not None
+                or clip_pooling is not None
+                or "track_embeddings" in input_tensors
+            ):
+                raise ValueError(
+                    "gallery_embeddings cannot be combined with track_ids, "
+                    "track_embeddings or clip_pooling"
+                )
+        gallery_search = (extra or {}).get("gallery_search", None)
+        gallery_ids = input_tensors.get("gallery_ids", None)
+        if gallery_search is not None or gallery_ids is not None:
+            if self.gallery is None:
+                raise ValueError("gallery_search and gallery_ids need the gallery")
+            if cascade or clip_pooling is not None:
+                raise ValueError(
+                    "the gallery cannot be combined with the cascade or clip_pooling"
+                )
+            if gallery_ids is not None and gallery_ids.size != len(crops):
+                raise ValueError(
+                    f"got {gallery_ids.size} gallery_ids for {len(crops)} crops"
+                )
+
+        res = {}
+        keep = None
+        if self.quality_gate is not None:
+            quality, valid = self.quality_gate.score(crops, boxes, frame_size)
+            res["quality"] = quality
+            res["valid"] = valid.astype(np.uint8)
+            self.metrics.increment("crops_rejected", int(np.count_nonzero(~valid)))
+            if not valid.all():
+                keep = np.flatnonzero(valid)
+                crops = select_crops(crops, keep)
+                boxes = boxes[keep] if boxes is not None else None
+                track_ids = track_ids[keep] if track_ids is not None else None
+
+        if cascade:
+            outputs = self.cascade.run(
+                crops,
+                flatten_embeddings(input_tensors["gallery_embeddings"]),
+                flatten_embeddings(input_tensors["gallery_embeddings_small"]),
+            )
+        elif track_ids is not None and self.track_scheduler is not None:
+            outputs = self._infer_tracks(crops, track_ids, boxes)
+        else:
+            outputs = self._compute_outputs(crops)
+
+        if keep is not None:
+            # rejected crops get all-zero rows
+            for name, value in outputs.items():
+                full = np.zeros((len(res["valid"]),) + value.shape[1:], value.dtype)
+                full[keep] = value
+                outputs[name] = full
+            if "match" in outputs:
+                outputs["match"][res["valid"] == 0] = -1
+        res.update(outputs)
+        if gallery_search is not None or gallery_ids is not None:
+            res.update(
+                self._use_gallery(
+                    res,
+                    gallery_search,
+                    gallery_ids,
+                    bool((extra or {}).get("gallery_approximate", False)),
+                    bool((extra or {}).get("gallery_hamming", False)),
+                )
+            )
+        if "track_embeddings" in input_tensors:
+            res.update(self._associate(res, input_tensors, extra or {}))
+        if clip_pooling is not None:
+            return self._add_codes(
+                self._pool_clip(
+                    res,
+                    clip_pooling,
+                    input_tensors.get("weights", None),
+                    (extra or {}).get("return_frames", False),
+                )
+            )
+        if not batched:
+            for name in [
+                "embedding",
+                "gallery_identity",
+                "gallery_similarity",
+                *self.embedder.heads,
+            ]:
+                if name in res:
+                    res[name] = res[name][0]
+        return self._add_codes(res)
+
+    def _add_codes(self, res: Dict[str, NDArray]) -> Dict[str, NDArray]:
+        """Add the binary codes of the embeddings as "embedding_code"."""
+        if self.hasher is None:
+            return res
+        embeddings = res["embedding"]
+        flat = embeddings.reshape(-1, embeddings.shape[-1])
+        codes = self.hasher.encode(flat)
+        # crops rejected by the quality gate or not escalated by the cascade
+        codes[~flat.any(axis=1)] = 0
+        res["embedding_code"] = codes.reshape(embeddings.shape[:-1] + (-1,))
+        return res
+
+    def _use_gallery(
+        self,
+        res: Dict[str, NDArray],
+        k: Optional[int],
+        identities: Optional[NDArray],
+        approximate: bool,
+        hamming: bool,
+    ) -> Dict[str, NDArray]:
+        """Search the gallery for the crops, then add them to their identities."""
+        embeddings = res["embedding"]
+        valid = (
+            res["valid"].astype(bool)
+            if "valid" in res
+            else np.ones(len(embeddings), dtype=bool)
+        )
+        outputs = {}
+        if k is not None:
+            if isinstance(k, bool) or not isinstance(k, (int, float)) or k < 1:
+                raise ValueError("gallery_search must be a positive integer")
+            matches, similarity = self.gallery.search(
+                embeddings, int(k), approximate, hamming
+            )
+            matches[~valid] = -1
+            similarity[~valid] = 0
+            outputs["gallery_identity"] = matches
+            outputs["gallery_similarity"] = similarity
+        if identities is not None:
+            weights = res.get("quality", np.ones(len(embeddings), dtype=np.float32))
+            self.gallery.add(
+                identities.reshape(-1), embeddings, np.where(valid, weights, 0)
+            )
+        return outputs
+
+    def _associate(
+        self,
+        res: Dict[str, NDArray],
+        input_tensors: Dict[str, NDArray],
+        extra: Mapping[str, ValueTypes],
+    ) -> Dict[str, NDArray]:
+        """Assign the embedded crops to the tracks in "track_embeddings"."""
+        embeddings = res["embedding"]
+        track_embeddings = input_tensors["track_embeddings"]
+        if track_embeddings.shape[-1] != embeddings.shape[1]:
+            raise ValueError(
+                f"track_embeddings must be (M, {embeddings.shape[1]}), "
+                f"got {track_embeddings.shape}"
+            )
+        track_embeddings = track_embeddings.reshape(-1, embeddings.shape[1])
+        boxes = input_tensors.get("boxes", None)
+        track_boxes = input_tensors.get("track_boxes", None)
+        if track_boxes is not None:
+            if boxes is None:
+                raise ValueError("track_boxes needs the boxes of the crops")
+            track_boxes = track_boxes.reshape(-1, 4)
+            if len(track_boxes) != len(track_embeddings):
+                raise ValueError(
+                    f"got {len(track_boxes)} track_boxes for {len(track_embeddings)} tracks"
+                )
+            boxes = boxes.reshape(-1, 4)
+        cost = association_cost(
+            embeddings,
+            track_embeddings,
+            boxes,
+            track_boxes,
+            iou_weight=float(extra.get("association_iou_weight", 0.0)),
+            min_iou=float(extra.get("association_min_iou", 0.0)),
+        )
+        if "valid" in res:
+            # rejected crops have no embedding to match
+            cost[res["valid"] == 0] = np.inf
+        max_cost = extra.get("association_max_cost", None)
+        assignment = associate(
+            cost,
+            extra.get("association", "hungarian"),
+            None if max_cost is None else float(max_cost),
+        )
+        self.metrics.increment("association_requests")
+        self.metrics.increment(
+            "association_matched", int(np.count_nonzero(assignment >= 0))
+        )
+        outputs = {"assignment": assignment}
+        if extra.get("return_costs", False):
+            outputs["cost"] = cost.astype(np.float32)
+        return outputs
+
+    def _pool_clip(
+        self,
+        res: Dict[str, NDArray],
+        method: str,
+        weights: Optional[NDArray],
+        return_frames: bool,
+    ) -> Dict[str, NDArray]:
+        """Replace the per-frame embeddings of a track clip by their pooled embedding."""
+        frame_embeddings = res.pop("embedding")
+        if weights is None and method == "weighted":
+            if "quality" not in res:
+                raise ValueError(
+                    "weighted clip_pooling needs a weights input or the quality_gate"
+                )
+            weights = res["quality"]
+        if weights is not None:
+            weights = weights.reshape(-1).astype(np.float64)
+        if "valid" in res:
+            # rejected frames have no embedding to pool
+            if weights is None:
+                weights = np.ones(len(frame_embeddings))
+            weights = weights * res["valid"]
+        embedding = pool_embeddings(frame_embeddings, method, weights)
+        if self.normalize_embeddings:
+            embedding = l2_normalize(embedding)
+        res["embedding"] = embedding
+        if return_frames:
+            res["frame_embeddings"] = frame_embeddings
+        return res
+
+    def _compute_embeddings(
+        self, crops: Union[List[torch.Tensor], RawFrameCrops]
+    ) -> NDArray:
+        if len(crops) == 0:
+            return np.zeros((0, self.embedder.model.feature_dim), dtype=np.float32)
+        if self.engine is not None:
+            return self.engine.submit(crops).result()
+
+        # Compute features using the OSNet encoder
+        embeddings = self.embedder.compute_features(crops)
 
+        # Convert back to numpy array for return
+        if isinstance(embeddings, torch.Tensor):
+            embeddings = embeddings.cpu().numpy()
+        if self.normalize_embeddings:
+            embeddings = l2_normalize(embeddings)
+        return embeddings
+
+    def _compute_outputs(
+        self, crops: Union[List[torch.Tensor], RawFrameCrops]
+    ) -> Dict[str, NDArray]:
+        """The embeddings under "embedding" and the outputs of every head."""
+        if not self.embedder.heads or len(crops) == 0:
+            outputs = {"embedding": self._compute_embeddings(crops)}
+            for name, shape in self.embedder.head_shapes.items():
+                outputs[name] = np.zeros((len(crops),) + shape, dtype=np.float32)
+            return outputs
+        if self.engine is not None:
+            return self.engine.submit(crops, with_heads=True).result()
+        outputs = {
+            name: value.cpu().numpy()
+            for name, value in self.embedder.compute_outputs(crops).items()
+        }
+        if self.normalize_embeddings:
+            outputs["embedding"] = l2_normalize(outputs["embedding"])
+        return outputs
+
+    def _infer_tracks(
+        self,
+        crops: List[torch.Tensor],
+        track_ids: NDArray,
+        boxes: Optional[NDArray],
+    ) -> Dict[str, NDArray]:
+        if boxes is None and isinstance(crops, RawFrameCrops):
+            boxes = crops.boxes
+        elif boxes is None:
+            # without frame coordinates only the crop size is known
+            boxes = np.array(
+                [[0, 0, crop.shape[2], crop.shape[1]] for crop in crops],
+                dtype=np.float64,
+            ).reshape(-1, 4)
+        recompute = self.track_scheduler.schedule(track_ids, boxes)
+        recomputed = np.flatnonzero(recompute)
+        try:
+            head_outputs = self._compute_outputs(select_crops(crops, recomputed))
+        except BaseException:
+            self.track_scheduler.release(track_ids, recompute)
+            raise
+        embeddings = head_outputs.pop("embedding")
+        if len(crops) == 0:
+            running_embeddings = embeddings
+        else:
+            running_embeddings = self.track_scheduler.update(
+                track_ids, boxes, recompute, embeddings
+            )
+        res = {
+            "embedding": running_embeddings.astype(np.float32),
+            "recomputed": recompute.astype(np.uint8),
+        }
+        # heads only ran on the recomputed crops, the others get zero rows
+        for name, value in head_outputs.items():
+            full = np.zeros((len(recompute),) + value.shape[1:], value.dtype)
+            full[recomputed] = value
+            res[name] = full
+        return res
+
+    def _get_crops(self, input_tensors: Dict[str, NDArray], pixel_format: str = "rgb"):
+        """Turn the input tensors into a list of float32 (C, H, W) crops on the embedder device.
+
+        Raw bgr/nv12/yuv420 frames are returned as RawFrameCrops so color is
+        only converted inside the boxes.
+
+        Returns:
+            (crops, batched, frame_size) where batched tells whether the caller
+            sent several crops and frame_size is the (height, width) of the
+            frame boxes refer to, None without boxes
+        """
         # Extract the cropped image from input tensors
         cropped_image = input_tensors["input"]
+        boxes = input_tensors.get("boxes", None)
+        if boxes is not None:
+            boxes = boxes.reshape(-1, 4)
+
+        if pixel_format != "rgb":
+            if pixel_format not in PIXEL_FORMATS:
+                raise ValueError(
+                    f"unsupported pixel_format {pixel_format}, use one of {PIXEL_FORMATS}"
+                )
+            crops = RawFrameCrops(
+                cropped_image,
+                pixel_format,
+                boxes,
+                getattr(self.embedder, "device", None),
+            )
+            frame_size = crops.frame_size if boxes is not None else None
+            return crops, boxes is not None, frame_size
+
+        if is_encoded_image(cropped_image):
+            if boxes is not None:
+                _, crops, frame_size = self.decoder.decode_frame(cropped_image, boxes)
+                return self._to_device(crops), True, frame_size
+            lengths = input_tensors.get("input_lengths", None)
+            if lengths is None:
+                lengths = np.array([len(cropped_image)])
+            crops = self.decoder.decode_crops(cropped_image, lengths.reshape(-1))
+            return self._to_device(crops), is_batched(input_tensors), None
+
         uint8_tensor = torch.from_numpy(cropped_image).contiguous()  # -> to (C, H, W)
         float32_tensor = uint8_tensor.to(dtype=torch.float32)
         # Ensure the tensor is on the correct device (CPU/GPU)
         if hasattr(self.embedder, "device"):
             float32_tensor = float32_tensor.to(self.embedder.device)
 
-        # Compute features using the OSNet encoder
-        embedding = self.embedder.compute_features_on_single_cropped_image(
-            float32_tensor
+        if boxes is not None:
+            if float32_tensor.dim() != 3:
+                raise ValueError("input must be a (C, H, W) frame when boxes are given")
+            return (
+                crop_boxes(float32_tensor, boxes),
+                True,
+                tuple(cropped_image.shape[1:]),
+            )
+        if float32_tensor.dim() == 4:
+            return list(float32_tensor), True, None
+        if float32_tensor.dim() == 3:
+            return [float32_tensor], False, None
+        raise ValueError(
+            f"input must be (C, H, W) or (B, C, H, W), got shape {tuple(cropped_image.shape)}"
         )
 
-        # Convert back to numpy array for return
-        if isinstance(embedding, torch.Tensor):
-            embedding = embedding.cpu().numpy()
+    def _to_device(self, crops: List[torch.Tensor]) -> List[torch.Tensor]:
+        if hasattr(self.embedder, "device"):
+            return [crop.to(self.embedder.device) for crop in crops]
+        return crops
 
-        return {"embedding": embedding}
+    async def do_command(
+        self,
+        command: Mapping[str, ValueTypes],
+        *,
+        timeout: Optional[float] = None,
+        **kwargs,
+    ) -> Mapping[str, ValueTypes]:
+        """Handle service commands.
+
+        Supported commands:
+            {"get_metrics": {}}: returns the service metrics under "metrics"
+            {"reset_metrics": {}}: clears the service metrics
+            {"reset_tracks": {}}: drops all track scheduler state
+            {"get_latest": {}}: returns the detections and embeddings of the
+                last frame processed by the camera pipeline
+            {"shm_infer": {"name", "input", "output", "boxes", "extra"}}: runs
+                infer on a tensor in a caller's shared-memory region and
+                writes the outputs back into it, see SharedMemoryRing
+            {"autotune": {"force": bool}}: applies the cached autotune result
+                for this host, or runs the calibration sweep when there is
+                none or "force" is set, and returns it under "autotune".
+                The sweep switches the live embedder's threads and backend,
+                so infer requests and the camera pipeline wait until it is
+                done; requests in flight finish first
+            {"get_memory": {}}: returns the memory accounting under "memory":
+                the current and peak process memory, the memory of the
+                weights, activations, track cache and gallery, and the plan
+                of `memory_budget_mb` under "budget" when set
+            {"gallery_add": {"identities", "embeddings", "weights"}}: adds
+                stored embeddings to the gallery
+            {"gallery_consolidate": {}}: folds the pending gallery embeddings
+                into prototypes now and returns the gallery stats
+            {"gallery_remove": {"identities": [...]}}: forgets identities
+            {"gallery_clear": {}}: empties the gallery
+        """
+        if "get_metrics" in command:
+            metrics = self.metrics.snapshot()
+            if self.engine is not None:
+                metrics.update(self.engine.utilization())
+            if self.admission is not None:
+                metrics.update(self.admission.stats())
+            if self.gallery is not None:
+                metrics.update(self.gallery.stats())
+            return {"metrics": metrics}
+        if "reset_metrics" in command:
+            self.metrics.reset()
+            if self.engine is not None:
+                self.engine.reset_utilization()
+            return {"status": "success"}
+        if "reset_tracks" in command:
+            if self.track_scheduler is not None:
+                self.track_scheduler.clear()
+            return {"status": "success"}
+        if "get_latest" in command:
+            if self.pipeline is None:
+                raise ValueError("get_latest requires camera_name and detector_name")
+            if self.pipeline.latest is None:
+                return {}
+            return self.pipeline.latest.to_dict()
+        if "shm_infer" in command:
+            return {"shm_infer": await self._shm_infer(command["shm_infer"])}
+        if "autotune" in command:
+            options = command["autotune"] or {}
+            self._check_configured()
+            if self.autotuner is None:
+                self.autotuner = Autotuner(self.embedder)
+            self.autotune_result = await asyncio.to_thread(
+                self._autotune, bool(options.get("force", False))
+            )
+            return {"autotune": self.autotune_result}
+        if "get_memory" in command:
+            self._check_configured()
+            return {"memory": await asyncio.to_thread(self._memory_report)}
+        if any(name.startswith("gallery_") for name in command):
+            return await self._gallery_command(command)
+        raise NotImplementedError(f"unsupported command: {list(command.keys())}")
+
+    def _check_configured(self):
+        if self.embedder is None:
+            raise ValueError(
+                "the service is not configured: the last reconfigure failed "
+                "to load the models"
+            )
+
+    def _autotune(self, force: bool) -> Dict:
+        with self.autotune_gate.paused():
+            result = self.autotuner.run(force)
+            if self.engine is not None:
+                self.engine.micro_batch_size = result["batch_size"]
+            if self.memory_budget is not None:
+                # the tuned batch size is capped to the budget again
+                self._fit_memory_budget()
+            return result
+
+    async def _gallery_command(
+        self, command: Mapping[str, ValueTypes]
+    ) -> Mapping[str, ValueTypes]:
+        if self.gallery is None:
+            raise ValueError("gallery commands need the gallery to be enabled")
+        if "gallery_add" in command:
+            request = command["gallery_add"]
+            embeddings = np.asarray(request["embeddings"], dtype=np.float32)
+            weights = request.get("weights", None)
+            self.gallery.add(
+                request["identities"],
+                embeddings.reshape(len(embeddings), -1),
+                None if weights is None else np.asarray(weights),
+            )
+            return {"gallery": self.gallery.stats()}
+        if "gallery_consolidate" in command:
+            await asyncio.to_thread(self.gallery.consolidate)
+            return {"gallery": self.gallery.stats()}
+        if "gallery_remove" in command:
+            identities = command["gallery_remove"]["identities"]
+            return {"removed": self.gallery.remove([int(i) for i in identities])}
+        if "gallery_clear" in command:
+            self.gallery.clear()
+            return {"status": "success"}
+        raise NotImplementedError(f"unsupported command: {list(command.keys())}")
+
+    def _memory_report(self) -> Dict[str, ValueTypes]:
+        if self._activation_bytes is None:
+            self._activation_bytes = measure_activation_bytes(self.embedder)
+        batch_size = self.embedder.max_batch_size
+        if self.engine is not None:
+            batch_size = self.engine.micro_batch_size
+        weights = weights_bytes(self.embedder)
+        if self.cascade is not None:
+            weights += weights_bytes(self.cascade.small)
+        report = {
+            **process_memory(),
+            "weights_mb": weights / MB,
+            "activations_mb_per_crop": self._activation_bytes / MB,
+            "tracks_mb": (
+                0.0
+                if self.track_scheduler is None
+                else self.track_scheduler.memory_bytes() / MB
+            ),
+            "gallery_mb": (
+                0.0 if self.gallery is None else self.gallery.memory_bytes() / MB
+            ),
+        }
+        if batch_size is not None:
+            report["batch_size"] = batch_size
+            report["batch_activations_mb"] = batch_size * self._activation_bytes / MB
+        host_available_mb = available_memory_mb()
+        if host_available_mb is not None:
+            report["host_available_mb"] = host_available_mb
+        if self.memory_budget is not None:
+            report["budget"] = dict(self.memory_budget.plan)
+        return report
+
+    async def _shm_infer(self, request: Mapping) -> Dict[str, Dict]:
+        """Run infer on shared-memory inputs and return the output descriptors.
+
+        The input is a zero-copy view of the caller's region, so it reaches
+        the embedder without any serialization.
+        """
+        name = request["name"]
+        input_tensors = {"input": self.shm_regions.view(name, request["input"])}
+        if request.get("boxes", None) is not None:
+            input_tensors["boxes"] = np.asarray(
+                request["boxes"], dtype=np.float32
+            ).reshape(-1, 4)
+        outputs = await self.infer(input_tensors, extra=request.get("extra", None))
+        self.metrics.increment("shm_requests")
+        output = request["output"]
+        return self.shm_regions.write(
+            name, int(output["offset"]), int(output["size"]), outputs
+        )
+
+    async def close(self):
+        self.shm_regions.close()
+        if self.pipeline is not None:
+            self.pipeline.stop()
+            self.pipeline = None
+        if self.decoder is not None:
+            self.decoder.shutdown()
+            self.decoder = None
+        if self.engine is not None:
+            self.engine.shutdown()
+            self.engine = None
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+        if self.gallery is not None:
+            self.gallery.stop()
+            self.gallery = None
 
     async def metadata(
         self,
@@ -128,3 +1159,242 @@ class PersonEmbedderService(MLModel, Reconfigurable):
         For more information, see `ML model service <https://docs.viam.com/dev/reference/apis/services/ml/#metadata>`_.
         """
         return NotImplementedError
+
+
+def select_crops(
+    crops: Union[List[torch.Tensor], RawFrameCrops], indices: Sequence[int]
+) -> Union[List[torch.Tensor], RawFrameCrops]:
+    """Keep the crops at `indices`, without converting raw frame crops."""
+    if isinstance(crops, RawFrameCrops):
+        return crops.subset(indices)
+    return [crops[i] for i in indices]
+
+
+def flatten_embeddings(embeddings: NDArray) -> NDArray:
+    """(G, D) view of one (D,) or several (G, D) embeddings."""
+    return embeddings.reshape(-1, embeddings.shape[-1])
+
+
+def get_aspect_ratio_buckets(attributes: Mapping) -> Optional[List[List[int]]]:
+    """Read the `aspect_ratio_buckets` attribute.
+
+    `true` selects DEFAULT_ASPECT_RATIO_BUCKETS, a list of [height, width] pairs
+    selects custom buckets, and `false` or missing disables bucketing.
+    """
+    buckets = attributes.get("aspect_ratio_buckets", False)
+    if buckets is False:
+        return None
+    if buckets is True:
+        return DEFAULT_ASPECT_RATIO_BUCKETS
+    if not isinstance(buckets, list) or len(buckets) == 0:
+        raise ValueError(
+            "aspect_ratio_buckets must be a boolean or a non-empty list of [height, width]"
+        )
+    res = []
+    for bucket in buckets:
+        if (
+            not isinstance(bucket, list)
+            or len(bucket) != 2
+            or any(
+                not isinstance(v, (int, float)) or not float(v).is_integer() or v <= 0
+                for v in bucket
+            )
+        ):
+            raise ValueError(
+                f"aspect_ratio_buckets entries must be [height, width] positive integers, got {bucket}"
+            )
+        res.append([int(bucket[0]), int(bucket[1])])
+    return res
+
+
+def get_pipeline_dependencies(attributes: Mapping) -> List[str]:
+    """Read the camera pipeline attributes and return the resources it depends on.
+
+    The pipeline runs when both `camera_name` and `detector_name` are set.
+    """
+    camera_name = attributes.get("camera_name", None)
+    detector_name = attributes.get("detector_name", None)
+    if camera_name is None and detector_name is None:
+        return []
+    if not isinstance(camera_name, str) or not isinstance(detector_name, str):
+        raise ValueError("camera_name and detector_name must both be set as strings")
+    labels = attributes.get("pipeline_labels", [])
+    if not isinstance(labels, list) or any(not isinstance(l, str) for l in labels):
+        raise ValueError("pipeline_labels must be a list of strings")
+    for attribute in (
+        "pipeline_queue_size",
+        "pipeline_min_confidence",
+        "pipeline_max_fps",
+    ):
+        value = attributes.get(attribute, 0)
+        if not isinstance(value, (int, float)) or isinstance(value, bool) or value < 0:
+            raise ValueError(f"{attribute} must be a non-negative number")
+    if attributes.get("pipeline_queue_size", 1) < 1:
+        raise ValueError("pipeline_queue_size must be at least 1")
+    return [camera_name, detector_name]
+
+
+def get_track_scheduler_kwargs(attributes: Mapping) -> Optional[Dict[str, float]]:
+    """Read the track scheduler attributes.
+
+    Returns None when `track_scheduler` is not enabled, otherwise the
+    TrackEmbeddingScheduler keyword arguments that were set.
+    """
+    kwargs = get_optional_kwargs(
+        attributes, "track_scheduler", TRACK_SCHEDULER_ATTRIBUTES
+    )
+    if (
+        kwargs is not None
+        and "ema_alpha" in kwargs
+        and not 0 < kwargs["ema_alpha"] <= 1
+    ):
+        raise ValueError("track_ema_alpha must be in (0, 1]")
+    return kwargs
+
+
+def get_autotune_kwargs(attributes: Mapping) -> Optional[Dict[str, ValueTypes]]:
+    """Read the autotune attributes, `autotune_cache_dir` included."""
+    kwargs = get_optional_kwargs(attributes, "autotune", AUTOTUNE_ATTRIBUTES)
+    if kwargs is None:
+        return None
+    if kwargs.get("max_batch_size", 1) < 1 or kwargs.get("iterations", 1) < 1:
+        raise ValueError(
+            "autotune_max_batch_size and autotune_iterations must be at least 1"
+        )
+    cache_dir = attributes.get("autotune_cache_dir", None)
+    if cache_dir is not None:
+        if not isinstance(cache_dir, str):
+            raise ValueError("autotune_cache_dir must be a string")
+        kwargs["cache_dir"] = cache_dir
+    return kwargs
+
+
+def get_artifact_cache_kwargs(
+    attributes: Mapping,
+) -> Optional[Dict[str, ValueTypes]]:
+    """Read the artifact cache attributes, `artifact_cache_dir` included."""
+    kwargs = get_optional_kwargs(
+        attributes, "artifact_cache", ARTIFACT_CACHE_ATTRIBUTES
+    )
+    if kwargs is None:
+        return None
+    cache_dir = attributes.get(
+        "artifact_cache_dir", os.path.join(default_cache_dir(), "artifacts")
+    )
+    if not isinstance(cache_dir, str):
+        raise ValueError("artifact_cache_dir must be a string")
+    return {**kwargs, "cache_dir": cache_dir}
+
+
+def get_cascade_kwargs(attributes: Mapping) -> Optional[Dict[str, ValueTypes]]:
+    """Read the cascade attributes, including the small model's path and architecture."""
+    kwargs = get_optional_kwargs(attributes, "cascade", CASCADE_ATTRIBUTES)
+    if kwargs is None:
+        return None
+    if not 0 <= kwargs.get("max_escalation", 1.0) <= 1:
+        raise ValueError("cascade_max_escalation must be between 0 and 1")
+    architecture = attributes.get("cascade_architecture", "osnet_ain_x0_25")
+    if architecture not in ARCHITECTURES:
+        raise ValueError(
+            f"cascade_architecture must be one of {list(ARCHITECTURES)}, got {architecture}"
+        )
+    model_path = attributes.get("cascade_model_path", None)
+    if model_path is not None and not isinstance(model_path, str):
+        raise ValueError("cascade_model_path must be a string")
+    if model_path is None and not attributes.get("random_weights", False):
+        raise ValueError("cascade requires cascade_model_path")
+    return {**kwargs, "model_path": model_path, "architecture": architecture}
+
+
+def get_memory_budget_mb(attributes: Mapping) -> Optional[float]:
+    """Read the `memory_budget_mb` attribute."""
+    budget_mb = attributes.get("memory_budget_mb", None)
+    if budget_mb is None:
+        return None
+    if isinstance(budget_mb, bool) or not isinstance(budget_mb, (int, float)):
+        raise ValueError("memory_budget_mb must be a number")
+    if budget_mb <= 0:
+        raise ValueError("memory_budget_mb must be positive")
+    return float(budget_mb)
+
+
+def get_gallery_kwargs(attributes: Mapping) -> Optional[Dict[str, ValueTypes]]:
+    """Read the gallery attributes."""
+    kwargs = get_optional_kwargs(attributes, "gallery", GALLERY_ATTRIBUTES)
+    if kwargs is None:
+        return None
+    if kwargs.get("max_prototypes", 1) < 1 or kwargs.get("nprobe", 1) < 1:
+        raise ValueError("gallery_max_prototypes and gallery_nprobe must be at least 1")
+    if kwargs.get("merge_threshold", 0.95) > 1:
+        raise ValueError("gallery_merge_threshold must be between 0 and 1")
+    return kwargs
+
+
+def get_binary_codes_path(attributes: Mapping) -> Optional[str]:
+    """Read the `binary_codes_path` attribute."""
+    path = attributes.get("binary_codes_path", None)
+    if path is None:
+        return None
+    if not isinstance(path, str) or not path.lower().endswith(".npz"):
+        raise ValueError("binary_codes_path must be the path of a .npz file")
+    return path
+
+
+def get_admission_kwargs(attributes: Mapping) -> Optional[Dict[str, float]]:
+    """Read the admission control attributes."""
+    kwargs = get_optional_kwargs(attributes, "admission_control", ADMISSION_ATTRIBUTES)
+    if kwargs is None:
+        return None
+    if kwargs.get("max_concurrency", 1) < 1:
+        raise ValueError("admission_max_concurrency must be at least 1")
+    if not 0 < kwargs.get("ewma_alpha", 0.2) <= 1:
+        raise ValueError("admission_ewma_alpha must be in (0, 1]")
+    return kwargs
+
+
+def get_recorder_kwargs(attributes: Mapping) -> Optional[Dict[str, ValueTypes]]:
+    """Read the traffic recorder attributes.
+
+    Recording is enabled by `record_traffic` and needs `record_path`.
+    """
+    kwargs = get_optional_kwargs(attributes, "record_traffic", RECORDER_ATTRIBUTES)
+    if kwargs is None:
+        return None
+    path = attributes.get("record_path", None)
+    if not isinstance(path, str) or not path:
+        raise ValueError("record_traffic requires record_path to be set")
+    if kwargs.get("sample_rate", 1.0) > 1:
+        raise ValueError("record_sample_rate must be between 0 and 1")
+    if not 1 <= kwargs.get("jpeg_quality", 90) <= 95:
+        raise ValueError("record_jpeg_quality must be between 1 and 95")
+    return {"path": path, **kwargs}
+
+
+def get_optional_kwargs(
+    attributes: Mapping, switch: str, attribute_map: Mapping
+) -> Optional[Dict[str, ValueTypes]]:
+    """Read the attributes of an optional component.
+
+    Returns None when the boolean `switch` attribute is not enabled, otherwise
+    the keyword arguments, mapped through `attribute_map`, that were set.
+    Numbers must be non-negative.
+    """
+    enabled = attributes.get(switch, False)
+    if not isinstance(enabled, bool):
+        raise ValueError(f"{switch} must be a boolean")
+    if not enabled:
+        return None
+    kwargs = {}
+    for attribute, (kwarg, kind) in attribute_map.items():
+        if attribute not in attributes:
+            continue
+        value = attributes[attribute]
+        if kind is bool:
+            if not isinstance(value, bool):
+                raise ValueError(f"{attribute} must be a boolean")
+        elif (
+            not isinstance(value, (int, float)) or isinstance(value, bool) or value < 0
+        ):
+            raise ValueError(f"{attribute} must be a non-negative number")
+        kwargs[kwarg] = kind(value)
+    return kwargs
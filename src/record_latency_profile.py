@@ -0,0 +1,100 @@
+"""
+Record the latency profile of the embedder for the fake embedder.
+
+Times OSNetFeatureEmbedder.compute_features, preprocessing included, on
+random person-sized crops at every batch size and writes the median latency
+of each, its relative deviation and the fitted per-batch and per-crop costs
+as JSON. FakeEmbedderMLModel (src/test/fake_embedder_ml_model_service.py)
+replays the profile, so downstream load tests and capacity planning can run
+on machines without the model weights.
+
+    python -m src.record_latency_profile profile.json --batch-sizes 1 2 4 8 16 32
+    python -m src.record_latency_profile profile.json --threads 4 --max-batch-size 16
+"""
+
+import argparse
+import time
+from typing import List, Tuple
+
+import numpy as np
+import torch
+
+from src.person_embedder.latency_profile import LatencyProfile
+from src.person_embedder.os_net_encoder import OSNetFeatureEmbedder
+
+
+def record(
+    embedder: OSNetFeatureEmbedder,
+    batch_sizes: List[int],
+    iterations: int,
+    crop_size: Tuple[int, int] = (300, 120),
+) -> Tuple[List[float], float]:
+    """
+    :return: (median ms of every batch size, median relative deviation).
+    """
+    medians, deviations = [], []
+    for batch_size in batch_sizes:
+        crops = [
+            torch.rand(3, *crop_size, device=embedder.device) * 255
+            for _ in range(batch_size)
+        ]
+        with torch.no_grad():
+            embedder.compute_features(crops)  # warm-up
+            latencies = []
+            for _ in range(iterations):
+                started = time.perf_counter()
+                embedder.compute_features(crops)
+                if embedder.device.type == "cuda":
+                    torch.cuda.synchronize()
+                latencies.append((time.perf_counter() - started) * 1000)
+        medians.append(float(np.median(latencies)))
+        deviations.append(float(np.std(latencies) / np.median(latencies)))
+    return medians, float(np.median(deviations))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n\n", maxsplit=1)[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("output", help="profile JSON file to write")
+    parser.add_argument(
+        "--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32]
+    )
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--threads", type=int, help="intra-op threads")
+    parser.add_argument(
+        "--max-batch-size",
+        type=int,
+        help="micro_batch_size of the service to model, unlimited by default",
+    )
+    parser.add_argument("--fuse-blocks", action="store_true")
+    parser.add_argument("--model-path", help="checkpoint, the bundled one by default")
+    parser.add_argument(
+        "--random-weights", action="store_true", help="skip loading weights"
+    )
+    args = parser.parse_args(argv)
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    embedder = OSNetFeatureEmbedder(
+        args.model_path,
+        random_weights=args.random_weights,
+        fuse_blocks=args.fuse_blocks,
+    )
+    batch_sizes = sorted(set(args.batch_sizes))
+    batch_ms, jitter = record(embedder, batch_sizes, args.iterations)
+    profile = LatencyProfile(batch_sizes, batch_ms, jitter, args.max_batch_size)
+    profile.save(args.output)
+
+    print(f"{'batch':>6}{'ms':>10}{'ms / crop':>11}")
+    for batch_size, ms in zip(batch_sizes, batch_ms):
+        print(f"{batch_size:>6}{ms:>10.2f}{ms / batch_size:>11.2f}")
+    print(
+        f"per batch {profile.per_batch_ms:.2f} ms, per crop "
+        f"{profile.per_crop_ms:.2f} ms, jitter {profile.jitter:.1%}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Replay traffic recorded with `record_traffic` against a local configuration.
+
+Requests are sent to an in-process PersonEmbedderService at their recorded
+arrival times, sped up by `--speed`, whether or not earlier requests
+returned, so the embedder sees the recorded mix of crop sizes, batch sizes
+and bursts. Latency is measured from the scheduled send time.
+
+    python -m src.replay_traffic traffic.rec --speed 4 --config '{"staged_execution": true}'
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from typing import Dict, List, Optional
+
+from google.protobuf.struct_pb2 import Struct
+from viam.proto.app.robot import ServiceConfig
+
+from src.load_test import latency_percentiles, load_attributes
+from src.person_embedder.admission import count_crops
+from src.person_embedder.recorder import read_traffic
+from src.person_embedder_service import PersonEmbedderService
+
+
+async def replay(
+    service: PersonEmbedderService,
+    path: str,
+    speed: float = 1.0,
+    limit: Optional[int] = None,
+) -> Dict:
+    """
+    Send the recorded requests to `service`.
+
+    :param speed: replay speed-up, 0 sends every request at once.
+    :param limit: maximum number of requests to replay.
+    :return: summary with throughput, latency percentiles and the lag of the
+        replay behind the recorded schedule.
+    """
+    requests = []
+    for i, request in enumerate(read_traffic(path)):
+        if limit is not None and i >= limit:
+            break
+        requests.append(request)
+    if not requests:
+        raise ValueError(f"no requests recorded in {path}")
+
+    latencies: List[float] = []
+    errors = 0
+    first_arrival = requests[0][0]
+    started_at = time.monotonic()
+
+    async def send(scheduled_at: float, input_tensors, extra):
+        nonlocal errors
+        try:
+            await service.infer(input_tensors, extra=extra)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            errors += 1
+            print(f"infer failed: {e}")
+            return
+        latencies.append(time.monotonic() - scheduled_at)
+
+    tasks = []
+    max_lag = 0.0
+    for arrived_at, input_tensors, extra in requests:
+        offset = (arrived_at - first_arrival) / speed if speed > 0 else 0.0
+        scheduled_at = started_at + offset
+        await asyncio.sleep(max(0, scheduled_at - time.monotonic()))
+        max_lag = max(max_lag, time.monotonic() - scheduled_at)
+        tasks.append(asyncio.ensure_future(send(scheduled_at, input_tensors, extra)))
+    await asyncio.gather(*tasks)
+    elapsed = time.monotonic() - started_at
+
+    res = {
+        "requests": len(requests),
+        "errors": errors,
+        "crops": sum(count_crops(t) for _, t, _ in requests),
+        "recorded_duration_s": requests[-1][0] - first_arrival,
+        "replay_duration_s": elapsed,
+        "throughput": len(latencies) / max(elapsed, 1e-9),
+        "max_send_lag_ms": max_lag * 1000,
+    }
+    res.update(latency_percentiles(latencies))
+    return res
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("path", help="file written by the traffic recorder")
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="speed-up over the recorded arrival times, 0 for no pacing",
+    )
+    parser.add_argument(
+        "--config",
+        default="{}",
+        help="embedder attributes as JSON, or a path to a JSON file",
+    )
+    parser.add_argument("--limit", type=int, help="replay at most this many requests")
+    parser.add_argument("--output", help="write the summary as JSON")
+    return parser.parse_args(argv)
+
+
+async def main(argv=None):
+    args = parse_args(argv)
+    attributes = load_attributes(args.config)
+    # never record the replay into the file being replayed
+    attributes.pop("record_traffic", None)
+    struct = Struct()
+    struct.update(attributes)
+    service = PersonEmbedderService("replay")
+    service.reconfigure(ServiceConfig(attributes=struct), {})
+    try:
+        summary = await replay(service, args.path, args.speed, args.limit)
+    finally:
+        await service.close()
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,17 +1,66 @@
-from typing import Dict, Mapping, Optional
+import asyncio
+import hashlib
+import math
+from typing import Dict, List, Mapping, Optional
 
 import numpy as np
 from viam.services.mlmodel import MLModel
 from viam.utils import ValueTypes
 
+from src.person_embedder.admission import (
+    AdmissionController,
+    count_crops,
+    is_batched,
+)
+from src.person_embedder.latency_profile import LatencyProfile
+from src.person_embedder.metrics import ServiceMetrics
+from src.person_embedder.utils import l2_normalize
+
 
 class FakeEmbedderMLModel(MLModel):
-    """A fake MLModel service that returns mock embeddings for testing purposes."""
+    """
+    A fake of the embedder service for performance testing without the model.
+
+    It takes the same inputs as the real service and returns an "embedding"
+    per crop after the latency `profile` predicts for the request, with
+    log-normal jitter. At most `max_concurrency` requests are served at
+    once; the others wait in the real service's admission queue, which
+    sheds them with OverloadError when it is full or when their deadline
+    cannot be met.
 
-    def __init__(self, name: str):
+    Embeddings are deterministic: a crop's embedding is the direction of its
+    identity plus `noise` times a direction drawn from the crop's content.
+    The identity is its `track_ids` entry when sent, otherwise the content
+    itself, so the same crop always embeds the same way and the crops of a
+    track stay close to each other.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        profile: Optional[LatencyProfile] = None,
+        max_concurrency: int = 1,
+        max_queue: int = 64,
+        dim: int = 512,
+        noise: float = 0.3,
+        seed: int = 0,
+    ):
+        """
+        :param profile: latency model, none to answer at once.
+        """
         super().__init__(name)
-        # Mock embedding that will be returned
-        self._mock_embedding = np.random.rand(512)  # Example 512-dimensional embedding
+        self.profile = profile
+        self.dim = dim
+        self.noise = noise
+        self.seed = seed
+        self.metrics = ServiceMetrics()
+        self.admission = AdmissionController(
+            max_concurrency=max_concurrency,
+            max_queue=max_queue,
+            initial_crop_ms=profile.latency_ms(1) if profile is not None else 0.0,
+            metrics=self.metrics,
+        )
+        self._jitter = np.random.default_rng(seed)
 
     async def infer(
         self,
@@ -20,17 +69,59 @@ class FakeEmbedderMLModel(MLModel):
         extra: Optional[Mapping[str, ValueTypes]] = None,
         timeout: Optional[float] = None,
     ) -> Dict[str, np.ndarray]:
-        """Return mock embeddings regardless of input.
+        """Return fake embeddings after the modeled latency.
 
         Args:
-            input_tensors: Dictionary of input tensors (ignored in this fake implementation)
-            extra: Optional extra parameters (ignored in this fake implementation)
-            timeout: Optional timeout in seconds (ignored in this fake implementation)
+            input_tensors: Dictionary of input tensors, as sent to the real
+                service: "input" with optional "boxes", "input_lengths" and
+                "track_ids".
+            extra: "caller_id" is used by the admission queue like in the
+                real service.
+            timeout: Deadline of the request in the admission queue.
 
         Returns:
-            Dictionary containing mock embedding tensor
+            "embedding", (D,) for a single crop and (N, D) otherwise.
         """
-        return {"output": self._mock_embedding}
+        crops = count_crops(input_tensors)
+        keys = crop_keys(input_tensors)
+        async with self.admission.admit(
+            crops, timeout, (extra or {}).get("caller_id", None)
+        ):
+            latency_ms = self.sample_latency_ms(crops)
+            await asyncio.sleep(latency_ms / 1000)
+        self.metrics.increment("fake_requests")
+        self.metrics.increment("fake_crops", crops)
+        self.metrics.observe("fake_service_ms", latency_ms)
+        embeddings = self.embed(keys)
+        # the same rule as the real service
+        batched = is_batched(input_tensors)
+        return {"embedding": embeddings if batched else embeddings[0]}
+
+    def sample_latency_ms(self, crops: int) -> float:
+        """Latency of a request of `crops` crops, with jitter."""
+        if self.profile is None:
+            return 0.0
+        latency_ms = self.profile.latency_ms(crops)
+        if self.profile.jitter > 0:
+            # log-normal with the profile's median and relative deviation
+            sigma = math.sqrt(math.log1p(self.profile.jitter**2))
+            latency_ms *= float(self._jitter.lognormal(0.0, sigma))
+        return latency_ms
+
+    def embed(self, keys: List[bytes]) -> np.ndarray:
+        """(N, D) float32 embeddings of crops identified by `keys`."""
+        embeddings = np.empty((len(keys), self.dim), dtype=np.float32)
+        for row, key in enumerate(keys):
+            identity, _, content = key.partition(b"/")
+            embeddings[row] = self._direction(identity) + self.noise * self._direction(
+                content
+            )
+        return l2_normalize(embeddings)
+
+    def _direction(self, key: bytes) -> np.ndarray:
+        digest = hashlib.blake2b(key, digest_size=8).digest()
+        rng = np.random.default_rng([self.seed, int.from_bytes(digest, "little")])
+        return l2_normalize(rng.standard_normal(self.dim))
 
     async def metadata(
         self,
@@ -52,10 +143,10 @@ class FakeEmbedderMLModel(MLModel):
             "type": "encoder",
             "inputs": [
                 {
-                    "name": "image",
+                    "name": "input",
                     "description": "Input image tensor",
-                    "data_type": "uint8",
-                    "shape": [1, 224, 224, 3],  # Example shape
+                    "data_type": "float32",
+                    "shape": [-1, 3, -1, -1],
                 }
             ],
             "outputs": [
@@ -63,7 +154,7 @@ class FakeEmbedderMLModel(MLModel):
                     "name": "embedding",
                     "description": "Output embedding tensor",
                     "data_type": "float32",
-                    "shape": [512],  # Example shape
+                    "shape": [-1, self.dim],
                 }
             ],
         }
@@ -78,11 +169,56 @@ class FakeEmbedderMLModel(MLModel):
         """Handle arbitrary commands.
 
         Args:
-            command: Dictionary of command parameters
+            command: {"get_metrics": {}} returns the fake's request counts,
+                modeled latencies and admission queue under "metrics",
+                {"reset_metrics": {}} clears them.
             timeout: Optional timeout in seconds (ignored in this fake implementation)
             **kwargs: Additional keyword arguments (ignored in this fake implementation)
 
         Returns:
             Dictionary containing command response
         """
+        if "get_metrics" in command:
+            return {"metrics": {**self.metrics.snapshot(), **self.admission.stats()}}
+        if "reset_metrics" in command:
+            self.metrics.reset()
         return {"status": "success"}
+
+
+def crop_keys(input_tensors: Dict[str, np.ndarray]) -> List[bytes]:
+    """
+    `identity/content` key of every crop of a request.
+
+    The content is the crop's pixels, encoded bytes or box, and the identity
+    its `track_ids` entry, or the content when there are no track ids.
+    """
+    image = np.asarray(input_tensors["input"])
+    if "boxes" in input_tensors:
+        frame = hashlib.blake2b(image.tobytes(), digest_size=8).digest()
+        boxes = np.asarray(input_tensors["boxes"], dtype=np.float32).reshape(-1, 4)
+        contents = [frame + box.tobytes() for box in boxes]
+    elif "input_lengths" in input_tensors:
+        lengths = np.asarray(input_tensors["input_lengths"]).reshape(-1)
+        ends = np.cumsum(lengths)
+        data = image.reshape(-1).tobytes()
+        contents = [
+            data[end - length : end]
+            for end, length in zip(ends.tolist(), lengths.tolist())
+        ]
+    elif image.ndim == 4:
+        contents = [crop.tobytes() for crop in image]
+    else:
+        contents = [image.tobytes()]
+    contents = [
+        hashlib.blake2b(content, digest_size=16).hexdigest().encode()
+        for content in contents
+    ]
+    if "track_ids" not in input_tensors:
+        return [content + b"/" + content for content in contents]
+    track_ids = np.asarray(input_tensors["track_ids"]).reshape(-1)
+    if len(track_ids) != len(contents):
+        raise ValueError(f"got {len(track_ids)} track_ids for {len(contents)} crops")
+    return [
+        f"track {track_id}".encode() + b"/" + content
+        for track_id, content in zip(track_ids.tolist(), contents)
+    ]
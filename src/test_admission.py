@@ -0,0 +1,111 @@
+import asyncio
+from typing import Dict
+
+import numpy as np
+import pytest
+from google.protobuf.struct_pb2 import Struct
+from grpclib import Status
+from viam.proto.app.robot import ServiceConfig
+
+from src.person_embedder.admission import AdmissionController, OverloadError
+from src.person_embedder.metrics import ServiceMetrics
+from src.person_embedder_service import PersonEmbedderService
+
+
+def get_config(config_dict: Dict) -> ServiceConfig:
+    struct = Struct()
+    struct.update(dictionary=config_dict)
+    return ServiceConfig(attributes=struct)
+
+
+async def serve(controller, seconds, order=None, name=None, **kwargs):
+    async with controller.admit(1, **kwargs):
+        if order is not None:
+            order.append(name)
+        await asyncio.sleep(seconds)
+
+
+class TestAdmissionController:
+    @pytest.mark.asyncio
+    async def test_earliest_deadline_first(self):
+        controller = AdmissionController(initial_crop_ms=1)
+        order = []
+        blocker = asyncio.create_task(serve(controller, 0.1))
+        await asyncio.sleep(0.01)
+        tasks = [
+            asyncio.create_task(serve(controller, 0.01, order, name, timeout=timeout))
+            for name, timeout in (("late", 3.0), ("early", 1.0), ("none", None))
+        ]
+        await asyncio.sleep(0.01)
+        assert controller.queue_depth() == 3
+        await asyncio.gather(blocker, *tasks)
+        assert order == ["early", "late", "none"]
+
+    @pytest.mark.asyncio
+    async def test_sheds_requests_that_cannot_meet_their_deadline(self):
+        metrics = ServiceMetrics()
+        controller = AdmissionController(initial_crop_ms=100, metrics=metrics)
+        with pytest.raises(OverloadError) as error:
+            async with controller.admit(1, timeout=0.05):
+                pass
+        assert error.value.status == Status.RESOURCE_EXHAUSTED
+
+        # admitted while the estimate said it would fit, expired by the time
+        # the slot it waited for freed up
+        controller.crop_s = 0.001
+        blocker = asyncio.create_task(serve(controller, 0.2))
+        await asyncio.sleep(0.01)
+        with pytest.raises(OverloadError):
+            await serve(controller, 0, timeout=0.1)
+        await blocker
+        assert metrics.snapshot()["admission_shed_deadline"] == 1
+        assert metrics.snapshot()["admission_shed_expired"] == 1
+        assert metrics.snapshot()["admission_shed"] == 2
+        # the service time estimate follows the measured requests
+        assert controller.crop_s > 0.01
+
+    @pytest.mark.asyncio
+    async def test_queue_and_caller_limits(self):
+        metrics = ServiceMetrics()
+        controller = AdmissionController(
+            max_queue=1, max_in_flight_per_caller=2, initial_crop_ms=1, metrics=metrics
+        )
+        blocker = asyncio.create_task(serve(controller, 0.1, caller="a"))
+        await asyncio.sleep(0.01)
+        queued = asyncio.create_task(serve(controller, 0, caller="a", timeout=5))
+        await asyncio.sleep(0.01)
+        with pytest.raises(OverloadError):
+            await serve(controller, 0, caller="a")
+
+        # an earlier deadline evicts the queued request
+        await serve(controller, 0, caller="b", timeout=1)
+        with pytest.raises(OverloadError):
+            await queued
+        await blocker
+        snapshot = metrics.snapshot()
+        assert snapshot["admission_shed_caller_limit"] == 1
+        assert snapshot["admission_shed_queue_full"] == 1
+        assert controller.stats()["admission_running"] == 0
+
+    @pytest.mark.asyncio
+    async def test_service_admission_control(self):
+        config = {"admission_control": True, "admission_initial_crop_ms": 50}
+        service = PersonEmbedderService("test")
+        service.reconfigure(get_config(config), {})
+        try:
+            crops = np.random.rand(2, 3, 256, 128).astype(np.float32) * 255
+            res = await service.infer({"input": crops}, timeout=60)
+            assert res["embedding"].shape == (2, 512)
+            with pytest.raises(OverloadError):
+                await service.infer({"input": crops}, timeout=0.001)
+            metrics = (await service.do_command({"get_metrics": {}}))["metrics"]
+            assert metrics["admission_admitted"] == 1
+            assert metrics["admission_shed_deadline"] == 1
+            assert metrics["admission_queue_depth"] == 0
+        finally:
+            await service.close()
+
+        with pytest.raises(ValueError):
+            PersonEmbedderService.validate_config(
+                get_config({**config, "admission_max_concurrency": 0})
+            )
@@ -0,0 +1,79 @@
+import os
+
+import pytest
+import torch
+
+from src.person_embedder import os_net_encoder
+from src.person_embedder.artifact_cache import ArtifactCache
+from src.person_embedder.metrics import ServiceMetrics
+from src.person_embedder.os_net_encoder import OSNetFeatureEmbedder
+from src.person_embedder_service import PersonEmbedderService
+from src.test_integration import get_config
+
+
+class TestArtifactCache:
+    def test_embedder_loads_cached_artifact(self, tmp_path, monkeypatch):
+        metrics = ServiceMetrics()
+        cache = ArtifactCache(str(tmp_path), metrics=metrics)
+        built = OSNetFeatureEmbedder(fuse_blocks=True, artifact_cache=cache)
+        assert metrics.snapshot()["artifact_cache_misses"] == 1
+        assert len(os.listdir(tmp_path)) == 1
+
+        def fail(*_):
+            raise AssertionError("the checkpoint should not be loaded")
+
+        monkeypatch.setattr(os_net_encoder, "load_pretrained_weights", fail)
+        cached = OSNetFeatureEmbedder(fuse_blocks=True, artifact_cache=cache)
+        assert metrics.snapshot()["artifact_cache_hits"] == 1
+        crops = [torch.rand(3, 200, 90) * 255, torch.rand(3, 300, 120) * 255]
+        torch.testing.assert_close(
+            cached.compute_features(crops), built.compute_features(crops)
+        )
+
+        # other options build another artifact
+        monkeypatch.undo()
+        OSNetFeatureEmbedder(artifact_cache=cache)
+        assert metrics.snapshot()["artifact_cache_misses"] == 2
+        assert len(os.listdir(tmp_path)) == 2
+
+    def test_keys_and_eviction(self, tmp_path):
+        checkpoint = tmp_path / "checkpoint.pth.tar"
+        checkpoint.write_bytes(b"weights")
+        cache = ArtifactCache(str(tmp_path / "cache"), max_mb=3.5)
+        key = cache.key(str(checkpoint), {"fuse_blocks": False})
+        assert key == cache.key(str(checkpoint), {"fuse_blocks": False})
+        assert key != cache.key(str(checkpoint), {"fuse_blocks": True})
+        checkpoint.write_bytes(b"other weights")
+        assert key != cache.key(str(checkpoint), {"fuse_blocks": False})
+
+        one_mb = {"weight": torch.zeros(2**18)}
+        for i, name in enumerate(("a", "b", "c")):
+            cache.save(name, one_mb)
+            os.utime(cache.path(name), (i, i))
+        assert cache.load("a") is not None  # a is now the most recently used
+        cache.save("d", one_mb)
+        assert not os.path.exists(cache.path("b"))
+        assert all(os.path.exists(cache.path(name)) for name in ("a", "c", "d"))
+        assert not [name for name in os.listdir(cache.cache_dir) if "tmp" in name]
+
+        with open(cache.path("c"), "wb") as f:
+            f.write(b"truncated")
+        assert cache.load("c") is None
+        assert not os.path.exists(cache.path("c"))
+        assert cache.load("missing") is None
+
+    def test_service_artifact_cache(self, tmp_path):
+        config = {"artifact_cache": True, "artifact_cache_dir": str(tmp_path)}
+        service = PersonEmbedderService("test")
+        service.reconfigure(get_config(config), None)
+        service.reconfigure(get_config(config), None)
+        metrics = service.metrics.snapshot()
+        assert metrics["artifact_cache_misses"] == 1
+        assert metrics["artifact_cache_hits"] == 1
+
+        for attributes in (
+            {"artifact_cache": True, "artifact_cache_dir": 1},
+            {"artifact_cache": True, "artifact_cache_max_mb": -1},
+        ):
+            with pytest.raises(ValueError):
+                PersonEmbedderService.validate_config(get_config(attributes))
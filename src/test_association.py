@@ -0,0 +1,113 @@
+import itertools
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from src.person_embedder.association import (
+    associate,
+    association_cost,
+    linear_assignment,
+    pairwise_iou,
+)
+from src.person_embedder_service import PersonEmbedderService
+from src.test_integration import IMG_PATH, WORKING_CONFIG_DICT, get_config
+
+
+def brute_force_cost(cost):
+    n, m = cost.shape
+    if n <= m:
+        return min(
+            sum(cost[i, p[i]] for i in range(n))
+            for p in itertools.permutations(range(m), n)
+        )
+    return min(
+        sum(cost[p[j], j] for j in range(m))
+        for p in itertools.permutations(range(n), m)
+    )
+
+
+class TestAssociation:
+    def test_linear_assignment_is_optimal(self):
+        rng = np.random.default_rng(0)
+        for n, m in ((1, 1), (3, 3), (4, 6), (6, 4), (5, 5)):
+            cost = rng.random((n, m))
+            res = linear_assignment(cost)
+            assigned = res >= 0
+            assert np.count_nonzero(assigned) == min(n, m)
+            assert len(set(res[assigned])) == min(n, m)
+            total = cost[np.flatnonzero(assigned), res[assigned]].sum()
+            assert total == pytest.approx(brute_force_cost(cost))
+
+    def test_gating_and_greedy(self):
+        cost = np.array([[0.1, 0.2], [0.15, 0.9], [np.inf, 0.3]])
+        # greedy takes 0.1 first and leaves row 1 without a track
+        assert associate(cost, "greedy").tolist() == [0, -1, 1]
+        assert associate(cost, "hungarian").tolist() == [1, 0, -1]
+        assert associate(cost, "hungarian", max_cost=0.25).tolist() == [1, 0, -1]
+        assert associate(cost, "greedy", max_cost=0.25).tolist() == [0, -1, -1]
+        assert associate(np.zeros((2, 0))).tolist() == [-1, -1]
+        with pytest.raises(ValueError):
+            associate(cost, "auction")
+
+    def test_cost_matrix(self):
+        embeddings = np.array([[1.0, 0.0], [0.0, 2.0]], dtype=np.float32)
+        tracks = np.array([[0.0, 1.0], [3.0, 0.0], [1.0, 1.0]], dtype=np.float32)
+        cost = association_cost(embeddings, tracks)
+        np.testing.assert_allclose(
+            cost, [[1, 0, 1 - 0.5**0.5], [0, 1, 1 - 0.5**0.5]], atol=1e-6
+        )
+
+        boxes = np.array([[0, 0, 10, 10], [100, 100, 110, 110]], dtype=np.float32)
+        track_boxes = np.array(
+            [[0, 0, 10, 10], [0, 5, 10, 15], [100, 100, 110, 110]], dtype=np.float32
+        )
+        iou = pairwise_iou(boxes, track_boxes)
+        np.testing.assert_allclose(iou, [[1, 1 / 3, 0], [0, 0, 1]], atol=1e-6)
+        cost = association_cost(
+            embeddings, tracks, boxes, track_boxes, iou_weight=0.5, min_iou=0.2
+        )
+        assert cost[0, 0] == pytest.approx(0.5)
+        assert np.isinf(cost[0, 2]) and np.isinf(cost[1, 0])
+
+    @pytest.mark.asyncio
+    async def test_infer_association(self):
+        service = PersonEmbedderService("test")
+        service.reconfigure(get_config(WORKING_CONFIG_DICT), None)
+        image = np.array(Image.open(IMG_PATH), dtype=np.float32).transpose(2, 0, 1)
+        boxes = np.array(
+            [[0, 0, 200, 400], [300, 100, 500, 500], [100, 50, 300, 250]],
+            dtype=np.float32,
+        )
+        embeddings = (await service.infer({"input": image, "boxes": boxes}))[
+            "embedding"
+        ]
+        order = [2, 0, 1]
+        res = await service.infer(
+            {
+                "input": image,
+                "boxes": boxes,
+                "track_embeddings": embeddings[order],
+                "track_boxes": boxes[order],
+            },
+            extra={"association_min_iou": 0.5, "return_costs": True},
+        )
+        np.testing.assert_allclose(res["embedding"], embeddings, atol=1e-5)
+        assert res["assignment"].tolist() == [1, 2, 0]
+        assert res["cost"].shape == (3, 3)
+
+        # a track far from every crop is gated out
+        res = await service.infer(
+            {
+                "input": image,
+                "boxes": boxes[:1],
+                "track_embeddings": embeddings[:1],
+                "track_boxes": boxes[1:2],
+            },
+            extra={"association_min_iou": 0.1, "association": "greedy"},
+        )
+        assert res["assignment"].tolist() == [-1]
+        with pytest.raises(ValueError):
+            await service.infer(
+                {"input": image, "track_embeddings": embeddings, "track_boxes": boxes}
+            )
@@ -0,0 +1,109 @@
+import asyncio
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from src.person_embedder.autotune import Autotuner, PauseGate, powers_of_two
+from src.person_embedder.os_net_encoder import OSNetFeatureEmbedder
+from src.person_embedder_service import PersonEmbedderService
+from src.test_integration import get_config
+
+
+@pytest.fixture(scope="module")
+def embedder():
+    return OSNetFeatureEmbedder(random_weights=True)
+
+
+class TestAutotune:
+    def test_powers_of_two(self):
+        assert powers_of_two(1) == [1]
+        assert powers_of_two(6) == [1, 2, 4, 6]
+        assert powers_of_two(8) == [1, 2, 4, 8]
+
+    def test_sweep_respects_slo_and_caches(self, embedder, tmp_path):
+        tuner = Autotuner(
+            embedder,
+            latency_slo_ms=1e6,
+            max_batch_size=4,
+            iterations=1,
+            cache_dir=str(tmp_path),
+            thread_counts=[1],
+        )
+        result = tuner.run()
+        assert result["meets_slo"]
+        assert result["batch_size"] in (1, 2, 4)
+        assert embedder.max_batch_size == result["batch_size"]
+        assert embedder.backend == result["backend"]
+        assert len(result["trials"]) == 3 * len(tuner.backends)
+        assert (tmp_path / "autotune.json").exists()
+
+        # a second start reuses the cached result instead of sweeping
+        tuner.sweep = None
+        assert tuner.run() == result
+
+    def test_sweep_stops_growing_batches_past_slo(self, embedder, tmp_path):
+        tuner = Autotuner(
+            embedder,
+            latency_slo_ms=1e-3,
+            max_batch_size=8,
+            iterations=1,
+            cache_dir=str(tmp_path),
+            thread_counts=[1],
+        )
+        result = tuner.sweep()
+        assert not result["meets_slo"]
+        # only batch size 1 was measured for each backend
+        assert {t["batch_size"] for t in result["trials"]} == {1}
+
+    def test_pause_gate(self):
+        gate = PauseGate()
+        order = []
+
+        def tune():
+            with gate.paused():
+                order.append("tune")
+
+        def request():
+            with gate.enter():
+                order.append("request")
+
+        tuner = threading.Thread(target=tune)
+        waiting = threading.Thread(target=request)
+        with gate.enter():
+            tuner.start()
+            # the sweep waits for the running request, new requests for the sweep
+            time.sleep(0.05)
+            assert gate.is_paused
+            waiting.start()
+            time.sleep(0.05)
+            assert not order
+        tuner.join(timeout=5)
+        waiting.join(timeout=5)
+        assert order == ["tune", "request"]
+
+    @pytest.mark.asyncio
+    async def test_autotune_command(self, tmp_path):
+        service = PersonEmbedderService("test")
+        service.reconfigure(
+            get_config(
+                {
+                    "autotune": True,
+                    "autotune_max_batch_size": 2,
+                    "autotune_iterations": 1,
+                    "autotune_cache_dir": str(tmp_path),
+                    "staged_execution": True,
+                }
+            ),
+            None,
+        )
+        assert service.engine.micro_batch_size == service.autotune_result["batch_size"]
+        crops = np.zeros((2, 3, 256, 128), dtype=np.float32)
+        res, embeddings = await asyncio.gather(
+            service.do_command({"autotune": {"force": True}}),
+            service.infer({"input": crops}),
+        )
+        assert res["autotune"]["batch_size"] in (1, 2)
+        assert embeddings["embedding"].shape == (2, 512)
+        await service.close()
@@ -0,0 +1,102 @@
+import json
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+from src.evaluate_cascade import main as evaluate_main
+from src.evaluate_cascade import split_gallery
+from src.person_embedder.cascade import match_margins, select_escalations
+from src.person_embedder.utils import crop_boxes
+from src.person_embedder_service import PersonEmbedderService
+from src.test_integration import IMG_PATH, get_config
+
+CASCADE_CONFIG = {"cascade": True, "random_weights": True}
+
+
+class TestCascade:
+    def test_match_margins_and_escalations(self):
+        gallery = np.array([[1.0, 0.0], [0.0, 1.0]], dtype=np.float32)
+        embeddings = np.array([[1.0, 0.1], [1.0, 1.0], [0.0, 3.0]], dtype=np.float32)
+        best, similarity, margin = match_margins(embeddings, gallery)
+        assert best.tolist() == [0, 0, 1]
+        assert similarity[2] == pytest.approx(1.0)
+        assert margin[1] == pytest.approx(0.0, abs=1e-6)
+        assert margin[0] > 0.8
+
+        margins = np.array([0.5, 0.01, 0.3, 0.02])
+        assert select_escalations(margins, 0.4).tolist() == [1, 2, 3]
+        # capped to the most ambiguous half
+        assert select_escalations(margins, 0.4, max_fraction=0.5).tolist() == [1, 3]
+        assert select_escalations(margins, 0.0).tolist() == []
+
+    @pytest.mark.asyncio
+    async def test_infer_cascade(self):
+        image = np.array(Image.open(IMG_PATH), dtype=np.float32).transpose(2, 0, 1)
+        boxes = np.array(
+            [[0, 0, 200, 400], [300, 100, 500, 500], [100, 50, 300, 250]],
+            dtype=np.float32,
+        )
+        service = PersonEmbedderService("test")
+        service.reconfigure(get_config({**CASCADE_CONFIG, "cascade_margin": 2}), None)
+        full = (await service.infer({"input": image, "boxes": boxes}))["embedding"]
+        crops = crop_boxes(torch.from_numpy(image), boxes)
+        small = service.cascade.small.compute_features(crops).numpy()
+        gallery = {"gallery_embeddings": full, "gallery_embeddings_small": small}
+
+        # a margin no match can reach escalates every crop
+        res = await service.infer({"input": image, "boxes": boxes, **gallery})
+        assert res["escalated"].tolist() == [1, 1, 1]
+        assert res["match"].tolist() == [0, 1, 2]
+        np.testing.assert_allclose(res["embedding"], full, atol=1e-4)
+
+        # a fresh reconfigure would draw new random weights, so keep the models
+        service.cascade.margin = 0
+        res = await service.infer({"input": image, "boxes": boxes, **gallery})
+        assert res["escalated"].tolist() == [0, 0, 0]
+        # random small-model embeddings nearly coincide, so only check consistency
+        best, _, margin = match_margins(res["embedding_small"], small)
+        assert res["match"].tolist() == best.tolist()
+        np.testing.assert_allclose(res["margin"], margin, atol=1e-5)
+        assert not np.any(res["embedding"])
+        np.testing.assert_allclose(res["embedding_small"], small, atol=1e-4)
+        metrics = (await service.do_command({"get_metrics": {}}))["metrics"]
+        assert metrics["cascade_crops"] == 6
+        assert metrics["cascade_escalated"] == 3
+        assert metrics["cascade_escalation_fraction_mean"] == pytest.approx(0.5)
+
+        with pytest.raises(ValueError):
+            await service.infer({"input": image, "gallery_embeddings": full})
+        with pytest.raises(ValueError):
+            PersonEmbedderService.validate_config(get_config({"cascade": True}))
+
+    def test_evaluate_cascade(self, tmp_path):
+        image = Image.open(IMG_PATH).convert("RGB")
+        for identity, box in (("a", (0, 0, 200, 400)), ("b", (300, 100, 500, 500))):
+            (tmp_path / identity).mkdir()
+            for i in range(3):
+                image.crop((box[0] + i, box[1], box[2] + i, box[3])).save(
+                    tmp_path / identity / f"{i}.jpg"
+                )
+        labels = np.array(["a", "a", "a", "b", "b", "b"])
+        gallery, queries = split_gallery(labels, 1)
+        assert gallery.tolist() == [0, 3] and queries.tolist() == [1, 2, 4, 5]
+
+        output = tmp_path / "results.json"
+        evaluate_main(
+            [
+                str(tmp_path),
+                "--random-weights",
+                "--margins",
+                "0",
+                "2",
+                "--output",
+                str(output),
+            ]
+        )
+        results = {r["config"]: r for r in json.loads(output.read_text())["results"]}
+        assert results["margin 0"]["escalated"] == 0
+        assert results["margin 0"]["rank1"] == results["small"]["rank1"]
+        assert results["margin 2"]["escalated"] == 1
+        assert results["margin 2"]["rank1"] == results["large"]["rank1"]
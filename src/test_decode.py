@@ -0,0 +1,48 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+from src.person_embedder.decode import ImageDecoder, decode_image, is_encoded_image
+
+IMG_PATH = "./src/test/alex/alex_3.jpg"
+
+
+def encode(image: Image.Image, image_format: str = "JPEG") -> np.ndarray:
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format)
+    return np.frombuffer(buffer.getvalue(), dtype=np.uint8)
+
+
+class TestDecode:
+    def test_scaled_jpeg_decoding(self):
+        data = encode(Image.open(IMG_PATH)).tobytes()
+        full, full_scale = decode_image(data)
+        assert full.shape == (3, 1224, 1170)
+        assert full_scale == 1
+
+        # DCT scaling picks 1/4, the smallest factor that is still >= 0.2
+        reduced, scale = decode_image(data, 0.2)
+        assert reduced.shape == (3, 306, 293)
+        assert abs(scale - 0.25) < 0.01
+
+    def test_decode_crops_and_frame(self):
+        image = Image.open(IMG_PATH)
+        decoder = ImageDecoder((256, 128), max_workers=2)
+        crops = [image.crop((0, 0, 512, 1024)), image.crop((0, 0, 50, 100))]
+        encoded = [encode(crops[0]), encode(crops[1], "PNG")]
+        buffer = np.concatenate(encoded)
+        assert is_encoded_image(buffer)
+
+        decoded = decoder.decode_crops(buffer, np.array([len(e) for e in encoded]))
+        # the big JPEG crop is decoded at 1/4 scale, the PNG at full resolution
+        assert tuple(decoded[0].shape) == (3, 256, 128)
+        assert tuple(decoded[1].shape) == (3, 100, 50)
+
+        boxes = np.array([[0, 0, 400, 800], [600, 200, 800, 600]], dtype=np.float32)
+        frame, frame_crops, frame_size = decoder.decode_frame(encode(image), boxes)
+        assert frame_size == (1224, 1170)
+        # the smallest box needs 0.64 of the original resolution, so 1/1 is kept
+        assert tuple(frame.shape) == (3, 1224, 1170)
+        assert tuple(frame_crops[1].shape) == (3, 400, 200)
+        decoder.shutdown()
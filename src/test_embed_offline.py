@@ -0,0 +1,77 @@
+import json
+
+import numpy as np
+import torch
+from PIL import Image
+
+from src.embed_offline import main, read_boxes
+from src.person_embedder.os_net_encoder import OSNetFeatureEmbedder
+from src.test_integration import IMG_PATH
+
+
+def write_crops(directory):
+    image = Image.open(IMG_PATH).convert("RGB")
+    (directory / "a").mkdir()
+    image.crop((0, 0, 200, 400)).save(directory / "a" / "0.jpg")
+    image.crop((100, 50, 500, 250)).save(directory / "a" / "1.png")
+    image.save(directory / "frame.jpg")
+
+
+class TestEmbedOffline:
+    def test_embeds_and_resumes(self, tmp_path):
+        images = tmp_path / "images"
+        images.mkdir()
+        write_crops(images)
+        output = tmp_path / "out"
+        argv = [str(images), str(output), "--batch-size", "2"]
+        main(argv)
+
+        ids = (output / "ids.txt").read_text().split()
+        assert ids == ["a/0.jpg", "a/1.png", "frame.jpg"]
+        embeddings = np.load(output / "embeddings.npy")
+        assert embeddings.shape == (3, 512)
+
+        embedder = OSNetFeatureEmbedder()
+        crop = torch.from_numpy(
+            np.asarray(Image.open(images / "a" / "1.png"), dtype=np.float32)
+        ).permute(2, 0, 1)
+        expected = embedder.compute_features([crop]).numpy()[0]
+        np.testing.assert_allclose(embeddings[1], expected, atol=1e-4)
+
+        # interrupted after the first batch: the second run only redoes the rest
+        matrix = np.load(output / "embeddings.npy", mmap_mode="r+")
+        matrix[2] = 0
+        matrix.flush()
+        del matrix
+        (output / "progress.json").write_text(
+            json.dumps(
+                {
+                    **json.loads((output / "progress.json").read_text()),
+                    "done": 2,
+                }
+            )
+        )
+        main(argv)
+        np.testing.assert_allclose(
+            np.load(output / "embeddings.npy"), embeddings, atol=1e-5
+        )
+
+    def test_box_file(self, tmp_path):
+        images = tmp_path / "images"
+        images.mkdir()
+        write_crops(images)
+        boxes = tmp_path / "boxes.csv"
+        boxes.write_text(
+            "key,x1,y1,x2,y2\nframe.jpg,0,0,200,400\nframe.jpg,100,50,500,250\n"
+        )
+        assert read_boxes(str(boxes))["frame.jpg"].shape == (2, 4)
+        output = tmp_path / "out"
+        main([str(images), str(output), "--boxes", str(boxes)])
+
+        assert (output / "ids.txt").read_text().split() == [
+            "frame.jpg#0",
+            "frame.jpg#1",
+        ]
+        embeddings = np.load(output / "embeddings.npy")
+        assert embeddings.shape == (2, 512)
+        assert np.all(np.any(embeddings != 0, axis=1))
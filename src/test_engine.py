@@ -0,0 +1,63 @@
+from concurrent.futures import wait
+
+import numpy as np
+import pytest
+import torch
+
+from src.person_embedder.engine import StagedExecutionEngine
+from src.person_embedder.os_net_encoder import OSNetFeatureEmbedder
+
+
+def random_crops(count: int):
+    generator = torch.Generator().manual_seed(0)
+    return [
+        torch.rand((3, 100 + 7 * i, 40 + 3 * i), generator=generator) * 255
+        for i in range(count)
+    ]
+
+
+class TestStagedExecutionEngine:
+    def test_matches_direct_computation(self):
+        embedder = OSNetFeatureEmbedder(aspect_ratio_buckets=[(256, 128), (192, 128)])
+        engine = StagedExecutionEngine(
+            embedder, preprocess_workers=2, micro_batch_size=4
+        )
+        try:
+            crops = random_crops(11)
+            expected = embedder.compute_features(crops).numpy()
+            futures = [engine.submit(crops), engine.submit(crops[:3])]
+            wait(futures, timeout=60)
+            np.testing.assert_allclose(futures[0].result(), expected, atol=1e-4)
+            np.testing.assert_allclose(futures[1].result(), expected[:3], atol=1e-4)
+
+            utilization = engine.utilization()
+            for stage in ("preprocess", "model", "postprocess"):
+                assert 0 < utilization[f"engine_{stage}_utilization"] <= 1
+        finally:
+            engine.shutdown()
+
+    def test_normalize_and_empty_batch(self):
+        embedder = OSNetFeatureEmbedder()
+        engine = StagedExecutionEngine(embedder, normalize=True)
+        try:
+            res = engine.submit(random_crops(2)).result(timeout=60)
+            np.testing.assert_allclose(np.linalg.norm(res, axis=1), 1, rtol=1e-5)
+            assert engine.submit([]).result().shape == (0, 512)
+        finally:
+            engine.shutdown()
+
+    def test_failing_head(self):
+        embedder = OSNetFeatureEmbedder()
+        # a head with one row too many fails when its rows are put in place
+        embedder.heads["broken"] = lambda featuremaps: torch.zeros(
+            featuremaps.shape[0] + 1, 2
+        )
+        engine = StagedExecutionEngine(embedder)
+        try:
+            with pytest.raises(ValueError):
+                engine.submit(random_crops(2), with_heads=True).result(timeout=60)
+            # the postprocess thread survives and serves the next requests
+            res = engine.submit(random_crops(2)).result(timeout=60)
+            assert res.shape == (2, 512)
+        finally:
+            engine.shutdown()
@@ -0,0 +1,127 @@
+import asyncio
+import json
+import time
+
+import numpy as np
+import pytest
+
+from src.load_test import main as load_test_main
+from src.person_embedder.admission import OverloadError
+from src.person_embedder.latency_profile import LatencyProfile
+from src.test.fake_embedder_ml_model_service import FakeEmbedderMLModel
+
+
+class TestFakeEmbedder:
+    def test_latency_profile(self, tmp_path):
+        profile = LatencyProfile([1, 4, 16], [10.0, 16.0, 40.0], jitter=0.1)
+        assert profile.latency_ms(1) == 10
+        assert profile.latency_ms(2) == pytest.approx(12)
+        # past the recorded sizes, at the per-crop cost of the largest ones
+        assert profile.latency_ms(20) == pytest.approx(48)
+        assert profile.per_crop_ms == pytest.approx(2, abs=0.1)
+        profile.max_batch_size = 4
+        assert profile.latency_ms(9) == pytest.approx(2 * 16 + 10)
+        path = str(tmp_path / "profile.json")
+        profile.save(path)
+        loaded = LatencyProfile.load(path)
+        assert loaded.to_dict() == profile.to_dict()
+        for sizes, ms in (([4, 1], [1.0, 2.0]), ([1, 2], [1.0])):
+            with pytest.raises(ValueError):
+                LatencyProfile(sizes, ms)
+
+    @pytest.mark.asyncio
+    async def test_embeddings(self):
+        fake = FakeEmbedderMLModel("fake")
+        rng = np.random.default_rng(0)
+        crops = rng.random((3, 3, 64, 32)).astype(np.float32)
+        res = await fake.infer({"input": crops})
+        assert res["embedding"].shape == (3, 512)
+        np.testing.assert_allclose(
+            np.linalg.norm(res["embedding"], axis=1), 1, rtol=1e-5
+        )
+        single = await fake.infer({"input": crops[1]})
+        assert single["embedding"].shape == (512,)
+        again = await FakeEmbedderMLModel("other").infer({"input": crops})
+        np.testing.assert_array_equal(again["embedding"], res["embedding"])
+        assert np.max(np.triu(res["embedding"] @ res["embedding"].T, 1)) < 0.5
+
+        # crops of one track stay close, different tracks do not
+        tracked = await fake.infer({"input": crops, "track_ids": np.array([7, 7, 8])})
+        similarity = tracked["embedding"] @ tracked["embedding"].T
+        assert similarity[0, 1] > 0.85 and similarity[0, 2] < 0.5
+        frame = rng.random((3, 100, 100)).astype(np.float32)
+        boxes = np.array([[0, 0, 50, 100], [50, 0, 100, 100]], dtype=np.float32)
+        res = await fake.infer({"input": frame, "boxes": boxes})
+        assert res["embedding"].shape == (2, 512)
+        encoded = np.frombuffer(b"abcdefgh", dtype=np.uint8)
+        res = await fake.infer({"input": encoded, "input_lengths": np.array([3, 5])})
+        assert res["embedding"].shape == (2, 512)
+        # one crop with input_lengths is still a batch, as in the real service
+        res = await fake.infer({"input": encoded, "input_lengths": np.array([8])})
+        assert res["embedding"].shape == (1, 512)
+        res = await fake.infer({"input": encoded})
+        assert res["embedding"].shape == (512,)
+        with pytest.raises(ValueError):
+            await fake.infer({"input": crops, "track_ids": np.array([1])})
+
+    @pytest.mark.asyncio
+    async def test_latency_and_queueing(self):
+        fake = FakeEmbedderMLModel(
+            "fake", LatencyProfile.constant(per_batch_ms=20, per_crop_ms=10)
+        )
+        crops = np.zeros((4, 3, 8, 8), dtype=np.float32)
+        started = time.perf_counter()
+        await asyncio.gather(*(fake.infer({"input": crops}) for _ in range(3)))
+        # one at a time, 60 ms each
+        assert time.perf_counter() - started >= 0.17
+        metrics = (await fake.do_command({"get_metrics": {}}))["metrics"]
+        assert metrics["fake_requests"] == 3
+        assert metrics["fake_crops"] == 12
+        assert metrics["fake_service_ms_mean"] == pytest.approx(60)
+        assert metrics["admission_wait_ms_mean"] > 0
+
+        fake = FakeEmbedderMLModel(
+            "fake",
+            LatencyProfile.constant(per_crop_ms=20, jitter=0.2),
+            max_concurrency=2,
+            max_queue=1,
+        )
+        results = await asyncio.gather(
+            *(fake.infer({"input": crops[0]}) for _ in range(4)),
+            return_exceptions=True,
+        )
+        assert sum(isinstance(r, OverloadError) for r in results) == 1
+        latencies = [fake.sample_latency_ms(1) for _ in range(1000)]
+        assert np.median(latencies) == pytest.approx(20, rel=0.05)
+        assert np.std(latencies) / np.mean(latencies) == pytest.approx(0.2, rel=0.2)
+        # requests that cannot meet their deadline are shed
+        with pytest.raises(OverloadError):
+            await fake.infer({"input": crops}, timeout=0.01)
+
+    @pytest.mark.asyncio
+    async def test_load_test_against_fake(self, tmp_path):
+        profile = str(tmp_path / "profile.json")
+        LatencyProfile.constant(per_batch_ms=5, per_crop_ms=2).save(profile)
+        output = tmp_path / "load_test.json"
+        await load_test_main(
+            [
+                "--cameras",
+                "2",
+                "--duration",
+                "0.5",
+                "--report-interval",
+                "0.25",
+                "--fake-profile",
+                profile,
+                "--output",
+                str(output),
+            ]
+        )
+        with open(output, encoding="utf-8") as f:
+            res = json.load(f)
+        assert res["summary"]["requests"] > 0
+        assert res["summary"]["errors"] == 0
+        assert (
+            res["summary"]["fake_metrics"]["fake_requests"]
+            >= res["summary"]["requests"]
+        )
@@ -0,0 +1,70 @@
+import copy
+
+import pytest
+import torch
+
+from src.benchmark_osblock import benchmark
+from src.person_embedder.fused_osnet import FusedOSBlock, fuse_os_blocks
+from src.person_embedder.os_net_encoder import OSNetFeatureEmbedder
+from src.person_embedder.osnet import OSBlock, OSBlockINin, osnet_ain_x0_25
+
+
+def randomize_batchnorms(model: torch.nn.Module):
+    """Non-trivial running statistics, so folding them is actually exercised."""
+    generator = torch.Generator().manual_seed(0)
+    for module in model.modules():
+        if isinstance(module, torch.nn.BatchNorm2d):
+            size = module.num_features
+            module.running_mean.copy_(torch.rand(size, generator=generator) - 0.5)
+            module.running_var.copy_(torch.rand(size, generator=generator) + 0.5)
+            module.weight.data.copy_(torch.rand(size, generator=generator) + 0.5)
+            module.bias.data.copy_(torch.rand(size, generator=generator) - 0.5)
+
+
+class TestFusedOSNet:
+    def test_fused_model_matches(self):
+        model = osnet_ain_x0_25(pretrained=False).eval()
+        randomize_batchnorms(model)
+        fused = copy.deepcopy(model)
+        assert fuse_os_blocks(fused) == 6
+        assert not any(isinstance(m, (OSBlock, OSBlockINin)) for m in fused.modules())
+        inputs = torch.randn(3, 3, 256, 128)
+        with torch.no_grad():
+            torch.testing.assert_close(
+                fused(inputs), model(inputs), atol=1e-5, rtol=1e-4
+            )
+
+        with pytest.raises(ValueError):
+            fuse_os_blocks(copy.deepcopy(model).train())
+
+    def test_fused_blocks_match(self):
+        model = osnet_ain_x0_25(pretrained=False).eval()
+        randomize_batchnorms(model)
+        for block in (model.conv2[0], model.conv2[1]):  # OSBlockINin, OSBlock
+            fused = FusedOSBlock(block)
+            # the four streams run as four levels of one pointwise and one depthwise op
+            assert len(fused.streams.pointwise_weights) == 3
+            assert len(fused.streams.depthwise) == 4
+            inputs = torch.randn(2, block.conv1.conv.in_channels, 64, 32)
+            with torch.no_grad():
+                torch.testing.assert_close(
+                    fused(inputs), block(inputs), atol=1e-5, rtol=1e-4
+                )
+
+    def test_embedder_fuse_blocks(self):
+        embedder = OSNetFeatureEmbedder()
+        fused = OSNetFeatureEmbedder(fuse_blocks=True)
+        crops = [torch.rand(3, 200, 90) * 255, torch.rand(3, 300, 120) * 255]
+        torch.testing.assert_close(
+            fused.compute_features(crops),
+            embedder.compute_features(crops),
+            atol=1e-4,
+            rtol=1e-4,
+        )
+
+    def test_benchmark(self):
+        model = osnet_ain_x0_25(pretrained=False).eval()
+        results = benchmark(model, [1], iterations=1)
+        assert [r["block"] for r in results][-1] == "model"
+        assert len(results) == 7
+        assert all(r["max_abs_error"] < 1e-4 for r in results)
@@ -0,0 +1,161 @@
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from src.benchmark_gallery import synthetic_embeddings
+from src.person_embedder.gallery import PrototypeGallery
+from src.person_embedder.utils import l2_normalize
+from src.person_embedder_service import PersonEmbedderService
+from src.test_integration import IMG_PATH, get_config
+
+
+class TestGallery:
+    def test_consolidation(self):
+        embeddings, labels = synthetic_embeddings(20, 60, appearances=3)
+        gallery = PrototypeGallery(max_prototypes=4, nlist=4, nprobe=4)
+        gallery.add(labels, embeddings)
+        queries = embeddings[::30]
+        pending, _ = gallery.search(queries)
+        assert gallery.consolidate() == len(embeddings)
+        stats = gallery.stats()
+        assert stats["gallery_pending"] == 0
+        # near-duplicate frames merge into one prototype per appearance
+        assert 20 <= stats["gallery_prototypes"] <= 60
+        exact, similarity = gallery.search(queries, k=3)
+        np.testing.assert_array_equal(exact[:, 0], labels[::30])
+        np.testing.assert_array_equal(pending[:, 0], exact[:, 0])
+        assert np.all(np.diff(similarity, axis=1) <= 0)
+        assert len(set(exact[0])) == 3
+        # scanning every inverted list is exact
+        approximate, _ = gallery.search(queries, k=3, approximate=True)
+        np.testing.assert_array_equal(approximate, exact)
+
+        # at most max_prototypes, weighted towards the heavier embeddings
+        gallery = PrototypeGallery(max_prototypes=2, merge_threshold=0.99)
+        rng = np.random.default_rng(0)
+        vectors = l2_normalize(rng.normal(size=(6, 16)))
+        gallery.add([7] * 6, vectors, weights=[1, 1, 1, 1, 1, 0])
+        gallery.add([7], vectors[:1], weights=[100])
+        gallery.consolidate()
+        assert gallery.stats() == {
+            "gallery_identities": 1,
+            "gallery_prototypes": 2,
+            "gallery_pending": 0,
+            "gallery_embeddings_added": 6,
+        }
+        ids, similarity = gallery.search(vectors[:1], k=2)
+        assert ids.tolist() == [[7, -1]]
+        assert similarity[0, 0] > 0.95
+
+    def test_remove_and_evict(self):
+        rng = np.random.default_rng(0)
+        vectors = l2_normalize(rng.normal(size=(4, 16))).astype(np.float32)
+        gallery = PrototypeGallery(max_identities=3)
+        gallery.add([0, 1, 2], vectors[:3])
+        gallery.consolidate()
+        gallery.add([3], vectors[3:])
+        # identity 0 was updated least recently
+        assert gallery.search(vectors[:1])[0][0, 0] != 0
+        assert gallery.stats()["gallery_identities"] == 3
+        size = gallery.memory_bytes()
+        assert gallery.remove([1, 5]) == 1
+        ids, _ = gallery.search(vectors, k=4)
+        assert sorted(set(ids.ravel()) - {-1}) == [2, 3]
+        gallery.consolidate()
+        assert gallery.memory_bytes() < size
+        gallery.clear()
+        assert gallery.search(vectors)[0].ravel().tolist() == [-1] * 4
+
+        # the background thread consolidates
+        gallery.add([1], vectors[:1])
+        gallery.start(0.01)
+        deadline = time.monotonic() + 5
+        while gallery.stats()["gallery_pending"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        gallery.stop()
+        assert gallery.stats()["gallery_prototypes"] == 1
+
+    @pytest.mark.asyncio
+    async def test_service_gallery(self):
+        image = np.array(Image.open(IMG_PATH), dtype=np.float32).transpose(2, 0, 1)
+        boxes = np.array([[0, 0, 200, 400], [300, 100, 500, 500]], dtype=np.float32)
+        service = PersonEmbedderService("test")
+        service.reconfigure(
+            get_config(
+                {
+                    "random_weights": True,
+                    "gallery": True,
+                    "gallery_consolidate_interval_s": 0,
+                }
+            ),
+            None,
+        )
+        res = await service.infer(
+            {"input": image, "boxes": boxes, "gallery_ids": np.array([4, 9])},
+            extra={"gallery_search": 1},
+        )
+        # searched before the crops are added
+        assert res["gallery_identity"].tolist() == [[-1], [-1]]
+        res = await service.infer(
+            {"input": image, "boxes": boxes}, extra={"gallery_search": 2}
+        )
+        assert res["gallery_identity"][:, 0].tolist() == [4, 9]
+        np.testing.assert_allclose(res["gallery_similarity"][:, 0], 1, atol=1e-5)
+
+        stats = (await service.do_command({"gallery_consolidate": {}}))["gallery"]
+        assert stats["gallery_prototypes"] == 2
+        single = await service.infer(
+            {"input": image[:, :400, :200]},
+            extra={"gallery_search": 1, "gallery_approximate": True},
+        )
+        assert single["gallery_identity"].tolist() == [4]
+        await service.do_command(
+            {"gallery_add": {"identities": [5], "embeddings": [[1.0] * 512]}}
+        )
+        assert (await service.do_command({"gallery_remove": {"identities": [4]}})) == {
+            "removed": 1
+        }
+        metrics = (await service.do_command({"get_metrics": {}}))["metrics"]
+        assert metrics["gallery_identities"] == 2
+        assert metrics["gallery_added"] == 3
+        memory = (await service.do_command({"get_memory": {}}))["memory"]
+        assert memory["gallery_mb"] > 0
+
+        with pytest.raises(ValueError):
+            await service.infer({"input": image}, extra={"gallery_search": 0})
+        with pytest.raises(ValueError):
+            await service.infer(
+                {"input": image, "boxes": boxes, "gallery_ids": np.array([1])}
+            )
+        await service.close()
+
+        service.reconfigure(get_config({"random_weights": True}), None)
+        with pytest.raises(ValueError):
+            await service.infer({"input": image}, extra={"gallery_search": 1})
+        for attributes in (
+            {"gallery": 1},
+            {"gallery": True, "gallery_max_prototypes": 0},
+            {"gallery": True, "gallery_merge_threshold": 1.5},
+        ):
+            with pytest.raises(ValueError):
+                PersonEmbedderService.validate_config(get_config(attributes))
+
+    def test_memory_budget_caps_gallery(self):
+        service = PersonEmbedderService("test")
+        service.reconfigure(
+            get_config(
+                {
+                    "random_weights": True,
+                    "gallery": True,
+                    "gallery_max_identities": 10**6,
+                    "memory_budget_mb": 80,
+                }
+            ),
+            None,
+        )
+        plan = service.memory_budget.plan
+        assert 0 < service.gallery.max_identities == plan["max_identities"] < 10**6
+        assert plan["planned_mb"] <= plan["budget_mb"]
+        service.gallery.stop()
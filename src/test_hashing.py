@@ -0,0 +1,126 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from src.benchmark_gallery import synthetic_embeddings
+from src.person_embedder.gallery import PrototypeGallery
+from src.person_embedder.hashing import (
+    BinaryHasher,
+    HammingIndex,
+    as_words,
+    fit_projection,
+    hamming_distances,
+    popcount,
+)
+from src.person_embedder_service import PersonEmbedderService
+from src.test_integration import IMG_PATH, get_config
+
+
+class TestHashing:
+    def test_hamming_distances(self):
+        rng = np.random.default_rng(0)
+        words = rng.integers(0, 2**63, size=(5, 4), dtype=np.uint64)
+        expected = [bin(int(w)).count("1") for w in words.ravel()]
+        assert popcount(words).ravel().tolist() == expected
+        codes = rng.integers(0, 256, size=(7, 32), dtype=np.uint8)
+        bits = np.unpackbits(codes, axis=1)
+        np.testing.assert_array_equal(
+            hamming_distances(as_words(codes[:3]), as_words(codes)),
+            (bits[:3, None] != bits[None]).sum(axis=2),
+        )
+
+    @pytest.mark.parametrize("method", ["itq", "random"])
+    def test_fit_and_search(self, method, tmp_path):
+        embeddings, _ = synthetic_embeddings(100, 20, dim=256)
+        is_query = np.arange(len(embeddings)) % 20 == 0
+        queries, vectors = embeddings[is_query], embeddings[~is_query]
+        projection, mean = fit_projection(vectors, 128, method)
+        assert projection.shape == (256, 128) and mean.shape == (256,)
+        path = str(tmp_path / "codes.npz")
+        BinaryHasher(projection, mean).save(path)
+        hasher = BinaryHasher.load(path)
+        assert (hasher.dim, hasher.bits) == (256, 128)
+        codes = hasher.encode(vectors)
+        assert codes.shape == (len(vectors), 16) and codes.dtype == np.uint8
+
+        index = HammingIndex(hasher, vectors)
+        rows, similarity = index.search(queries, k=5, candidates=64)
+        truth = np.argsort(-(queries @ vectors.T), axis=1)[:, :5]
+        assert np.mean(rows[:, 0] == truth[:, 0]) >= 0.9
+        assert np.mean([len(set(r) & set(t)) for r, t in zip(rows, truth)]) >= 4
+        assert np.all(np.diff(similarity, axis=1) <= 0)
+
+        for bits in (100, 512):
+            with pytest.raises(ValueError):
+                fit_projection(vectors, bits, method)
+        with pytest.raises(ValueError):
+            fit_projection(vectors, 128, "lsh")
+
+    def test_gallery_hamming_search(self):
+        embeddings, labels = synthetic_embeddings(50, 20)
+        projection, mean = fit_projection(embeddings, 256)
+        gallery = PrototypeGallery(hasher=BinaryHasher(projection, mean))
+        gallery.add(labels, embeddings)
+        queries = embeddings[::20]
+        with pytest.raises(ValueError):
+            gallery.search(queries, hamming=True, approximate=True)
+        gallery.consolidate()
+        exact, similarity = gallery.search(queries, k=2)
+        hamming, hamming_similarity = gallery.search(queries, k=2, hamming=True)
+        np.testing.assert_array_equal(hamming[:, 0], exact[:, 0])
+        np.testing.assert_allclose(
+            hamming_similarity[:, 0], similarity[:, 0], rtol=1e-5
+        )
+        with pytest.raises(ValueError):
+            PrototypeGallery().search(queries, hamming=True)
+
+    @pytest.mark.asyncio
+    async def test_service_codes(self, tmp_path):
+        image = np.array(Image.open(IMG_PATH), dtype=np.float32).transpose(2, 0, 1)
+        boxes = np.array([[0, 0, 200, 400], [300, 100, 500, 500]], dtype=np.float32)
+        projection, mean = fit_projection(
+            np.random.default_rng(0).normal(size=(10, 512)), 128, "random"
+        )
+        path = str(tmp_path / "codes.npz")
+        BinaryHasher(projection, mean).save(path)
+        service = PersonEmbedderService("test")
+        service.reconfigure(
+            get_config(
+                {
+                    "random_weights": True,
+                    "binary_codes_path": path,
+                    "gallery": True,
+                    "gallery_consolidate_interval_s": 0,
+                }
+            ),
+            None,
+        )
+        res = await service.infer(
+            {"input": image, "boxes": boxes, "gallery_ids": np.array([4, 9])}
+        )
+        assert res["embedding_code"].shape == (2, 16)
+        np.testing.assert_array_equal(
+            res["embedding_code"], service.hasher.encode(res["embedding"])
+        )
+        single = await service.infer({"input": image[:, :400, :200]})
+        assert single["embedding_code"].shape == (16,)
+        await service.do_command({"gallery_consolidate": {}})
+        res = await service.infer(
+            {"input": image, "boxes": boxes},
+            extra={"gallery_search": 1, "gallery_hamming": True},
+        )
+        assert res["gallery_identity"][:, 0].tolist() == [4, 9]
+        await service.close()
+
+        with pytest.raises(ValueError):
+            PersonEmbedderService.validate_config(
+                get_config({"binary_codes_path": "codes.npy"})
+            )
+        projection, mean = fit_projection(
+            np.random.default_rng(0).normal(size=(10, 256)), 128, "random"
+        )
+        BinaryHasher(projection, mean).save(path)
+        with pytest.raises(ValueError):
+            service.reconfigure(
+                get_config({"random_weights": True, "binary_codes_path": path}), None
+            )
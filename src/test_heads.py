@@ -0,0 +1,116 @@
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+from src.person_embedder.heads import load_head, validate_heads
+from src.person_embedder.os_net_encoder import OSNetFeatureEmbedder
+from src.person_embedder_service import PersonEmbedderService
+from src.test_integration import IMG_PATH, get_config
+
+
+class ColorHead(torch.nn.Module):
+    """A stand-in attribute head: pooled feature maps -> 3 scores."""
+
+    def __init__(self):
+        super().__init__()
+        self.fc = torch.nn.Linear(512, 3)
+
+    def forward(self, featuremaps: torch.Tensor) -> torch.Tensor:
+        return self.fc(featuremaps.mean(dim=(2, 3)))
+
+
+@pytest.fixture(name="head_path")
+def fixture_head_path(tmp_path):
+    torch.manual_seed(0)
+    path = str(tmp_path / "color.pt")
+    torch.jit.script(ColorHead().eval()).save(path)
+    return path
+
+
+class TestHeads:
+    def test_compute_outputs(self, head_path):
+        embedder = OSNetFeatureEmbedder(random_weights=True, heads={"color": head_path})
+        crops = [torch.rand(3, 200, 90) * 255, torch.rand(3, 300, 120) * 255]
+        outputs = embedder.compute_outputs(crops)
+        assert set(outputs) == {"embedding", "color"}
+        torch.testing.assert_close(
+            outputs["embedding"], embedder.compute_features(crops)
+        )
+
+        ((_, batch),) = embedder.prepare_batches(crops)
+        with torch.no_grad():
+            featuremaps = embedder.model(batch, return_featuremaps=True)
+        head = load_head(head_path, embedder.device)
+        torch.testing.assert_close(outputs["color"], head(featuremaps))
+
+    @pytest.mark.asyncio
+    async def test_infer_heads(self, head_path):
+        image = np.array(Image.open(IMG_PATH), dtype=np.float32).transpose(2, 0, 1)
+        boxes = np.array([[0, 0, 200, 400], [300, 100, 500, 500]], dtype=np.float32)
+        config = {"random_weights": True, "heads": {"color": head_path}}
+        service = PersonEmbedderService("test")
+        # the same random weights in every configuration
+        torch.manual_seed(0)
+        service.reconfigure(get_config(config), None)
+        res = await service.infer({"input": image, "boxes": boxes})
+        assert res["embedding"].shape == (2, 512)
+        assert res["color"].shape == (2, 3)
+        single = await service.infer({"input": image[:, :400, :200]})
+        assert single["color"].shape == (3,)
+
+        # the staged engine returns the same outputs
+        torch.manual_seed(0)
+        service.reconfigure(get_config({**config, "staged_execution": True}), None)
+        staged = await service.infer({"input": image, "boxes": boxes})
+        np.testing.assert_allclose(staged["color"], res["color"], atol=1e-5)
+        np.testing.assert_allclose(staged["embedding"], res["embedding"], atol=1e-5)
+
+        # reused track embeddings have no head output
+        service.reconfigure(get_config({**config, "track_scheduler": True}), None)
+        inputs = {"input": image, "boxes": boxes, "track_ids": np.array([1, 2])}
+        await service.infer(inputs)
+        reused = await service.infer(inputs)
+        assert reused["recomputed"].tolist() == [0, 0]
+        assert not np.any(reused["color"])
+        await service.close()
+
+    def test_validate_heads(self, head_path):
+        assert validate_heads({"color": head_path}) == {"color": head_path}
+        for heads in (
+            {"embedding": head_path},
+            {"color": "color.tflite"},
+            {"color": 1},
+            [head_path],
+        ):
+            with pytest.raises(ValueError):
+                PersonEmbedderService.validate_config(get_config({"heads": heads}))
+
+    def test_onnx_head_without_onnxruntime(self, monkeypatch):
+        monkeypatch.setattr(
+            "src.person_embedder.heads.onnxruntime_available", lambda: False
+        )
+        with pytest.raises(ValueError, match="onnxruntime"):
+            PersonEmbedderService.validate_config(
+                get_config({"heads": {"color": "color.onnx"}})
+            )
+
+    def test_onnx_head(self, tmp_path):
+        pytest.importorskip("onnxruntime")
+        path = str(tmp_path / "color.onnx")
+        head = ColorHead().eval()
+        featuremaps = torch.rand(2, 512, 16, 8)
+        torch.onnx.export(
+            head,
+            featuremaps,
+            path,
+            input_names=["featuremaps"],
+            dynamic_axes={"featuremaps": {0: "batch"}},
+        )
+        with torch.no_grad():
+            torch.testing.assert_close(
+                load_head(path, torch.device("cpu"))(featuremaps),
+                head(featuremaps),
+                atol=1e-5,
+                rtol=1e-4,
+            )
@@ -10,6 +10,8 @@ from viam.proto.app.robot import ServiceConfig
 from src.person_embedder_service import PersonEmbedderService
 
 WORKING_CONFIG_DICT = {}
+CONFIG_WITH_BUCKETS = {"aspect_ratio_buckets": True}
+CONFIG_WITH_QUALITY_GATE = {"quality_gate": True, "quality_min_sharpness": 0}
 CONFIG_WITH_MODEL_PATH = {"model_path": "./src/models/osnet/osnet_ain_ms_d_c.pth.tar"}
 IMG_PATH = "./src/test/alex/alex_2.jpeg"
 
@@ -98,6 +100,93 @@ class TestTracker:
         # Also verify shapes are the same
         assert embedding_default.shape == embedding_explicit.shape == (512,)
 
+    @pytest.mark.asyncio
+    async def test_infer_with_boxes(self):
+        """Test that a frame plus boxes returns one embedding per box."""
+        service = PersonEmbedderService("test")
+        service.reconfigure(get_config(WORKING_CONFIG_DICT), None)
+        image_array = np.array(Image.open(IMG_PATH), dtype=np.uint8)
+        input_array = image_array.transpose(2, 0, 1).astype(np.float32)
+        boxes = np.array([[0, 0, 200, 400], [100, 50, 500, 250]], dtype=np.float32)
+
+        res = await service.infer({"input": input_array, "boxes": boxes})
+        assert res["embedding"].shape == (2, 512)
+
+        # Batched inference must match running each crop on its own
+        single = await service.infer({"input": input_array[:, 0:400, 0:200]})
+        np.testing.assert_allclose(res["embedding"][0], single["embedding"], atol=1e-4)
+
+    @pytest.mark.asyncio
+    async def test_aspect_ratio_buckets(self):
+        """Test that bucketing keeps output order and reports saved padding."""
+        service = PersonEmbedderService("test")
+        service.reconfigure(get_config(CONFIG_WITH_BUCKETS), None)
+        image_array = np.array(Image.open(IMG_PATH), dtype=np.uint8)
+        input_array = image_array.transpose(2, 0, 1).astype(np.float32)
+        # tall crop -> 256x128, square crop -> 192x128, thin crop -> 256x96
+        boxes = np.array(
+            [[0, 0, 200, 400], [100, 100, 400, 400], [0, 0, 150, 400]],
+            dtype=np.float32,
+        )
+
+        res = await service.infer({"input": input_array, "boxes": boxes})
+        assert res["embedding"].shape == (3, 512)
+        metrics = (await service.do_command({"get_metrics": {}}))["metrics"]
+        assert 0 < metrics["padding_fraction_saved_last"] < 1
+
+        single = await service.infer({"input": input_array[:, 100:400, 100:400]})
+        np.testing.assert_allclose(res["embedding"][1], single["embedding"], atol=1e-4)
+
+    @pytest.mark.asyncio
+    async def test_quality_gate_skips_rejected_crops(self):
+        """Test that rejected crops get a zero embedding and a cleared valid flag."""
+        service = PersonEmbedderService("test")
+        service.reconfigure(get_config(CONFIG_WITH_QUALITY_GATE), None)
+        image_array = np.array(Image.open(IMG_PATH), dtype=np.uint8)
+        input_array = image_array.transpose(2, 0, 1).astype(np.float32)
+        boxes = np.array([[100, 50, 300, 450], [100, 50, 108, 70]], dtype=np.float32)
+
+        res = await service.infer({"input": input_array, "boxes": boxes})
+        assert res["embedding"].shape == (2, 512)
+        assert res["valid"].tolist() == [1, 0]
+        assert res["quality"].shape == (2,)
+        assert np.all(res["embedding"][1] == 0)
+        assert np.any(res["embedding"][0] != 0)
+
+        res = await service.infer(
+            {"input": input_array, "boxes": np.zeros((0, 4), dtype=np.float32)}
+        )
+        assert res["embedding"].shape == (0, 512)
+        assert res["valid"].shape == (0,)
+
+    @pytest.mark.asyncio
+    async def test_track_clip_pooling(self):
+        """Test that a clip of crops is pooled into one embedding in one call."""
+        service = PersonEmbedderService("test")
+        service.reconfigure(get_config(WORKING_CONFIG_DICT), None)
+        image_array = np.array(Image.open(IMG_PATH), dtype=np.uint8)
+        input_array = image_array.transpose(2, 0, 1).astype(np.float32)
+        clip = np.stack([input_array[:, :400, :200], input_array[:, 100:500, 300:500]])
+
+        frames = (await service.infer({"input": clip}))["embedding"]
+        res = await service.infer(
+            {"input": clip},
+            extra={"clip_pooling": "mean", "return_frames": True},
+        )
+        assert res["embedding"].shape == (512,)
+        np.testing.assert_allclose(res["frame_embeddings"], frames, atol=1e-5)
+        np.testing.assert_allclose(res["embedding"], frames.mean(axis=0), atol=1e-5)
+
+        weights = np.array([0.0, 1.0], dtype=np.float32)
+        res = await service.infer(
+            {"input": clip, "weights": weights}, extra={"clip_pooling": "weighted"}
+        )
+        np.testing.assert_allclose(res["embedding"], frames[1], atol=1e-5)
+        assert "frame_embeddings" not in res
+
+        res = await service.infer({"input": clip}, extra={"clip_pooling": "max"})
+        np.testing.assert_allclose(res["embedding"], frames.max(axis=0), atol=1e-5)
+
 
 if __name__ == "__main__":
     # Run all tests with pytest
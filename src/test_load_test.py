@@ -0,0 +1,41 @@
+import json
+
+import pytest
+
+from src.load_test import latency_percentiles, main
+
+
+class TestLoadTest:
+    def test_latency_percentiles(self):
+        res = latency_percentiles([i / 1000 for i in range(1, 101)])
+        assert res["p50_ms"] == pytest.approx(50.5)
+        assert res["p99_ms"] == pytest.approx(99.01)
+        assert latency_percentiles([]) == {
+            "p50_ms": None,
+            "p95_ms": None,
+            "p99_ms": None,
+        }
+
+    @pytest.mark.asyncio
+    async def test_closed_loop_against_module(self, tmp_path):
+        """Test a short run against the module started through src/main.py."""
+        output = tmp_path / "load_test.json"
+        await main(
+            [
+                "--cameras",
+                "2",
+                "--duration",
+                "1",
+                "--report-interval",
+                "0.5",
+                "--random-weights",
+                "--output",
+                str(output),
+            ]
+        )
+        with open(output, encoding="utf-8") as f:
+            res = json.load(f)
+        assert res["summary"]["requests"] > 0
+        assert res["summary"]["errors"] == 0
+        assert res["summary"]["p50_ms"] > 0
+        assert len(res["timeline"]) >= 2
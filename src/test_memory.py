@@ -0,0 +1,165 @@
+import gc
+import weakref
+
+import numpy as np
+import pytest
+import torch
+from viam.components.camera import Camera
+from viam.services.vision import Vision
+
+from src.person_embedder.memory import (
+    MB,
+    MemoryBudget,
+    MemoryBudgetError,
+    measure_activation_bytes,
+    module_bytes,
+)
+from src.person_embedder.os_net_encoder import (
+    OSNetFeatureEmbedder,
+    load_pretrained_weights,
+)
+from src.person_embedder.osnet import osnet_ain_x0_25
+from src.person_embedder_service import PersonEmbedderService
+from src.test.fake_camera import FakeCamera
+from src.test.fake_detector_vision_service import FakeDetectorVisionService
+from src.test_integration import get_config
+from src.test_pipeline import IMG_FOLDER
+
+
+class TestMemory:
+    def test_activations_grow_with_batch_size(self):
+        embedder = OSNetFeatureEmbedder(random_weights=True)
+        assert module_bytes(embedder.model) == sum(
+            t.nbytes for t in embedder.model.state_dict().values()
+        )
+        one = measure_activation_bytes(embedder, batch_size=1)
+        four = measure_activation_bytes(embedder, batch_size=4)
+        # the largest activations of OSNet at 256x128 are a few MB per crop
+        assert 1 * MB < one < 64 * MB
+        assert four == pytest.approx(one, rel=0.3)
+
+    def test_budget_fit(self):
+        embedder = OSNetFeatureEmbedder(random_weights=True)
+        weights_mb = module_bytes(embedder.model) / MB
+        crop_mb = measure_activation_bytes(embedder) / MB + 3 * 256 * 128 * 4 / MB
+
+        plan = MemoryBudget(weights_mb + 10.5 * crop_mb).fit(
+            [embedder], max_tracks=1000, track_bytes=2560
+        )
+        assert plan["max_tracks"] == 1000
+        assert 8 <= plan["batch_size"] <= 11
+        assert plan["planned_mb"] <= plan["budget_mb"]
+        # a requested batch size is kept when it fits
+        plan = MemoryBudget(weights_mb + 10.5 * crop_mb).fit([embedder], batch_size=4)
+        assert plan["batch_size"] == 4
+
+        # the track cache gets at most half of what is left after one crop
+        plan = MemoryBudget(weights_mb + 3 * crop_mb).fit(
+            [embedder], max_tracks=10**6, track_bytes=2560
+        )
+        assert plan["max_tracks"] * 2560 <= crop_mb * MB
+        assert plan["batch_size"] >= 1
+
+        with pytest.raises(MemoryBudgetError):
+            MemoryBudget(weights_mb).fit([embedder])
+
+    def test_load_pretrained_weights_discards(self, tmp_path):
+        source = osnet_ain_x0_25(pretrained=False)
+        state_dict = {f"module.{k}": v for k, v in source.state_dict().items()}
+        state_dict["module.classifier.weight"] = torch.zeros(7, 512)
+        path = tmp_path / "checkpoint.pth.tar"
+        torch.save({"state_dict": state_dict, "optimizer": {"lr": 0.1}}, path)
+
+        model = osnet_ain_x0_25(pretrained=False)
+        load_pretrained_weights(model, str(path))
+        for key, value in source.state_dict().items():
+            if key.startswith("classifier"):
+                # shape mismatch, the initialization is kept
+                assert model.state_dict()[key].shape != (7, 512)
+            else:
+                torch.testing.assert_close(model.state_dict()[key], value)
+
+    @pytest.mark.asyncio
+    async def test_service_memory_budget(self):
+        service = PersonEmbedderService("test")
+        service.reconfigure(
+            get_config(
+                {
+                    "random_weights": True,
+                    "track_scheduler": True,
+                    "memory_budget_mb": 80,
+                }
+            ),
+            None,
+        )
+        plan = service.memory_budget.plan
+        assert service.embedder.max_batch_size == plan["batch_size"] >= 1
+        assert service.track_scheduler.max_tracks == plan["max_tracks"] == 1000
+        memory = (await service.do_command({"get_memory": {}}))["memory"]
+        assert memory["budget"] == plan
+        assert memory["peak_rss_mb"] > 0
+        assert memory["weights_mb"] == pytest.approx(plan["weights_mb"])
+        assert memory["tracks_mb"] == 0
+
+        # the previous model is released by a reconfigure
+        old_model = weakref.ref(service.embedder.model)
+        service.reconfigure(get_config({"random_weights": True}), None)
+        gc.collect()
+        assert old_model() is None
+        assert service.memory_budget is None
+        assert "budget" not in (await service.do_command({"get_memory": {}}))["memory"]
+
+        with pytest.raises(MemoryBudgetError):
+            service.reconfigure(
+                get_config({"random_weights": True, "memory_budget_mb": 5}), None
+            )
+        # the failed reconfigure leaves the service unconfigured
+        with pytest.raises(ValueError, match="not configured"):
+            await service.infer({"input": np.zeros((3, 256, 128), np.float32)})
+
+        # concurrent requests each need their own activations
+        service.reconfigure(
+            get_config({"random_weights": True, "memory_budget_mb": 300}), None
+        )
+        batch_size = service.memory_budget.plan["batch_size"]
+        service.reconfigure(
+            get_config(
+                {
+                    "random_weights": True,
+                    "memory_budget_mb": 300,
+                    "admission_control": True,
+                    "admission_max_concurrency": 4,
+                }
+            ),
+            None,
+        )
+        admission_batch_size = service.memory_budget.plan["batch_size"]
+        assert admission_batch_size < batch_size
+        # so do the camera pipeline's, next to the admitted ones
+        service.reconfigure(
+            get_config(
+                {
+                    "random_weights": True,
+                    "memory_budget_mb": 300,
+                    "admission_control": True,
+                    "admission_max_concurrency": 4,
+                    "camera_name": "camera",
+                    "detector_name": "detector",
+                }
+            ),
+            {
+                Camera.get_resource_name("camera"): FakeCamera(
+                    "camera", IMG_FOLDER, use_ring_buffer=True
+                ),
+                Vision.get_resource_name("detector"): FakeDetectorVisionService(
+                    "detector"
+                ),
+            },
+        )
+        assert service.memory_budget.plan["batch_size"] < admission_batch_size
+        await service.close()
+        for budget_mb in (0, "1", True):
+            with pytest.raises(ValueError):
+                PersonEmbedderService.validate_config(
+                    get_config({"memory_budget_mb": budget_mb})
+                )
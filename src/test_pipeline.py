@@ -0,0 +1,60 @@
+import asyncio
+from typing import Dict
+
+import pytest
+from google.protobuf.struct_pb2 import Struct
+from viam.components.camera import Camera
+from viam.proto.app.robot import ServiceConfig
+from viam.services.vision import Vision
+
+from src.person_embedder_service import PersonEmbedderService
+from src.test.fake_camera import FakeCamera
+from src.test.fake_detector_vision_service import FakeDetectorVisionService
+
+IMG_FOLDER = "./src/test/alex"
+PIPELINE_CONFIG_DICT = {
+    "camera_name": "camera",
+    "detector_name": "detector",
+    "pipeline_max_fps": 20,
+}
+
+
+def get_config(config_dict: Dict) -> ServiceConfig:
+    struct = Struct()
+    struct.update(dictionary=config_dict)
+    return ServiceConfig(attributes=struct)
+
+
+class TestPipeline:
+    def test_validate_config_returns_dependencies(self):
+        config = get_config(PIPELINE_CONFIG_DICT)
+        assert PersonEmbedderService.validate_config(config) == ["camera", "detector"]
+        with pytest.raises(ValueError):
+            PersonEmbedderService.validate_config(get_config({"camera_name": "camera"}))
+
+    @pytest.mark.asyncio
+    async def test_pipeline_produces_latest_embeddings(self):
+        dependencies = {
+            Camera.get_resource_name("camera"): FakeCamera(
+                "camera", IMG_FOLDER, use_ring_buffer=True
+            ),
+            Vision.get_resource_name("detector"): FakeDetectorVisionService("detector"),
+        }
+        service = PersonEmbedderService("test")
+        service.reconfigure(get_config(PIPELINE_CONFIG_DICT), dependencies)
+        try:
+            latest = {}
+            for _ in range(100):
+                latest = await service.do_command({"get_latest": {}})
+                if latest:
+                    break
+                await asyncio.sleep(0.05)
+            # the fake detector returns a person and a car, only persons are embedded
+            assert [d["class_name"] for d in latest["detections"]] == ["person"]
+            assert len(latest["embedding"]) == 1
+            assert len(latest["embedding"][0]) == 512
+            metrics = (await service.do_command({"get_metrics": {}}))["metrics"]
+            assert metrics["pipeline_frames_embedded"] >= 1
+        finally:
+            await service.close()
+        assert service.pipeline is None
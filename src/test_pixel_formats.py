@@ -0,0 +1,83 @@
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+from src.person_embedder.os_net_encoder import OSNetFeatureEmbedder
+from src.person_embedder.pixel_formats import RawFrameCrops, yuv_planes, yuv_to_rgb
+
+IMG_PATH = "./src/test/alex/alex_3.jpg"
+BOXES = np.array([[100, 101, 501, 900], [600, 300, 1000, 500]], dtype=np.float32)
+
+
+def load_rgb() -> np.ndarray:
+    # crop to even dimensions for the 4:2:0 formats
+    image = np.asarray(Image.open(IMG_PATH).convert("RGB"), dtype=np.float64)
+    return image[:1224, :1170]
+
+
+def rgb_to_nv12(rgb: np.ndarray) -> np.ndarray:
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    y = 16 + 0.257 * r + 0.504 * g + 0.098 * b
+    u = 128 - 0.148 * r - 0.291 * g + 0.439 * b
+    v = 128 + 0.439 * r - 0.368 * g - 0.071 * b
+    height, width = y.shape
+    u = u.reshape(height // 2, 2, width // 2, 2).mean(axis=(1, 3))
+    v = v.reshape(height // 2, 2, width // 2, 2).mean(axis=(1, 3))
+    uv = np.stack([u, v], axis=-1).reshape(height // 2, width)
+    return np.clip(np.round(np.concatenate([y, uv])), 0, 255).astype(np.uint8)
+
+
+def nv12_to_rgb_full_frame(nv12: np.ndarray) -> torch.Tensor:
+    """Reference conversion of the whole frame, as clients did before."""
+    y, uv = yuv_planes(nv12, "nv12")
+    uv = F.interpolate(
+        uv.float().unsqueeze(0), scale_factor=2, mode="bilinear", align_corners=False
+    )
+    return yuv_to_rgb(torch.cat([y.float()[None, None], uv], dim=1))[0]
+
+
+class TestPixelFormats:
+    def test_nv12_letterbox_matches_rgb_path(self):
+        embedder = OSNetFeatureEmbedder()
+        nv12 = rgb_to_nv12(load_rgb())
+        reference = nv12_to_rgb_full_frame(nv12)
+        raw = RawFrameCrops(nv12, "nv12", BOXES)
+
+        for i, box in enumerate(raw.boxes):
+            x1, y1, x2, y2 = box
+            expected = embedder.preprocess(
+                embedder._letterbox(reference[:, y1:y2, x1:x2], embedder.input_shape)
+            )
+            fused = raw.letterbox(
+                [i], embedder.input_shape, embedder.pixel_mean, embedder.pixel_std
+            )
+            # the fused path resizes before clamping to 0-255 and samples real
+            # neighbours on the crop border, so allow a few intensity levels
+            difference = (fused - expected).abs() * embedder.pixel_std.view(1, 3, 1, 1)
+            assert difference.max() < 4
+            assert difference.mean() < 0.05
+            # crop-level conversion of the same box
+            torch.testing.assert_close(
+                raw[i], reference[:, y1:y2, x1:x2], atol=1.0, rtol=0
+            )
+
+        expected_features = embedder.compute_features(
+            [reference[:, y1:y2, x1:x2] for x1, y1, x2, y2 in raw.boxes]
+        )
+        features = embedder.compute_features(raw)
+        similarity = F.cosine_similarity(features, expected_features)
+        assert torch.all(similarity > 0.99)
+
+    def test_bgr_matches_rgb_path(self):
+        embedder = OSNetFeatureEmbedder()
+        rgb = load_rgb().astype(np.uint8)
+        raw = RawFrameCrops(np.ascontiguousarray(rgb[..., ::-1]), "bgr", BOXES)
+        reference = torch.from_numpy(rgb).permute(2, 0, 1).float()
+
+        features = embedder.compute_features(raw)
+        expected_features = embedder.compute_features(
+            [reference[:, y1:y2, x1:x2] for x1, y1, x2, y2 in raw.boxes]
+        )
+        similarity = F.cosine_similarity(features, expected_features)
+        assert torch.all(similarity > 0.99)
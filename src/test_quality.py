@@ -0,0 +1,46 @@
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from src.person_embedder.quality import CropQualityGate
+
+
+def textured_crop(height: int, width: int) -> torch.Tensor:
+    generator = torch.Generator().manual_seed(0)
+    return torch.rand((3, height, width), generator=generator) * 255
+
+
+class TestCropQualityGate:
+    def test_rejects_small_and_wide_crops(self):
+        gate = CropQualityGate(min_sharpness=0)
+        crops = [textured_crop(200, 80), textured_crop(20, 8), textured_crop(60, 200)]
+        quality, valid = gate.score(crops)
+        assert valid.tolist() == [True, False, False]
+        assert quality[0] > quality[1]
+        assert quality[0] > quality[2]
+
+    def test_blurry_crop_scores_lower(self):
+        gate = CropQualityGate(min_sharpness=200)
+        sharp = textured_crop(256, 128)
+        blurry = F.avg_pool2d(sharp.unsqueeze(0), 9, stride=1, padding=4)[0]
+        quality, valid = gate.score([sharp, blurry])
+        assert valid.tolist() == [True, False]
+        assert quality[0] > quality[1]
+
+    def test_truncated_boxes(self):
+        crops = [textured_crop(200, 80), textured_crop(200, 80)]
+        boxes = np.array([[100, 100, 180, 300], [0, 100, 80, 300]])
+        quality, valid = CropQualityGate(min_sharpness=0).score(
+            crops, boxes, (480, 640)
+        )
+        assert valid.tolist() == [True, True]
+        assert quality[1] < quality[0]
+
+        _, valid = CropQualityGate(min_sharpness=0, reject_truncated=True).score(
+            crops, boxes, (480, 640)
+        )
+        assert valid.tolist() == [True, False]
+
+    def test_no_crops(self):
+        quality, valid = CropQualityGate().score([], np.zeros((0, 4)), (480, 640))
+        assert quality.shape == (0,) and valid.shape == (0,)
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from src.person_embedder.recorder import (
+    TrafficRecorder,
+    decode_tensor,
+    encode_tensor,
+    read_traffic,
+)
+from src.person_embedder_service import PersonEmbedderService
+from src.replay_traffic import replay
+from src.test_integration import IMG_PATH, get_config
+
+
+def get_frame() -> np.ndarray:
+    return np.array(Image.open(IMG_PATH), dtype=np.float32).transpose(2, 0, 1)
+
+
+class TestRecorder:
+    def test_tensor_round_trip(self):
+        frame = get_frame()[:, :200, :100]
+        codec, data = encode_tensor(frame)
+        assert codec == "jpeg"
+        assert len(data) < frame.nbytes / 10
+        decoded = decode_tensor(codec, data, frame.dtype.str, frame.shape)
+        assert decoded.shape == frame.shape
+        assert np.abs(decoded - frame).mean() < 5
+
+        boxes = np.array([[0, 0, 10, 20]], dtype=np.float32)
+        codec, data = encode_tensor(boxes)
+        assert codec == "zlib"
+        np.testing.assert_array_equal(
+            decode_tensor(codec, data, boxes.dtype.str, boxes.shape), boxes
+        )
+
+    def test_size_cap(self, tmp_path):
+        path = str(tmp_path / "traffic.rec")
+        recorder = TrafficRecorder(path, max_mb=0.02)
+        crop = get_frame()[:, :256, :128]
+        for _ in range(20):
+            recorder.record({"input": crop})
+        recorder.close()
+        records = list(read_traffic(path))
+        assert 0 < len(records) < 20
+        assert tmp_path.joinpath("traffic.rec").stat().st_size <= 0.02 * 1024 * 1024
+
+    @pytest.mark.asyncio
+    async def test_record_and_replay(self, tmp_path):
+        path = str(tmp_path / "traffic.rec")
+        service = PersonEmbedderService("test")
+        service.reconfigure(
+            get_config({"record_traffic": True, "record_path": path}), None
+        )
+        frame = get_frame()
+        boxes = np.array([[0, 0, 200, 400], [100, 50, 500, 250]], dtype=np.float32)
+        await service.infer({"input": frame, "boxes": boxes})
+        await service.infer(
+            {"input": frame[:, :400, :200]}, extra={"clip_pooling": "max"}
+        )
+        await service.close()
+
+        records = list(read_traffic(path))
+        assert len(records) == 2
+        assert records[0][0] <= records[1][0]
+        np.testing.assert_array_equal(records[0][1]["boxes"], boxes)
+        assert records[0][1]["input"].shape == frame.shape
+        assert records[1][2] == {"clip_pooling": "max"}
+
+        replay_service = PersonEmbedderService("replay")
+        replay_service.reconfigure(get_config({}), None)
+        summary = await replay(replay_service, path, speed=0)
+        assert summary["requests"] == 2
+        assert summary["errors"] == 0
+        assert summary["crops"] == 3
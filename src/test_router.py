@@ -0,0 +1,276 @@
+import asyncio
+import io
+
+import numpy as np
+import pytest
+import torch
+from grpclib import GRPCError, Status
+from PIL import Image
+from viam.services.mlmodel import MLModel
+
+from src.embedder_router import EmbedderRouter
+from src.person_embedder.router import (
+    HashRing,
+    aggregate_metrics,
+    merge_outputs,
+    split_request,
+)
+from src.person_embedder_service import PersonEmbedderService
+from src.test.fake_embedder_ml_model_service import FakeEmbedderMLModel
+from src.test_integration import IMG_PATH, get_config
+
+
+class FlakyEmbedder(FakeEmbedderMLModel):
+    """A fake embedder that is unreachable while `down` is set."""
+
+    down = False
+
+    async def infer(self, input_tensors, *, extra=None, timeout=None):
+        if self.down:
+            raise GRPCError(Status.UNAVAILABLE, "connection refused")
+        return await super().infer(input_tensors, extra=extra, timeout=timeout)
+
+    async def do_command(self, command, *, timeout=None, **kwargs):
+        if self.down:
+            raise GRPCError(Status.UNAVAILABLE, "connection refused")
+        return await super().do_command(command, timeout=timeout, **kwargs)
+
+
+def make_router(names, **attributes):
+    fakes = {name: FlakyEmbedder(name) for name in names}
+    router = EmbedderRouter("router")
+    router.reconfigure(
+        get_config({"instances": list(names), **attributes}),
+        {MLModel.get_resource_name(name): fake for name, fake in fakes.items()},
+    )
+    return router, fakes
+
+
+async def requests_by_instance(fakes):
+    return {
+        name: (await fake.do_command({"get_metrics": {}}))["metrics"].get(
+            "fake_requests", 0
+        )
+        for name, fake in fakes.items()
+    }
+
+
+class TestRouter:
+    def test_hash_ring(self):
+        ring = HashRing(["a", "b", "c"])
+        keys = [f"track {i}" for i in range(3000)]
+        owners = [ring.owner(key) for key in keys]
+        counts = {name: owners.count(name) for name in "abc"}
+        assert all(600 < count < 1400 for count in counts.values())
+        assert sorted(ring.owners(keys[0])) == ["a", "b", "c"]
+        # only the keys of the removed instance move
+        ring.remove("c")
+        moved = [o for key, o in zip(keys, owners) if ring.owner(key) != o]
+        assert set(moved) == {"c"}
+        ring.add("c")
+        assert [ring.owner(key) for key in keys] == owners
+        assert ring.owner(keys[0], {"a": False, "b": True, "c": True}) != "a"
+
+    def test_split_and_merge(self):
+        request = {
+            "input": np.frombuffer(b"aabbbcccc", dtype=np.uint8),
+            "input_lengths": np.array([2, 3, 4]),
+            "track_ids": np.array([5, 6, 7]),
+        }
+        part = split_request(request, [0, 2])
+        assert part["input"].tobytes() == b"aacccc"
+        assert part["input_lengths"].tolist() == [2, 4]
+        assert part["track_ids"].tolist() == [5, 7]
+        frame = {"input": np.zeros((3, 10, 10)), "boxes": np.arange(12).reshape(3, 4)}
+        part = split_request(frame, [1])
+        assert part["input"].shape == (3, 10, 10)
+        assert part["boxes"].tolist() == [[4, 5, 6, 7]]
+
+        merged = merge_outputs(
+            3,
+            [
+                ([0, 2], {"embedding": np.array([[0.0], [2.0]]), "n": np.array(1)}),
+                ([1], {"embedding": np.array([[1.0]]), "n": np.array(2)}),
+            ],
+        )
+        assert merged["embedding"].ravel().tolist() == [0, 1, 2]
+        assert merged["n"] == 1
+        # outputs that are not per crop stay whole, even when their length
+        # happens to match a part's crops
+        merged = merge_outputs(
+            2,
+            [
+                ([1], {"embedding": np.ones((1, 2)), "color": np.ones((1, 3))}),
+                ([0], {"embedding": np.zeros((1, 2)), "color": np.zeros((1, 3))}),
+            ],
+            per_crop=("embedding",),
+        )
+        assert merged["embedding"][:, 0].tolist() == [0, 1]
+        assert merged["color"].tolist() == [[1, 1, 1]]
+        assert aggregate_metrics(
+            [
+                {"requests": 2, "ms_mean": 10, "ms_p95": 30, "ok": True},
+                {"requests": 3, "ms_mean": 20, "ms_p95": 20},
+            ]
+        ) == {"requests": 5, "ms_mean": 15, "ms_p95": 30}
+
+    @pytest.mark.asyncio
+    async def test_routing(self):
+        router, fakes = make_router("abc", health_check_interval_s=0)
+        crops = np.random.default_rng(0).random((6, 3, 16, 8)).astype(np.float32)
+        track_ids = np.arange(6)
+
+        # a camera sticks to one instance
+        for _ in range(3):
+            await router.infer({"input": crops[:2]}, extra={"camera_id": "front"})
+        assert sorted((await requests_by_instance(fakes)).values()) == [0, 0, 3]
+
+        # tracks are spread, and the outputs come back in crop order
+        res = await router.infer({"input": crops, "track_ids": track_ids})
+        direct = await FakeEmbedderMLModel("direct").infer(
+            {"input": crops, "track_ids": track_ids}
+        )
+        np.testing.assert_array_equal(res["embedding"], direct["embedding"])
+        metrics = await router.do_command({"get_metrics": {}})
+        assert metrics["metrics"]["router_split_requests"] == 1
+        assert metrics["metrics"]["fake_crops"] == 12
+        assert metrics["metrics"]["router_healthy_instances"] == 3
+        assert set(metrics["instances"]) == {"a", "b", "c"}
+
+        # single crops without routing keys go to the least busy instance
+        res = await router.infer({"input": crops[0]})
+        assert res["embedding"].shape == (512,)
+        await router.close()
+
+    @pytest.mark.asyncio
+    async def test_failover_and_rebalance(self):
+        router, fakes = make_router(
+            "abc", health_check_interval_s=0.02, unhealthy_after=1
+        )
+        crop = np.zeros((1, 3, 16, 8), dtype=np.float32)
+        owner = router.ring.owner("track 42")
+        fakes[owner].down = True
+        res = await router.infer({"input": crop, "track_ids": np.array([42])})
+        assert res["embedding"].shape == (1, 512)
+        status = (await router.do_command({"router_status": {}}))["instances"]
+        assert not status[owner]["healthy"]
+        metrics = router.metrics.snapshot()
+        assert metrics["router_failovers"] == 1
+        assert metrics["router_rerouted"] == 1
+
+        # the health checks bring it back
+        fakes[owner].down = False
+        for _ in range(100):
+            if router.instances[owner].healthy:
+                break
+            await asyncio.sleep(0.02)
+        assert router.instances[owner].healthy
+        before = (await requests_by_instance(fakes))[owner]
+        await router.infer({"input": crop, "track_ids": np.array([42])})
+        assert (await requests_by_instance(fakes))[owner] == before + 1
+
+        for fake in fakes.values():
+            fake.down = True
+        with pytest.raises(GRPCError):
+            await router.infer({"input": crop})
+        for fake in fakes.values():
+            fake.down = False
+
+        # removing an instance only moves its own tracks
+        keys = [f"track {i}" for i in range(200)]
+        owners = {key: router.ring.owner(key) for key in keys}
+        router.reconfigure(
+            get_config({"instances": ["a", "b"], "health_check_interval_s": 0}),
+            {MLModel.get_resource_name(name): fakes[name] for name in "ab"},
+        )
+        for key in keys:
+            if owners[key] != "c":
+                assert router.ring.owner(key) == owners[key]
+        assert router.metrics.snapshot()["router_instances_removed"] == 1
+        await router.close()
+
+        for attributes in (
+            {},
+            {"instances": "a"},
+            {"instances": ["a", "a"]},
+            {"local_processes": -1},
+            {"local_processes": 1, "local_attributes": [1]},
+            {"instances": ["a"], "heads": "color"},
+        ):
+            with pytest.raises(ValueError):
+                EmbedderRouter.validate_config(get_config(attributes))
+        assert EmbedderRouter.validate_config(get_config({"instances": ["a"]})) == ["a"]
+        router = EmbedderRouter("router")
+        router.reconfigure(
+            get_config(
+                {
+                    "local_processes": 1,
+                    "heads": ["color"],
+                    "local_attributes": {"heads": {"age": "/path/age.pt"}},
+                }
+            ),
+            {},
+        )
+        assert router.per_crop_outputs[-2:] == ("color", "age")
+
+    @pytest.mark.asyncio
+    async def test_split_encoded_crops(self):
+        """Encoded crops split down to one crop per real embedder."""
+        services = {}
+        for name in "ab":
+            # the same random weights on both instances
+            torch.manual_seed(0)
+            services[name] = PersonEmbedderService(name)
+            services[name].reconfigure(get_config({"random_weights": True}), None)
+        router = EmbedderRouter("router")
+        router.reconfigure(
+            get_config({"instances": ["a", "b"], "health_check_interval_s": 0}),
+            {MLModel.get_resource_name(name): s for name, s in services.items()},
+        )
+        track_a = next(t for t in range(100) if router.ring.owner(f"track {t}") == "a")
+        track_b = next(t for t in range(100) if router.ring.owner(f"track {t}") == "b")
+        image = Image.open(IMG_PATH).convert("RGB")
+        encoded = []
+        for box in ((0, 0, 200, 400), (100, 50, 300, 450)):
+            buffer = io.BytesIO()
+            image.crop(box).save(buffer, format="JPEG")
+            encoded.append(np.frombuffer(buffer.getvalue(), dtype=np.uint8))
+        request = {
+            "input": np.concatenate(encoded),
+            "input_lengths": np.array([len(e) for e in encoded]),
+            "track_ids": np.array([track_a, track_b]),
+        }
+        res = await router.infer(request)
+        direct = await services["a"].infer(request)
+        assert res["embedding"].shape == (2, 512)
+        np.testing.assert_allclose(res["embedding"], direct["embedding"], atol=1e-4)
+        assert router.metrics.snapshot()["router_split_requests"] == 1
+        await router.close()
+
+    @pytest.mark.asyncio
+    async def test_local_process(self):
+        """Test a router over a module process it starts itself."""
+        image = np.array(Image.open(IMG_PATH), dtype=np.float32).transpose(2, 0, 1)
+        router = EmbedderRouter("router")
+        router.reconfigure(
+            get_config(
+                {
+                    "local_processes": 1,
+                    "local_attributes": {"random_weights": True},
+                    "health_check_interval_s": 0,
+                }
+            ),
+            {},
+        )
+        try:
+            res = await router.infer(
+                {"input": image, "boxes": np.array([[0, 0, 200, 400]])},
+                extra={"camera_id": "front"},
+            )
+            assert res["embedding"].shape == (1, 512)
+            metrics = (await router.do_command({"get_metrics": {}}))["metrics"]
+            assert metrics["router_processes_started"] == 1
+            assert metrics["router_requests_local-0"] == 1
+        finally:
+            await router.close()
+        assert not router.processes
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from src.person_embedder.shm_transport import (
+    SharedMemoryRegions,
+    SharedMemoryRing,
+)
+from src.person_embedder_service import PersonEmbedderService
+from src.test_integration import IMG_PATH, get_config
+
+
+class TestSharedMemoryTransport:
+    def test_ring_wraps_and_views_are_zero_copy(self):
+        ring = SharedMemoryRing(size_mb=0.005)
+        regions = SharedMemoryRegions()
+        try:
+            array = np.arange(1000, dtype=np.float32)
+            first = ring.write(array)
+            second = ring.write(array)
+            assert first["offset"] == 0
+            assert second["offset"] == 0  # the ring wrapped
+
+            view = regions.view(ring.name, second)
+            np.testing.assert_array_equal(view, array)
+            ring.write(array * 2)
+            np.testing.assert_array_equal(view, array * 2)
+
+            with pytest.raises(ValueError):
+                regions.view(
+                    ring.name, {"offset": 0, "shape": [10**6], "dtype": "float32"}
+                )
+            del view
+        finally:
+            regions.close()
+            ring.close()
+
+    @pytest.mark.asyncio
+    async def test_shm_infer_matches_infer(self):
+        service = PersonEmbedderService("test")
+        service.reconfigure(get_config({}), None)
+        frame = np.array(Image.open(IMG_PATH), dtype=np.float32).transpose(2, 0, 1)
+        boxes = [[0, 0, 200, 400], [100, 50, 500, 250]]
+        ring = SharedMemoryRing(size_mb=64)
+        try:
+            res = await service.do_command(
+                ring.shm_infer_command(np.ascontiguousarray(frame), boxes=boxes)
+            )
+            embedding = ring.read(res["shm_infer"]["embedding"])
+            expected = await service.infer(
+                {"input": frame, "boxes": np.array(boxes, dtype=np.float32)}
+            )
+            assert embedding.shape == (2, 512)
+            np.testing.assert_allclose(embedding, expected["embedding"], atol=1e-5)
+        finally:
+            await service.close()
+            ring.close()
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from src.person_embedder.track_scheduler import TrackEmbeddingScheduler
+
+BOX = np.array([[10, 10, 60, 110]], dtype=np.float64)
+
+
+class TestTrackEmbeddingScheduler:
+    def test_reuses_embedding_until_refresh_interval(self):
+        scheduler = TrackEmbeddingScheduler(
+            refresh_interval_frames=3, max_scale_change=0, min_iou=0, max_age_s=0
+        )
+        recomputed = []
+        for frame in range(6):
+            recompute = scheduler.schedule([7], BOX, now=frame)
+            recomputed.append(bool(recompute[0]))
+            embeddings = np.full((int(recompute.sum()), 4), float(frame))
+            scheduler.update([7], BOX, recompute, embeddings, now=frame)
+        assert recomputed == [True, False, False, True, False, False]
+
+    def test_geometry_policies_trigger_recompute(self):
+        scheduler = TrackEmbeddingScheduler(
+            refresh_interval_frames=0, max_scale_change=0.2, min_iou=0.5, max_age_s=0
+        )
+        recompute = scheduler.schedule([1], BOX, now=0)
+        scheduler.update([1], BOX, recompute, np.ones((1, 4)), now=0)
+
+        assert not scheduler.schedule([1], BOX + 2, now=1)[0]
+        # box moved away: IoU drift
+        assert scheduler.schedule([1], BOX + 100, now=1)[0]
+        # box doubled in size: scale change
+        grown = BOX.copy()
+        grown[0, 2:] += 50
+        assert scheduler.schedule([1], grown, now=1)[0]
+
+    def test_ema_and_eviction(self):
+        scheduler = TrackEmbeddingScheduler(
+            refresh_interval_frames=1, ema_alpha=0.5, ttl_s=5, max_tracks=2
+        )
+        scheduler.update([1], BOX, np.array([True]), np.zeros((1, 4)), now=0)
+        res = scheduler.update([1], BOX, np.array([True]), np.ones((1, 4)), now=1)
+        np.testing.assert_allclose(res[0], 0.5)
+
+        boxes = np.repeat(BOX, 2, axis=0)
+        scheduler.update([2, 3], boxes, np.array([True, True]), np.ones((2, 4)), now=2)
+        assert list(scheduler.tracks) == [2, 3]
+
+        scheduler.schedule([2], BOX, now=8)
+        assert len(scheduler.tracks) == 0
+
+    def test_scheduled_tracks_are_not_evicted(self):
+        scheduler = TrackEmbeddingScheduler(refresh_interval_frames=0, max_tracks=1)
+        scheduler.update([1], BOX, np.array([True]), np.ones((1, 4)), now=0)
+        recompute = scheduler.schedule([1], BOX, now=0)
+        assert not recompute[0]
+        # another request fills the scheduler before the first one updates
+        scheduler.update([2], BOX, np.array([True]), np.zeros((1, 4)), now=0)
+        assert list(scheduler.tracks) == [1, 2]
+        res = scheduler.update([1], BOX, recompute, np.empty((0, 4)), now=0)
+        np.testing.assert_allclose(res[0], 1)
+
+        # released requests unpin their tracks too
+        recompute = scheduler.schedule([1], BOX, now=0)
+        scheduler.release([1], recompute)
+        scheduler.update([3], BOX, np.array([True]), np.zeros((1, 4)), now=0)
+        assert list(scheduler.tracks) == [3]
+
+    def test_update_unknown_track_without_embedding_raises(self):
+        scheduler = TrackEmbeddingScheduler()
+        with pytest.raises(KeyError):
+            scheduler.update([1], BOX, np.array([False]), np.empty((0, 4)), now=0)